@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.admin_dashboard import search
+
+
+class Command(BaseCommand):
+    help = 'Creates the floor plan full-text search index if needed and re-indexes every plan'
+
+    def handle(self, *args, **options):
+        backend = search.ensure_index()
+        if backend is None:
+            self.stdout.write(self.style.WARNING('This database has no full-text backend; /plans uses a table scan.'))
+            return
+        count = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} floor plan(s) ({backend})"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.admin_dashboard import visual_index
+
+
+class Command(BaseCommand):
+    help = 'Computes the image descriptors used by visual floor plan similarity search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every descriptor, not only missing or outdated ones')
+
+    def handle(self, *args, **options):
+        count = visual_index.update_stale(include_current=options['all'])
+        self.stdout.write(self.style.SUCCESS(f"Described {count} floor plan image(s)"))
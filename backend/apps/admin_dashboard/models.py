@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from apps.core.config_cache import ConfigCache
 from apps.core.models import TimeStampedModel
 
 
@@ -25,6 +26,10 @@ class FloorPlanDataset(TimeStampedModel):
     uploaded_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='uploaded_floor_plans'
     )
+    # Image descriptor for visual similarity search (see visual_index.py).
+    visual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    visual_features = models.BinaryField(null=True, blank=True, editable=False)
+    visual_version = models.PositiveSmallIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ['-created_at']
@@ -68,6 +73,17 @@ class PlatformSettings(TimeStampedModel):
         obj, _ = cls.objects.get_or_create(pk=1)
         return obj
 
+    @classmethod
+    def cached(cls):
+        """
+        The settings row from process memory (see apps.core.config_cache).
+        Read-only: modify and save an instance from ``load()`` instead.
+        """
+        return _platform_settings.get()
+
+
+_platform_settings = ConfigCache('platform_settings', PlatformSettings.load, PlatformSettings)
+
 
 # ── Admin Activity Log ──
 
@@ -0,0 +1,221 @@
+"""
+Ranked full-text search over ``FloorPlanDataset``.
+
+Plans are indexed on title, category name and description in a side table
+kept in step with the model by signals (see ``signals.py``):
+
+* PostgreSQL — ``admin_dashboard_floorplan_search(plan_id, document tsvector)``
+  with a GIN index; the title is weighted A, the category B and the
+  description C, and results are ordered by ``ts_rank_cd``
+* SQLite — an FTS5 table ``admin_dashboard_floorplan_fts`` (porter stemming,
+  prefix indexes) ranked by ``bm25`` with the same relative weights
+
+Every query term is matched as a prefix, so "bed" finds "bedroom". The side
+table is created on first use (``manage.py rebuild_floor_plan_search``
+creates and back-fills it explicitly). On any other database the old
+``icontains`` scan is used, newest first.
+"""
+import logging
+import re
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+
+from .models import FloorPlanCategory, FloorPlanDataset
+
+logger = logging.getLogger(__name__)
+
+PG_TABLE = 'admin_dashboard_floorplan_search'
+FTS_TABLE = 'admin_dashboard_floorplan_fts'
+MAX_TERMS = 12
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+_ready: set = set()
+
+
+def _backend():
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        return 'sqlite'
+    return None
+
+
+def query_terms(query: str) -> list[str]:
+    return [t.lower() for t in _TERM_RE.findall(query or '')][:MAX_TERMS]
+
+
+# ── Schema ───────────────────────────────────────────────────────────
+
+def ensure_index():
+    """Create the search table if needed (back-filling it when new); returns the backend."""
+    backend = _backend()
+    if backend is None or connection.alias in _ready:
+        return backend
+    table = PG_TABLE if backend == 'postgresql' else FTS_TABLE
+    with connection.cursor() as cursor:
+        existed = table in connection.introspection.table_names(cursor)
+        if not existed:
+            if backend == 'postgresql':
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {PG_TABLE} ("
+                    f" plan_id bigint PRIMARY KEY"
+                    f" REFERENCES {FloorPlanDataset._meta.db_table}(id) ON DELETE CASCADE,"
+                    f" document tsvector NOT NULL)"
+                )
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {PG_TABLE}_gin ON {PG_TABLE} USING GIN (document)")
+            else:
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                    f"title, category, description, tokenize='porter unicode61', prefix='2 3')"
+                )
+    _ready.add(connection.alias)
+    if not existed:
+        rebuild()
+    return backend
+
+
+def _run(fn):
+    """Run ``fn`` against the search table, re-creating it once if it vanished."""
+    try:
+        with transaction.atomic():
+            return fn()
+    except DatabaseError:
+        if connection.alias not in _ready:
+            raise
+        # e.g. the table was dropped or rolled back under us; try once more.
+        _ready.discard(connection.alias)
+        ensure_index()
+        with transaction.atomic():
+            return fn()
+
+
+# ── Maintenance ──────────────────────────────────────────────────────
+
+def _plan_rows_sql(where: str) -> str:
+    plans = FloorPlanDataset._meta.db_table
+    categories = FloorPlanCategory._meta.db_table
+    return (
+        f"FROM {plans} p LEFT JOIN {categories} c ON c.id = p.category_id WHERE {where}"
+    )
+
+
+def index_plans(plan_ids):
+    """(Re-)index the given plans."""
+    plan_ids = [int(pk) for pk in plan_ids]
+    backend = ensure_index()
+    if backend is None or not plan_ids:
+        return
+
+    def _write():
+        with connection.cursor() as cursor:
+            if backend == 'postgresql':
+                cursor.execute(
+                    f"INSERT INTO {PG_TABLE} (plan_id, document) SELECT p.id,"
+                    f" setweight(to_tsvector('english', coalesce(p.title, '')), 'A') ||"
+                    f" setweight(to_tsvector('english', coalesce(c.name, '')), 'B') ||"
+                    f" setweight(to_tsvector('english', coalesce(p.description, '')), 'C') "
+                    + _plan_rows_sql("p.id = ANY(%s)")
+                    + " ON CONFLICT (plan_id) DO UPDATE SET document = EXCLUDED.document",
+                    [plan_ids],
+                )
+            else:
+                placeholders = ', '.join(['%s'] * len(plan_ids))
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", plan_ids)
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, title, category, description)"
+                    f" SELECT p.id, coalesce(p.title, ''), coalesce(c.name, ''), coalesce(p.description, '') "
+                    + _plan_rows_sql(f"p.id IN ({placeholders})"),
+                    plan_ids,
+                )
+
+    _run(_write)
+
+
+def remove_plans(plan_ids):
+    plan_ids = [int(pk) for pk in plan_ids]
+    backend = ensure_index()
+    if backend is None or not plan_ids:
+        return
+    table, column = (PG_TABLE, 'plan_id') if backend == 'postgresql' else (FTS_TABLE, 'rowid')
+    placeholders = ', '.join(['%s'] * len(plan_ids))
+
+    def _delete():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE {column} IN ({placeholders})", plan_ids)
+
+    _run(_delete)
+
+
+def rebuild() -> int:
+    """Re-index every plan; returns the number indexed."""
+    backend = ensure_index()
+    if backend is None:
+        return 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {PG_TABLE if backend == 'postgresql' else FTS_TABLE}")
+        ids = list(FloorPlanDataset.objects.values_list('id', flat=True))
+        for start in range(0, len(ids), 500):
+            index_plans(ids[start:start + 500])
+    logger.info("[FloorPlanSearch] indexed %d plan(s) (%s)", len(ids), backend)
+    return len(ids)
+
+
+# ── Queries ──────────────────────────────────────────────────────────
+
+def search_plan_ids(query: str, limit: int | None = None, offset: int = 0) -> list[int] | None:
+    """
+    Ids of plans matching ``query``, best match first. ``None`` when this
+    database has no full-text backend.
+    """
+    terms = query_terms(query)
+    backend = ensure_index()
+    if backend is None:
+        return None
+    if not terms:
+        return []
+    page = " LIMIT %s OFFSET %s" if limit is not None else ""
+    page_params = [limit, offset] if limit is not None else []
+
+    def _select():
+        with connection.cursor() as cursor:
+            if backend == 'postgresql':
+                tsquery = ' | '.join(f"{t}:*" for t in terms)
+                cursor.execute(
+                    f"SELECT plan_id FROM {PG_TABLE}, to_tsquery('english', %s) q"
+                    f" WHERE document @@ q ORDER BY ts_rank_cd(document, q) DESC, plan_id DESC" + page,
+                    [tsquery, *page_params],
+                )
+            else:
+                match = ' OR '.join(f'"{t}"*' for t in terms)
+                cursor.execute(
+                    f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+                    f" ORDER BY bm25({FTS_TABLE}, 10.0, 5.0, 1.0), rowid DESC" + page,
+                    [match, *page_params],
+                )
+            return [row[0] for row in cursor.fetchall()]
+
+    return _run(_select)
+
+
+def search_plans(query: str, limit: int | None = None) -> list:
+    """``FloorPlanDataset`` rows (category loaded) for ``query``, most relevant first."""
+    plans = FloorPlanDataset.objects.select_related('category')
+    try:
+        ids = search_plan_ids(query, limit)
+    except DatabaseError as e:
+        logger.error("Floor plan full-text search failed, falling back to a scan: %s", e)
+        ids = None
+    if ids is None:
+        q_filter = Q()
+        for term in query_terms(query):
+            q_filter |= (
+                Q(title__icontains=term) |
+                Q(description__icontains=term) |
+                Q(category__name__icontains=term)
+            )
+        matches = plans.filter(q_filter).distinct().order_by('-created_at')
+        return list(matches[:limit] if limit is not None else matches)
+    found = plans.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found]
@@ -0,0 +1,49 @@
+import logging
+
+from django.db import DatabaseError
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import search, visual_index
+from .models import FloorPlanCategory, FloorPlanDataset
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_save, sender=FloorPlanDataset)
+def reset_visual_descriptor_on_new_image(sender, instance, **kwargs):
+    if not instance.pk:
+        return
+    previous = FloorPlanDataset.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+    if previous != instance.image.name:
+        instance.visual_version = 0
+
+
+@receiver(post_save, sender=FloorPlanDataset)
+def index_floor_plan(sender, instance, **kwargs):
+    try:
+        search.index_plans([instance.pk])
+    except DatabaseError as e:
+        logger.error("Could not index floor plan %s: %s", instance.pk, e)
+    if instance.visual_version != visual_index.DESCRIPTOR_VERSION and instance.image:
+        visual_index.update_plan(instance)
+
+
+@receiver(post_delete, sender=FloorPlanDataset)
+def unindex_floor_plan(sender, instance, **kwargs):
+    try:
+        search.remove_plans([instance.pk])
+    except DatabaseError as e:
+        logger.error("Could not remove floor plan %s from the search index: %s", instance.pk, e)
+    visual_index.invalidate()
+
+
+@receiver(post_save, sender=FloorPlanCategory)
+def reindex_category_plans(sender, instance, created, **kwargs):
+    """The category name is part of every plan's search document."""
+    if created:
+        return
+    try:
+        search.index_plans(instance.datasets.values_list('id', flat=True))
+    except DatabaseError as e:
+        logger.error("Could not re-index plans of category %s: %s", instance.pk, e)
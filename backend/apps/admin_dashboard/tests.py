@@ -1,3 +1,125 @@
-from django.test import TestCase
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from . import search
+from .models import FloorPlanCategory, FloorPlanDataset
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FloorPlanSearchTest(TestCase):
+    """Full-text index over title, category and description."""
+
+    def setUp(self):
+        self.residential = FloorPlanCategory.objects.create(name="Residential")
+        self.commercial = FloorPlanCategory.objects.create(name="Commercial")
+        self.cottage = self._plan("Three bedroom cottage", self.residential, "Compact family home with a veranda")
+        self.office = self._plan("Open office block", self.commercial, "Two storeys with a bedroom-sized server room")
+        self.villa = self._plan("Modern villa", self.residential, "Four bedrooms, pool and double garage")
+
+    def _plan(self, title, category, description):
+        return FloorPlanDataset.objects.create(
+            title=title, category=category, description=description,
+            image=SimpleUploadedFile("plan.gif", b"GIF89a", content_type="image/gif"),
+        )
+
+    def test_ranks_title_matches_first_and_matches_prefixes(self):
+        ids = search.search_plan_ids("bedroom")
+        self.assertEqual(ids[0], self.cottage.pk)
+        self.assertCountEqual(ids, [self.cottage.pk, self.office.pk, self.villa.pk])
+        self.assertEqual(search.search_plan_ids("cott"), [self.cottage.pk])
+
+    def test_category_name_is_searchable_and_kept_in_sync(self):
+        self.assertEqual(search.search_plan_ids("commercial"), [self.office.pk])
+        self.commercial.name = "Industrial"
+        self.commercial.save()
+        self.assertEqual(search.search_plan_ids("industrial"), [self.office.pk])
+        self.assertEqual(search.search_plan_ids("commercial"), [])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.villa.title = "Modern bungalow"
+        self.villa.save()
+        self.assertEqual(search.search_plan_ids("bungalow"), [self.villa.pk])
+        self.villa.delete()
+        self.assertEqual(search.search_plan_ids("bungalow"), [])
+
+    def test_rebuild_restores_missing_rows(self):
+        from django.db import connection
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.FTS_TABLE}")
+        self.assertEqual(search.search_plan_ids("villa"), [])
+        self.assertEqual(search.rebuild(), 3)
+        self.assertEqual(search.search_plan_ids("villa"), [self.villa.pk])
+
+    def test_admin_listing_filters_by_query(self):
+        admin = User.objects.create_user("plans-admin", password="pw")
+        admin.profile.role = "ADMIN"
+        admin.profile.save()
+        client = APIClient()
+        client.force_authenticate(admin)
+        body = client.get(reverse("admin-floor-plans"), {"q": "garage pool"}).json()
+        self.assertEqual([p["id"] for p in body["results"]], [self.villa.pk])
+
+
+def _plan_png(rooms, size=(400, 300), offset=(0, 0), width=3, canvas=None):
+    """A line drawing of rectangular rooms, optionally placed on a larger sheet."""
+    import io
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", canvas or size, "white")
+    draw = ImageDraw.Draw(img)
+    sx, sy = size
+    ox, oy = offset
+    for x0, y0, x1, y1 in rooms:
+        draw.rectangle([ox + x0 * sx, oy + y0 * sy, ox + x1 * sx, oy + y1 * sy], outline="black", width=width)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+_L_SHAPED = [(0, 0, 1, 1), (0, 0, 0.5, 0.5), (0.5, 0, 1, 0.3), (0, 0.5, 0.3, 1)]
+_ROW_HOUSE = [(0, 0, 1, 1), (0.25, 0, 0.25, 1), (0.5, 0, 0.5, 1), (0.75, 0, 0.75, 1)]
+_SQUARE_GRID = [(0, 0, 1, 1), (0, 0.5, 1, 0.5), (0.5, 0, 0.5, 1)]
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class FloorPlanVisualIndexTest(TestCase):
+    """Descriptors are stored on upload and answer nearest-neighbour queries."""
+
+    def setUp(self):
+        from . import visual_index
+
+        self.visual_index = visual_index
+        category = FloorPlanCategory.objects.create(name="Residential")
+        self.plans = {}
+        for name, rooms in (("l-shaped", _L_SHAPED), ("row", _ROW_HOUSE), ("grid", _SQUARE_GRID)):
+            self.plans[name] = FloorPlanDataset.objects.create(
+                title=name, category=category,
+                image=SimpleUploadedFile(f"{name}.png", _plan_png(rooms), content_type="image/png"),
+            )
+
+    def test_descriptor_is_stored_on_upload(self):
+        plan = FloorPlanDataset.objects.get(pk=self.plans["row"].pk)
+        self.assertEqual(plan.visual_version, self.visual_index.DESCRIPTOR_VERSION)
+        self.assertIsNotNone(plan.visual_hash)
+        self.assertGreater(len(bytes(plan.visual_features)), 0)
+
+    def test_sketch_on_larger_sheet_finds_matching_plan(self):
+        sketch = _plan_png(_L_SHAPED, size=(300, 230), offset=(150, 90), width=6, canvas=(800, 600))
+        hits = self.visual_index.nearest(sketch, k=3)
+        self.assertEqual(hits[0][0], self.plans["l-shaped"].pk)
+        self.assertGreater(hits[0][1], hits[1][1])
+
+        sketch = _plan_png(_ROW_HOUSE, size=(500, 380), width=5)
+        self.assertEqual(self.visual_index.nearest(sketch, k=1)[0][0], self.plans["row"].pk)
+
+    def test_deleted_plans_leave_the_index(self):
+        self.plans["grid"].delete()
+        ids = [pk for pk, _ in self.visual_index.nearest(_plan_png(_SQUARE_GRID), k=5)]
+        self.assertNotIn(self.plans["grid"].pk, ids)
+        self.assertEqual(len(ids), 2)
@@ -18,6 +18,7 @@ from .models import (
     AdminActivityLog, log_admin_action,
     UserActivityEvent, log_user_activity,
 )
+from .search import search_plans
 
 
 class IsAdminRole(BasePermission):
@@ -634,7 +635,11 @@ class FloorPlanDatasetView(APIView):
     parser_classes = [MultiPartParser, FormParser]
 
     def get(self, request):
-        plans = FloorPlanDataset.objects.select_related('category').all()
+        query = request.query_params.get('q', '').strip()
+        if query:
+            plans = search_plans(query)
+        else:
+            plans = FloorPlanDataset.objects.select_related('category').all()
         data = []
         for p in plans:
             img_url = request.build_absolute_uri(p.image.url) if p.image else None
@@ -965,7 +970,7 @@ class PlatformSettingsView(APIView):
     permission_classes = [IsAuthenticated, IsAdminRole]
 
     def get(self, request):
-        s = PlatformSettings.load()
+        s = PlatformSettings.cached()
         return Response({
             'site_name': s.site_name,
             'tagline': s.tagline,
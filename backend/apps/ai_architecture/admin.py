@@ -1,8 +1,9 @@
 from django.contrib import admin
+from django.db.models import Count
 from .models import (
     ChatSession, ChatMessage,
     MaterialPrice, TokenUsage,
-    BOQTemplate,
+    BOQTemplate, AIJob, KnowledgeDocument,
 )
 
 class ChatMessageInline(admin.TabularInline):
@@ -36,6 +37,18 @@ class TokenUsageAdmin(admin.ModelAdmin):
     date_hierarchy = 'created_at'
 
 
+@admin.register(AIJob)
+class AIJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'user', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status', 'created_at')
+    search_fields = ('id', 'user__username', 'user__email')
+    readonly_fields = (
+        'user', 'session', 'project', 'kind', 'payload', 'result', 'http_status', 'error',
+        'progress', 'progress_message', 'attempts', 'locked_by', 'started_at', 'heartbeat_at', 'finished_at',
+    )
+    date_hierarchy = 'created_at'
+
+
 @admin.register(BOQTemplate)
 class BOQTemplateAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_active', 'include_labour_rate', 'include_measurement_formula', 'updated_at')
@@ -69,3 +82,31 @@ class BOQTemplateAdmin(admin.ModelAdmin):
         }),
     )
 
+
+@admin.register(KnowledgeDocument)
+class KnowledgeDocumentAdmin(admin.ModelAdmin):
+    list_display = ('title', 'is_embedded', 'chunk_count', 'uploaded_by', 'created_at')
+    list_filter = ('is_embedded',)
+    search_fields = ('title',)
+    readonly_fields = ('content_hash', 'is_embedded')
+    actions = ['reindex_documents']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_chunk_count=Count('chunks'))
+
+    @admin.display(description='Chunks', ordering='_chunk_count')
+    def chunk_count(self, obj):
+        return obj._chunk_count
+
+    def save_model(self, request, obj, form, change):
+        if not obj.uploaded_by_id:
+            obj.uploaded_by = request.user
+        super().save_model(request, obj, form, change)
+
+    @admin.action(description='Re-index selected documents')
+    def reindex_documents(self, request, queryset):
+        from . import knowledge
+
+        chunks = sum(knowledge.ingest_document(doc, rebuild=False) for doc in queryset)
+        size = knowledge.rebuild_index()
+        self.message_user(request, f"Stored {chunks} chunk(s); the index now holds {size} passage(s).")
@@ -0,0 +1,76 @@
+"""
+Content-addressed cache for /analyse results.
+
+A budget analysis is a single, very large Gemini Pro call (up to 64k output
+tokens). Re-running /analyse on the same drawings with the same template and
+project state yields an equivalent answer, so the normalized payload is
+cached in the shared cache under a key built from everything that shapes it:
+
+* SHA-256 of every image / rasterized PDF page (decoded bytes)
+* the active BOQ template id and ``updated_at``
+* the project-context version (see ``project_context``)
+* SHA-256 of the system prompt and the user prompt
+* the model name
+
+Controlled by ``AI_ANALYSE_CACHE_ENABLED`` / ``AI_ANALYSE_CACHE_TTL``; callers
+may bypass the lookup per request (the fresh result is still stored).
+"""
+import base64
+import binascii
+import hashlib
+import logging
+
+from django.conf import settings
+
+from apps.core.cache_utils import shared_cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ai:analyse:v1:"
+
+
+def is_enabled() -> bool:
+    return getattr(settings, 'AI_ANALYSE_CACHE_ENABLED', True)
+
+
+def image_digest(img_data: str) -> str:
+    """SHA-256 of an image given as a data URL or bare base64 string."""
+    b64 = img_data.split(",", 1)[1] if img_data.startswith("data:") else img_data
+    try:
+        raw = base64.b64decode(b64, validate=False)
+    except (binascii.Error, ValueError):
+        raw = b64.encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def analyse_cache_key(*, images: list, template_marker: str, context_version,
+                      system_prompt: str, user_prompt: str, model: str, fan_out: bool = False) -> str:
+    h = hashlib.sha256()
+    for part in (
+        ",".join(image_digest(img) for img in images or []),
+        template_marker,
+        str(context_version),
+        hashlib.sha256(system_prompt.encode("utf-8")).hexdigest(),
+        hashlib.sha256(user_prompt.encode("utf-8")).hexdigest(),
+        model,
+        # Fan-out results carry a per-sheet status map the single call lacks.
+        "fan_out" if fan_out else "single",
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x1f")
+    return KEY_PREFIX + h.hexdigest()
+
+
+def get_cached(key: str):
+    try:
+        return shared_cache().get(key)
+    except Exception as e:
+        logger.warning("Analyse cache read failed: %s", e)
+        return None
+
+
+def store(key: str, payload: dict):
+    try:
+        shared_cache().set(key, payload, getattr(settings, 'AI_ANALYSE_CACHE_TTL', 7 * 86400))
+    except Exception as e:
+        logger.warning("Analyse cache write failed: %s", e)
@@ -5,3 +5,6 @@ class AiArchitectureConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.ai_architecture'
     verbose_name = '7. AI Architecture'
+
+    def ready(self):
+        import apps.ai_architecture.signals
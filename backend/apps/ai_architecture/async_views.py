@@ -0,0 +1,389 @@
+"""
+ASGI variants of the long-running AI endpoints.
+
+Under WSGI every open SSE stream or 3-minute /analyse call pins a gunicorn
+worker. These views run on the event loop instead and *await* Gemini over
+``httpx`` (see ``gemini_client.apost``), so an idle stream costs a coroutine,
+not a process. The ordinary DRF views are untouched and keep running on the
+sync path (Django executes them in its thread pool under ASGI).
+
+Authentication, permissions and throttling are delegated to the sync DRF view
+class, and all ORM / prompt-building work reuses the sync views' ``prepare``
+helpers through ``sync_to_async``. Only the Gemini round-trips are async.
+
+Enabled with ``AI_ASGI_VIEWS=True`` (see ``urls.py``) when serving
+``config.asgi:application`` with uvicorn workers.
+"""
+import abc
+import logging
+
+from asgiref.sync import sync_to_async
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.response import Response
+import requests as http_requests
+
+from . import gemini_client, json_stream, usage
+from .views import (
+    ChatCompletionView, ChatStreamView, DrawAgentView, DraftCopilotView,
+    _DRAW_AGENT_SYSTEM, _DRAFT_COPILOT_SYSTEM_PROMPT, _STREAM_FALLBACK_TEXT,
+    _AnalyseRowStream, _StreamRound, _analyse_payload, _analyse_row_events,
+    _build_gemini_contents, _build_gemini_tool_config,
+    _chat_payload, _empty_analyse_payload, _execute_function_calls,
+    _gemini_response_text, _get_analyse_model_name,
+    _get_draft_model_name, _get_gemini_chat_model, _json_payload,
+    _parse_analyse_text, _require_gemini_key, _sse, _stream_error_message,
+    _tool_round_parts, _tools_payload,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# ── Async Gemini helpers ─────────────────────────────────────────────
+
+async def _apost_or_raise(model_name: str, payload: dict, timeout: float, label: str):
+    try:
+        return await gemini_client.apost(model_name, payload, timeout=timeout, label=label)
+    except http_requests.exceptions.Timeout:
+        logger.error("Gemini %s API timed out after %s seconds", label, timeout)
+        raise RuntimeError("The AI request timed out. Please try a simpler request or try again later.")
+    except http_requests.exceptions.RequestException as e:
+        logger.error("Gemini %s API connection error: %s", label, e)
+        raise RuntimeError(f"Could not connect to AI service: {e}")
+
+
+async def _acall_gemini(messages: list, system: str = "", max_tokens: int = 8192,
+                        temperature: float = 0.7, images: list | None = None,
+                        timeout: float = 120.0) -> str:
+    """Async ``views._call_gemini``."""
+    _require_gemini_key()
+    model_name = _get_gemini_chat_model()
+    payload = _chat_payload(messages, system, max_tokens, temperature, images)
+    resp = await _apost_or_raise(model_name, payload, timeout, "chat")
+    return _gemini_response_text(resp, "Chat")
+
+
+async def _acall_gemini_json(system: str, user_content: str, max_tokens: int = 8192,
+                             temperature: float = 0.4, timeout: float = 90.0) -> str:
+    """Async ``views._call_gemini_json``."""
+    _require_gemini_key()
+    payload = _json_payload(system, user_content, max_tokens, temperature)
+    resp = await _apost_or_raise(_get_draft_model_name(), payload, timeout, "draft_json")
+    return _gemini_response_text(resp, "JSON")
+
+
+async def _acall_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
+                                   temperature: float = 0.7, images: list | None = None,
+                                   timeout: float = 120.0) -> str:
+    """Async ``views._call_gemini_with_tools``; tools still run in a thread."""
+    _require_gemini_key()
+    model_name = _get_gemini_chat_model()
+    tool_config = await sync_to_async(_build_gemini_tool_config)()
+    contents = _build_gemini_contents(messages, system, images)
+
+    parts: list = []
+    for _round in range(5):
+        payload = _tools_payload(contents, tool_config, max_tokens, temperature)
+        resp = await _apost_or_raise(model_name, payload, timeout, "chat_tools")
+        parts = _tool_round_parts(resp)
+
+        fn_calls = [p for p in parts if "functionCall" in p]
+        if not fn_calls:
+            return "\n".join(p.get("text", "") for p in parts if "text" in p)
+
+        contents.append({"role": "model", "parts": parts})
+        fn_response_parts = await sync_to_async(_execute_function_calls)(fn_calls)
+        contents.append({"role": "user", "parts": fn_response_parts})
+
+    text_parts = [p.get("text", "") for p in parts if "text" in p]
+    return "\n".join(text_parts) if text_parts else _STREAM_FALLBACK_TEXT
+
+
+async def _astream_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
+                                     temperature: float = 0.7, images: list | None = None,
+                                     timeout: float = 120.0):
+    """Async ``views._stream_gemini_with_tools`` (same SSE event contract)."""
+    try:
+        _require_gemini_key()
+    except RuntimeError as exc:
+        yield _sse({'type': 'error', 'content': str(exc)})
+        return
+
+    model_name = _get_gemini_chat_model()
+    tool_config = await sync_to_async(_build_gemini_tool_config)()
+    contents = _build_gemini_contents(messages, system, images)
+
+    emitted_text = False
+    for _round in range(5):
+        payload = _tools_payload(contents, tool_config, max_tokens, temperature)
+        turn = _StreamRound()
+        try:
+            async for chunk in gemini_client.astream_generate_content(
+                model_name, payload, timeout=timeout, label="chat_stream",
+            ):
+                for delta in turn.feed(chunk):
+                    emitted_text = True
+                    yield _sse({'type': 'token', 'content': delta})
+        except Exception as exc:
+            yield _sse({'type': 'error', 'content': _stream_error_message(exc, timeout)})
+            return
+
+        if not turn.fn_calls:
+            break
+
+        for fc_part in turn.fn_calls:
+            yield _sse({'type': 'tool', 'name': fc_part["functionCall"].get("name", "")})
+        contents.append({"role": "model", "parts": turn.parts})
+        fn_response_parts = await sync_to_async(_execute_function_calls)(turn.fn_calls)
+        contents.append({"role": "user", "parts": fn_response_parts})
+
+    if not emitted_text:
+        yield _sse({'type': 'token', 'content': _STREAM_FALLBACK_TEXT})
+
+
+async def _astream_gemini_analyse(system: str, user_content: str, images: list | None = None,
+                                  max_tokens: int = 16384, temperature: float = 0.3,
+                                  timeout: float = 180.0):
+    """Async ``views._stream_gemini_analyse``."""
+    _require_gemini_key()
+    model_name = _get_analyse_model_name()
+    payload = _analyse_payload(system, user_content, images, max_tokens, temperature)
+
+    logger.info("[Analyse] Streaming Gemini %s (max_tokens=%d)", model_name, max_tokens)
+    turn = _StreamRound()
+    try:
+        async for chunk in gemini_client.astream_generate_content(
+            model_name, payload, timeout=timeout, label="analyse_stream",
+        ):
+            for delta in turn.feed(chunk):
+                yield delta
+    except http_requests.exceptions.Timeout:
+        logger.error("Gemini Analyse stream timed out after %s seconds", timeout)
+        raise RuntimeError("The AI analysis timed out. The file might be too complex or large.")
+    except http_requests.exceptions.RequestException as e:
+        logger.error("Gemini Analyse stream connection error: %s", e)
+        raise RuntimeError(f"Could not connect to AI service: {e}")
+
+
+async def _astream_analyse_rows(stream, analysis: dict, images: list):
+    """Feed the streamed /analyse JSON into ``stream``; yields an ``analyse_row`` frame per finished row."""
+    rows = _AnalyseRowStream()
+    async for delta in _astream_gemini_analyse(
+        system=analysis['system'],
+        user_content=analysis['user_content'],
+        images=images if images else None,
+        max_tokens=65536,
+        temperature=0.3,
+    ):
+        for key, index, value in stream.feed(delta):
+            event = rows.event(key, index, value)
+            if event:
+                yield _sse(event)
+
+
+# ── DRF bridge ───────────────────────────────────────────────────────
+
+class AsyncDRFView(View, metaclass=abc.ABCMeta):
+    """
+    Plain Django async view that borrows request parsing, authentication,
+    permissions, throttling and exception handling from ``drf_view_class``.
+
+    Subclasses implement ``async handle(view, request)`` and return a DRF
+    ``Response`` or a ``StreamingHttpResponse``.
+    """
+    drf_view_class = None
+    http_method_names = ['post', 'options']
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated API, same as DRF's APIView.as_view().
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def post(self, request, *args, **kwargs):
+        view = self.drf_view_class()
+        view.args, view.kwargs = args, kwargs
+        view.headers = view.default_response_headers
+        view.format_kwarg = None
+
+        def _enter():
+            drf_request = view.initialize_request(request, *args, **kwargs)
+            view.request = drf_request
+            view.initial(drf_request, *args, **kwargs)
+            drf_request.data  # parse the body while still off the event loop
+            return drf_request
+
+        try:
+            drf_request = await sync_to_async(_enter)()
+            response = await self.handle(view, drf_request)
+        except Exception as exc:
+            response = await sync_to_async(view.handle_exception)(exc)
+        return await sync_to_async(view.finalize_response)(view.request, response, *args, **kwargs)
+
+    @abc.abstractmethod
+    async def handle(self, view, request):
+        """Serve ``request`` with the initialised DRF ``view``."""
+
+
+class AsyncChatCompletionView(AsyncDRFView):
+    """ASGI variant of :class:`views.ChatCompletionView`."""
+    drf_view_class = ChatCompletionView
+
+    async def handle(self, view, request):
+        # Slash-command handlers (/analyse, /draw, /scan) are multi-step sync
+        # pipelines; they run inside prepare() on Django's per-request thread.
+        prepared = await sync_to_async(view.prepare)(request)
+        if isinstance(prepared, Response):
+            return prepared
+
+        try:
+            response_content = await _acall_gemini_with_tools(
+                messages=prepared['llm_messages'],
+                system=prepared['system'],
+                images=prepared['images'],
+            )
+        except Exception as e:
+            return view.error_response(e)
+        return await sync_to_async(view.completion_response)(prepared, response_content)
+
+
+class AsyncChatStreamView(AsyncDRFView):
+    """ASGI variant of :class:`views.ChatStreamView`."""
+    drf_view_class = ChatStreamView
+
+    async def handle(self, view, request):
+        if view.wants_analyse_stream(request):
+            return await self.stream_analyse(view, request)
+        if view.is_command(request):
+            return await AsyncChatCompletionView().handle(self._completion_view(request), request)
+
+        prepared = await sync_to_async(view.prepare)(request)
+        if isinstance(prepared, Response):
+            return prepared
+
+        session_id_value = prepared['session_id']
+        # finalize_response() clears the request's binding before the body is sent.
+        usage_binding = usage.current_binding()
+
+        async def event_stream():
+            usage_token = usage.restore_binding(usage_binding)
+            collected = []
+            try:
+                async for chunk in _astream_gemini_with_tools(
+                    messages=prepared['llm_messages'],
+                    system=prepared['system'],
+                    images=prepared['images'],
+                ):
+                    yield chunk
+                    view.collect_token(chunk, collected)
+
+                yield _sse({'type': 'meta', 'session_id': session_id_value})
+                yield "data: [DONE]\n\n"
+
+            except Exception as e:
+                logger.exception("AsyncChatStreamView SSE error")
+                yield _sse({'type': 'error', 'content': str(e)})
+                yield "data: [DONE]\n\n"
+            finally:
+                await sync_to_async(view.save_reply)(session_id_value, collected)
+                usage.unbind(usage_token)
+
+        return view.sse_response(event_stream())
+
+    async def stream_analyse(self, view, request):
+        """
+        Async :meth:`views.ChatStreamView.stream_analyse`. Rows are read from
+        Gemini on the event loop and sent as they are written; the prompt,
+        cache, normalization and history writes run through ``sync_to_async``.
+        """
+        inputs = await sync_to_async(view.begin_analyse)(request)
+        if isinstance(inputs, Response):
+            return inputs
+        completion = inputs['view']
+        project, user, file_name = inputs['project'], inputs['user'], inputs['file_name']
+        usage_binding = usage.current_binding()
+
+        async def event_stream():
+            usage_token = usage.restore_binding(usage_binding)
+            try:
+                analysis = await sync_to_async(completion._analyse_request)(
+                    inputs['user_query'], inputs['vision_images'], project,
+                )
+                norm = await sync_to_async(completion._cached_analyse)(
+                    analysis, project, user, file_name, inputs['use_cache'],
+                )
+                if norm is not None:
+                    for frame in _analyse_row_events(norm):
+                        yield frame
+                else:
+                    stream = json_stream.ObjectStream()
+                    try:
+                        async for frame in _astream_analyse_rows(stream, analysis, inputs['vision_images']):
+                            yield frame
+                        parsed, complete = _parse_analyse_text(stream.text)
+                        norm = await sync_to_async(completion._finish_analyse)(
+                            parsed, analysis, project, user, file_name, complete=complete,
+                        )
+                    except Exception as e:
+                        logger.error("Gemini analyse stream error: %s", e, exc_info=True)
+                        yield _sse({'type': 'error', 'content': str(e)})
+                        norm = _empty_analyse_payload(f"Analysis failed: {str(e)}")
+                yield _sse({'type': 'analyse', 'analyse': norm})
+
+                await sync_to_async(view.save_analyse_reply)(inputs['session'], norm)
+                yield _sse({'type': 'meta', 'session_id': inputs['session'].id})
+                yield "data: [DONE]\n\n"
+            except Exception as e:
+                logger.exception("AsyncChatStreamView /analyse SSE error")
+                yield _sse({'type': 'error', 'content': str(e)})
+                yield "data: [DONE]\n\n"
+            finally:
+                usage.unbind(usage_token)
+
+        return view.sse_response(event_stream())
+
+    @staticmethod
+    def _completion_view(request):
+        view = ChatCompletionView()
+        view.request = request
+        return view
+
+
+class AsyncDrawAgentView(AsyncDRFView):
+    """ASGI variant of :class:`views.DrawAgentView`."""
+    drf_view_class = DrawAgentView
+
+    async def handle(self, view, request):
+        prompt, user_message = view.build_user_message(request)
+        if prompt is None:
+            return Response({'error': 'prompt is required'}, status=400)
+
+        try:
+            raw = await _acall_gemini(
+                messages=[{"role": "user", "content": user_message}],
+                system=_DRAW_AGENT_SYSTEM,
+                **view.gemini_options,
+            )
+            return view.plan_response(raw, prompt)
+        except Exception as e:
+            return view.error_response(e)
+
+
+class AsyncDraftCopilotView(AsyncDRFView):
+    """ASGI variant of :class:`views.DraftCopilotView`."""
+    drf_view_class = DraftCopilotView
+
+    async def handle(self, view, request):
+        prompt = view.get_prompt(request)
+        if not prompt:
+            return Response({'error': 'prompt is required'}, status=400)
+
+        try:
+            raw = await _acall_gemini_json(
+                system=_DRAFT_COPILOT_SYSTEM_PROMPT,
+                user_content=prompt,
+                **view.gemini_options,
+            )
+            return view.draft_response(raw, prompt)
+        except Exception as e:
+            return view.error_response(e)
@@ -0,0 +1,102 @@
+"""
+Admin-edited AI configuration served from process memory.
+
+The active ``AIInstruction`` text and the prompt block rendered from the
+active ``BOQTemplate`` (with its example JSON parsed once) are held in
+``ConfigCache`` instances, so chat, stream, site-intel and /analyse requests
+read them without a query; edits are picked up as described in
+``apps.core.config_cache``.
+"""
+import json
+
+from apps.core.config_cache import ConfigCache
+
+from .models import AIInstruction, BOQTemplate
+
+DEFAULT_INSTRUCTION = (
+    "You are the DzeNhare Architecture AI, a helpful, professional AI assistant "
+    "built into the builder dashboard. You specialize in construction, compliance "
+    "regulations (like SI-56), and architectural guidance. Keep answers concise, "
+    "helpful, and professional."
+)
+
+
+def _load_instruction() -> str:
+    instruction_obj = AIInstruction.objects.filter(is_active=True).first()
+    return instruction_obj.instruction_text if instruction_obj else DEFAULT_INSTRUCTION
+
+
+_instruction = ConfigCache('ai_instruction', _load_instruction, AIInstruction)
+
+
+def base_instruction() -> str:
+    """System prompt of the active AIInstruction (or the built-in default)."""
+    return _instruction.get()
+
+
+def render_boq_template_prompt(template) -> str:
+    """Prompt instructions for /analyse derived from ``template``."""
+    lines = [
+        "\n\n--- ACTIVE BOQ TEMPLATE (STRICTLY FOLLOW) ---",
+        f"Template Name: {template.name}",
+    ]
+
+    if template.category_order:
+        lines.extend([
+            "Category Order (preserve this sequence):",
+            template.category_order.strip(),
+        ])
+
+    if template.extraction_rules:
+        lines.extend([
+            "Template Extraction Rules:",
+            template.extraction_rules.strip(),
+        ])
+
+    example_items = template.get_example_items()
+    if example_items:
+        lines.extend([
+            "Few-shot Example Items (mirror this naming/detail style):",
+            json.dumps(example_items, ensure_ascii=True, indent=2),
+        ])
+
+    # Keep these explicit so the model includes expected optional fields.
+    if template.include_labour_rate:
+        lines.append(
+            "For each building item, include `labour_rate` where reasonably derivable."
+        )
+    if template.include_measurement_formula:
+        lines.append(
+            "For each measurable item, include `measurement_formula` showing how quantity was computed."
+        )
+
+    if template.header_text:
+        lines.append(
+            f"Use this BOQ export header intent/context when writing summary: {template.header_text.strip()}"
+        )
+    if template.footer_text:
+        lines.append(
+            f"Consider this BOQ footer intent/context for notes or recommendations: {template.footer_text.strip()}"
+        )
+
+    return "\n".join(lines)
+
+
+def _load_boq_template() -> dict:
+    template = BOQTemplate.objects.filter(is_active=True).order_by('-updated_at', '-id').first()
+    if not template:
+        return {'id': None, 'marker': '', 'prompt': ''}
+    return {
+        'id': template.id,
+        # Folded into /analyse cache keys so a template edit misses the cache.
+        'marker': f"{template.id}@{template.updated_at.isoformat()}",
+        'prompt': render_boq_template_prompt(template),
+    }
+
+
+_boq_template = ConfigCache('boq_template', _load_boq_template, BOQTemplate)
+
+
+def active_boq_template() -> dict:
+    """``{"id", "marker", "prompt"}`` of the active BOQ template (empty values if none)."""
+    return _boq_template.get()
@@ -0,0 +1,404 @@
+"""
+Process-wide pooled HTTP client for the Gemini REST API.
+
+Every Gemini call site goes through :func:`post` so that TCP/TLS connections
+to generativelanguage.googleapis.com are reused across requests and tool
+rounds, transient failures (429 / 5xx / dropped connections) are retried with
+jittered exponential backoff, and per-call latency / byte counters are kept.
+Token counts from each response's ``usageMetadata`` are handed to ``usage``.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import usage
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_ROOT = "https://generativelanguage.googleapis.com/v1beta"
+
+# Status codes worth retrying: rate limiting and transient upstream failures.
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+# ── Pooled session ───────────────────────────────────────────────────
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, "GEMINI_HTTP_POOL_CONNECTIONS", 4),
+        pool_maxsize=getattr(settings, "GEMINI_HTTP_POOL_MAXSIZE", 32),
+        pool_block=True,
+        max_retries=0,  # retries are handled by post() so they can be counted
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Connection": "keep-alive",
+    })
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the per-process keep-alive session (rebuilt after a fork)."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+# ── Call statistics ──────────────────────────────────────────────────
+
+class GeminiCallStats:
+    """Thread-safe counters for Gemini HTTP traffic in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.failures = 0
+            self.retries = 0
+            self.total_latency_ms = 0.0
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.by_label: dict[str, dict] = {}
+
+    def record(self, label: str, latency_ms: float, sent: int, received: int,
+               retries: int, ok: bool):
+        with self._lock:
+            self.calls += 1
+            self.retries += retries
+            self.total_latency_ms += latency_ms
+            self.bytes_sent += sent
+            self.bytes_received += received
+            if not ok:
+                self.failures += 1
+            entry = self.by_label.setdefault(label, {
+                "calls": 0, "failures": 0, "latency_ms": 0.0,
+                "bytes_sent": 0, "bytes_received": 0,
+            })
+            entry["calls"] += 1
+            entry["latency_ms"] += latency_ms
+            entry["bytes_sent"] += sent
+            entry["bytes_received"] += received
+            if not ok:
+                entry["failures"] += 1
+
+    def add_received(self, label: str, received: int):
+        """Account bytes read after the call was recorded (streamed bodies)."""
+        with self._lock:
+            self.bytes_received += received
+            entry = self.by_label.get(label)
+            if entry is not None:
+                entry["bytes_received"] += received
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": self.retries,
+                "avg_latency_ms": round(self.total_latency_ms / self.calls, 1) if self.calls else 0.0,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "by_label": {k: dict(v) for k, v in self.by_label.items()},
+            }
+
+
+stats = GeminiCallStats()
+
+
+# ── Request helpers ──────────────────────────────────────────────────
+
+def model_url(model_name: str, method: str = "generateContent") -> str:
+    return f"{GEMINI_API_ROOT}/models/{model_name}:{method}"
+
+
+def _backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when given."""
+    cap = getattr(settings, "GEMINI_HTTP_BACKOFF_MAX", 8.0)
+    if retry_after:
+        try:
+            return min(cap, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    base = getattr(settings, "GEMINI_HTTP_BACKOFF_BASE", 0.5)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def post(model_name: str, payload: dict, *, timeout: float,
+         method: str = "generateContent", label: str = "",
+         stream: bool = False, params: dict | None = None) -> requests.Response:
+    """
+    POST *payload* to ``models/{model_name}:{method}`` over the pooled session.
+
+    Retries connection failures and 429/5xx responses with jittered backoff.
+    Read timeouts are not retried (the caller's timeout is the whole budget).
+    Raises the usual ``requests`` exceptions so callers keep their handling.
+    """
+    url = model_url(model_name, method)
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"x-goog-api-key": settings.GEMINI_API_KEY}
+    max_retries = getattr(settings, "GEMINI_HTTP_MAX_RETRIES", 2)
+    label = label or method
+    session = get_session()
+
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            resp = session.post(
+                url, data=body, headers=headers, params=params,
+                timeout=timeout, stream=stream,
+            )
+        except requests.exceptions.ConnectionError as exc:
+            if attempt < max_retries:
+                delay = _backoff_delay(attempt)
+                logger.warning("[Gemini %s] connection error (%s); retrying in %.2fs", label, exc, delay)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            stats.record(label, (time.monotonic() - started) * 1000, len(body), 0, attempt, ok=False)
+            raise
+        except requests.exceptions.RequestException:
+            stats.record(label, (time.monotonic() - started) * 1000, len(body), 0, attempt, ok=False)
+            raise
+
+        if resp.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+            delay = _backoff_delay(attempt, resp.headers.get("Retry-After"))
+            logger.warning("[Gemini %s] HTTP %s; retrying in %.2fs", label, resp.status_code, delay)
+            resp.close()
+            attempt += 1
+            time.sleep(delay)
+            continue
+        break
+
+    latency_ms = (time.monotonic() - started) * 1000
+    received = 0 if stream else len(resp.content)
+    stats.record(label, latency_ms, len(body), received, attempt, ok=resp.status_code == 200)
+    logger.info(
+        "[Gemini %s] %s → HTTP %s in %.0f ms (sent %d B, received %s B, retries %d)",
+        label, model_name, resp.status_code, latency_ms, len(body),
+        received if not stream else "stream", attempt,
+    )
+    if not stream and resp.status_code == 200:
+        usage.record_response_body(model_name, resp.content, label)
+    return resp
+
+
+def stream_generate_content(model_name: str, payload: dict, *, timeout: float,
+                            label: str = "stream"):
+    """
+    Call ``streamGenerateContent`` with SSE framing and yield each response
+    chunk (a ``GenerateContentResponse`` dict) as soon as it is received.
+
+    Raises ``RuntimeError`` for a non-200 answer; transport errors propagate
+    as ``requests`` exceptions.
+    """
+    resp = post(
+        model_name, payload, timeout=timeout, method="streamGenerateContent",
+        label=label, stream=True, params={"alt": "sse"},
+    )
+    try:
+        if resp.status_code != 200:
+            body = resp.text[:600]
+            logger.error("Gemini stream HTTP %s: %s", resp.status_code, body)
+            raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {body}")
+
+        received = 0
+        usage_metadata = None
+        data_lines: list[str] = []
+        for raw_line in resp.iter_lines(decode_unicode=False):
+            received += len(raw_line) + 1
+            line = raw_line.decode("utf-8") if isinstance(raw_line, bytes) else raw_line
+            if line.startswith("data:"):
+                data_lines.append(line[5:].lstrip())
+                continue
+            if line.strip() or not data_lines:
+                continue
+            # A blank line terminates one SSE event.
+            chunk = _decode_event(data_lines, label)
+            data_lines = []
+            if chunk is not None:
+                # Each chunk reports cumulative usage; the last one is the total.
+                usage_metadata = chunk.get("usageMetadata") or usage_metadata
+                yield chunk
+        chunk = _decode_event(data_lines, label) if data_lines else None
+        if chunk is not None:
+            usage_metadata = chunk.get("usageMetadata") or usage_metadata
+            yield chunk
+        stats.add_received(label, received)
+        usage.record(model_name, usage_metadata, label)
+    finally:
+        resp.close()
+
+
+def _decode_event(data_lines: list[str], label: str):
+    event = "\n".join(data_lines)
+    try:
+        chunk = json.loads(event)
+    except json.JSONDecodeError:
+        logger.warning("[Gemini %s] skipping undecodable stream event: %.200s", label, event)
+        return None
+    return chunk if isinstance(chunk, dict) else None
+
+
+# ── Async client (ASGI deployments) ──────────────────────────────────
+#
+# The ASGI views await Gemini instead of parking a thread on the socket.
+# httpx.AsyncClient is bound to the event loop it was created on, so one
+# client is kept per running loop. Entries go away with their loop (weak
+# keys), and clients of loops that have closed are dropped on the next call.
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the keep-alive ``httpx.AsyncClient`` for the running event loop."""
+    import asyncio
+    import httpx
+
+    for stale in [loop for loop in list(_async_clients) if loop.is_closed()]:
+        _async_clients.pop(stale, None)
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=getattr(settings, "GEMINI_HTTP_POOL_MAXSIZE", 32),
+                max_keepalive_connections=getattr(settings, "GEMINI_HTTP_POOL_MAXSIZE", 32),
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def apost(model_name: str, payload: dict, *, timeout: float,
+                method: str = "generateContent", label: str = "",
+                params: dict | None = None):
+    """
+    Async counterpart of :func:`post` (same retries and counters).
+
+    ``httpx`` transport errors are re-raised as the equivalent ``requests``
+    exceptions so call sites share one set of ``except`` clauses.
+    """
+    import asyncio
+    import httpx
+
+    url = model_url(model_name, method)
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"x-goog-api-key": settings.GEMINI_API_KEY}
+    max_retries = getattr(settings, "GEMINI_HTTP_MAX_RETRIES", 2)
+    label = label or method
+    client = get_async_client()
+
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            resp = await client.post(url, content=body, headers=headers,
+                                     params=params, timeout=timeout)
+        except httpx.TimeoutException as exc:
+            stats.record(label, (time.monotonic() - started) * 1000, len(body), 0, attempt, ok=False)
+            raise requests.exceptions.Timeout(str(exc)) from exc
+        except httpx.TransportError as exc:
+            if attempt < max_retries:
+                delay = _backoff_delay(attempt)
+                logger.warning("[Gemini %s] connection error (%s); retrying in %.2fs", label, exc, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            stats.record(label, (time.monotonic() - started) * 1000, len(body), 0, attempt, ok=False)
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+
+        if resp.status_code in RETRYABLE_STATUS_CODES and attempt < max_retries:
+            delay = _backoff_delay(attempt, resp.headers.get("Retry-After"))
+            logger.warning("[Gemini %s] HTTP %s; retrying in %.2fs", label, resp.status_code, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        break
+
+    latency_ms = (time.monotonic() - started) * 1000
+    stats.record(label, latency_ms, len(body), len(resp.content), attempt, ok=resp.status_code == 200)
+    logger.info(
+        "[Gemini %s] %s → HTTP %s in %.0f ms (sent %d B, received %d B, retries %d, async)",
+        label, model_name, resp.status_code, latency_ms, len(body), len(resp.content), attempt,
+    )
+    if resp.status_code == 200:
+        usage.record_response_body(model_name, resp.content, label)
+    return resp
+
+
+async def astream_generate_content(model_name: str, payload: dict, *, timeout: float,
+                                   label: str = "stream"):
+    """Async counterpart of :func:`stream_generate_content`."""
+    import httpx
+
+    url = model_url(model_name, "streamGenerateContent")
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"x-goog-api-key": settings.GEMINI_API_KEY}
+    client = get_async_client()
+
+    started = time.monotonic()
+    received = 0
+    try:
+        async with client.stream("POST", url, content=body, headers=headers,
+                                 params={"alt": "sse"}, timeout=timeout) as resp:
+            stats.record(label, (time.monotonic() - started) * 1000, len(body), 0, 0,
+                         ok=resp.status_code == 200)
+            if resp.status_code != 200:
+                text = (await resp.aread()).decode("utf-8", "replace")[:600]
+                logger.error("Gemini stream HTTP %s: %s", resp.status_code, text)
+                raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {text}")
+
+            usage_metadata = None
+            data_lines: list[str] = []
+            async for line in resp.aiter_lines():
+                received += len(line) + 1
+                if line.startswith("data:"):
+                    data_lines.append(line[5:].lstrip())
+                    continue
+                if line.strip() or not data_lines:
+                    continue
+                chunk = _decode_event(data_lines, label)
+                data_lines = []
+                if chunk is not None:
+                    usage_metadata = chunk.get("usageMetadata") or usage_metadata
+                    yield chunk
+            chunk = _decode_event(data_lines, label) if data_lines else None
+            if chunk is not None:
+                usage_metadata = chunk.get("usageMetadata") or usage_metadata
+                yield chunk
+            usage.record(model_name, usage_metadata, label)
+    except httpx.TimeoutException as exc:
+        raise requests.exceptions.Timeout(str(exc)) from exc
+    except httpx.TransportError as exc:
+        raise requests.exceptions.ConnectionError(str(exc)) from exc
+    finally:
+        stats.add_received(label, received)
@@ -0,0 +1,217 @@
+"""
+Server-side conversation history for the chat views.
+
+Clients send the whole conversation on every turn, so long sessions used to
+grow the Gemini prompt without bound. The prompt is now rebuilt from the
+session's own ``ChatMessage`` rows:
+
+* ``ChatSession.summary`` — a rolling summary of everything up to
+  ``summary_through_id``, injected into the system prompt
+* the most recent messages after that point, newest first, until
+  ``AI_HISTORY_PROMPT_BUDGET`` (summary + window, in estimated tokens) or
+  ``AI_HISTORY_MAX_MESSAGES`` is reached
+
+After each reply :func:`schedule_summary` checks how much unsummarised
+history has accumulated; past ``AI_HISTORY_SUMMARIZE_AFTER_TOKENS`` a
+background thread folds all but the last ``AI_HISTORY_KEEP_RECENT`` messages
+into the summary. A shared-cache lock keeps one refresh per session in flight.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from apps.core.cache_utils import shared_cache
+
+from .models import ChatMessage, ChatSession
+from .project_context import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_CHAT_ROLES = ('user', 'assistant')
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You maintain a running summary of a conversation between a user and the DzeNhare "
+    "Architecture AI assistant. Merge the previous summary with the new messages into one "
+    "updated summary. Keep every fact the assistant may need later: project details, "
+    "dimensions, quantities, rates, prices, decisions, open questions and user preferences. "
+    "Drop greetings and repetition. Write compact bullet points in plain text, at most "
+    "{max_words} words. Output only the summary."
+)
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def build_history(session: ChatSession, client_messages: list | None = None) -> tuple[list, str]:
+    """
+    Return ``(llm_messages, summary)`` for the next Gemini call on ``session``.
+
+    The latest user message must already be saved. Falls back to the client's
+    ``messages`` (trimmed to the same budget) if the session has no stored turns.
+    """
+    summary = (session.summary or '').strip()
+    budget = _setting('AI_HISTORY_PROMPT_BUDGET', 12000)
+    window_budget = max(budget - (session.summary_tokens or estimate_tokens(summary)), 0)
+    max_messages = _setting('AI_HISTORY_MAX_MESSAGES', 40)
+
+    rows = ChatMessage.objects.filter(session=session, role__in=_CHAT_ROLES)
+    if session.summary_through_id:
+        rows = rows.filter(id__gt=session.summary_through_id)
+    recent = [
+        {"role": role, "content": content}
+        for role, content in rows.order_by('-id').values_list('role', 'content')[:max_messages]
+    ]
+    if not recent and client_messages:
+        summary = ''
+        recent = [
+            {"role": m['role'], "content": m['content']}
+            for m in reversed(client_messages[-max_messages:])
+            if m.get('role') in _CHAT_ROLES
+        ]
+
+    window, used = [], 0
+    for msg in recent:  # newest first
+        tokens = estimate_tokens(msg['content'] or '')
+        # The newest message is always sent, even if it alone exceeds the budget.
+        if window and used + tokens > window_budget:
+            break
+        window.append(msg)
+        used += tokens
+    window.reverse()
+
+    # Gemini expects the conversation to open with a user turn.
+    while len(window) > 1 and window[0]['role'] != 'user':
+        window.pop(0)
+    return window, summary
+
+
+def summary_prompt_block(summary: str) -> str:
+    if not summary:
+        return ''
+    return (
+        "\n\nSUMMARY OF EARLIER CONVERSATION (older messages are not repeated below):\n"
+        f"{summary}"
+    )
+
+
+def unsummarised_tokens(session: ChatSession) -> int:
+    rows = ChatMessage.objects.filter(session=session, role__in=_CHAT_ROLES)
+    if session.summary_through_id:
+        rows = rows.filter(id__gt=session.summary_through_id)
+    chars = rows.aggregate(chars=Sum(Length('content')))['chars'] or 0
+    return (chars + 3) // 4
+
+
+def needs_summary(session: ChatSession) -> bool:
+    return unsummarised_tokens(session) > _setting('AI_HISTORY_SUMMARIZE_AFTER_TOKENS', 8000)
+
+
+def summarize_session(session_id: int) -> bool:
+    """Fold older messages of ``session_id`` into its rolling summary."""
+    from . import usage
+    from .views import _call_gemini
+
+    session = ChatSession.objects.select_related('user').get(pk=session_id)
+    keep_recent = _setting('AI_HISTORY_KEEP_RECENT', 6)
+    rows = ChatMessage.objects.filter(session=session, role__in=_CHAT_ROLES)
+    if session.summary_through_id:
+        rows = rows.filter(id__gt=session.summary_through_id)
+    ids = list(rows.order_by('-id').values_list('id', flat=True)[keep_recent:keep_recent + 1])
+    if not ids:
+        return False
+    through_id = ids[0]
+
+    # Oldest first, stopping at the input cap: the summary may only claim the
+    # messages it has seen, the rest is folded in by the next refresh.
+    max_chars = _setting('AI_HISTORY_SUMMARY_INPUT_CHARS', 60000)
+    lines, used = [], 0
+    older = rows.filter(id__lte=through_id).order_by('id').values_list('id', 'role', 'content')
+    for msg_id, role, content in older:
+        line = f"{'User' if role == 'user' else 'Assistant'}: {content}"
+        if lines and used + len(line) + 2 > max_chars:
+            break
+        # A single oversized message is cut rather than blocking the summary.
+        lines.append(line[:max_chars])
+        used += len(lines[-1]) + 2
+        through_id = msg_id
+    transcript = "\n\n".join(lines)
+
+    max_words = _setting('AI_HISTORY_SUMMARY_MAX_WORDS', 400)
+    usage_token = usage.bind(session.user, 'summary', session=session)
+    try:
+        new_summary = _call_gemini(
+            messages=[{
+                "role": "user",
+                "content": (
+                    f"PREVIOUS SUMMARY:\n{session.summary or '(none)'}\n\n"
+                    f"NEW MESSAGES:\n{transcript}"
+                ),
+            }],
+            system=SUMMARY_SYSTEM_PROMPT.format(max_words=max_words),
+            max_tokens=2048,
+            temperature=0.2,
+            timeout=60.0,
+        ).strip()
+    finally:
+        usage.unbind(usage_token)
+    if not new_summary:
+        return False
+
+    # Conditional update: a concurrent refresh that already moved further wins.
+    base = ChatSession.objects.filter(pk=session_id)
+    if session.summary_through_id:
+        base = base.filter(summary_through_id=session.summary_through_id)
+    else:
+        base = base.filter(summary_through_id__isnull=True)
+    updated = base.update(
+        summary=new_summary,
+        summary_through_id=through_id,
+        summary_tokens=estimate_tokens(new_summary),
+        summary_updated_at=timezone.now(),
+    )
+    logger.info("[History] session %s summarised through message %s (%s)",
+                session_id, through_id, "saved" if updated else "superseded")
+    return bool(updated)
+
+
+def schedule_summary(session: ChatSession | int):
+    """Refresh the session summary in the background when history is long enough."""
+    if not _setting('AI_HISTORY_SUMMARY_ENABLED', True):
+        return
+    if not isinstance(session, ChatSession):
+        session = ChatSession.objects.filter(pk=session).first()
+        if session is None:
+            return
+    try:
+        if not needs_summary(session):
+            return
+    except Exception as e:
+        logger.warning("History size check failed for session %s: %s", session.pk, e)
+        return
+
+    lock_key = f"ai:history:summarising:{session.pk}"
+    try:
+        if not shared_cache().add(lock_key, 1, timeout=300):
+            return
+    except Exception:
+        return
+
+    def _run():
+        try:
+            summarize_session(session.pk)
+        except Exception as e:
+            logger.error("History summary failed for session %s: %s", session.pk, e)
+        finally:
+            try:
+                shared_cache().delete(lock_key)
+            except Exception:
+                pass
+            connections.close_all()
+
+    threading.Thread(target=_run, name="chat-history-summary", daemon=True).start()
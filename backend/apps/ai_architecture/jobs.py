@@ -0,0 +1,243 @@
+"""
+DB-backed background jobs for the long-running AI commands.
+
+``/analyse`` (one 180 s Gemini Pro call) and ``/draw`` / ``/scan`` (prompt
+engineering followed by a 90 s image call) are too slow to run inside an
+HTTP request behind a proxy. When backgrounding is requested the chat view
+saves the user's message, stores the command inputs on an :class:`AIJob`
+and answers ``202`` with the job id. ``manage.py run_ai_jobs`` workers then:
+
+1. claim the oldest queued job with a conditional ``UPDATE`` (safe with any
+   number of workers on SQLite or Postgres, no broker required),
+2. replay the command through ``ChatCompletionView.run_job`` — which writes
+   the assistant ``ChatMessage`` / ``BudgetAnalysisHistory`` rows exactly as
+   the synchronous path does — reporting progress as it goes,
+3. store the response body on the job.
+
+Clients poll ``GET jobs/<id>/`` or follow ``GET jobs/<id>/events/`` (SSE).
+While a job runs, a heartbeat thread in the worker refreshes its
+``heartbeat_at`` every ``AI_JOB_HEARTBEAT_INTERVAL`` seconds, however long a
+single Gemini call takes. Jobs whose worker stopped heart-beating are
+re-queued (up to ``AI_JOB_MAX_ATTEMPTS``) by the next worker.
+"""
+import logging
+import os
+import socket
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AIJob
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def backgrounding_enabled() -> bool:
+    return getattr(settings, 'AI_BACKGROUND_JOBS', False)
+
+
+def enqueue(kind: str, user, payload: dict, *, session=None, project=None) -> AIJob:
+    job = AIJob.objects.create(
+        kind=kind,
+        user=user,
+        session=session,
+        project=project,
+        payload=payload,
+        progress_message='Queued',
+    )
+    logger.info("[Jobs] queued %s job %s for user %s", kind, job.id, user.pk)
+    return job
+
+
+def report_progress(percent: int, message: str = ''):
+    """
+    Record progress of the job running on this thread. A no-op outside a
+    worker, so command handlers can call it unconditionally.
+    """
+    job_id = getattr(_current, 'job_id', None)
+    if job_id is None:
+        return
+    now = timezone.now()
+    AIJob.objects.filter(pk=job_id).update(
+        progress=max(0, min(100, int(percent))),
+        progress_message=message[:255],
+        heartbeat_at=now,
+        updated_at=now,
+    )
+
+
+def requeue_stale_jobs() -> int:
+    """Put jobs abandoned by a dead worker back on the queue (or fail them)."""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'AI_JOB_STALE_AFTER', 600))
+    stale = AIJob.objects.filter(status=AIJob.STATUS_RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    max_attempts = getattr(settings, 'AI_JOB_MAX_ATTEMPTS', 2)
+    now = timezone.now()
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status=AIJob.STATUS_FAILED,
+        error='Worker stopped responding.',
+        http_status=500,
+        result={
+            'error': 'Worker stopped responding.',
+            'message': 'The AI job was interrupted. Please try again.',
+            'role': 'assistant',
+        },
+        payload={},
+        finished_at=now,
+        updated_at=now,
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status=AIJob.STATUS_QUEUED,
+        locked_by='',
+        progress=0,
+        progress_message='Re-queued after worker timeout',
+        updated_at=now,
+    )
+    if failed or requeued:
+        logger.warning("[Jobs] stale jobs: %d re-queued, %d failed", requeued, failed)
+    return requeued + failed
+
+
+def claim_next_job(worker: str | None = None):
+    """
+    Atomically move the oldest queued job to ``running`` and return it.
+
+    Candidates are read without locks; the ``UPDATE ... WHERE status='queued'``
+    only matches for the first worker to get there, so concurrent workers
+    simply move on to the next candidate.
+    """
+    worker = worker or worker_id()
+    candidates = list(
+        AIJob.objects.filter(status=AIJob.STATUS_QUEUED)
+        .order_by('created_at')
+        .values_list('pk', flat=True)[:10]
+    )
+    for pk in candidates:
+        now = timezone.now()
+        claimed = AIJob.objects.filter(pk=pk, status=AIJob.STATUS_QUEUED).update(
+            status=AIJob.STATUS_RUNNING,
+            locked_by=worker[:120],
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now,
+            progress=5,
+            progress_message='Started',
+            updated_at=now,
+        )
+        if claimed:
+            return AIJob.objects.select_related('user', 'session', 'project').get(pk=pk)
+    return None
+
+
+class _Heartbeat:
+    """Refresh ``heartbeat_at`` of a running job from a side thread until stopped."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'ai-job-heartbeat-{job_id}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        interval = getattr(settings, 'AI_JOB_HEARTBEAT_INTERVAL', 30)
+        try:
+            while not self._stop.wait(interval):
+                try:
+                    self._beat()
+                except Exception as e:
+                    logger.warning("[Jobs] heartbeat for job %s failed: %s", self.job_id, e)
+        finally:
+            connection.close()
+
+    def _beat(self):
+        now = timezone.now()
+        AIJob.objects.filter(pk=self.job_id, status=AIJob.STATUS_RUNNING).update(
+            heartbeat_at=now, updated_at=now,
+        )
+
+
+def execute_job(job: AIJob) -> AIJob:
+    """Run a claimed job to completion and persist its outcome."""
+    from .views import ChatCompletionView
+
+    _current.job_id = job.pk
+    try:
+        with _Heartbeat(job.pk):
+            response = ChatCompletionView().run_job(job)
+        body, http_status, error = response.data, response.status_code, ''
+        if http_status >= 400:
+            error = str(body.get('error', '')) if isinstance(body, dict) else ''
+    except Exception as e:
+        logger.exception("[Jobs] %s job %s crashed", job.kind, job.pk)
+        body = {
+            'error': str(e),
+            'message': 'The AI job failed unexpectedly. Please try again.',
+            'role': 'assistant',
+        }
+        http_status, error = 500, str(e)
+    finally:
+        _current.job_id = None
+
+    job.status = AIJob.STATUS_FAILED if http_status >= 400 else AIJob.STATUS_SUCCEEDED
+    job.result = body
+    job.http_status = http_status
+    job.error = error
+    job.payload = {}
+    job.progress = 100
+    job.progress_message = 'Done' if job.status == AIJob.STATUS_SUCCEEDED else 'Failed'
+    job.finished_at = timezone.now()
+    # Only the worker that still holds the claim may record the outcome: if the
+    # job went stale and was re-queued (or claimed by another worker) meanwhile,
+    # this result is discarded rather than overwriting the newer attempt.
+    written = AIJob.objects.filter(
+        pk=job.pk, locked_by=job.locked_by, status=AIJob.STATUS_RUNNING,
+    ).update(
+        status=job.status,
+        result=job.result,
+        http_status=job.http_status,
+        error=job.error,
+        payload=job.payload,
+        progress=job.progress,
+        progress_message=job.progress_message,
+        finished_at=job.finished_at,
+        updated_at=job.finished_at,
+    )
+    if not written:
+        logger.warning(
+            "[Jobs] %s job %s lost its claim before finishing; result discarded", job.kind, job.pk,
+        )
+        job.refresh_from_db()
+        return job
+    logger.info("[Jobs] %s job %s finished: %s", job.kind, job.pk, job.status)
+    return job
+
+
+def run_pending_jobs(max_jobs: int | None = None, worker: str | None = None) -> int:
+    """Drain the queue (up to ``max_jobs``); returns the number of jobs run."""
+    ran = 0
+    while max_jobs is None or ran < max_jobs:
+        close_old_connections()
+        job = claim_next_job(worker)
+        if job is None:
+            break
+        execute_job(job)
+        ran += 1
+    return ran
@@ -0,0 +1,258 @@
+"""
+Tolerant parsing of truncated JSON from Gemini.
+
+Long structured responses (``/analyse`` BOQs, DrawAgent plans, DraftCopilot
+drafts) are regularly cut off at the output-token limit. :func:`loads` parses
+such text in a single pass and keeps everything that arrived complete:
+
+* every complete array element and every complete ``key: value`` pair
+* containers left open by the cut, with the members they already have —
+  except a half-written row (an array element holding only scalars), which
+  is dropped rather than passed off as a real one
+* nothing of a value that was itself cut (a half string, a number that may
+  be missing digits, ``tru``)
+
+Complete sub-values are handed to the C decoder (``raw_decode``) as they are
+met, so only the containers on the path to the cut are walked in Python and
+the whole input is scanned a small, fixed number of times however large it is.
+
+:class:`ObjectStream` parses a top-level object as it is being generated and
+reports each array element (and each other member) the moment it is complete,
+for streaming ``/analyse`` rows to the client.
+"""
+import json
+import re
+from json.decoder import scanstring
+
+_decoder = json.JSONDecoder(strict=False)
+_WS = re.compile(r'[ \t\n\r]*')
+_INCOMPLETE = object()
+
+
+class _Truncated(Exception):
+    """The value starting here was cut off (or is unreadable) and has nothing to keep."""
+
+
+def _cut_number(text: str, start: int, end: int) -> bool:
+    """Whether the number decoded from ``text[start:end]`` may continue past ``end``."""
+    return text[start] in '-0123456789' and (end >= len(text) or text[end] in '.eE+-')
+
+
+def _is_row(value) -> bool:
+    """A flat record: an object or array holding only scalars."""
+    members = value.values() if isinstance(value, dict) else value
+    return not any(isinstance(member, (dict, list)) for member in members)
+
+
+class _Parser:
+    def __init__(self, text: str):
+        self.text = text
+        self.end = len(text)
+
+    def _skip(self, pos: int) -> int:
+        return _WS.match(self.text, pos).end()
+
+    def value(self, pos: int):
+        """``(value, next_pos, complete)`` for the value at ``pos``."""
+        pos = self._skip(pos)
+        if pos >= self.end:
+            raise _Truncated
+        try:
+            value, next_pos = _decoder.raw_decode(self.text, pos)
+        except json.JSONDecodeError:
+            char = self.text[pos]
+            if char == '{':
+                return self._object(pos + 1)
+            if char == '[':
+                return self._array(pos + 1)
+            raise _Truncated
+        if _cut_number(self.text, pos, next_pos):
+            # "12" or "1." may have been "1250" before the cut.
+            raise _Truncated
+        return value, next_pos, True
+
+    def _array(self, pos: int):
+        items = []
+        while True:
+            pos = self._skip(pos)
+            if pos >= self.end:
+                return items, pos, False
+            if self.text[pos] == ']':
+                return items, pos + 1, True
+            try:
+                item, pos, complete = self.value(pos)
+            except _Truncated:
+                return items, pos, False
+            if not complete:
+                # A half-written row would pass for a real one; drop it.
+                if not _is_row(item):
+                    items.append(item)
+                return items, pos, False
+            items.append(item)
+            pos = self._skip(pos)
+            if pos < self.end and self.text[pos] == ',':
+                pos += 1
+            elif pos >= self.end or self.text[pos] != ']':
+                return items, pos, False
+
+    def _object(self, pos: int):
+        obj = {}
+        while True:
+            pos = self._skip(pos)
+            if pos >= self.end:
+                return obj, pos, False
+            char = self.text[pos]
+            if char == '}':
+                return obj, pos + 1, True
+            if char != '"':
+                return obj, pos, False
+            try:
+                key, pos = scanstring(self.text, pos + 1, False)
+            except json.JSONDecodeError:
+                return obj, pos, False
+            pos = self._skip(pos)
+            if pos >= self.end or self.text[pos] != ':':
+                return obj, pos, False
+            try:
+                value, pos, complete = self.value(pos + 1)
+            except _Truncated:
+                return obj, pos, False
+            obj[key] = value
+            if not complete:
+                return obj, pos, False
+            pos = self._skip(pos)
+            if pos < self.end and self.text[pos] == ',':
+                pos += 1
+            elif pos >= self.end or self.text[pos] != '}':
+                return obj, pos, False
+
+
+class ObjectStream:
+    """
+    Incremental parser for a JSON object arriving in chunks.
+
+    :meth:`feed` returns ``(key, index, value)`` for every member completed
+    by the chunk: one event per element of an array member (``index`` counts
+    from 0) and one event with ``index=None`` for any other value. Text
+    before the opening ``{`` is skipped. Each element is decoded once it has
+    fully arrived, so a chunk costs time proportional to its own length plus
+    the element still open. Input that stops making sense simply produces no
+    further events; :attr:`text` keeps everything fed for a final
+    :func:`loads`.
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._buf = ''
+        self._pos = 0
+        self._state = 'start'
+        self._key = None
+        self._index = 0
+
+    @property
+    def text(self) -> str:
+        return ''.join(self._chunks)
+
+    @property
+    def done(self) -> bool:
+        return self._state == 'end'
+
+    def feed(self, chunk: str) -> list[tuple]:
+        self._chunks.append(chunk)
+        # Keep only the unparsed tail; everything before _pos has been reported.
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        events = []
+        while self._step(events):
+            pass
+        return events
+
+    def _step(self, events: list) -> bool:
+        """Advance over one token or value; False when more input is needed."""
+        buf = self._buf
+        pos = _WS.match(buf, self._pos).end()
+        self._pos = pos
+        if pos >= len(buf) or self._state == 'end':
+            return False
+        char = buf[pos]
+        state = self._state
+
+        if state == 'start':
+            start = buf.find('{', pos)
+            if start < 0:
+                self._pos = len(buf)
+                return False
+            self._pos, self._state = start + 1, 'key'
+        elif state == 'key':
+            if char == '}':
+                self._pos, self._state = pos + 1, 'end'
+            elif char == ',':
+                self._pos = pos + 1
+            elif char == '"':
+                try:
+                    self._key, self._pos = scanstring(buf, pos + 1, False)
+                except json.JSONDecodeError:
+                    return False
+                self._state = 'colon'
+            else:
+                return False
+        elif state == 'colon':
+            if char != ':':
+                return False
+            self._pos, self._state = pos + 1, 'value'
+        elif state == 'value':
+            if char == '[':
+                self._pos, self._state, self._index = pos + 1, 'array', 0
+                return True
+            value = self._decode(buf, pos)
+            if value is _INCOMPLETE:
+                return False
+            events.append((self._key, None, value))
+            self._state = 'key'
+        else:  # array
+            if char == ']':
+                self._pos, self._state = pos + 1, 'key'
+            elif char == ',':
+                self._pos = pos + 1
+            else:
+                value = self._decode(buf, pos)
+                if value is _INCOMPLETE:
+                    return False
+                events.append((self._key, self._index, value))
+                self._index += 1
+        return True
+
+    def _decode(self, buf: str, pos: int):
+        try:
+            value, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            return _INCOMPLETE
+        if _cut_number(buf, pos, end):
+            return _INCOMPLETE
+        self._pos = end
+        return value
+
+
+def parse_partial(text: str):
+    """
+    ``(value, complete)`` for the JSON object or array in ``text``, which may
+    be truncated. Anything before the first ``{`` or ``[`` is ignored.
+    Raises ``ValueError`` when no object or array is found, or when the one
+    found is cut off before its first member (prose such as ``"Sorry, I
+    cannot read {this drawing}"`` is not an empty result).
+    """
+    match = re.search(r'[{\[]', text)
+    if match is None:
+        raise ValueError("Could not repair truncated JSON from Gemini response.")
+    value, _, complete = _Parser(text).value(match.start())
+    if not complete and not value:
+        raise ValueError("Could not repair truncated JSON from Gemini response.")
+    return value, complete
+
+
+def loads(text: str):
+    """``json.loads(text)``, recovering what it can when ``text`` is truncated."""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return parse_partial(text)[0]
@@ -0,0 +1,450 @@
+"""
+Knowledge-base retrieval for the chat assistant.
+
+Regulations and reference documents used to be pasted into
+``AIInstruction.instruction_text``, so every prompt carried all of them.
+Uploaded :class:`KnowledgeDocument` files are instead:
+
+1. read (PDF via pypdf, anything else as UTF-8 text) and split into
+   overlapping, paragraph-aligned :class:`KnowledgeChunk` rows
+2. deduplicated — a file whose SHA-256 matches an already indexed document is
+   skipped, and identical chunks are indexed once
+3. embedded by a pluggable backend (``AI_KNOWLEDGE_EMBEDDER``; the default
+   :class:`HashingEmbedder` needs no model download or network access)
+4. written to a NumPy index under ``AI_KNOWLEDGE_INDEX_DIR``: an L2-normalised
+   ``float32`` matrix plus the matching chunk ids, loaded with
+   ``mmap_mode='r'`` so worker processes share the pages
+
+:func:`prompt_block` returns the top-k passages for a user query (cosine
+similarity = one matrix-vector product) for the chat views to append to the
+system prompt. Each rebuild writes a new version directory and bumps the
+``knowledge_index`` generation, which tells every process to re-open it.
+"""
+import hashlib
+import io
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from apps.core.cache_utils import bump_generation, get_generation, shared_cache
+
+from .models import KnowledgeChunk, KnowledgeDocument
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAMESPACE = 'knowledge_index'
+_REBUILD_LOCK_KEY = 'ai:knowledge:rebuilding'
+_REBUILD_DIRTY_KEY = 'ai:knowledge:dirty'
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+# ── Embedding backends ───────────────────────────────────────────────
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was "
+    "were will with shall may must not no any all be been being which who what when where".split()
+)
+
+
+class HashingEmbedder:
+    """
+    Feature-hashed bag of words and bigrams, sublinear TF, L2-normalised.
+
+    Purely lexical, but deterministic, dependency-free and fast enough to
+    embed a whole regulations library on every rebuild. Swap in a neural
+    backend with ``AI_KNOWLEDGE_EMBEDDER``: any class with ``name``, ``dim``
+    and ``embed(texts) -> float32 array (len(texts), dim)``.
+    """
+
+    def __init__(self, dim: int | None = None):
+        self.dim = int(dim or _setting('AI_KNOWLEDGE_EMBED_DIM', 1024))
+        self.name = f"hashing-v1-{self.dim}"
+
+    def _features(self, text: str):
+        words = [w for w in _TOKEN_RE.findall(text.lower()) if w not in _STOPWORDS]
+        yield from words
+        for a, b in zip(words, words[1:]):
+            yield f"{a} {b}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: dict[int, float] = {}
+            for feature in self._features(text):
+                h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                slot = h % self.dim
+                sign = 1.0 if (h >> 63) & 1 else -1.0
+                counts[slot] = counts.get(slot, 0.0) + sign
+            for slot, value in counts.items():
+                out[row, slot] = math.copysign(1.0 + math.log(abs(value)), value) if value else 0.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+_embedders: dict = {}
+
+
+def get_embedder():
+    path = _setting('AI_KNOWLEDGE_EMBEDDER', 'apps.ai_architecture.knowledge.HashingEmbedder')
+    embedder = _embedders.get(path)
+    if embedder is None:
+        embedder = _embedders[path] = import_string(path)()
+    return embedder
+
+
+# ── Extraction and chunking ──────────────────────────────────────────
+
+def extract_pages(raw: bytes, filename: str) -> list[tuple[int | None, str]]:
+    """``[(page_number, text)]``; plain-text files are a single page ``None``."""
+    if filename.lower().endswith('.pdf') or raw[:5] == b'%PDF-':
+        from pypdf import PdfReader
+
+        reader = PdfReader(io.BytesIO(raw))
+        pages = []
+        for number, page in enumerate(reader.pages, start=1):
+            try:
+                text = page.extract_text() or ''
+            except Exception as e:
+                logger.warning("Could not extract text from %s page %d: %s", filename, number, e)
+                text = ''
+            pages.append((number, text))
+        return pages
+    return [(None, raw.decode('utf-8', 'replace'))]
+
+
+def _split_long(paragraph: str, size: int, overlap: int) -> list[str]:
+    pieces, start = [], 0
+    while start < len(paragraph):
+        end = min(len(paragraph), start + size)
+        if end < len(paragraph):
+            # Prefer to cut at whitespace rather than mid-word.
+            cut = paragraph.rfind(' ', start + size // 2, end)
+            end = cut if cut > 0 else end
+        pieces.append(paragraph[start:end].strip())
+        if end >= len(paragraph):
+            break
+        start = max(end - overlap, start + 1)
+    return [p for p in pieces if p]
+
+
+def chunk_text(text: str, size: int | None = None, overlap: int | None = None) -> list[str]:
+    """
+    Paragraph-aligned chunks of at most ``size`` characters. Consecutive
+    chunks share their last paragraph (up to ``overlap`` chars) so a clause
+    cut at a boundary is still retrievable with its context.
+    """
+    size = size or _setting('AI_KNOWLEDGE_CHUNK_CHARS', 1200)
+    overlap = _setting('AI_KNOWLEDGE_CHUNK_OVERLAP', 200) if overlap is None else overlap
+    paragraphs = []
+    for para in re.split(r'\n\s*\n', text):
+        para = re.sub(r'\s+', ' ', para).strip()
+        if not para:
+            continue
+        paragraphs.extend(_split_long(para, size, overlap) if len(para) > size else [para])
+
+    chunks, current = [], []
+    for para in paragraphs:
+        if current and sum(len(p) + 1 for p in current) + len(para) > size:
+            chunks.append('\n'.join(current))
+            tail = current[-1]
+            current = [tail] if len(tail) <= overlap and len(tail) + len(para) < size else []
+        current.append(para)
+    if current:
+        chunks.append('\n'.join(current))
+    return chunks
+
+
+def ingest_document(doc: KnowledgeDocument, rebuild: bool = True, force: bool = False) -> int:
+    """
+    (Re-)chunk ``doc`` and, unless ``rebuild`` is false, refresh the index.
+    Unchanged files keep their chunks unless ``force`` is set. Returns the
+    number of chunks stored (0 for empty files and duplicates).
+    """
+    with doc.file.open('rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    duplicate = (
+        KnowledgeDocument.objects.filter(content_hash=digest, chunks__isnull=False)
+        .exclude(pk=doc.pk).values_list('title', flat=True).first()
+    )
+    if duplicate is not None:
+        logger.info("[Knowledge] '%s' duplicates '%s'; not indexed", doc.title, duplicate)
+        KnowledgeChunk.objects.filter(document=doc).delete()
+        KnowledgeDocument.objects.filter(pk=doc.pk).update(content_hash=digest, is_embedded=False)
+        return 0
+    if not force and digest == doc.content_hash and KnowledgeChunk.objects.filter(document=doc).exists():
+        return KnowledgeChunk.objects.filter(document=doc).count()
+
+    rows = []
+    for page, text in extract_pages(raw, doc.file.name):
+        for chunk in chunk_text(text):
+            rows.append(KnowledgeChunk(
+                document=doc,
+                ordinal=len(rows),
+                page=page,
+                text=chunk,
+                content_hash=hashlib.sha256(chunk.encode('utf-8')).hexdigest(),
+            ))
+    KnowledgeChunk.objects.filter(document=doc).delete()
+    KnowledgeChunk.objects.bulk_create(rows, batch_size=500)
+    # .update() so the post_save hook does not schedule another ingestion.
+    KnowledgeDocument.objects.filter(pk=doc.pk).update(content_hash=digest, is_embedded=False)
+    logger.info("[Knowledge] '%s': %d chunk(s)", doc.title, len(rows))
+    if rebuild:
+        rebuild_index()
+    return len(rows)
+
+
+# ── Vector index ─────────────────────────────────────────────────────
+
+def _index_dir() -> Path:
+    return Path(_setting('AI_KNOWLEDGE_INDEX_DIR', Path(tempfile.gettempdir()) / 'ai_knowledge_index'))
+
+
+def _read_manifest() -> dict | None:
+    try:
+        return json.loads((_index_dir() / 'current.json').read_text())
+    except (OSError, ValueError):
+        return None
+
+
+class VectorIndex:
+    def __init__(self, vectors: np.ndarray, chunk_ids: np.ndarray, embedder: str, version: str = ''):
+        self.vectors = vectors
+        self.chunk_ids = chunk_ids
+        self.embedder = embedder
+        self.version = version
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    @classmethod
+    def open(cls, manifest: dict):
+        path = _index_dir() / manifest['version']
+        return cls(
+            np.load(path / 'vectors.npy', mmap_mode='r'),
+            np.load(path / 'chunk_ids.npy'),
+            manifest['embedder'],
+            manifest['version'],
+        )
+
+    def search(self, query_vector: np.ndarray, k: int) -> list[tuple[int, float]]:
+        """Top-``k`` ``(chunk_id, cosine)`` pairs, best first."""
+        if not len(self) or k <= 0:
+            return []
+        scores = self.vectors @ query_vector
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.chunk_ids[i]), float(scores[i])) for i in top]
+
+
+_loaded = {'key': None, 'index': None}
+_loaded_lock = threading.Lock()
+
+
+def current_index() -> VectorIndex | None:
+    key = (get_generation(INDEX_NAMESPACE), str(_index_dir()))
+    with _loaded_lock:
+        if _loaded['key'] == key:
+            return _loaded['index']
+        manifest = _read_manifest()
+        index = None
+        if manifest:
+            try:
+                index = VectorIndex.open(manifest)
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Could not open knowledge index %s: %s", manifest.get('version'), e)
+        elif _setting('AI_KNOWLEDGE_AUTO_INDEX', True) and KnowledgeChunk.objects.exists():
+            # Chunks are stored but this filesystem has no index (new container,
+            # index directory not shared): build one here.
+            logger.warning("[Knowledge] no index under %s; rebuilding", _index_dir())
+            schedule_rebuild()
+        _loaded.update(key=key, index=index)
+        return index
+
+
+def rebuild_index() -> int:
+    """
+    Write a fresh index covering every stored chunk; returns its size.
+    Vectors already in the current index (same embedder) are reused, so only
+    new chunks are embedded.
+    """
+    embedder = get_embedder()
+    chunks = KnowledgeChunk.objects.order_by('id').values_list('id', 'content_hash', 'text')
+
+    previous = current_index()
+    reusable = {}
+    if previous is not None and previous.embedder == embedder.name:
+        reusable = {int(cid): row for row, cid in enumerate(previous.chunk_ids)}
+
+    ids, texts_to_embed, seen = [], [], set()
+    for chunk_id, content_hash, text in chunks.iterator():
+        if content_hash in seen:
+            continue
+        seen.add(content_hash)
+        ids.append(chunk_id)
+        if chunk_id not in reusable:
+            texts_to_embed.append((len(ids) - 1, text))
+
+    vectors = np.zeros((len(ids), embedder.dim), dtype=np.float32)
+    for row, chunk_id in enumerate(ids):
+        if chunk_id in reusable:
+            vectors[row] = previous.vectors[reusable[chunk_id]]
+    batch = _setting('AI_KNOWLEDGE_EMBED_BATCH', 256)
+    for start in range(0, len(texts_to_embed), batch):
+        part = texts_to_embed[start:start + batch]
+        vectors[[row for row, _ in part]] = embedder.embed([text for _, text in part])
+
+    root = _index_dir()
+    version = f"v{uuid.uuid4().hex[:12]}"
+    path = root / version
+    path.mkdir(parents=True, exist_ok=True)
+    np.save(path / 'vectors.npy', vectors)
+    np.save(path / 'chunk_ids.npy', np.asarray(ids, dtype=np.int64))
+    manifest = {'version': version, 'embedder': embedder.name, 'dim': embedder.dim, 'count': len(ids)}
+    fd, tmp = tempfile.mkstemp(dir=root, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, root / 'current.json')
+    bump_generation(INDEX_NAMESPACE)
+
+    # Keep the previous version for processes that still have it mapped.
+    keep = {version, previous.version if previous is not None else ''}
+    for old in root.iterdir():
+        if old.is_dir() and old.name not in keep:
+            shutil.rmtree(old, ignore_errors=True)
+
+    indexed_docs = KnowledgeChunk.objects.filter(id__in=ids).values('document_id')
+    KnowledgeDocument.objects.filter(id__in=indexed_docs).update(is_embedded=True)
+    KnowledgeDocument.objects.exclude(id__in=indexed_docs).update(is_embedded=False)
+    logger.info("[Knowledge] index %s: %d vectors (%d embedded)", version, len(ids), len(texts_to_embed))
+    return len(ids)
+
+
+def _rebuild_while_dirty():
+    """
+    Rebuild until no document was ingested during the last rebuild. Only one
+    process holds the lock; the others just mark the index dirty and leave,
+    and the holder re-checks the flag after releasing the lock.
+    """
+    cache = shared_cache()
+    cache.set(_REBUILD_DIRTY_KEY, 1, timeout=None)
+    while cache.add(_REBUILD_LOCK_KEY, 1, timeout=600):
+        try:
+            cache.delete(_REBUILD_DIRTY_KEY)
+            rebuild_index()
+        finally:
+            cache.delete(_REBUILD_LOCK_KEY)
+        if not cache.get(_REBUILD_DIRTY_KEY):
+            return
+    logger.info("[Knowledge] rebuild already running; it is repeated once it finishes")
+
+
+def schedule_ingestion(document_id: int):
+    """Ingest a saved document in the background (one rebuild at a time)."""
+    from django.db import connections
+
+    def _run():
+        try:
+            doc = KnowledgeDocument.objects.filter(pk=document_id).first()
+            if doc is not None:
+                ingest_document(doc, rebuild=False)
+            _rebuild_while_dirty()
+        except Exception as e:
+            logger.error("Knowledge ingestion failed for document %s: %s", document_id, e)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=_run, name="knowledge-ingest", daemon=True).start()
+
+
+def schedule_rebuild():
+    """Rebuild the index in the background (see :func:`_rebuild_while_dirty`)."""
+    from django.db import connections
+
+    def _run():
+        try:
+            _rebuild_while_dirty()
+        except Exception as e:
+            logger.error("Knowledge index rebuild failed: %s", e)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=_run, name="knowledge-rebuild", daemon=True).start()
+
+
+# ── Retrieval ────────────────────────────────────────────────────────
+
+def retrieve(query: str, k: int | None = None) -> list[dict]:
+    """Top passages for ``query`` above ``AI_KNOWLEDGE_MIN_SCORE``."""
+    if not query or not query.strip():
+        return []
+    index = current_index()
+    if index is None or not len(index):
+        return []
+    embedder = get_embedder()
+    if index.embedder != embedder.name:
+        logger.warning("Knowledge index built with %s, querying with %s; rebuild needed",
+                       index.embedder, embedder.name)
+        return []
+
+    k = k or _setting('AI_KNOWLEDGE_TOP_K', 4)
+    min_score = _setting('AI_KNOWLEDGE_MIN_SCORE', 0.15)
+    hits = [(cid, score) for cid, score in index.search(embedder.embed([query])[0], k) if score >= min_score]
+    if not hits:
+        return []
+    rows = KnowledgeChunk.objects.select_related('document').in_bulk([cid for cid, _ in hits])
+    return [
+        {
+            'document': rows[cid].document.title,
+            'page': rows[cid].page,
+            'text': rows[cid].text,
+            'score': round(score, 4),
+        }
+        for cid, score in hits if cid in rows
+    ]
+
+
+def prompt_block(query: str) -> str:
+    """System-prompt section with the passages relevant to ``query`` ('' if none)."""
+    if not _setting('AI_KNOWLEDGE_ENABLED', True):
+        return ''
+    try:
+        passages = retrieve(query)
+    except Exception as e:
+        logger.error("Knowledge retrieval failed: %s", e)
+        return ''
+    if not passages:
+        return ''
+
+    budget = _setting('AI_KNOWLEDGE_MAX_CHARS', 6000)
+    blocks, used = [], 0
+    for n, p in enumerate(passages, start=1):
+        source = p['document'] + (f", p. {p['page']}" if p['page'] else '')
+        block = f"[{n}] {source}\n{p['text']}"
+        if blocks and used + len(block) > budget:
+            break
+        blocks.append(block[:budget])
+        used += len(block)
+    return (
+        "\n\nREFERENCE PASSAGES (from the knowledge base; rely on them where relevant "
+        "and name the source document):\n" + "\n\n".join(blocks)
+    )
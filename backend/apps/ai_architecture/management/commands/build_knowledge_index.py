@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from apps.ai_architecture import knowledge
+from apps.ai_architecture.models import KnowledgeDocument
+
+
+class Command(BaseCommand):
+    help = 'Chunks knowledge-base documents and rebuilds the local vector index used by the chat assistant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reingest', action='store_true',
+                            help='Re-read and re-chunk every document, not only those without chunks')
+
+    def handle(self, *args, **options):
+        docs = KnowledgeDocument.objects.all()
+        if not options['reingest']:
+            docs = docs.filter(chunks__isnull=True)
+        for doc in docs.distinct():
+            try:
+                count = knowledge.ingest_document(doc, rebuild=False, force=options['reingest'])
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"{doc.title}: {e}"))
+                continue
+            self.stdout.write(f"{doc.title}: {count} chunk(s)")
+
+        size = knowledge.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Knowledge index rebuilt with {size} passage(s)"))
@@ -0,0 +1,48 @@
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.ai_architecture import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background AI jobs (/analyse, /draw, /scan) from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit instead of polling forever')
+        parser.add_argument('--max-jobs', type=int, default=None,
+                            help='Exit after running this many jobs')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds to sleep when the queue is empty (default: AI_JOB_WORKER_POLL_INTERVAL)')
+
+    def handle(self, *args, **options):
+        poll = options['poll_interval'] or getattr(settings, 'AI_JOB_WORKER_POLL_INTERVAL', 2.0)
+        max_jobs = options['max_jobs']
+        worker = jobs.worker_id()
+        self._stopping = False
+
+        def _stop(signum, frame):
+            self.stdout.write(f'Received signal {signum}; finishing the current job before exiting.')
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+
+        self.stdout.write(self.style.SUCCESS(f'AI job worker {worker} started'))
+        total = 0
+        while not self._stopping:
+            jobs.requeue_stale_jobs()
+            # One job per iteration so a stop signal is honoured between jobs.
+            ran = jobs.run_pending_jobs(max_jobs=1, worker=worker)
+            total += ran
+            if max_jobs is not None and total >= max_jobs:
+                break
+            if not ran:
+                if options['once']:
+                    break
+                time.sleep(poll)
+
+        self.stdout.write(f'AI job worker {worker} stopped after {total} job(s)')
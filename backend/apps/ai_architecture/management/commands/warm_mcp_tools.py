@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.ai_architecture import mcp_manager
+
+
+class Command(BaseCommand):
+    help = 'Discovers tools on all configured MCP servers and publishes them to the shared tool registry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--timeout', type=float, default=None,
+                            help='Seconds to wait for discovery (default: MCP_CONNECT_TIMEOUT + 30)')
+
+    def handle(self, *args, **options):
+        if not mcp_manager.MCP_AVAILABLE:
+            self.stdout.write(self.style.WARNING('MCP dependency is not installed; nothing to warm.'))
+            return
+
+        urls, stdio = mcp_manager._configured_servers()
+        if not urls and not stdio:
+            self.stdout.write('No MCP servers configured.')
+            return
+
+        try:
+            entry = mcp_manager.refresh_tool_registry(timeout=options['timeout'])
+        except Exception as e:
+            raise CommandError(f'MCP tool discovery failed: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Registered {len(entry['tools'])} MCP tools under {mcp_manager.tool_registry_key(urls, stdio)}"
+        ))
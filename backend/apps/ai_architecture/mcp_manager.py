@@ -1,8 +1,15 @@
 import logging
 import asyncio
+import atexit
+import concurrent.futures
 import json
+import hashlib
+import os
+import threading
+import time
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import caches
+from django.db import connections
 try:
     from mcp import ClientSession
     from mcp.client.sse import sse_client
@@ -17,153 +24,458 @@ except Exception:
 
 logger = logging.getLogger(__name__)
 
+# ── Shared background event loop ──────────────────────────────────────
+#
+# One asyncio loop per process, running in a daemon thread, on which every MCP
+# coroutine is scheduled. Sync callers get a concurrent.futures.Future back,
+# so several tool calls can be in flight at once without each one building
+# (and tearing down) its own event loop.
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_pid: int | None = None
+_loop_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide MCP event loop, starting it on first use (and after a fork)."""
+    global _loop, _loop_pid
+    pid = os.getpid()
+    if _loop is None or _loop_pid != pid or _loop.is_closed():
+        with _loop_lock:
+            if _loop is None or _loop_pid != pid or _loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever, name="mcp-event-loop", daemon=True,
+                )
+                thread.start()
+                _loop, _loop_pid = loop, pid
+    return _loop
+
+
+@atexit.register
+def _shutdown_pool():
+    """Stop pooled stdio servers when the worker exits instead of orphaning them."""
+    if _pool is None or _loop is None or _loop_pid != os.getpid() or _loop.is_closed():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_pool.close_all(), _loop).result(timeout=10)
+    except Exception:
+        pass
+
+
+def submit(coro):
+    """Schedule *coro* on the background loop; returns a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop())
+
+
+def submit_mcp_tool(tool_name, arguments):
+    """
+    Start an MCP tool call on the background loop without waiting for it.
+    Returns a ``concurrent.futures.Future`` resolving to the tool result.
+    """
+    urls = getattr(settings, 'MCP_SERVERS', [])
+    stdio = getattr(settings, 'MCP_STDIO_SERVERS', [])
+    if not MCP_AVAILABLE or (not urls and not stdio):
+        future = concurrent.futures.Future()
+        future.set_result({"error": "MCP dependency is not installed on the backend."}
+                          if not MCP_AVAILABLE else {"error": "No MCP servers configured."})
+        return future
+    manager = MCPManager(urls, stdio)
+    return submit(manager.execute_tool(tool_name, arguments, route=tool_route(tool_name)))
+
+
+# ── Warm session pool ─────────────────────────────────────────────────
+
+def _server_key(kind: str, target) -> str:
+    """Stable identifier for an SSE url or a stdio command config."""
+    if kind == "sse":
+        return f"sse:{target}"
+    return "stdio:" + json.dumps(target, sort_keys=True)
+
+
+class _PooledServer:
+    """
+    One warm ``ClientSession`` to a single MCP server.
+
+    The transport and session context managers are entered and exited by a
+    dedicated task (anyio requires both to happen in the same task), which
+    parks on ``_closing`` while the session is in use. Calls are limited by a
+    per-server semaphore; a dead session is dropped and reopened on next use.
+    """
+
+    def __init__(self, kind: str, target, max_concurrency: int):
+        self.kind = kind
+        self.target = target
+        self.key = _server_key(kind, target)
+        self.session = None
+        self.last_used = 0.0
+        self.last_checked = 0.0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._connect_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._ready: asyncio.Event | None = None
+        self._closing: asyncio.Event | None = None
+        self._error: BaseException | None = None
+
+    def _transport(self):
+        if self.kind == "sse":
+            return sse_client(self.target)
+        params = StdioServerParameters(
+            command=self.target["command"], args=self.target.get("args", []),
+        )
+        return stdio_client(params)
+
+    async def _run(self):
+        try:
+            async with self._transport() as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._closing.wait()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._error = e
+            logger.warning("MCP session %s closed: %s", self.key, e)
+        finally:
+            self.session = None
+            self._ready.set()
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def ensure(self):
+        if self.connected:
+            return self.session
+        async with self._connect_lock:
+            if self.connected:
+                return self.session
+            await self.close()
+            self._ready, self._closing, self._error = asyncio.Event(), asyncio.Event(), None
+            self._task = asyncio.create_task(self._run(), name=f"mcp:{self.key[:60]}")
+            timeout = getattr(settings, 'MCP_CONNECT_TIMEOUT', 30)
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                await self.close()
+                raise RuntimeError(f"Timed out connecting to MCP server {self.key}")
+            if self.session is None:
+                raise RuntimeError(f"Could not connect to MCP server {self.key}: {self._error}")
+            logger.info("MCP session opened: %s", self.key)
+            self.last_checked = asyncio.get_running_loop().time()
+            return self.session
+
+    async def request(self, fn):
+        """Run ``await fn(session)`` under the concurrency limit, reconnecting once."""
+        async with self._semaphore:
+            for attempt in (0, 1):
+                session = await self.ensure()
+                self.last_used = asyncio.get_running_loop().time()
+                try:
+                    return await fn(session)
+                except (OSError, EOFError, ConnectionError) as e:
+                    # Transport died under us (process exited, socket dropped).
+                    logger.warning("MCP %s transport error (%s); reconnecting", self.key, e)
+                    await self.close()
+                    if attempt:
+                        raise
+                except Exception:
+                    if self.connected:
+                        raise
+                    await self.close()
+                    if attempt:
+                        raise
+
+    async def ping(self) -> bool:
+        if not self.connected:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), 10)
+            self.last_checked = asyncio.get_running_loop().time()
+            return True
+        except Exception as e:
+            logger.warning("MCP %s failed health check: %s", self.key, e)
+            await self.close()
+            return False
+
+    async def close(self):
+        task, self._task = self._task, None
+        if task is None:
+            return
+        if self._closing is not None:
+            self._closing.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), 5)
+        except (asyncio.TimeoutError, Exception):
+            task.cancel()
+        self.session = None
+
+
+class MCPSessionPool:
+    """
+    Per-process pool of warm MCP sessions living on the background loop.
+
+    A maintenance task pings sessions that have been quiet for
+    ``MCP_POOL_HEALTHCHECK_INTERVAL`` seconds and closes those idle for more
+    than ``MCP_POOL_IDLE_TIMEOUT`` (stdio servers are Node processes).
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self._servers: dict[str, _PooledServer] = {}
+        self.tool_servers: dict[str, tuple[str, object]] = {}  # tool name -> (kind, target)
+        self._maintenance: asyncio.Task | None = None
+
+    def server(self, kind: str, target) -> _PooledServer:
+        key = _server_key(kind, target)
+        srv = self._servers.get(key)
+        if srv is None:
+            srv = _PooledServer(kind, target, getattr(settings, 'MCP_POOL_MAX_CONCURRENCY', 4))
+            self._servers[key] = srv
+        if self._maintenance is None or self._maintenance.done():
+            self._maintenance = asyncio.create_task(self._maintain(), name="mcp-pool-maintenance")
+        return srv
+
+    async def _maintain(self):
+        interval = getattr(settings, 'MCP_POOL_HEALTHCHECK_INTERVAL', 60)
+        idle_timeout = getattr(settings, 'MCP_POOL_IDLE_TIMEOUT', 300)
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(interval, idle_timeout) / 2)
+            now = loop.time()
+            for srv in list(self._servers.values()):
+                if not srv.connected:
+                    continue
+                if now - srv.last_used > idle_timeout:
+                    logger.info("Closing idle MCP session %s", srv.key)
+                    await srv.close()
+                elif now - max(srv.last_used, srv.last_checked) > interval:
+                    await srv.ping()
+
+    async def list_tools(self, kind: str, target) -> list[dict]:
+        result = await self.server(kind, target).request(lambda session: session.list_tools())
+        tools = []
+        for t in result.tools:
+            tools.append({
+                "name": t.name,
+                "description": t.description or "",
+                "input_schema": t.inputSchema,
+            })
+            self.tool_servers[t.name] = (kind, target)
+        return tools
+
+    async def call_tool(self, kind: str, target, tool_name: str, arguments: dict):
+        timeout = getattr(settings, 'AI_TOOL_CALL_TIMEOUT', 30)
+        result = await self.server(kind, target).request(
+            lambda session: asyncio.wait_for(session.call_tool(tool_name, arguments), timeout)
+        )
+        return [c.model_dump() for c in result.content]
+
+    def stats(self) -> dict:
+        return {
+            key: {"connected": srv.connected, "last_used": srv.last_used}
+            for key, srv in self._servers.items()
+        }
+
+    async def close_all(self):
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+        await asyncio.gather(*(srv.close() for srv in self._servers.values()), return_exceptions=True)
+
+
+_pool: MCPSessionPool | None = None
+
+
+def get_pool() -> MCPSessionPool:
+    """The session pool of this process (must be called on the background loop)."""
+    global _pool
+    loop = get_background_loop()
+    if _pool is None or _pool.loop is not loop:
+        _pool = MCPSessionPool(loop)
+    return _pool
+
+
 class MCPManager:
     """
     Manages connections to multiple remote/local MCP servers (SSE & Stdio).
-    Discovers tools and routes execution calls.
+    Discovers tools and routes execution calls through the warm session pool.
     """
     def __init__(self, sse_urls: list[str], stdio_configs: list[dict]):
         self.sse_urls = sse_urls
         self.stdio_configs = stdio_configs
-        self._server_tool_map = {} # tool_name -> {"type": "...", "config": ...}
 
     async def _fetch_tools_from_sse(self, url: str):
-        """Connect to a single SSE MCP server and list its tools."""
+        """List the tools of a single SSE MCP server."""
         try:
-            async with sse_client(url) as streams:
-                async with ClientSession(streams[0], streams[1]) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    server_tools = []
-                    for t in tools_result.tools:
-                        server_tools.append({
-                            "name": t.name,
-                            "description": t.description or "",
-                            "input_schema": t.inputSchema,
-                        })
-                        self._server_tool_map[t.name] = {"type": "sse", "url": url}
-                    return server_tools
+            return await get_pool().list_tools("sse", url)
         except Exception as e:
             logger.error(f"Failed to fetch tools from MCP SSE server {url}: {e}")
             return []
 
     async def _fetch_tools_from_stdio(self, config: dict):
-        """Connect to a stdio-based local MCP server."""
-        command = config.get("command")
-        args = config.get("args", [])
+        """List the tools of a stdio-based local MCP server."""
         try:
-            params = StdioServerParameters(command=command, args=args)
-            async with stdio_client(params) as streams:
-                async with ClientSession(streams[0], streams[1]) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    server_tools = []
-                    for t in tools_result.tools:
-                        server_tools.append({
-                            "name": t.name,
-                            "description": t.description or "",
-                            "input_schema": t.inputSchema,
-                        })
-                        self._server_tool_map[t.name] = {"type": "stdio", "config": config}
-                    return server_tools
+            return await get_pool().list_tools("stdio", config)
         except Exception as e:
-            logger.error(f"Failed to fetch tools from MCP stdio {command} {args}: {e}")
+            logger.error(f"Failed to fetch tools from MCP stdio {config.get('command')} {config.get('args', [])}: {e}")
             return []
 
     async def get_all_tools(self):
         """Parallel fetch tools from all configured servers."""
         if not self.sse_urls and not self.stdio_configs:
             return []
-            
+
         tasks = []
         for url in self.sse_urls:
             tasks.append(self._fetch_tools_from_sse(url))
         for cfg in self.stdio_configs:
             tasks.append(self._fetch_tools_from_stdio(cfg))
-            
+
         results = await asyncio.gather(*tasks)
         # Flatten results
         return [item for sublist in results for item in sublist]
 
-    async def execute_tool(self, tool_name: str, arguments: dict):
-        """Route tool call to the correct remote server."""
-        if not self._server_tool_map:
+    async def execute_tool(self, tool_name: str, arguments: dict, route=None):
+        """Route tool call to the server that advertised it."""
+        pool = get_pool()
+        if tool_name not in pool.tool_servers and route is not None:
+            pool.tool_servers[tool_name] = route
+        if tool_name not in pool.tool_servers:
             await self.get_all_tools()
 
-        server_info = self._server_tool_map.get(tool_name)
-        if not server_info:
+        server = pool.tool_servers.get(tool_name)
+        if not server:
             return {"error": f"Tool {tool_name} not found on any configured MCP server."}
 
         try:
-            if server_info["type"] == "sse":
-                async with sse_client(server_info["url"]) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-                        result = await session.call_tool(tool_name, arguments)
-                        return [c.model_dump() for c in result.content]
-            elif server_info["type"] == "stdio":
-                config = server_info["config"]
-                params = StdioServerParameters(command=config["command"], args=config.get("args", []))
-                async with stdio_client(params) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-                        result = await session.call_tool(tool_name, arguments)
-                        return [c.model_dump() for c in result.content]
+            return await pool.call_tool(server[0], server[1], tool_name, arguments)
         except Exception as e:
             logger.error(f"Failed to execute MCP tool {tool_name}: {e}")
-            return {"error": str(e)}
+            return {"error": str(e) or e.__class__.__name__}
+
+
+# ── Shared tool registry ──────────────────────────────────────────────
+#
+# Tool discovery means talking to every configured server, so its result is
+# kept in the "shared" cache under a key derived from the server config
+# (stable across processes, unlike hash()). Chat requests only ever read it:
+# a stale or missing entry schedules a refresh on the background loop and the
+# request proceeds with what is there (possibly no MCP tools at all).
+
+_REGISTRY_LOCAL_TTL = 30  # seconds a worker trusts its in-memory copy
+_registry_local: dict = {}
+
+
+def _configured_servers():
+    return getattr(settings, 'MCP_SERVERS', []), getattr(settings, 'MCP_STDIO_SERVERS', [])
+
+
+def tool_registry_key(urls=None, stdio=None) -> str:
+    if urls is None and stdio is None:
+        urls, stdio = _configured_servers()
+    blob = json.dumps({"sse": list(urls or []), "stdio": list(stdio or [])}, sort_keys=True)
+    return "mcp_tools:v3:" + hashlib.sha256(blob.encode("utf-8")).hexdigest()[:32]
+
+
+def _shared_cache():
+    return caches['shared']
+
+
+def _read_registry(key: str) -> dict | None:
+    now = time.monotonic()
+    local = _registry_local.get(key)
+    if local and local[0] > now:
+        return local[1]
+    try:
+        entry = _shared_cache().get(key)
+    except Exception as e:
+        logger.warning("MCP tool registry unavailable: %s", e)
+        entry = None
+    if entry is not None:
+        _registry_local[key] = (now + _REGISTRY_LOCAL_TTL, entry)
+    return entry
 
 
-# ── Sync Helpers for Django Views ─────────────────────────────────────
+async def _discover_tools(urls, stdio) -> dict:
+    manager = MCPManager(urls, stdio)
+    tools = await manager.get_all_tools()
+    pool = get_pool()
+    routes = {
+        t["name"]: list(pool.tool_servers[t["name"]])
+        for t in tools if t["name"] in pool.tool_servers
+    }
+    return {"tools": tools, "routes": routes, "refreshed_at": time.time()}
+
+
+def refresh_tool_registry(timeout: float | None = None) -> dict:
+    """Discover tools now (blocking) and publish them to the shared cache."""
+    urls, stdio = _configured_servers()
+    key = tool_registry_key(urls, stdio)
+    timeout = timeout or getattr(settings, 'MCP_CONNECT_TIMEOUT', 30) + 30
+    entry = submit(_discover_tools(urls, stdio)).result(timeout=timeout)
+    ttl = getattr(settings, 'MCP_TOOLS_TTL', 3600)
+    # Keep serving the entry for a second TTL while a refresh is in flight.
+    _shared_cache().set(key, entry, ttl * 2)
+    _registry_local[key] = (time.monotonic() + _REGISTRY_LOCAL_TTL, entry)
+    return entry
+
+
+def _schedule_registry_refresh(key: str):
+    """Refresh in the background unless another worker already is."""
+    try:
+        if not _shared_cache().add(f"{key}:refreshing", 1, timeout=120):
+            return
+    except Exception:
+        return
+
+    def _run():
+        try:
+            entry = refresh_tool_registry()
+            logger.info("MCP tool registry refreshed: %d tools", len(entry["tools"]))
+        except Exception as e:
+            logger.error("MCP tool registry refresh failed: %s", e)
+        finally:
+            try:
+                _shared_cache().delete(f"{key}:refreshing")
+            except Exception:
+                pass
+            connections.close_all()
+
+    threading.Thread(target=_run, name="mcp-registry-refresh", daemon=True).start()
+
 
 def sync_get_mcp_tools():
-    """Sync wrapper to discover tools with caching."""
+    """Tool definitions from the shared registry; never blocks on discovery."""
     if not MCP_AVAILABLE:
         return []
 
-    urls = getattr(settings, 'MCP_SERVERS', [])
-    stdio = getattr(settings, 'MCP_STDIO_SERVERS', [])
-    
+    urls, stdio = _configured_servers()
     if not urls and not stdio:
         return []
-        
-    cache_key = f"mcp_tools_v2_{hash(tuple(urls))}_{hash(str(stdio))}"
-    cached_tools = cache.get(cache_key)
-    if cached_tools:
-        return cached_tools
 
-    try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        manager = MCPManager(urls, stdio)
-        tools = loop.run_until_complete(manager.get_all_tools())
-        loop.close()
-        
-        if tools:
-            cache.set(cache_key, tools, 3600) # Cache for 1 hour
-        return tools
-    except Exception as e:
-        logger.error(f"Sync MCP tool discovery failed: {e}", exc_info=True)
-        return []
+    key = tool_registry_key(urls, stdio)
+    entry = _read_registry(key)
+    ttl = getattr(settings, 'MCP_TOOLS_TTL', 3600)
+    # Refresh a little before the TTL so readers rarely see an expired entry.
+    if entry is None or time.time() - entry.get("refreshed_at", 0) > ttl * 0.9:
+        _schedule_registry_refresh(key)
+    return entry["tools"] if entry else []
+
+
+def tool_route(tool_name: str):
+    """(kind, target) of the server advertising *tool_name*, if the registry knows it."""
+    entry = _read_registry(tool_registry_key())
+    route = (entry or {}).get("routes", {}).get(tool_name)
+    return tuple(route) if route else None
+
 
 def sync_execute_mcp_tool(tool_name, arguments):
     """Sync wrapper to execute a tool."""
-    if not MCP_AVAILABLE:
-        return {"error": "MCP dependency is not installed on the backend."}
-
-    urls = getattr(settings, 'MCP_SERVERS', [])
-    stdio = getattr(settings, 'MCP_STDIO_SERVERS', [])
-    
-    if not urls and not stdio:
-        return {"error": "No MCP servers configured."}
-        
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        manager = MCPManager(urls, stdio)
-        result = loop.run_until_complete(manager.execute_tool(tool_name, arguments))
-        loop.close()
-        return result
+        timeout = getattr(settings, 'AI_TOOL_CALL_TIMEOUT', 30)
+        return submit_mcp_tool(tool_name, arguments).result(timeout=timeout)
     except Exception as e:
         logger.error(f"Sync MCP execution failed: {e}", exc_info=True)
         return {"error": str(e)}
@@ -1,3 +1,6 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from apps.core.models import TimeStampedModel
 from apps.builder_dashboard.models import Project
@@ -14,7 +17,7 @@ class KnowledgeDocument(TimeStampedModel):
         db_index=True,
         help_text="SHA-256 hash of file content for deduplication"
     )
-    is_embedded = models.BooleanField(default=False, help_text="True if successfully processed into ChromaDB")
+    is_embedded = models.BooleanField(default=False, help_text="True if the document's chunks are in the knowledge vector index")
     uploaded_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
     
     class Meta:
@@ -25,6 +28,28 @@ class KnowledgeDocument(TimeStampedModel):
     def __str__(self):
         return self.title
 
+
+class KnowledgeChunk(TimeStampedModel):
+    """
+    A retrievable passage of a KnowledgeDocument (see knowledge.py). The
+    vectors live in the on-disk index, keyed by this row's id.
+    """
+    document = models.ForeignKey(KnowledgeDocument, on_delete=models.CASCADE, related_name='chunks')
+    ordinal = models.PositiveIntegerField()
+    page = models.PositiveIntegerField(null=True, blank=True, help_text="PDF page the passage starts on")
+    text = models.TextField()
+    content_hash = models.CharField(max_length=64, db_index=True, help_text="SHA-256 of the passage text")
+
+    class Meta:
+        ordering = ['document', 'ordinal']
+        unique_together = [('document', 'ordinal')]
+        verbose_name = 'Knowledge Chunk'
+        verbose_name_plural = 'Knowledge Chunks'
+
+    def __str__(self):
+        return f"{self.document.title} #{self.ordinal}"
+
+
 class AIInstruction(TimeStampedModel):
     """
     Stores the system prompt instructions for the AI architecture assistant.
@@ -50,10 +75,21 @@ class ChatSession(TimeStampedModel):
     user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='chat_sessions')
     title = models.CharField(max_length=255, default="New Chat")
 
+    # Rolling summary of older turns (see history.py). Messages with
+    # id <= summary_through_id are represented only by the summary.
+    summary = models.TextField(blank=True, default='')
+    summary_through_id = models.BigIntegerField(null=True, blank=True)
+    summary_tokens = models.PositiveIntegerField(default=0)
+    summary_updated_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         ordering = ['-updated_at']
         verbose_name = 'Chat Session'
         verbose_name_plural = 'Chat Sessions'
+        indexes = [
+            # Keyset pagination of a user's sessions (see pagination.py).
+            models.Index(fields=['user', '-updated_at', '-id']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.title}"
@@ -78,6 +114,9 @@ class ChatMessage(TimeStampedModel):
         ordering = ['created_at']
         verbose_name = 'Chat Message'
         verbose_name_plural = 'Chat Messages'
+        indexes = [
+            models.Index(fields=['session', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return f"[{self.session.id}] {self.role}: {self.content[:50]}"
@@ -124,6 +163,11 @@ class TokenUsage(TimeStampedModel):
         ('stream', 'Chat Stream'),
         ('analyse', 'BOQ Analyse'),
         ('draw', 'Image Generation'),
+        ('scan', 'Sketch Scan'),
+        ('draw_agent', 'Draw Agent'),
+        ('draft', 'Draft Copilot'),
+        ('site_intel', 'Site Intel'),
+        ('summary', 'History Summary'),
         ('tools', 'Tool Use'),
     ]
 
@@ -364,3 +408,84 @@ class BOQTemplate(TimeStampedModel):
             return []
 
 
+
+
+class AIJob(TimeStampedModel):
+    """
+    A long-running AI command (/analyse, /draw, /scan) queued for a background
+    worker (``manage.py run_ai_jobs``). The database is the queue: workers
+    claim rows with a conditional UPDATE, so no external broker is needed.
+    """
+    KIND_CHOICES = [
+        ('analyse', 'BOQ Analyse'),
+        ('draw', 'Image Generation'),
+        ('scan', 'Sketch Scan'),
+    ]
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name='ai_jobs')
+    session = models.ForeignKey(ChatSession, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True, blank=True, related_name='ai_jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+
+    # Inputs captured at enqueue time (chat messages, vision images, flags).
+    # Cleared once the job finishes so large images don't linger in the table.
+    payload = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    # Same body the synchronous /chat/ endpoint would have returned.
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    http_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+
+    progress = models.PositiveSmallIntegerField(default=0, help_text="0–100")
+    progress_message = models.CharField(max_length=255, blank=True, default='')
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    locked_by = models.CharField(max_length=120, blank=True, default='')
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'AI Job'
+        verbose_name_plural = 'AI Jobs'
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.id} ({self.status})"
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in self.FINISHED_STATUSES
+
+    def as_status_dict(self) -> dict:
+        data = {
+            'job_id': str(self.id),
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'progress_message': self.progress_message,
+            'session_id': self.session_id,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.is_finished:
+            data['result'] = self.result
+            data['http_status'] = self.http_status
+        return data
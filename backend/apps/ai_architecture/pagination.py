@@ -0,0 +1,60 @@
+"""
+Keyset (cursor) pagination for the chat history APIs.
+
+Offset pagination re-scans every skipped row and shifts when new messages
+arrive, so the chat views page on a ``(timestamp, id)`` key instead. A cursor
+is the key of the last row returned, base64-encoded so clients treat it as
+opaque; the next page is everything strictly after it in sort order, which
+the composite ``(…, timestamp, id)`` indexes answer with a single range scan.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime, pk: int) -> str:
+    raw = f"{timestamp.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        timestamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    try:
+        limit = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+def keyset_page(queryset, field: str, cursor: str | None, limit: int, descending: bool = True):
+    """
+    Return ``(rows, next_cursor)`` for one page of ``queryset`` ordered by
+    ``(field, id)``. ``next_cursor`` is ``None`` on the last page.
+    """
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': timestamp}) | Q(**{field: timestamp, f'id__{op}': pk})
+        )
+    prefix = '-' if descending else ''
+    rows = list(queryset.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, field), last.pk)
@@ -0,0 +1,224 @@
+"""
+PDF uploads → Gemini inputs.
+
+A chat PDF used to be rasterized at a fixed 200 DPI, PNG-encoded and
+base64'd page by page inside the request, and again every time the user
+re-sent it. :func:`extract_pdf` instead:
+
+* reads each page with pypdf first; pages that are plainly text (a text layer,
+  no embedded images, hardly any vector paths) are sent as text and never
+  rasterized
+* picks the DPI per page from its size so the rendered edge lands near
+  ``AI_VISION_MAX_EDGE`` (an A4 schedule and an A1 sheet get different DPIs)
+* renders the remaining pages concurrently, one ``pdftoppm`` process per page
+  driven from a small thread pool, and encodes them with ``vision``
+* caches every page result on disk keyed by the PDF's SHA-256, the page
+  number, the DPI and the image encoding parameters
+"""
+import hashlib
+import io
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import vision
+
+logger = logging.getLogger(__name__)
+
+# Path construction / painting operators in a content stream.
+_PATH_OPERATOR_RE = re.compile(rb'(?<![A-Za-z])(?:re|l|c|v|y|S|s|f|F|B|b)(?![A-Za-z\'"*])')
+
+
+def page_dpi(width_pt: float, height_pt: float) -> int:
+    """DPI at which the page's longest edge renders at about ``AI_VISION_MAX_EDGE`` px."""
+    min_dpi = getattr(settings, 'AI_PDF_MIN_DPI', 72)
+    max_dpi = getattr(settings, 'AI_PDF_MAX_DPI', 200)
+    longest_in = max(width_pt, height_pt, 1.0) / 72.0
+    target = getattr(settings, 'AI_VISION_MAX_EDGE', 2048) / longest_in
+    return int(max(min_dpi, min(max_dpi, target)))
+
+
+def _page_has_images(page) -> bool:
+    try:
+        xobjects = page.get('/Resources', {}).get('/XObject', {})
+        xobjects = xobjects.get_object() if hasattr(xobjects, 'get_object') else xobjects
+        for ref in xobjects.values():
+            obj = ref.get_object() if hasattr(ref, 'get_object') else ref
+            if obj.get('/Subtype') in ('/Image', '/Form'):
+                return True
+    except Exception:
+        return True  # when unsure, render it
+    return False
+
+
+def _path_operator_count(page) -> int:
+    try:
+        contents = page.get_contents()
+        data = contents.get_data() if contents is not None else b''
+    except Exception:
+        return 10 ** 6
+    return len(_PATH_OPERATOR_RE.findall(data))
+
+
+def classify_pages(pdf_bytes: bytes, max_pages: int) -> list[dict]:
+    """
+    ``[{"page", "width", "height", "text", "text_only"}]`` for the first
+    ``max_pages`` pages. Drawings (even vector CAD exports with text labels)
+    are never classified as text-only.
+    """
+    from pypdf import PdfReader
+
+    min_chars = getattr(settings, 'AI_PDF_TEXT_MIN_CHARS', 200)
+    max_path_ops = getattr(settings, 'AI_PDF_TEXT_MAX_PATH_OPS', 60)
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    pages = []
+    for number, page in enumerate(reader.pages[:max_pages], start=1):
+        box = page.mediabox
+        try:
+            text = (page.extract_text() or '').strip()
+        except Exception:
+            text = ''
+        text_only = (
+            len(text) >= min_chars
+            and not _page_has_images(page)
+            and _path_operator_count(page) <= max_path_ops
+        )
+        pages.append({
+            'page': number,
+            'width': float(box.width),
+            'height': float(box.height),
+            'text': text,
+            'text_only': text_only,
+        })
+    return pages
+
+
+def _render_page(pdf_bytes: bytes, page: int, dpi: int):
+    import pdf2image
+
+    images = pdf2image.convert_from_bytes(pdf_bytes, first_page=page, last_page=page, dpi=dpi)
+    if not images:
+        return None
+    return vision.encode_pil_image(images[0])
+
+
+def _render_first_pages(pdf_bytes: bytes, max_pages: int) -> dict:
+    """
+    ``{page: (dpi, (mime, data))}`` for the first ``max_pages`` pages at the
+    default DPI, for PDFs pypdf cannot open (broken xref tables, some
+    encryption) that poppler still renders.
+    """
+    import pdf2image
+
+    dpi = getattr(settings, 'AI_PDF_MAX_DPI', 200)
+    images = pdf2image.convert_from_bytes(pdf_bytes, first_page=1, last_page=max_pages, dpi=dpi)
+    return {page: (dpi, vision.encode_pil_image(image)) for page, image in enumerate(images, start=1)}
+
+
+def _render_pages(pdf_bytes: bytes, to_render: list) -> dict:
+    """``{page: (dpi, (mime, data))}`` for ``[(page, dpi)]``, one ``pdftoppm`` per page."""
+    rendered = {}
+    if not to_render:
+        return rendered
+    workers = max(1, min(len(to_render), getattr(settings, 'AI_PDF_RENDER_WORKERS', 4)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf-render') as pool:
+        futures = {page: pool.submit(_render_page, pdf_bytes, page, dpi) for page, dpi in to_render}
+    for page, dpi in to_render:
+        try:
+            result = futures[page].result()
+        except Exception as e:
+            logger.error("PDF page %d rasterization failed: %s", page, e)
+            result = None
+        if result is not None:
+            rendered[page] = (dpi, result)
+    return rendered
+
+
+def _manifest_path(digest: str, max_pages: int):
+    return vision._cache_dir() / 'pdf' / digest[:2] / f"{digest}-{max_pages}-{vision.encoding_signature()}.json"
+
+
+def _page_image_path(digest: str, page: int, dpi: int, mime: str):
+    ext = mime.split('/')[-1]
+    return vision._cache_dir() / 'pdf' / digest[:2] / f"{digest}-p{page}-{dpi}dpi-{vision.encoding_signature()}.{ext}"
+
+
+def _load_cached(digest: str, max_pages: int):
+    path = _manifest_path(digest, max_pages)
+    raw = vision._read_cached(path)
+    if raw is None:
+        return None
+    try:
+        manifest = json.loads(raw)
+    except ValueError:
+        return None
+    images = []
+    for entry in manifest.get('images', []):
+        data = vision._read_cached(_page_image_path(digest, entry['page'], entry['dpi'], entry['mime']))
+        if data is None:
+            return None
+        images.append(vision.to_data_url(entry['mime'], data))
+    return {'images': images, 'text_pages': [tuple(t) for t in manifest.get('text_pages', [])]}
+
+
+def extract_pdf(pdf_bytes: bytes, max_pages: int = 5) -> dict:
+    """
+    Return ``{"images": [data URLs], "text_pages": [(page, text)]}`` for the
+    first ``max_pages`` pages of ``pdf_bytes``.
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    cached = _load_cached(digest, max_pages)
+    if cached is not None:
+        logger.debug("[PDF] cache hit %s", digest[:12])
+        return cached
+
+    try:
+        pages = classify_pages(pdf_bytes, max_pages)
+    except Exception as e:
+        logger.warning("pypdf could not read PDF (%s); rasterizing its first %d page(s)", e, max_pages)
+        try:
+            rendered = _render_first_pages(pdf_bytes, max_pages)
+        except Exception as e:
+            logger.error("Could not read PDF: %s", e)
+            return {'images': [], 'text_pages': []}
+        if not rendered:
+            return {'images': [], 'text_pages': []}
+        text_pages = []
+        to_render = [(page, dpi) for page, (dpi, _) in rendered.items()]
+    else:
+        text_pages = [(p['page'], p['text']) for p in pages if p['text_only']]
+        to_render = [(p['page'], page_dpi(p['width'], p['height'])) for p in pages if not p['text_only']]
+        if to_render:
+            try:
+                import pdf2image  # noqa: F401
+            except ImportError:
+                logger.warning("pdf2image not installed — falling back to text extraction for PDFs")
+                text_pages = [(p['page'], p['text']) for p in pages if p['text']]
+                to_render = []
+        rendered = _render_pages(pdf_bytes, to_render)
+
+    manifest = {'images': [], 'text_pages': text_pages}
+    images = []
+    for page in sorted(rendered):
+        dpi, (mime, data) = rendered[page]
+        vision._write_cached(_page_image_path(digest, page, dpi, mime), data)
+        manifest['images'].append({'page': page, 'dpi': dpi, 'mime': mime})
+        images.append(vision.to_data_url(mime, data))
+    # Only cache complete results; a failed page is retried next time.
+    if len(rendered) == len(to_render):
+        vision._write_cached(_manifest_path(digest, max_pages), json.dumps(manifest).encode('utf-8'))
+
+    logger.info("[PDF] %s: %d page(s) rendered, %d sent as text", digest[:12], len(images), len(text_pages))
+    return {'images': images, 'text_pages': text_pages}
+
+
+def text_pages_block(text_pages: list) -> str:
+    """Render text-only pages for inclusion in the user's message."""
+    if not text_pages:
+        return ""
+    max_chars = getattr(settings, 'AI_PDF_TEXT_MAX_CHARS', 20000)
+    blocks = [f"[Attached PDF — page {page} text]\n{text}" for page, text in text_pages]
+    return "\n\n".join(blocks)[:max_chars]
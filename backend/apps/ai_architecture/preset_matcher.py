@@ -0,0 +1,118 @@
+"""
+Keyword routing of prompts to a ``DrawingStylePreset``.
+
+The keywords of every active preset are compiled into one Aho-Corasick
+automaton, so matching a prompt is a single pass over its characters no
+matter how many presets or keywords exist, and needs no database access.
+The winning preset is the highest-priority one with any keyword occurring
+in the text (the same rule the per-preset substring scan used).
+
+The compiled matcher is held in a ``ConfigCache`` (``apps.core.config_cache``),
+so saving or deleting a preset rebuilds it in this process at once and in
+other processes within ``CONFIG_CACHE_CHECK_INTERVAL`` seconds.
+"""
+import logging
+from collections import deque
+
+from apps.core.config_cache import ConfigCache
+
+from .models import DrawingStylePreset
+
+logger = logging.getLogger(__name__)
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton reporting the payloads of all keywords found in a text."""
+
+    def __init__(self, keywords: dict):
+        # keywords: {keyword: payload}
+        self._goto: list[dict] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list] = [[]]
+        for keyword, payload in keywords.items():
+            node = 0
+            for ch in keyword:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(payload)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def __len__(self):
+        return len(self._goto)
+
+    def scan(self, text: str):
+        """Yield the payload of every keyword occurrence in ``text``."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+
+class PresetMatcher:
+    def __init__(self, presets: list):
+        # Payload = rank in priority order, so the best match is the minimum.
+        self.presets = presets
+        ranks: dict[str, int] = {}
+        for rank, preset in enumerate(presets):
+            for keyword in preset.get_keywords_list():
+                ranks.setdefault(keyword, rank)
+        self.automaton = KeywordAutomaton(ranks)
+
+    @classmethod
+    def build(cls):
+        matcher = cls(list(DrawingStylePreset.objects.filter(is_active=True).order_by('-priority', 'name', 'id')))
+        logger.debug("[Presets] matcher built: %d preset(s), %d states", len(matcher.presets), len(matcher.automaton))
+        return matcher
+
+    def match(self, text: str):
+        if not text or not self.presets:
+            return None
+        best = None
+        for rank in self.automaton.scan(text.lower()):
+            if best is None or rank < best:
+                best = rank
+                if best == 0:
+                    break
+        return self.presets[best] if best is not None else None
+
+
+_matcher = ConfigCache('drawing_presets', PresetMatcher.build, DrawingStylePreset)
+
+
+def get_matcher() -> PresetMatcher:
+    return _matcher.get()
+
+
+def invalidate():
+    _matcher.invalidate()
+
+
+def match_preset(*texts):
+    """The preset matching the first of ``texts`` that matches any, or ``None``."""
+    matcher = get_matcher()
+    for text in texts:
+        preset = matcher.match(text)
+        if preset is not None:
+            return preset
+    return None
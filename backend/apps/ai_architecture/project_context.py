@@ -0,0 +1,165 @@
+"""
+Versioned per-project context snapshot for AI prompts.
+
+Building the project context walks escrow milestones, the capital schedule,
+every preliminary BOQ building item and the latest BOQ corrections. The
+rendered text is cached under the project's context *generation*, which the
+signals in ``signals.py`` bump whenever one of those rows changes, so a chat
+turn normally costs one cache read instead of half a dozen queries.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from apps.core.cache_utils import bump_generation, get_generation, shared_cache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAMESPACE = 'project_context'
+
+# Small per-process LRU in front of the shared cache; entries are keyed by
+# generation so they can never be served after an invalidation.
+_LOCAL_MAX_ENTRIES = 64
+_local: "OrderedDict[tuple, dict]" = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough Gemini token count (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def invalidate_project_context(project_id) -> int:
+    """Drop every cached context snapshot of ``project_id``."""
+    if not project_id:
+        return 0
+    return bump_generation(GENERATION_NAMESPACE, project_id)
+
+
+def get_project_context_snapshot(project) -> dict:
+    """
+    Return ``{"project_id", "version", "text", "tokens", "built_at"}`` for
+    ``project``, building and caching it on a miss.
+    """
+    version = get_generation(GENERATION_NAMESPACE, project.pk)
+    local_key = (project.pk, version)
+    with _local_lock:
+        snapshot = _local.get(local_key)
+        if snapshot is not None:
+            _local.move_to_end(local_key)
+            return snapshot
+
+    cache_key = f"ai:project_context:{project.pk}:v{version}"
+    try:
+        snapshot = shared_cache().get(cache_key)
+    except Exception as e:
+        logger.warning("Project context cache read failed: %s", e)
+        snapshot = None
+
+    if snapshot is None:
+        started = time.monotonic()
+        text = build_project_context(project)
+        snapshot = {
+            "project_id": project.pk,
+            "version": version,
+            "text": text,
+            "tokens": estimate_tokens(text),
+            "built_at": time.time(),
+        }
+        logger.debug(
+            "[Context] project %s v%s built in %.0f ms (~%d tokens)",
+            project.pk, version, (time.monotonic() - started) * 1000, snapshot["tokens"],
+        )
+        try:
+            shared_cache().set(cache_key, snapshot, getattr(settings, 'AI_PROJECT_CONTEXT_TTL', 86400))
+        except Exception as e:
+            logger.warning("Project context cache write failed: %s", e)
+
+    with _local_lock:
+        _local[local_key] = snapshot
+        while len(_local) > _LOCAL_MAX_ENTRIES:
+            _local.popitem(last=False)
+    return snapshot
+
+
+def build_project_context(project) -> str:
+    """
+    Format all available project survey/brief data into a structured string
+    for the AI to understand the building's requirements and site conditions.
+    """
+    lines = [
+        f"Project Title: {project.title}",
+        f"Location: {project.location}",
+        f"Engagement Tier: {project.get_engagement_tier_display()}",
+        f"SI-56 Verified: {'Yes' if project.si56_verified else 'No'}",
+        f"Budget Signed: {'Yes' if project.is_budget_signed else 'No'}",
+        f"Assigned Architect: {project.architect.username if project.architect else 'None'}",
+        f"Building Type: {project.building_type or 'Not specified'}",
+        f"Use Case: {project.use_case or 'Not specified'}",
+        f"Bedrooms: {project.bedrooms or 'Not specified'}",
+        f"Bathrooms: {project.bathrooms or 'Not specified'}",
+        f"Occupants: {project.occupants or 'Not specified'}",
+        f"Floors: {project.floors or 'Not specified'}",
+        f"Preferred Architectural Style: {project.preferred_style or 'Not specified'}",
+        f"Roof Type: {project.roof_type or 'Not specified'}",
+        f"Has Garage: {'Yes' if project.has_garage else 'No' if project.has_garage is False else 'Not specified'}",
+        f"Parking Spaces: {project.parking_spaces or 'Not specified'}",
+        f"Lot Size: {project.lot_size or 'Not specified'}",
+        f"Building Footprint: {project.footprint or 'Not specified'}",
+        f"Sustainability Requirements: {project.sustainability or 'None'}",
+        f"Accessibility Requirements: {project.accessibility or 'None'}",
+        f"Special Spaces Needed: {project.special_spaces or 'None'}",
+        f"Timeline: {project.timeline or 'Not specified'}",
+        f"Budget Flexibility: {project.budget_flex or 'Not specified'}",
+    ]
+
+    # Added Financial Context
+    milestones = list(project.escrow_milestones.values_list('name', 'amount', 'status'))
+    if milestones:
+        lines.append("\nEscrow Milestones:")
+        for name, amount, status in milestones:
+            lines.append(f"- {name}: ${amount} ({status})")
+
+    schedule = list(project.capital_schedules.values_list('description', 'amount', 'due_date', 'status'))
+    if schedule:
+        lines.append("\nCapital Schedule:")
+        for description, amount, due_date, status in schedule:
+            lines.append(f"- {description}: ${amount} (Due: {due_date}, Status: {status})")
+
+    # Fully explore the database for related BOQ information
+    try:
+        from apps.builder_dashboard.models import BOQBuildingItem, BOQCorrection, ProjectBudgetVersion
+
+        existing_items = list(BOQBuildingItem.objects.filter(
+            budget_version__project=project,
+            budget_version__kind=ProjectBudgetVersion.Kind.PRELIMINARY,
+        ).values_list('bill_no', 'description', 'quantity', 'unit', 'rate', 'is_ai_generated'))
+        if existing_items:
+            lines.append("\n--- EXISTING BOQ ITEMS ALREADY ON PROJECT ---")
+            for bill_no, description, quantity, unit, rate, is_ai_generated in existing_items:
+                ai_flag = "[AI-Generated]" if is_ai_generated else "[Manual]"
+                lines.append(f"- {bill_no or ''} | {description}: {quantity} {unit or ''} @ ${rate} {ai_flag}")
+
+        corrections = list(
+            BOQCorrection.objects.filter(project=project)
+            .order_by('-created_at')
+            .values_list('action', 'was_ai_generated', 'previous_data', 'new_data')[:30]
+        )
+        if corrections:
+            lines.append("\n--- PAST USER CORRECTIONS TO BOQ (Learn from these adjustments!) ---")
+            lines.append("Review how the user manually corrected previous AI outputs, and adjust your current calculations/rates to match their preferences.")
+            for action, was_ai_generated, previous_data, new_data in corrections:
+                ai_src = "AI-Generated Item" if was_ai_generated else "Manual Item"
+                msg = f"- [{action}] on {ai_src}."
+                if action == "UPDATE":
+                    msg += f"\n  Before: {previous_data}\n  After:  {new_data}"
+                elif action == "DELETE":
+                    msg += f"\n  Deleted: {previous_data}"
+                lines.append(msg)
+    except Exception:
+        pass
+
+    return "\n".join(lines)
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apps.builder_dashboard.models import (
+    Project, EscrowMilestone, CapitalSchedule, ProjectBudgetVersion,
+    BOQBuildingItem, BOQCorrection,
+)
+from .models import KnowledgeDocument
+from .project_context import invalidate_project_context
+# Importing these registers their ConfigCache save/delete handlers.
+from . import config, preset_matcher  # noqa: F401
+
+
+@receiver([post_save, post_delete], sender=Project)
+def invalidate_context_on_project_change(sender, instance, **kwargs):
+    invalidate_project_context(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=EscrowMilestone)
+@receiver([post_save, post_delete], sender=CapitalSchedule)
+@receiver([post_save, post_delete], sender=ProjectBudgetVersion)
+@receiver([post_save, post_delete], sender=BOQCorrection)
+def invalidate_context_on_project_row_change(sender, instance, **kwargs):
+    """Rows that carry ``project_id`` directly."""
+    invalidate_project_context(instance.project_id)
+
+
+@receiver([post_save, post_delete], sender=BOQBuildingItem)
+def invalidate_context_on_boq_item_change(sender, instance, origin=None, **kwargs):
+    """
+    BOQ building items hang off a budget version; the version's project is
+    looked up unless it is already loaded on the instance. A queryset
+    ``delete()`` sends one post_delete per row, so each version is only
+    invalidated once per delete.
+    """
+    if isinstance(origin, QuerySet):
+        seen = origin.__dict__.setdefault('_invalidated_versions', set())
+        if instance.budget_version_id in seen:
+            return
+        seen.add(instance.budget_version_id)
+    version = instance._state.fields_cache.get('budget_version')
+    if version is not None:
+        project_id = version.project_id
+    else:
+        project_id = (
+            ProjectBudgetVersion.objects
+            .filter(pk=instance.budget_version_id)
+            .values_list('project_id', flat=True)
+            .first()
+        )
+    invalidate_project_context(project_id)
+
+
+@receiver([post_save, post_delete], sender=KnowledgeDocument)
+def reindex_knowledge_on_document_change(sender, instance, **kwargs):
+    """Chunk/embed uploads (and drop deleted documents) once the write commits."""
+    if not getattr(settings, 'AI_KNOWLEDGE_AUTO_INDEX', True):
+        return
+    from . import knowledge
+
+    document_id = instance.pk
+    transaction.on_commit(lambda: knowledge.schedule_ingestion(document_id))
@@ -2,20 +2,76 @@
 Unit tests for the AI Architecture module.
 Covers tool functions, Pydantic schemas, and mocked view behaviour.
 """
+import asyncio
+import base64
+import contextlib
+import importlib
+import io
 import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from types import ModuleType, SimpleNamespace
 from unittest.mock import patch, MagicMock
-from django.test import TestCase, RequestFactory
+
+from asgiref.sync import async_to_sync
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from PIL import Image
 from pydantic import ValidationError
+from rest_framework.test import APIClient
+
+from apps.authentication.models import Profile
+from apps.builder_dashboard.models import (
+    BOQBuildingItem,
+    BudgetAnalysisHistory,
+    EscrowMilestone,
+    Project,
+    ProjectBudgetVersion,
+)
 
+from . import analyse_cache
+from . import config as ai_config
+from . import gemini_client
+from . import history as chat_history
+from . import jobs as ai_jobs
+from . import json_stream
+from . import knowledge
+from . import mcp_manager
+from . import pdf_pages
+from . import preset_matcher
+from . import project_context
+from . import urls as ai_urls
+from . import usage as ai_usage
+from . import views
+from . import vision
+from .async_views import AsyncDraftCopilotView
 from .views import (
+    _ANALYSE_SHEET_GROUPS,
     _get_material_prices,
     _check_compliance,
     _calculate_area,
-    BOQItem,
+    _stream_gemini_with_tools,
+    BOQBuildingItem as BOQItemSchema,
     BOQAnalysis,
+    ChatCompletionView,
+)
+from .models import (
+    AIInstruction,
+    AIJob,
+    BOQTemplate,
+    ChatMessage,
+    ChatSession,
+    DrawingStylePreset,
+    KnowledgeChunk,
+    KnowledgeDocument,
+    MaterialPrice,
+    TokenUsage,
 )
-from .models import MaterialPrice, TokenUsage, ChatSession
 
 
 # ── Tool function tests ──────────────────────────────────────────────
@@ -83,39 +139,35 @@ class AreaCalculationToolTest(TestCase):
 # ── Pydantic schema tests ────────────────────────────────────────────
 
 class BOQSchemaTest(TestCase):
-    """Tests for BOQItem and BOQAnalysis Pydantic models."""
+    """Tests for the BOQBuildingItem and BOQAnalysis Pydantic models."""
 
     def test_valid_boq_item(self):
-        item = BOQItem(
-            category="Substructure",
-            item_name="Foundation Concrete",
+        item = BOQItemSchema(
+            bill_no="1.1",
             description="C25 concrete for strip foundations",
+            specification="Substructure",
             unit="m³",
             quantity=12.5,
             rate=120.0,
-            total_amount=1500.0,
         )
-        self.assertEqual(item.total_amount, 1500.0)
+        self.assertEqual(item.quantity * item.rate, 1500.0)
 
     def test_boq_item_missing_field(self):
         with self.assertRaises(ValidationError):
-            BOQItem(category="Sub", item_name="X", description="Y", unit="m²", quantity=1)
+            BOQItemSchema(bill_no="1", description="Y", unit="m²", quantity=1)
 
     def test_valid_boq_analysis(self):
         analysis = BOQAnalysis(
             summary="Test analysis",
-            items=[
-                BOQItem(
-                    category="Superstructure", item_name="Bricks",
-                    description="Face bricks", unit="1000 nr",
-                    quantity=5, rate=150, total_amount=750,
-                )
+            building_items=[
+                BOQItemSchema(bill_no="2", description="Face bricks", unit="1000 nr", quantity=5, rate=150),
             ],
             compliance_notes=["Wall thickness OK"],
             recommendations=["Get 3 quotes"],
         )
-        self.assertEqual(len(analysis.items), 1)
-        self.assertEqual(analysis.items[0].total_amount, 750)
+        self.assertEqual(len(analysis.building_items), 1)
+        self.assertEqual(analysis.building_items[0].rate, 150)
+        self.assertEqual(analysis.professional_fees, [])
 
 
 # ── Model tests ──────────────────────────────────────────────────────
@@ -139,7 +191,6 @@ class TokenUsageModelTest(TestCase):
         self.assertEqual(t.total_tokens, 0)
 
 
-
 class MaterialPriceModelTest(TestCase):
     """Tests for MaterialPrice model."""
 
@@ -150,3 +201,1232 @@ class MaterialPriceModelTest(TestCase):
         )
         self.assertIn("cement", str(p))
         self.assertIn("12.5", str(p))
+
+
+# ── Gemini HTTP client tests ─────────────────────────────────────────
+
+def _fake_response(status_code, body=b'{}', headers=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.content = body
+    resp.headers = headers or {}
+    return resp
+
+
+@override_settings(GEMINI_API_KEY="test-key-1234567890", GEMINI_HTTP_MAX_RETRIES=2)
+class GeminiClientTest(TestCase):
+    """Tests for the pooled Gemini client (retries, pooling, counters)."""
+
+    def setUp(self):
+        gemini_client.stats.reset()
+
+    def test_session_is_reused(self):
+        self.assertIs(gemini_client.get_session(), gemini_client.get_session())
+
+    @patch("apps.ai_architecture.gemini_client.time.sleep")
+    def test_retries_on_429_then_succeeds(self, _sleep):
+        session = MagicMock()
+        session.post.side_effect = [_fake_response(429), _fake_response(200, b'{"ok": 1}')]
+        with patch.object(gemini_client, "get_session", return_value=session):
+            resp = gemini_client.post("gemini-test", {"contents": []}, timeout=5, label="unit")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(session.post.call_count, 2)
+        snap = gemini_client.stats.snapshot()
+        self.assertEqual(snap["calls"], 1)
+        self.assertEqual(snap["retries"], 1)
+        self.assertEqual(snap["by_label"]["unit"]["bytes_received"], len(b'{"ok": 1}'))
+
+    @patch("apps.ai_architecture.gemini_client.time.sleep")
+    def test_gives_up_after_max_retries(self, _sleep):
+        session = MagicMock()
+        session.post.return_value = _fake_response(503)
+        with patch.object(gemini_client, "get_session", return_value=session):
+            resp = gemini_client.post("gemini-test", {}, timeout=5)
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(session.post.call_count, 3)
+        self.assertEqual(gemini_client.stats.snapshot()["failures"], 1)
+
+    def test_api_key_sent_as_header_not_query(self):
+        session = MagicMock()
+        session.post.return_value = _fake_response(200)
+        with patch.object(gemini_client, "get_session", return_value=session):
+            gemini_client.post("gemini-test", {}, timeout=5)
+        args, kwargs = session.post.call_args
+        self.assertNotIn("key=", args[0])
+        self.assertEqual(kwargs["headers"]["x-goog-api-key"], "test-key-1234567890")
+
+    def test_async_clients_of_closed_loops_are_dropped(self):
+        loop = asyncio.new_event_loop()
+        client = loop.run_until_complete(self._get_async_client())
+        self.assertIn(loop, gemini_client._async_clients)
+        loop.run_until_complete(client.aclose())
+        loop.close()
+        asyncio.run(self._get_async_client())
+        self.assertNotIn(loop, gemini_client._async_clients)
+
+    @staticmethod
+    async def _get_async_client():
+        return gemini_client.get_async_client()
+
+    def test_stream_parses_sse_events(self):
+        resp = _fake_response(200)
+        resp.iter_lines.return_value = [
+            b'data: {"candidates": [{"content": {"parts": [{"text": "Hel"}]}}]}', b'',
+            b'data: {"candidates": [{"content": {"parts": [{"text": "lo"}]}}]}', b'',
+        ]
+        session = MagicMock()
+        session.post.return_value = resp
+        with patch.object(gemini_client, "get_session", return_value=session):
+            chunks = list(gemini_client.stream_generate_content("gemini-test", {}, timeout=5))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[1]["candidates"][0]["content"]["parts"][0]["text"], "lo")
+        args, kwargs = session.post.call_args
+        self.assertTrue(args[0].endswith(":streamGenerateContent"))
+        self.assertEqual(kwargs["params"], {"alt": "sse"})
+        self.assertTrue(kwargs["stream"])
+
+
+@override_settings(GEMINI_API_KEY="test-key-1234567890")
+class StreamGeminiWithToolsTest(TestCase):
+    """Tests for the incremental SSE chat stream with tool rounds."""
+
+    def _events(self, frames):
+        return [json.loads(f[6:]) for f in frames]
+
+    @patch("apps.ai_architecture.views.sync_get_mcp_tools", return_value=[])
+    def test_tokens_forwarded_then_tool_round_resumes(self, _mcp):
+        round_one = [
+            {"candidates": [{"content": {"parts": [{"text": "Checking prices"}]}}]},
+            {"candidates": [{"content": {"parts": [{"functionCall": {
+                "name": "get_material_prices", "args": {"material": "cement"}},
+                "thoughtSignature": "sig"}]}}]},
+        ]
+        round_two = [
+            {"candidates": [{"content": {"parts": [{"text": "Cement is "}]}}]},
+            {"candidates": [{"content": {"parts": [{"text": "$12."}]}}]},
+        ]
+        payloads = []
+
+        def fake_stream(model_name, payload, **kwargs):
+            payloads.append(json.loads(json.dumps(payload)))
+            return iter(round_one if len(payloads) == 1 else round_two)
+
+        with patch("apps.ai_architecture.views.gemini_client.stream_generate_content", side_effect=fake_stream):
+            events = self._events(list(_stream_gemini_with_tools(
+                messages=[{"role": "user", "content": "cement price?"}],
+            )))
+
+        self.assertEqual(
+            [e["type"] for e in events], ["token", "tool", "token", "token"]
+        )
+        self.assertEqual(events[1]["name"], "get_material_prices")
+        self.assertEqual(len(payloads), 2)
+        model_turn, tool_turn = payloads[1]["contents"][-2:]
+        self.assertEqual(model_turn["parts"][1]["thoughtSignature"], "sig")
+        self.assertIn("functionResponse", tool_turn["parts"][0])
+
+    @patch("apps.ai_architecture.views.sync_get_mcp_tools", return_value=[])
+    def test_upstream_error_becomes_error_event(self, _mcp):
+        with patch("apps.ai_architecture.views.gemini_client.stream_generate_content",
+                   side_effect=RuntimeError("Gemini API error (HTTP 400)")):
+            events = self._events(list(_stream_gemini_with_tools(
+                messages=[{"role": "user", "content": "hi"}],
+            )))
+        self.assertEqual(events, [{"type": "error", "content": "Gemini API error (HTTP 400)"}])
+
+
+# ── ASGI view tests ──────────────────────────────────────────────────
+
+@override_settings(GEMINI_API_KEY="test-key-1234567890")
+class AsyncAIViewsTest(TestCase):
+    """The async views reuse DRF auth and await Gemini through apost()."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("asyncuser", password="pw")
+        self.factory = AsyncRequestFactory()
+
+    def _post(self, view_cls, data, user=None):
+        request = self.factory.post("/", data=json.dumps(data), content_type="application/json")
+        if user is not None:
+            request._force_auth_user = user
+        return async_to_sync(view_cls.as_view())(request)
+
+    def test_requires_authentication(self):
+        response = self._post(AsyncDraftCopilotView, {"prompt": "2 bedroom house"})
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_draft_copilot_awaits_gemini(self):
+        draft = {"draft_name": "Tiny", "floors": 1, "rooms": [{"id": "r1", "type": "bedroom", "floor": 1,
+                 "dimensions": {"width": 3, "depth": 3}, "origin": [0, 0],
+                 "doors": [], "windows": []}]}
+        fake = MagicMock(status_code=200)
+        fake.json.return_value = {"candidates": [{"content": {"parts": [{"text": json.dumps(draft)}]}}]}
+
+        async def fake_apost(*args, **kwargs):
+            return fake
+
+        with patch("apps.ai_architecture.async_views.gemini_client.apost", side_effect=fake_apost) as apost:
+            response = self._post(AsyncDraftCopilotView, {"prompt": "one room"}, user=self.user)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["draft_name"], "Tiny")
+        self.assertEqual(apost.call_args.kwargs["label"], "draft_json")
+
+
+# ── Parallel tool round tests ────────────────────────────────────────
+
+class ParallelFunctionCallsTest(TestCase):
+    """Function calls of one round are dispatched together and kept in order."""
+
+    def _calls(self, *names):
+        return [{"functionCall": {"name": n, "args": {"n": i}}} for i, n in enumerate(names)]
+
+    def test_local_tools_run_concurrently_in_order(self):
+        def slow(n):
+            time.sleep(0.3)
+            return {"n": n}
+
+        with patch.dict(views._TOOL_MAP, {"slow_a": slow, "slow_b": slow, "slow_c": slow}):
+            started = time.monotonic()
+            parts = views._execute_function_calls(self._calls("slow_a", "slow_b", "slow_c"))
+            elapsed = time.monotonic() - started
+
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual([p["functionResponse"]["name"] for p in parts], ["slow_a", "slow_b", "slow_c"])
+        self.assertEqual([p["functionResponse"]["response"]["n"] for p in parts], [0, 1, 2])
+
+    @override_settings(AI_TOOL_CALL_TIMEOUT=0.2)
+    def test_slow_call_times_out_without_blocking_others(self):
+        def hang(n):
+            time.sleep(1.0)
+            return {"n": n}
+
+        with patch.dict(views._TOOL_MAP, {"fast": lambda n: {"n": n}, "hang": hang}):
+            parts = views._execute_function_calls(self._calls("fast", "hang"))
+
+        self.assertEqual(parts[0]["functionResponse"]["response"], {"n": 0})
+        self.assertIn("timed out", parts[1]["functionResponse"]["response"]["error"])
+
+
+# ── MCP session pool tests ───────────────────────────────────────────
+
+class _FakeMCPSession:
+    def __init__(self, *streams):
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def initialize(self):
+        pass
+
+    async def list_tools(self):
+        return SimpleNamespace(tools=[SimpleNamespace(name="echo", description="", inputSchema={})])
+
+    async def call_tool(self, name, arguments):
+        self.calls.append((name, arguments))
+        return SimpleNamespace(content=[SimpleNamespace(model_dump=lambda: {"text": arguments["msg"]})])
+
+    async def send_ping(self):
+        pass
+
+
+@override_settings(MCP_SERVERS=["http://mcp.test/sse"], MCP_STDIO_SERVERS=[])
+class MCPSessionPoolTest(TestCase):
+    """Tool calls reuse one warm session per server."""
+
+    def setUp(self):
+        self.opened = 0
+
+        @contextlib.asynccontextmanager
+        async def fake_sse_client(url):
+            self.opened += 1
+            yield (None, None)
+
+        patches = [
+            patch.object(mcp_manager, "MCP_AVAILABLE", True),
+            patch.object(mcp_manager, "sse_client", fake_sse_client),
+            patch.object(mcp_manager, "ClientSession", _FakeMCPSession),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        mcp_manager._pool = None
+        self.addCleanup(lambda: mcp_manager.submit(mcp_manager.get_pool().close_all()).result(5))
+
+    def test_session_is_reused_across_calls(self):
+        first = mcp_manager.sync_execute_mcp_tool("echo", {"msg": "a"})
+        second = mcp_manager.sync_execute_mcp_tool("echo", {"msg": "b"})
+        self.assertEqual(first, [{"text": "a"}])
+        self.assertEqual(second, [{"text": "b"}])
+        self.assertEqual(self.opened, 1)
+
+    def test_reconnects_after_session_closed(self):
+        mcp_manager.sync_execute_mcp_tool("echo", {"msg": "a"})
+        pool = mcp_manager.get_pool()
+        mcp_manager.submit(pool.close_all()).result(5)
+        self.assertEqual(mcp_manager.sync_execute_mcp_tool("echo", {"msg": "c"}), [{"text": "c"}])
+        self.assertEqual(self.opened, 2)
+
+
+# ── MCP tool registry tests ──────────────────────────────────────────
+
+@override_settings(MCP_SERVERS=["http://mcp.test/sse"], MCP_STDIO_SERVERS=[])
+class MCPToolRegistryTest(TestCase):
+    """Tool discovery never runs on the request path."""
+
+    def setUp(self):
+        mcp_manager._registry_local.clear()
+        p = patch.object(mcp_manager, "MCP_AVAILABLE", True)
+        p.start()
+        self.addCleanup(p.stop)
+
+    def test_key_is_stable_and_config_sensitive(self):
+        key = mcp_manager.tool_registry_key(["http://a"], [{"command": "npx", "args": ["x"]}])
+        self.assertEqual(key, mcp_manager.tool_registry_key(["http://a"], [{"args": ["x"], "command": "npx"}]))
+        self.assertNotEqual(key, mcp_manager.tool_registry_key(["http://b"], []))
+
+    def test_miss_returns_empty_and_schedules_refresh(self):
+        with patch.object(mcp_manager, "_schedule_registry_refresh") as schedule, \
+                patch.object(mcp_manager, "submit") as submit:
+            self.assertEqual(mcp_manager.sync_get_mcp_tools(), [])
+        schedule.assert_called_once()
+        submit.assert_not_called()
+
+    def test_fresh_entry_is_served_without_refresh(self):
+        key = mcp_manager.tool_registry_key()
+        tools = [{"name": "echo", "description": "", "input_schema": {}}]
+        mcp_manager.caches["shared"].set(key, {"tools": tools, "routes": {}, "refreshed_at": time.time()})
+        with patch.object(mcp_manager, "_schedule_registry_refresh") as schedule:
+            self.assertEqual(mcp_manager.sync_get_mcp_tools(), tools)
+        schedule.assert_not_called()
+
+
+# ── Project context snapshot tests ───────────────────────────────────
+
+class ProjectContextSnapshotTest(TestCase):
+    """The prompt context is cached per project and invalidated by signals."""
+
+    def setUp(self):
+        project_context._local.clear()
+        owner = User.objects.create_user("ctxowner", password="pw")
+        self.project = Project.objects.create(owner=owner, title="Ctx House", location="Harare", budget=1000)
+        self.version = ProjectBudgetVersion.objects.create(
+            project=self.project, kind=ProjectBudgetVersion.Kind.PRELIMINARY,
+        )
+
+    def test_second_read_hits_cache(self):
+        first = project_context.get_project_context_snapshot(self.project)
+        self.assertIn("Ctx House", first["text"])
+        self.assertEqual(first["tokens"], project_context.estimate_tokens(first["text"]))
+        with self.assertNumQueries(1):  # generation counter only
+            second = project_context.get_project_context_snapshot(self.project)
+        self.assertEqual(second["version"], first["version"])
+
+    def test_boq_item_save_invalidates(self):
+        before = project_context.get_project_context_snapshot(self.project)
+        BOQBuildingItem.objects.create(
+            budget_version=self.version, bill_no="B1", description="Brickwork", quantity=2, rate=5,
+        )
+        after = project_context.get_project_context_snapshot(self.project)
+        self.assertGreater(after["version"], before["version"])
+        self.assertIn("Brickwork", after["text"])
+
+    def test_milestone_delete_invalidates(self):
+        milestone = EscrowMilestone.objects.create(project=self.project, name="Slab", amount=10, status="pending")
+        self.assertIn("Slab", project_context.get_project_context_snapshot(self.project)["text"])
+        milestone.delete()
+        self.assertNotIn("Slab", project_context.get_project_context_snapshot(self.project)["text"])
+
+
+# ── /analyse result cache tests ──────────────────────────────────────
+
+class AnalyseCacheTest(TestCase):
+    """Repeat /analyse runs on identical inputs are served from the cache."""
+
+    IMAGE = "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+
+    def setUp(self):
+        project_context._local.clear()
+        self.user = User.objects.create_user("analyst", password="pw")
+        self.project = Project.objects.create(owner=self.user, title="Cache House", location="Gweru", budget=1)
+        self.raw = json.dumps({"summary": "ok", "building_items": [
+            {"bill_no": "1", "description": "Slab", "unit": "m3", "quantity": 2, "rate": 3}]})
+
+    def _analyse(self, **kwargs):
+        return ChatCompletionView()._handle_analyse(
+            "/analyse", [self.IMAGE], self.project, file_name="plan.png", user=self.user, **kwargs
+        )
+
+    def test_hit_skips_gemini_and_records_history(self):
+        with patch("apps.ai_architecture.views._call_gemini_analyse", return_value=self.raw) as call:
+            first = self._analyse()
+            second = self._analyse()
+        self.assertEqual(call.call_count, 1)
+        self.assertNotIn("cached", first)
+        self.assertTrue(second["cached"])
+        self.assertEqual(second["building_items"], first["building_items"])
+        self.assertEqual(BudgetAnalysisHistory.objects.filter(project=self.project).count(), 2)
+
+    def test_bypass_and_context_change_force_fresh_call(self):
+        with patch("apps.ai_architecture.views._call_gemini_analyse", return_value=self.raw) as call:
+            self._analyse()
+            self._analyse(use_cache=False)
+            self.project.title = "Renamed House"
+            self.project.save()
+            self._analyse()
+        self.assertEqual(call.call_count, 3)
+
+    def test_non_json_reply_is_a_failure(self):
+        with patch("apps.ai_architecture.views._call_gemini_analyse",
+                   return_value="Sorry, I cannot read {this drawing}") as call:
+            first = self._analyse()
+            self._analyse()
+        self.assertTrue(first["summary"].startswith("Analysis failed"))
+        self.assertEqual(first["building_items"], [])
+        self.assertEqual(call.call_count, 2)
+
+    def test_truncated_or_empty_results_are_not_cached(self):
+        for raw in (self.raw[:-20], "{}"):
+            with patch("apps.ai_architecture.views._call_gemini_analyse", return_value=raw) as call:
+                self._analyse()
+                second = self._analyse()
+            self.assertEqual(call.call_count, 2, raw)
+            self.assertNotIn("cached", second)
+
+    def test_fan_out_is_cached_separately(self):
+        with patch("apps.ai_architecture.views._call_gemini_analyse", return_value=self.raw):
+            self._analyse()
+            fanned = self._analyse(fan_out=True)
+        self.assertNotIn("cached", fanned)
+        self.assertIn("sheets", fanned)
+
+    def test_key_depends_on_image_content(self):
+        common = dict(template_marker="", context_version=1, system_prompt="s", user_prompt="u", model="m")
+        a = analyse_cache.analyse_cache_key(images=[self.IMAGE], **common)
+        b = analyse_cache.analyse_cache_key(images=[self.IMAGE.split(",", 1)[1]], **common)
+        c = analyse_cache.analyse_cache_key(images=["data:image/png;base64,AAAA"], **common)
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, c)
+
+
+# ── Background job tests ─────────────────────────────────────────────
+
+@override_settings(AI_VISION_CACHE_DIR=tempfile.mkdtemp(prefix="ai-vision-test-"))
+class AIJobQueueTest(TestCase):
+    """Slow commands can be queued, claimed once and replayed by a worker."""
+
+    IMAGE = AnalyseCacheTest.IMAGE
+
+    def setUp(self):
+        self.user = User.objects.create_user("jobuser", password="pw")
+        self.project = Project.objects.create(owner=self.user, title="Job House", location="Mutare", budget=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.raw = json.dumps({"summary": "Queued analysis", "building_items": [
+            {"bill_no": "1", "description": "Slab", "unit": "m3", "quantity": 2, "rate": 3}]})
+
+    def _queue_analyse(self):
+        return self.client.post(reverse("ai-chat"), {
+            "messages": [{"role": "user", "content": "/analyse"}],
+            "image": self.IMAGE,
+            "project_id": self.project.pk,
+            "background": True,
+        }, format="json")
+
+    def test_analyse_returns_job_and_worker_persists_results(self):
+        response = self._queue_analyse()
+        self.assertEqual(response.status_code, 202)
+        job = AIJob.objects.get(pk=response.data["job_id"])
+        self.assertEqual((job.kind, job.status), ("analyse", AIJob.STATUS_QUEUED))
+        self.assertTrue(ChatMessage.objects.filter(session=job.session, role="user").exists())
+
+        with patch("apps.ai_architecture.views._call_gemini_analyse", return_value=self.raw) as call:
+            self.assertEqual(ai_jobs.run_pending_jobs(), 1)
+        self.assertEqual(call.call_count, 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, AIJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.payload, {})
+        self.assertEqual(job.result["analyse"]["summary"], "Queued analysis")
+        self.assertTrue(ChatMessage.objects.filter(session=job.session, role="assistant",
+                                                   content="Queued analysis").exists())
+        self.assertEqual(BudgetAnalysisHistory.objects.filter(project=self.project).count(), 1)
+
+        status = self.client.get(reverse("ai-job-detail", args=[job.pk]))
+        self.assertEqual(status.data["status"], AIJob.STATUS_SUCCEEDED)
+        events = self.client.get(reverse("ai-job-events", args=[job.pk]))
+        body = b"".join(events.streaming_content).decode()
+        self.assertIn('"type": "result"', body)
+        self.assertTrue(body.endswith("data: [DONE]\n\n"))
+
+    @override_settings(AI_JOB_EVENTS_TIMEOUT=0)
+    def test_events_of_unfinished_job_end_for_reconnect(self):
+        job_id = self._queue_analyse().data["job_id"]
+        events = self.client.get(reverse("ai-job-events", args=[job_id]))
+        body = b"".join(events.streaming_content).decode()
+        self.assertTrue(body.startswith("retry: "))
+        self.assertIn('"type": "progress"', body)
+        self.assertNotIn("[DONE]", body)
+
+    @override_settings(AI_JOB_HEARTBEAT_INTERVAL=0.01)
+    def test_worker_heartbeats_during_a_long_call(self):
+        job_id = self._queue_analyse().data["job_id"]
+        beats = threading.Event()
+
+        def slow_call(*args, **kwargs):
+            if not beats.wait(2):
+                raise AssertionError("no heartbeat while the call was running")
+            return self.raw
+
+        with patch.object(ai_jobs._Heartbeat, "_beat", lambda hb: beats.set()), \
+                patch("apps.ai_architecture.views._call_gemini_analyse", side_effect=slow_call):
+            ai_jobs.run_pending_jobs()
+        self.assertEqual(AIJob.objects.get(pk=job_id).status, AIJob.STATUS_SUCCEEDED)
+
+    def test_plain_chat_is_not_queued(self):
+        view = ChatCompletionView()
+        self.assertIsNone(view.job_kind("hello there"))
+        self.assertEqual(view.job_kind("/draw a cottage"), "draw")
+
+    def test_job_is_claimed_once_and_stale_jobs_requeued(self):
+        job_id = self._queue_analyse().data["job_id"]
+        claimed = ai_jobs.claim_next_job("worker-a")
+        self.assertEqual(str(claimed.pk), job_id)
+        self.assertIsNone(ai_jobs.claim_next_job("worker-b"))
+
+        AIJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(ai_jobs.requeue_stale_jobs(), 1)
+        self.assertEqual(AIJob.objects.get(pk=job_id).status, AIJob.STATUS_QUEUED)
+
+    def test_worker_that_lost_its_claim_does_not_overwrite_the_job(self):
+        job_id = self._queue_analyse().data["job_id"]
+        job = ai_jobs.claim_next_job("worker-a")
+
+        def reclaimed(*args, **kwargs):
+            AIJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+            ai_jobs.requeue_stale_jobs()
+            ai_jobs.claim_next_job("worker-b")
+            return self.raw
+
+        with patch("apps.ai_architecture.views._call_gemini_analyse", side_effect=reclaimed):
+            ai_jobs.execute_job(job)
+        job = AIJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.locked_by), (AIJob.STATUS_RUNNING, "worker-b"))
+        self.assertIsNone(job.result)
+
+    def test_other_users_cannot_see_job(self):
+        job_id = self._queue_analyse().data["job_id"]
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user("snoop", password="pw"))
+        self.assertEqual(other.get(reverse("ai-job-detail", args=[job_id])).status_code, 404)
+
+
+# ── Token usage accounting tests ─────────────────────────────────────
+
+@override_settings(GEMINI_API_KEY="test-key-1234567890", AI_USAGE_BACKGROUND_FLUSH=False,
+                   AI_USAGE_FLUSH_SIZE=100)
+class TokenUsageRecordingTest(TestCase):
+    """usageMetadata from Gemini responses is buffered and bulk-inserted."""
+
+    USAGE = {"promptTokenCount": 120, "candidatesTokenCount": 30, "thoughtsTokenCount": 5,
+             "totalTokenCount": 155}
+
+    def setUp(self):
+        ai_usage.flush()
+        self.user = User.objects.create_user("tokenuser", password="pw")
+        self.session = ChatSession.objects.create(user=self.user, title="t")
+        ai_usage.bind(self.user, "chat", session=self.session)
+
+    def tearDown(self):
+        ai_usage.restore_binding(None)
+
+    def test_post_records_usage_after_flush(self):
+        body = json.dumps({"candidates": [{"content": {"parts": [{"text": "hi"}]}}],
+                           "usageMetadata": self.USAGE}).encode()
+        session = MagicMock()
+        session.post.return_value = _fake_response(200, body)
+        with patch.object(gemini_client, "get_session", return_value=session):
+            gemini_client.post("gemini-test", {}, timeout=5, label="analyse")
+        self.assertFalse(TokenUsage.objects.exists())
+
+        self.assertEqual(ai_usage.flush(), 1)
+        row = TokenUsage.objects.get()
+        self.assertEqual((row.endpoint, row.model_name, row.session_id), ("analyse", "gemini-test", self.session.pk))
+        self.assertEqual((row.input_tokens, row.output_tokens, row.total_tokens), (120, 35, 155))
+
+    def test_stream_records_final_cumulative_usage(self):
+        lines = [
+            b'data: ' + json.dumps({"usageMetadata": {"promptTokenCount": 10}}).encode(), b'',
+            b'data: ' + json.dumps({"usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 7,
+                                                      "totalTokenCount": 17}}).encode(), b'',
+        ]
+        resp = _fake_response(200)
+        resp.iter_lines.return_value = lines
+        with patch.object(gemini_client, "post", return_value=resp):
+            list(gemini_client.stream_generate_content("gemini-test", {}, timeout=5))
+        ai_usage.flush()
+        row = TokenUsage.objects.get()
+        self.assertEqual((row.endpoint, row.total_tokens), ("chat", 17))
+
+    def test_streamed_analyse_is_accounted_to_analyse(self):
+        ai_usage.record("gemini-pro-test", self.USAGE, label="analyse_stream")
+        ai_usage.flush()
+        self.assertEqual(TokenUsage.objects.get().endpoint, "analyse")
+
+    def test_unbound_usage_is_not_recorded(self):
+        ai_usage.restore_binding(None)
+        ai_usage.record("gemini-test", self.USAGE)
+        self.assertEqual(ai_usage.flush(), 0)
+
+    def test_request_binding_is_cleared_with_the_response(self):
+        ai_usage.restore_binding(None)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(reverse("ai-chat"), {"messages": []}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(ai_usage.current_binding())
+
+    def test_extract_usage_reads_trailing_metadata(self):
+        body = b'{"candidates": [{"inlineData": {"data": "' + b"A" * 5000 + b'"}}], "usageMetadata": {"totalTokenCount": 9}}'
+        self.assertEqual(ai_usage.extract_usage(body), {"totalTokenCount": 9})
+
+
+# ── Vision preprocessing tests ───────────────────────────────────────
+
+def _png_data_url(width, height, color=(200, 30, 30)):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buf, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+
+class VisionPreprocessTest(TestCase):
+    """Images are downscaled, re-encoded, cached by content and budgeted."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.override = override_settings(AI_VISION_CACHE_DIR=self.tmp.name, AI_VISION_MAX_EDGE=256,
+                                          AI_VISION_FORMAT="webp", AI_VISION_QUALITY=80)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.tmp.cleanup()
+
+    def test_downscales_and_reencodes(self):
+        out = vision.preprocess_data_url(_png_data_url(1200, 600))
+        self.assertTrue(out.startswith("data:image/webp;base64,"))
+        with Image.open(io.BytesIO(base64.b64decode(out.split(",", 1)[1]))) as img:
+            self.assertEqual(img.size, (256, 128))
+
+    def test_derivative_is_cached_on_disk(self):
+        src = _png_data_url(800, 800)
+        first = vision.preprocess_data_url(src)
+        with patch.object(vision, "_encode") as encode:
+            second = vision.preprocess_data_url(src)
+        encode.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_undecodable_input_passes_through(self):
+        self.assertEqual(vision.preprocess_data_url("data:image/png;base64,AAAA"), "data:image/png;base64,AAAA")
+
+    def test_budget_keeps_priority_order_and_skips_oversized(self):
+        small_a, big, small_b = "data:x;base64," + "A" * 400, "data:x;base64," + "B" * 4000, "data:x;base64," + "C" * 400
+        self.assertEqual(vision.fit_budget([small_a, big, small_b], max_bytes=1000, max_images=5), [small_a, small_b])
+        self.assertEqual(vision.fit_budget([small_a, small_b], max_bytes=1000, max_images=1), [small_a])
+
+
+# ── PDF rasterization tests ──────────────────────────────────────────
+
+def _one_page_pdf(content: bytes, width=595, height=842) -> bytes:
+    """Minimal single-page PDF with the given content stream."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        (b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents 4 0 R "
+         b"/Resources << /Font << /F1 5 0 R >> >> >>" % (width, height)),
+        b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+class PdfPagesTest(TestCase):
+    """Text pages skip rasterization; rendered pages are cached per PDF/page/DPI."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.override = override_settings(AI_VISION_CACHE_DIR=self.tmp.name, AI_VISION_MAX_EDGE=2048)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        self.tmp.cleanup()
+
+    def test_text_only_page_is_not_rendered(self):
+        line = b"BT /F1 10 Tf 50 800 Td (" + b"Specification clause for concrete works. " * 8 + b") Tj ET"
+        with patch.object(pdf_pages, "_render_page") as render:
+            result = pdf_pages.extract_pdf(_one_page_pdf(line))
+        render.assert_not_called()
+        self.assertEqual(result["images"], [])
+        self.assertIn("Specification clause", result["text_pages"][0][1])
+
+    def test_drawing_page_rendered_once_with_adaptive_dpi(self):
+        lines = b"".join(b"%d 0 m %d 500 l S\n" % (i, i) for i in range(100))
+        pdf = _one_page_pdf(lines, width=2384, height=1684)  # A1 landscape
+        with patch.object(pdf_pages, "_render_page", return_value=("image/webp", b"page")) as render:
+            first = pdf_pages.extract_pdf(pdf)
+            second = pdf_pages.extract_pdf(pdf)
+        render.assert_called_once()
+        self.assertEqual(render.call_args.args[1:], (1, 72))
+        self.assertEqual(first, second)
+        self.assertEqual(first["images"], ["data:image/webp;base64," + base64.b64encode(b"page").decode()])
+
+    def test_pdf_pypdf_cannot_open_is_still_rasterized(self):
+        pages = [Image.new("RGB", (40, 60), "white"), Image.new("RGB", (40, 60), "black")]
+        with patch("pdf2image.convert_from_bytes", return_value=pages) as convert:
+            result = pdf_pages.extract_pdf(b"%PDF-1.4 broken xref", max_pages=3)
+        self.assertEqual(convert.call_args.kwargs, {"first_page": 1, "last_page": 3, "dpi": 200})
+        self.assertEqual(len(result["images"]), 2)
+        self.assertEqual(result["text_pages"], [])
+
+    def test_page_dpi_scales_with_page_size(self):
+        self.assertEqual(pdf_pages.page_dpi(595, 842), 175)   # A4
+        self.assertEqual(pdf_pages.page_dpi(100, 100), 200)   # capped
+
+
+# ── Conversation history tests ───────────────────────────────────────
+
+@override_settings(AI_HISTORY_PROMPT_BUDGET=100, AI_HISTORY_MAX_MESSAGES=40, AI_HISTORY_KEEP_RECENT=2,
+                   AI_HISTORY_SUMMARIZE_AFTER_TOKENS=50)
+class ChatHistoryTest(TestCase):
+    """Prompts use the rolling summary plus a budgeted window of stored turns."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("historian", password="pw")
+        self.session = ChatSession.objects.create(user=self.user, title="long")
+        for i in range(10):
+            ChatMessage.objects.create(session=self.session, role="user", content=f"question {i} " + "x" * 80)
+            ChatMessage.objects.create(session=self.session, role="assistant", content=f"answer {i} " + "y" * 80)
+        ChatMessage.objects.create(session=self.session, role="user", content="latest question")
+
+    def test_window_respects_budget_and_starts_with_user(self):
+        messages, summary = chat_history.build_history(self.session, [])
+        self.assertEqual(summary, "")
+        self.assertEqual(messages[-1]["content"], "latest question")
+        self.assertEqual(messages[0]["role"], "user")
+        used = sum(chat_history.estimate_tokens(m["content"]) for m in messages)
+        self.assertLessEqual(used, 100)
+        self.assertLess(len(messages), 21)
+
+    def test_summary_replaces_older_turns(self):
+        self.assertTrue(chat_history.needs_summary(self.session))
+        with patch("apps.ai_architecture.views._call_gemini", return_value="- user asked ten questions") as call:
+            self.assertTrue(chat_history.summarize_session(self.session.pk))
+        self.assertIn("question 0", call.call_args.kwargs["messages"][0]["content"])
+
+        self.session.refresh_from_db()
+        last_ids = list(ChatMessage.objects.filter(session=self.session).order_by("-id").values_list("id", flat=True)[:3])
+        self.assertEqual(self.session.summary_through_id, last_ids[2])
+        messages, summary = chat_history.build_history(self.session, [])
+        self.assertEqual(summary, "- user asked ten questions")
+        self.assertEqual([m["content"] for m in messages][-1], "latest question")
+        self.assertNotIn("question 0", " ".join(m["content"] for m in messages))
+        self.assertIn("SUMMARY OF EARLIER CONVERSATION", chat_history.summary_prompt_block(summary))
+
+    @override_settings(AI_HISTORY_SUMMARY_INPUT_CHARS=500)
+    def test_summary_only_covers_messages_that_fit_the_input(self):
+        with patch("apps.ai_architecture.views._call_gemini", return_value="- two questions") as call:
+            self.assertTrue(chat_history.summarize_session(self.session.pk))
+        prompt = call.call_args.kwargs["messages"][0]["content"]
+        self.assertIn("question 0", prompt)
+        self.assertNotIn("question 2", prompt)
+
+        self.session.refresh_from_db()
+        first_ids = list(ChatMessage.objects.filter(session=self.session).order_by("id").values_list("id", flat=True)[:4])
+        self.assertEqual(self.session.summary_through_id, first_ids[3])
+        self.assertTrue(chat_history.needs_summary(self.session))
+
+
+# ── Chat history pagination tests ────────────────────────────────────
+
+class ChatHistoryPaginationTest(TestCase):
+    """Keyset pages over sessions and messages, plus the list projection."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("scroller", password="pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        base = timezone.now()
+        self.sessions = []
+        for i in range(5):
+            s = ChatSession.objects.create(user=self.user, title=f"s{i}")
+            # Two sessions share a timestamp so the id tie-breaker is exercised.
+            ChatSession.objects.filter(pk=s.pk).update(updated_at=base - timedelta(minutes=min(i, 3)))
+            self.sessions.append(s)
+        self.long = self.sessions[0]
+        for i in range(7):
+            ChatMessage.objects.create(session=self.long, role="user" if i % 2 == 0 else "assistant", content=f"m{i}")
+
+    def test_session_pages_cover_everything_once(self):
+        url = reverse("ai-chat-sessions")
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            body = self.client.get(url, params).json()
+            seen += [s["id"] for s in body["results"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [s.pk for s in self.sessions[:3]] + [self.sessions[4].pk, self.sessions[3].pk])
+
+    def test_session_list_preview_and_count(self):
+        rows = self.client.get(reverse("ai-chat-sessions")).json()
+        first = rows[0]
+        self.assertEqual(first["id"], self.long.pk)
+        self.assertEqual(first["message_count"], 7)
+        self.assertEqual(first["last_message"], {"role": "user", "preview": "m6"})
+        self.assertIsNone(rows[1]["last_message"])
+
+    def test_messages_load_newest_page_first(self):
+        url = reverse("ai-chat-session-detail", args=[self.long.pk])
+        page = self.client.get(url, {"limit": 3}).json()
+        self.assertEqual([m["content"] for m in page["messages"]], ["m4", "m5", "m6"])
+        older = self.client.get(url, {"limit": 3, "cursor": page["next_cursor"]}).json()
+        self.assertEqual([m["content"] for m in older["messages"]], ["m1", "m2", "m3"])
+        oldest = self.client.get(url, {"limit": 3, "cursor": older["next_cursor"]}).json()
+        self.assertEqual([m["content"] for m in oldest["messages"]], ["m0"])
+        self.assertIsNone(oldest["next_cursor"])
+
+        full = self.client.get(url).json()
+        self.assertEqual(len(full["messages"]), 7)
+        self.assertNotIn("next_cursor", full)
+
+    def test_invalid_cursor_is_rejected(self):
+        resp = self.client.get(reverse("ai-chat-sessions"), {"cursor": "not-a-cursor!"})
+        self.assertEqual(resp.status_code, 400)
+
+
+# ── Knowledge retrieval tests ────────────────────────────────────────
+
+_REGULATIONS = (
+    "Part 3. Stair design.\n\n"
+    "Every stair shall have a riser height not exceeding 190 mm and a tread depth of at least 250 mm. "
+    "Handrails are required on at least one side of a stair wider than 1 metre.\n\n"
+    "Part 4. Fire safety.\n\n"
+    "Habitable rooms above ground floor require an emergency escape window with a clear opening "
+    "of at least 0.33 square metres. Smoke detectors must be installed in every hallway.\n\n"
+    "Part 5. Drainage.\n\n"
+    "Septic tanks must be sited at least 3 metres from any building and 30 metres from a borehole."
+)
+
+
+@override_settings(AI_KNOWLEDGE_AUTO_INDEX=False, AI_KNOWLEDGE_CHUNK_CHARS=260, AI_KNOWLEDGE_MIN_SCORE=0.05)
+class KnowledgeRetrievalTest(TestCase):
+    """Chunking, dedup, the NumPy index and prompt injection."""
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=tmp, AI_KNOWLEDGE_INDEX_DIR=f"{tmp}/index")
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def _upload(self, title, text=_REGULATIONS):
+        return KnowledgeDocument.objects.create(
+            title=title, file=SimpleUploadedFile(f"{title}.txt", text.encode("utf-8")),
+        )
+
+    def test_chunks_respect_size_and_paragraphs(self):
+        chunks = knowledge.chunk_text(_REGULATIONS, size=260, overlap=60)
+        self.assertGreater(len(chunks), 2)
+        self.assertTrue(all(len(c) <= 260 for c in chunks))
+        self.assertTrue(any(c.startswith("Part 4. Fire safety.") for c in chunks))
+
+    def test_top_passage_matches_query(self):
+        doc = self._upload("Building Regulations")
+        self.assertGreater(knowledge.ingest_document(doc), 0)
+        doc.refresh_from_db()
+        self.assertTrue(doc.is_embedded)
+
+        passages = knowledge.retrieve("What is the maximum riser height for a stair?")
+        self.assertIn("riser height", passages[0]["text"])
+        self.assertEqual(passages[0]["document"], "Building Regulations")
+        block = knowledge.prompt_block("how far must a septic tank be from a borehole")
+        self.assertIn("REFERENCE PASSAGES", block)
+        self.assertIn("30 metres from a borehole", block)
+
+    def test_duplicate_upload_is_not_indexed_twice(self):
+        first = self._upload("Regs")
+        knowledge.ingest_document(first)
+        second = self._upload("Regs copy")
+        self.assertEqual(knowledge.ingest_document(second), 0)
+        self.assertFalse(KnowledgeChunk.objects.filter(document=second).exists())
+        index = knowledge.current_index()
+        self.assertEqual(len(index), KnowledgeChunk.objects.filter(document=first).count())
+
+    def test_rebuild_reuses_existing_vectors(self):
+        knowledge.ingest_document(self._upload("Regs"))
+        other = self._upload("Notes", "Roof sheets overlap by one and a half corrugations.")
+        with patch.object(knowledge.HashingEmbedder, "embed", autospec=True,
+                          side_effect=knowledge.HashingEmbedder.embed) as embed:
+            knowledge.ingest_document(other)
+        self.assertEqual(sum(len(call.args[1]) for call in embed.call_args_list), 1)
+        self.assertIn("corrugations", knowledge.retrieve("roof sheet overlap corrugations")[0]["text"])
+
+    def test_no_index_means_no_prompt_block(self):
+        self.assertEqual(knowledge.prompt_block("stairs"), "")
+
+    def test_ingestion_during_a_rebuild_triggers_another(self):
+        calls = []
+
+        def rebuild():
+            calls.append(1)
+            if len(calls) == 1:
+                knowledge._rebuild_while_dirty()  # another document lands mid-rebuild
+
+        with patch.object(knowledge, "rebuild_index", side_effect=rebuild):
+            knowledge._rebuild_while_dirty()
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(AI_KNOWLEDGE_AUTO_INDEX=True)
+    def test_missing_index_is_rebuilt_from_stored_chunks(self):
+        knowledge.ingest_document(self._upload("Regs"), rebuild=False)
+        with patch.object(knowledge, "schedule_rebuild") as schedule:
+            self.assertIsNone(knowledge.current_index())
+        schedule.assert_called_once_with()
+
+
+# ── Preset matcher tests ─────────────────────────────────────────────
+
+class PresetMatcherTest(TestCase):
+    """Compiled keyword routing to DrawingStylePreset."""
+
+    def setUp(self):
+        self.modern = DrawingStylePreset.objects.create(name="Modern", priority=5, keywords="modern, minimalist")
+        self.section = DrawingStylePreset.objects.create(name="Section", priority=10, keywords="section, cross-section")
+        self.plan = DrawingStylePreset.objects.create(name="Plan", priority=1, keywords="floor plan, plan, layout")
+        DrawingStylePreset.objects.create(name="Retired", priority=99, keywords="modern", is_active=False)
+
+    def test_automaton_finds_overlapping_keywords(self):
+        automaton = preset_matcher.KeywordAutomaton({"he": 1, "she": 2, "hers": 3, "his": 4})
+        self.assertEqual(sorted(automaton.scan("ushers")), [1, 2, 3])
+
+    def test_highest_priority_match_wins(self):
+        self.assertEqual(preset_matcher.match_preset("A MODERN floor plan"), self.modern)
+        self.assertEqual(preset_matcher.match_preset("modern cross-section"), self.section)
+        self.assertIsNone(preset_matcher.match_preset("a rustic cabin"))
+
+    def test_fallback_text_and_zero_queries(self):
+        preset_matcher.get_matcher()
+        with self.assertNumQueries(0):
+            self.assertEqual(preset_matcher.match_preset("draw a house", "minimalist"), self.modern)
+
+    def test_saving_a_preset_rebuilds_the_matcher(self):
+        self.assertIsNone(preset_matcher.match_preset("tuscan villa"))
+        self.plan.keywords = "tuscan"
+        self.plan.save()
+        self.assertEqual(preset_matcher.match_preset("tuscan villa"), self.plan)
+        self.section.is_active = False
+        self.section.save()
+        self.assertEqual(preset_matcher.match_preset("modern cross-section"), self.modern)
+
+
+# ── Config cache tests ───────────────────────────────────────────────
+
+class AIConfigCacheTest(TestCase):
+    """Active instruction / BOQ template served from memory."""
+
+    def test_instruction_follows_admin_edits(self):
+        self.assertEqual(ai_config.base_instruction(), ai_config.DEFAULT_INSTRUCTION)
+        row = AIInstruction.objects.create(instruction_text="Be brief.")
+        self.assertEqual(ai_config.base_instruction(), "Be brief.")
+        with self.assertNumQueries(0):
+            ai_config.base_instruction()
+        row.is_active = False
+        row.save()
+        self.assertEqual(ai_config.base_instruction(), ai_config.DEFAULT_INSTRUCTION)
+
+    def test_boq_template_prompt_and_marker(self):
+        self.assertEqual(ai_config.active_boq_template()["prompt"], "")
+        template = BOQTemplate.objects.create(
+            name="Standard", is_active=True, example_items_json='[{"bill_no": "1"}]',
+        )
+        active = ai_config.active_boq_template()
+        self.assertIn("Template Name: Standard", active["prompt"])
+        self.assertIn('"bill_no": "1"', active["prompt"])
+        self.assertTrue(active["marker"].startswith(f"{template.pk}@"))
+        template.delete()
+        self.assertEqual(ai_config.active_boq_template()["marker"], "")
+
+
+# ── Truncated JSON recovery ──────────────────────────────────────────
+
+class TolerantJSONTest(TestCase):
+    """Single-pass recovery of truncated Gemini JSON."""
+
+    PAYLOAD = {
+        "summary": "Three bedroom bungalow",
+        "sections": [
+            {"name": "Substructure", "items": [
+                {"description": f"Item {i} with \"quotes\" and [brackets]", "qty": i * 1.5, "rate": 1200 + i}
+                for i in range(6)
+            ]},
+            {"name": "Roofing", "items": [{"description": "Iron sheets", "qty": 40, "rate": 950}]},
+        ],
+    }
+
+    def test_complete_json_is_unchanged(self):
+        text = json.dumps(self.PAYLOAD)
+        self.assertEqual(json_stream.loads(text), self.PAYLOAD)
+        self.assertEqual(json_stream.parse_partial(text), (self.PAYLOAD, True))
+
+    def test_keeps_complete_members_and_drops_cut_values(self):
+        self.assertEqual(json_stream.loads('{"a": [1, 2, {"b": "x"}, {"c": "unfinis'), {"a": [1, 2, {"b": "x"}]})
+        self.assertEqual(json_stream.loads('{"a": {"b": [1], "c": {"d": 2, "e'), {"a": {"b": [1], "c": {"d": 2}}})
+        self.assertEqual(json_stream.loads('{"a": 1, "b": 12'), {"a": 1})
+        self.assertEqual(json_stream.loads('{"a": [true, fal'), {"a": [True]})
+        self.assertEqual(json_stream.loads('{"a": "x", "b'), {"a": "x"})
+        self.assertEqual(json_stream.loads('Here you go:\n[{"a": 1}, {"a"'), [{"a": 1}])
+        with self.assertRaises(ValueError):
+            json_stream.loads("no json here")
+
+    def test_prose_with_braces_is_not_an_empty_result(self):
+        for text in ('Sorry, I cannot read {this drawing}', 'I need a clearer scan {', 'See [the notes', '{"summ'):
+            with self.assertRaises(ValueError, msg=text):
+                json_stream.parse_partial(text)
+        self.assertEqual(json_stream.parse_partial("{}"), ({}, True))
+
+    def test_every_cut_keeps_every_complete_item(self):
+        text = json.dumps(self.PAYLOAD)
+        items = self.PAYLOAD["sections"][0]["items"]
+        item_texts = [json.dumps(item) for item in items]
+        for cut in range(text.index('"sections"'), len(text)):
+            head = text[:cut]
+            recovered = json_stream.loads(head)
+            got = (recovered.get("sections") or [{}])[0].get("items", [])
+            expected = [item for item, raw in zip(items, item_texts) if raw in head]
+            # Exactly the rows that arrived complete; nothing half-written.
+            self.assertEqual(got, expected, cut)
+
+    def test_large_truncated_response_is_fast(self):
+        rows = [{"description": "x" * 80, "qty": i, "rate": i * 3} for i in range(20000)]
+        text = json.dumps({"items": rows})[:-5000]
+        start = time.perf_counter()
+        recovered = json_stream.loads(text)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertGreater(len(recovered["items"]), 19900)
+        self.assertEqual(recovered["items"][:3], rows[:3])
+
+
+# ── Streaming /analyse ───────────────────────────────────────────────
+
+@override_settings(GEMINI_API_KEY="test-key-1234567890")
+class AnalyseStreamTest(TestCase):
+    """/analyse over SSE pushes normalized rows while Gemini is still writing."""
+
+    IMAGE = AnalyseCacheTest.IMAGE
+
+    def setUp(self):
+        project_context._local.clear()
+        self.user = User.objects.create_user("streamer", password="pw")
+        Profile.objects.update_or_create(user=self.user, defaults={"is_approved": True})
+        self.user.refresh_from_db()
+        self.project = Project.objects.create(owner=self.user, title="Stream House", location="Mutare", budget=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        raw = json.dumps({
+            "summary": "Two rooms",
+            "building_items": [
+                {"category": "Concrete", "description": "Slab", "unit": "m3", "quantity": "2", "total_amount": 90},
+                "not a row",
+                {"item_name": "Walls", "quantity": 40, "rate": 12},
+            ],
+            "professional_fees": [{"discipline": "QS", "estimated_fee": "1,200"}],
+            "compliance_notes": ["SI-56 ok"],
+        })
+        self.chunks = [
+            {"candidates": [{"content": {"parts": [{"text": raw[i:i + 17]}]}}]}
+            for i in range(0, len(raw), 17)
+        ]
+
+    def _stream(self):
+        response = self.client.post(reverse("ai-chat-stream"), {
+            "messages": [{"role": "user", "content": "/analyse"}],
+            "project_id": self.project.id, "image": self.IMAGE, "stream_analyse": True,
+        }, format="json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        frames = b"".join(response.streaming_content).decode().split("\n\n")
+        return [json.loads(f[6:]) for f in frames if f.startswith("data: {")]
+
+    def test_rows_then_result_and_persistence(self):
+        fed = []
+
+        def fake_stream(model_name, payload, **kwargs):
+            for chunk in self.chunks:
+                fed.append(chunk)
+                yield chunk
+
+        with patch("apps.ai_architecture.views.gemini_client.stream_generate_content", side_effect=fake_stream):
+            events = self._stream()
+
+        rows = [e for e in events if e["type"] == "analyse_row"]
+        self.assertEqual([(r["section"], r["index"]) for r in rows], [
+            ("building_items", 0), ("building_items", 1), ("professional_fees", 0), ("compliance_notes", 0),
+        ])
+        self.assertEqual(rows[0]["row"]["description"], "Concrete - Slab")
+        self.assertEqual(rows[0]["row"]["rate"], 45.0)
+        self.assertEqual(rows[1]["row"]["bill_no"], "3")
+        self.assertEqual(rows[2]["row"]["estimated_fee"], 1200.0)
+        self.assertEqual(events[0], {"type": "analyse_summary", "content": "Two rooms"})
+
+        final = next(e for e in events if e["type"] == "analyse")["analyse"]
+        self.assertEqual(final["building_items"], [r["row"] for r in rows[:2]])
+        self.assertEqual(events[-1]["type"], "meta")
+        self.assertEqual(BudgetAnalysisHistory.objects.filter(project=self.project).count(), 1)
+        self.assertTrue(ChatMessage.objects.filter(role="assistant", content="Two rooms").exists())
+
+        with patch("apps.ai_architecture.views.gemini_client.stream_generate_content") as again:
+            cached = self._stream()
+        again.assert_not_called()
+        self.assertEqual(
+            [e["row"] for e in cached if e["type"] == "analyse_row"], [r["row"] for r in rows]
+        )
+        self.assertTrue(next(e for e in cached if e["type"] == "analyse")["analyse"]["cached"])
+
+    def test_streams_rows_under_the_asgi_views(self):
+        fed = []
+
+        async def fake_astream(model_name, payload, **kwargs):
+            for chunk in self.chunks:
+                fed.append(chunk)
+                yield chunk
+
+        with override_settings(AI_ASGI_VIEWS=True):
+            importlib.reload(ai_urls)
+        self.addCleanup(importlib.reload, ai_urls)
+        asgi_urlconf = ModuleType("asgi_urls")
+        asgi_urlconf.urlpatterns = [path("api/v1/ai/", include(ai_urls.urlpatterns))]
+
+        with override_settings(ROOT_URLCONF=asgi_urlconf), \
+                patch("apps.ai_architecture.async_views.gemini_client.astream_generate_content",
+                      side_effect=fake_astream), \
+                patch("apps.ai_architecture.views.gemini_client.stream_generate_content") as sync_stream:
+            self.assertIs(resolve(reverse("ai-chat-stream")).func.view_class, ai_urls.AsyncChatStreamView)
+            response = self.client.post(reverse("ai-chat-stream"), {
+                "messages": [{"role": "user", "content": "/analyse"}],
+                "project_id": self.project.id, "image": self.IMAGE, "stream_analyse": True,
+            }, format="json")
+            self.assertTrue(response.is_async)
+
+            async def read():
+                # (frame, upstream chunks consumed when it was sent)
+                return [(part, len(fed)) async for part in response.streaming_content]
+            parts = async_to_sync(read)()
+        sync_stream.assert_not_called()
+
+        first_row = next(fed_at for part, fed_at in parts if b'"analyse_row"' in part)
+        self.assertLess(first_row, len(self.chunks))
+        events = [json.loads(f[6:]) for part, _ in parts for f in part.decode().split("\n\n")
+                  if f.startswith("data: {")]
+        self.assertEqual(len([e for e in events if e["type"] == "analyse_row"]), 4)
+        self.assertEqual(next(e for e in events if e["type"] == "analyse")["analyse"]["summary"], "Two rooms")
+        self.assertEqual(events[-1]["type"], "meta")
+        self.assertTrue(ChatMessage.objects.filter(role="assistant", content="Two rooms").exists())
+
+    def test_upstream_failure_reports_error_and_empty_result(self):
+        with patch("apps.ai_architecture.views.gemini_client.stream_generate_content",
+                   side_effect=RuntimeError("Gemini API error (HTTP 500)")):
+            events = self._stream()
+        self.assertEqual(events[0], {"type": "error", "content": "Gemini API error (HTTP 500)"})
+        self.assertTrue(events[1]["analyse"]["summary"].startswith("Analysis failed"))
+        self.assertEqual(events[1]["analyse"]["building_items"], [])
+
+
+# ── Sectioned /analyse ───────────────────────────────────────────────
+
+@override_settings(AI_ANALYSE_FAN_OUT_WORKERS=6)
+class AnalyseFanOutTest(TestCase):
+    """Fan-out /analyse generates sheet groups concurrently and merges them."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("fanout", password="pw")
+        self.project = Project.objects.create(owner=self.user, title="Fan House", location="Harare", budget=1)
+
+    def _analyse(self, fake):
+        with patch("apps.ai_architecture.views._call_gemini_analyse", side_effect=fake) as call:
+            result = ChatCompletionView()._handle_analyse(
+                "/analyse", [AnalyseCacheTest.IMAGE], self.project, file_name="plan.png", user=self.user,
+                fan_out=True,
+            )
+        self.assertEqual(call.call_count, len(_ANALYSE_SHEET_GROUPS))
+        return result, call
+
+    def test_groups_run_concurrently_and_merge(self):
+        barrier = threading.Barrier(len(_ANALYSE_SHEET_GROUPS), timeout=5)
+        answers = {
+            "building_items": [{"description": "Slab", "unit": "m3", "quantity": 2, "rate": 3}],
+            "schedule_materials": [{"section": "finishes", "material_description": "Paint", "qty": "4 tins"}],
+            "professional_fees": [{"discipline": "QS", "estimated_fee": 100}],
+            "summary": "Merged",
+            "recommendations": ["Check soil"],
+        }
+
+        def fake(**kwargs):
+            barrier.wait()  # all groups are in flight at once
+            keys = [k for k in answers if f" {k}," in kwargs["suffix"] or f" {k}." in kwargs["suffix"]]
+            return json.dumps({k: answers[k] for k in keys})
+
+        result, call = self._analyse(fake)
+        prompts = {c.kwargs["system"] + c.kwargs["user_content"] for c in call.call_args_list}
+        self.assertEqual(len(prompts), 1)  # shared prefix; only the suffix differs
+        self.assertEqual(result["summary"], "Merged")
+        self.assertEqual(result["building_items"][0]["description"], "Slab")
+        self.assertEqual(result["schedule_materials"][0]["section"], "FINISHES")
+        self.assertEqual(result["recommendations"], ["Check soil"])
+        self.assertEqual(result["sheets"]["building_items"], {"status": "ok"})
+        self.assertEqual(result["sheets"]["labour_costs"], {"status": "missing"})
+        self.assertEqual(BudgetAnalysisHistory.objects.filter(project=self.project).count(), 1)
+
+    def test_failed_and_truncated_groups_are_reported(self):
+        def fake(**kwargs):
+            if "building_items" in kwargs["suffix"]:
+                raise RuntimeError("Gemini API error (HTTP 503)")
+            if "schedule_materials" in kwargs["suffix"]:
+                return '{"schedule_materials": [{"material_description": "Cement"}, {"material_desc'
+            return json.dumps({"summary": "Partial"}) if "summary" in kwargs["suffix"] else "{}"
+
+        result, _ = self._analyse(fake)
+        self.assertEqual(result["sheets"]["building_items"], {"status": "failed", "error": "Gemini API error (HTTP 503)"})
+        self.assertEqual(result["sheets"]["schedule_materials"], {"status": "partial"})
+        self.assertEqual([m["material_description"] for m in result["schedule_materials"]], ["Cement"])
+        self.assertTrue(result["summary"].startswith("Partial\n\nSome sheets could not be generated (building_items)"))
+
+    def test_truncated_groups_are_not_cached(self):
+        def fake(**kwargs):
+            if "schedule_materials" in kwargs["suffix"]:
+                return '{"schedule_materials": [{"material_description": "Cement"}, {"material_desc'
+            return "{}"
+
+        self._analyse(fake)
+        result, _ = self._analyse(fake)
+        self.assertNotIn("cached", result)
+        self.assertEqual(result["sheets"]["schedule_materials"], {"status": "partial"})
+
+    def test_every_group_failing_is_an_analysis_failure(self):
+        result, _ = self._analyse(RuntimeError("offline"))
+        self.assertEqual(result["summary"], "Analysis failed: offline")
+        self.assertNotIn("sheets", result)
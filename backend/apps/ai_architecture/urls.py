@@ -1,26 +1,42 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
     ChatCompletionView, ChatStreamView,
     ChatSessionListView, ChatSessionDetailView,
     BOQTemplateView, MaterialPriceView, SiteIntelView, DrawAgentView,
-    DraftCopilotView,
+    DraftCopilotView, AIJobDetailView, AIJobEventsView,
 )
 
+# Under ASGI the long-running AI endpoints are served by async views that
+# await Gemini instead of holding a worker for the whole call.
+if getattr(settings, 'AI_ASGI_VIEWS', False):
+    from .async_views import (
+        AsyncChatCompletionView, AsyncChatStreamView,
+        AsyncDrawAgentView, AsyncDraftCopilotView,
+    )
+    chat_view, chat_stream_view = AsyncChatCompletionView, AsyncChatStreamView
+    draw_agent_view, draft_copilot_view = AsyncDrawAgentView, AsyncDraftCopilotView
+else:
+    chat_view, chat_stream_view = ChatCompletionView, ChatStreamView
+    draw_agent_view, draft_copilot_view = DrawAgentView, DraftCopilotView
+
 router = DefaultRouter()
 
 urlpatterns = [
-    path('chat/', ChatCompletionView.as_view(), name='ai-chat'),
-    path('chat/stream/', ChatStreamView.as_view(), name='ai-chat-stream'),
+    path('chat/', chat_view.as_view(), name='ai-chat'),
+    path('chat/stream/', chat_stream_view.as_view(), name='ai-chat-stream'),
     path('chat/sessions/', ChatSessionListView.as_view(), name='ai-chat-sessions'),
     path('chat/sessions/<int:pk>/', ChatSessionDetailView.as_view(), name='ai-chat-session-detail'),
+    path('jobs/<uuid:job_id>/', AIJobDetailView.as_view(), name='ai-job-detail'),
+    path('jobs/<uuid:job_id>/events/', AIJobEventsView.as_view(), name='ai-job-events'),
     path('boq-templates/', BOQTemplateView.as_view(), name='ai-boq-templates'),
     path('boq-templates/<int:pk>/', BOQTemplateView.as_view(), name='ai-boq-templates-detail'),
     path('material-prices/', MaterialPriceView.as_view(), name='ai-material-prices'),
     path('material-prices/<int:pk>/', MaterialPriceView.as_view(), name='ai-material-prices-detail'),
     path('site-intel/', SiteIntelView.as_view(), name='ai-site-intel-create'),
     path('site-intel/<int:project_id>/', SiteIntelView.as_view(), name='ai-site-intel-latest'),
-    path('draw-agent/', DrawAgentView.as_view(), name='ai-draw-agent'),
-    path('draft-copilot/', DraftCopilotView.as_view(), name='ai-draft-copilot'),
+    path('draw-agent/', draw_agent_view.as_view(), name='ai-draw-agent'),
+    path('draft-copilot/', draft_copilot_view.as_view(), name='ai-draft-copilot'),
     path('', include(router.urls)),
 ]
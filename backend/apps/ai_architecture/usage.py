@@ -0,0 +1,243 @@
+"""
+Gemini token accounting.
+
+Every Gemini response carries ``usageMetadata`` (prompt / candidates / total
+token counts). ``gemini_client`` hands each one to :func:`record`, which
+turns it into an unsaved :class:`TokenUsage` row attributed to the user,
+session and endpoint bound for the current request (see :func:`bind`).
+
+Rows are buffered in memory and written with a single ``bulk_create`` by a
+background flusher thread every ``AI_USAGE_FLUSH_INTERVAL`` seconds, or as
+soon as ``AI_USAGE_FLUSH_SIZE`` rows are pending, so accounting adds no
+insert to the request path. The buffer is also flushed at interpreter exit.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+# Call-site labels (``gemini_client.post(label=...)``) whose traffic is
+# accounted to a fixed endpoint regardless of the view that triggered it.
+LABEL_ENDPOINTS = {
+    'analyse': 'analyse',
+    'analyse_stream': 'analyse',
+    'image': 'draw',
+    'scan': 'scan',
+}
+
+_binding: contextvars.ContextVar = contextvars.ContextVar('ai_usage_binding', default=None)
+
+
+# ── Attribution ──────────────────────────────────────────────────────
+
+def bind(user, endpoint: str, session=None):
+    """
+    Attribute Gemini usage in the current context to ``user`` / ``endpoint``.
+
+    Returns a token for :func:`unbind`; worker threads are reused across
+    requests, so every ``bind`` must be undone once the work is finished.
+    """
+    user_id = getattr(user, 'pk', None) if getattr(user, 'is_authenticated', False) else None
+    return _binding.set({
+        'user_id': user_id,
+        'session_id': getattr(session, 'pk', session),
+        'endpoint': endpoint,
+    })
+
+
+def unbind(token):
+    """Undo the :func:`bind` that returned ``token``."""
+    try:
+        _binding.reset(token)
+    except ValueError:
+        # Bound in a copied context (e.g. an earlier sync_to_async call).
+        _binding.set(None)
+
+
+def bind_session(session):
+    """Attach the chat session once the view has resolved it."""
+    current = _binding.get()
+    if current is not None:
+        _binding.set({**current, 'session_id': getattr(session, 'pk', session)})
+
+
+def current_binding():
+    return _binding.get()
+
+
+def restore_binding(binding):
+    """
+    Re-enter a binding captured with :func:`current_binding` (e.g. in a stream
+    generator). Returns a token for :func:`unbind`.
+    """
+    return _binding.set(binding)
+
+
+class UsageBindingMixin:
+    """APIView mixin binding token usage to the authenticated user."""
+    usage_endpoint = 'chat'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._usage_token = bind(request.user, self.usage_endpoint)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        try:
+            return super().finalize_response(request, response, *args, **kwargs)
+        finally:
+            token, self._usage_token = getattr(self, '_usage_token', None), None
+            if token is not None:
+                unbind(token)
+
+
+# ── usageMetadata parsing ────────────────────────────────────────────
+
+def parse_usage(usage_metadata: dict | None):
+    """Return ``(input_tokens, output_tokens, total_tokens)`` or ``None``."""
+    if not usage_metadata:
+        return None
+    prompt = int(usage_metadata.get('promptTokenCount') or 0)
+    # Thinking tokens are billed as output.
+    output = int(usage_metadata.get('candidatesTokenCount') or 0) \
+        + int(usage_metadata.get('thoughtsTokenCount') or 0)
+    total = int(usage_metadata.get('totalTokenCount') or 0) or prompt + output
+    if not (prompt or output or total):
+        return None
+    return prompt, output, total
+
+
+def extract_usage(body: bytes):
+    """
+    Pull ``usageMetadata`` out of a raw generateContent body without decoding
+    the whole document (image responses carry megabytes of base64).
+    """
+    key = b'"usageMetadata"'
+    idx = body.rfind(key)
+    if idx < 0:
+        return None
+    start = body.find(b'{', idx + len(key))
+    if start < 0:
+        return None
+    try:
+        value, _end = json.JSONDecoder().raw_decode(body[start:].decode('utf-8', 'replace'))
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+# ── Buffered writer ──────────────────────────────────────────────────
+
+class _UsageBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows: list = []
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, row: TokenUsage):
+        flush_size = getattr(settings, 'AI_USAGE_FLUSH_SIZE', 50)
+        with self._lock:
+            self._rows.append(row)
+            pending = len(self._rows)
+        if not getattr(settings, 'AI_USAGE_BACKGROUND_FLUSH', True):
+            if pending >= flush_size:
+                self.flush()
+            return
+        self._ensure_thread()
+        if pending >= flush_size:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self) -> int:
+        with self._lock:
+            rows, self._rows = self._rows, []
+        if not rows:
+            return 0
+        try:
+            TokenUsage.objects.bulk_create(rows, batch_size=500)
+        except Exception as e:
+            # One bad row (e.g. a session deleted meanwhile) must not drop the batch.
+            logger.warning("TokenUsage bulk insert failed (%s); retrying row by row", e)
+            saved = 0
+            for row in rows:
+                try:
+                    TokenUsage.objects.bulk_create([row])
+                    saved += 1
+                except Exception:
+                    logger.exception("Dropping TokenUsage row for user %s", row.user_id)
+            return saved
+        return len(rows)
+
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == pid:
+                return
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name='token-usage-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        interval = getattr(settings, 'AI_USAGE_FLUSH_INTERVAL', 10.0)
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                close_old_connections()
+                self.flush()
+            except Exception:
+                logger.exception("TokenUsage flush failed")
+
+
+_buffer = _UsageBuffer()
+
+
+def record(model_name: str, usage_metadata: dict | None, label: str = ''):
+    """Queue a TokenUsage row for one Gemini response (no-op if unattributed)."""
+    counts = parse_usage(usage_metadata)
+    if counts is None:
+        return
+    binding = _binding.get()
+    if not binding or not binding.get('user_id'):
+        logger.debug("Unattributed Gemini usage (%s, %s): %s", label, model_name, counts)
+        return
+    input_tokens, output_tokens, total_tokens = counts
+    _buffer.add(TokenUsage(
+        user_id=binding['user_id'],
+        session_id=binding.get('session_id'),
+        endpoint=LABEL_ENDPOINTS.get(label, binding.get('endpoint') or 'chat'),
+        model_name=model_name[:80],
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        # bulk_create bypasses TokenUsage.save(), so set the total explicitly.
+        total_tokens=total_tokens,
+    ))
+
+
+def record_response_body(model_name: str, body: bytes, label: str = ''):
+    if _binding.get() is None or not isinstance(body, (bytes, bytearray)):
+        return
+    record(model_name, extract_usage(body), label)
+
+
+def flush() -> int:
+    """Write all buffered rows now; returns how many were written."""
+    return _buffer.flush()
+
+
+atexit.register(flush)
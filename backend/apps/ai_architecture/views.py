@@ -5,11 +5,18 @@ import io
 import json
 import uuid
 import base64
+import contextvars
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
 import requests as http_requests
 from django.conf import settings
-from django.db.models import Avg, Q
+from django.db import connections
+from django.db.models import Avg, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
 from django.http import StreamingHttpResponse
+from django.urls import reverse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -18,12 +25,26 @@ from rest_framework.throttling import ScopedRateThrottle
 from pydantic import BaseModel, Field
 from typing import Any, Dict, List, Optional
 from .models import (
-    AIInstruction, ChatSession, ChatMessage,
+    ChatSession, ChatMessage,
     DrawingStylePreset, ImageFeedback, MaterialPrice, TokenUsage,
-    BOQTemplate, SiteIntel,
+    BOQTemplate, SiteIntel, AIJob,
 )
 from apps.builder_dashboard.models import Project, BudgetAnalysisHistory
-from .mcp_manager import sync_get_mcp_tools, sync_execute_mcp_tool
+from .mcp_manager import sync_get_mcp_tools, sync_execute_mcp_tool, submit_mcp_tool
+from . import gemini_client
+from .project_context import get_project_context_snapshot
+from . import analyse_cache
+from . import config
+from . import jobs
+from . import json_stream
+from . import usage
+from . import vision
+from . import pdf_pages
+from . import history
+from . import knowledge
+from . import pagination
+from . import preset_matcher
+from .usage import UsageBindingMixin
 
 logger = logging.getLogger(__name__)
 
@@ -393,55 +414,72 @@ def _parse_site_intel_response(raw_text: str) -> dict:
 
 def _search_floor_plans(query: str, limit: int = 6) -> list:
     """
-    Search FloorPlanDataset by title, description, and category name.
+    Search FloorPlanDataset by title, description, and category name, most
+    relevant first (see apps.admin_dashboard.search).
     Returns a list of dicts with plan details and image URLs.
     """
     from apps.admin_dashboard.models import FloorPlanDataset
+    from apps.admin_dashboard.search import search_plans
 
     if not query:
         # No search terms — return the latest plans
         plans = FloorPlanDataset.objects.select_related('category').order_by('-created_at')[:limit]
     else:
-        terms = query.split()
-        q_filter = Q()
-        for term in terms:
-            q_filter |= (
-                Q(title__icontains=term) |
-                Q(description__icontains=term) |
-                Q(category__name__icontains=term)
-            )
-        plans = FloorPlanDataset.objects.select_related('category').filter(q_filter).distinct().order_by('-created_at')[:limit]
+        plans = search_plans(query, limit=limit)
+
+    return [_floor_plan_dict(plan) for plan in plans]
+
+
+def _floor_plan_dict(plan) -> dict:
+    image_url = None
+    if plan.image:
+        try:
+            image_url = plan.image.url
+        except Exception:
+            pass
+    result = {
+        'id': plan.id,
+        'title': plan.title,
+        'description': plan.description or '',
+        'category_name': plan.category.name if plan.category else 'Uncategorized',
+        'image_url': image_url,
+        'created_at': plan.created_at.isoformat() if plan.created_at else None,
+    }
+    if hasattr(plan, 'similarity'):
+        result['similarity'] = plan.similarity
+    return result
 
-    results = []
-    for plan in plans:
-        image_url = None
-        if plan.image:
-            try:
-                image_url = plan.image.url
-            except Exception:
-                pass
-        results.append({
-            'id': plan.id,
-            'title': plan.title,
-            'description': plan.description or '',
-            'category_name': plan.category.name if plan.category else 'Uncategorized',
-            'image_url': image_url,
-            'created_at': plan.created_at.isoformat() if plan.created_at else None,
-        })
-    return results
 
+def _find_similar_floor_plans(img_data: str, limit: int | None = None) -> list:
+    """
+    Existing floor plans that look like an uploaded sketch (data URL or bare
+    base64), via the local visual index — no Gemini call involved.
+    """
+    from apps.admin_dashboard.visual_index import similar_plans
 
-def _match_style_preset(text: str):
+    if not img_data:
+        return []
+    b64 = img_data.split(',', 1)[1] if img_data.startswith('data:') else img_data
+    try:
+        raw = base64.b64decode(b64)
+        plans = similar_plans(
+            raw,
+            k=limit or getattr(settings, 'AI_SCAN_SIMILAR_LIMIT', 4),
+            min_score=getattr(settings, 'AI_SCAN_SIMILAR_MIN_SCORE', 0.5),
+        )
+    except Exception as e:
+        logger.warning("Visual floor plan lookup failed: %s", e)
+        return []
+    return [_floor_plan_dict(plan) for plan in plans]
+
+
+def _match_style_preset(*texts):
     """
-    Find the best-matching active DrawingStylePreset for the user's query.
+    Find the best-matching active DrawingStylePreset for the user's query
+    (falling back to any further texts given, in order).
     Returns the preset or None.
     """
-    lower = text.lower()
-    presets = DrawingStylePreset.objects.filter(is_active=True).order_by('-priority')
-    for preset in presets:
-        if any(kw in lower for kw in preset.get_keywords_list()):
-            return preset
-    return None
+    return preset_matcher.match_preset(*texts)
 
 
 def _get_top_rated_prompts(preset, limit=3):
@@ -476,7 +514,6 @@ def _generate_image_from_gemini(prompt: str, negative_prompt: str = "", guidance
         )
 
     model_name = model_override or settings.GEMINI_IMAGE_MODEL
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
 
     enhanced_prompt = prompt
     if negative_prompt:
@@ -496,7 +533,7 @@ def _generate_image_from_gemini(prompt: str, negative_prompt: str = "", guidance
 
     try:
         logger.info("[Gemini Image] Calling %s with prompt: %.120s…", model_name, enhanced_prompt)
-        response = http_requests.post(url, json=payload, timeout=90.0)
+        response = gemini_client.post(model_name, payload, timeout=90.0, label="image")
 
         if response.status_code != 200:
             body = response.text[:500]
@@ -576,20 +613,11 @@ def _get_gemini_chat_model() -> str:
     return (getattr(settings, "GEMINI_CHAT_MODEL", "") or "gemini-2.5-flash").strip()
 
 
-def _call_gemini(messages: list, system: str = "", max_tokens: int = 8192,
-                 temperature: float = 0.7, images: list | None = None,
-                 timeout: float = 120.0) -> str:
-    """Call Gemini for chat/text completion. Returns assistant text."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or len(api_key) < 10:
-        raise RuntimeError("GEMINI_API_KEY is not configured.")
-
-    model_name = _get_gemini_chat_model()
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}"
-        f":generateContent?key={api_key}"
-    )
-
+def _build_gemini_contents(messages: list, system: str = "", images: list | None = None) -> list:
+    """
+    Convert chat messages into Gemini ``contents``. The system prompt is
+    prepended to the first turn and images are attached to the last user turn.
+    """
     contents = []
     full_system = system.strip()
 
@@ -614,27 +642,139 @@ def _call_gemini(messages: list, system: str = "", max_tokens: int = 8192,
 
         contents.append({"role": role, "parts": parts})
 
-    payload = {
-        "contents": contents,
+    return contents
+
+
+def _build_gemini_tool_config() -> dict | None:
+    """Function declarations for the local tools plus any discovered MCP tools."""
+    mcp_tools = sync_get_mcp_tools()
+    all_tool_defs = _TOOL_DEFINITIONS + mcp_tools
+
+    gemini_tools = []
+    for td in all_tool_defs:
+        fn_decl = {
+            "name": td["name"],
+            "description": td.get("description", ""),
+        }
+        schema = td.get("input_schema")
+        if schema:
+            fn_decl["parameters"] = _sanitize_schema_for_gemini(schema)
+        gemini_tools.append(fn_decl)
+
+    return {"functionDeclarations": gemini_tools} if gemini_tools else None
+
+
+_tool_executor: ThreadPoolExecutor | None = None
+_tool_executor_lock = threading.Lock()
+
+
+def _get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "AI_TOOL_MAX_WORKERS", 8),
+                    thread_name_prefix="ai-tool",
+                )
+    return _tool_executor
+
+
+def _run_local_tool(tool_fn, fn_args: dict):
+    """Run a local tool in a pool thread and release that thread's DB connection."""
+    try:
+        return tool_fn(**fn_args)
+    except Exception as e:
+        return {"error": str(e)}
+    finally:
+        connections.close_all()
+
+
+def _function_response_part(fn_name: str, result) -> dict:
+    return {
+        "functionResponse": {
+            "name": fn_name,
+            "response": result if isinstance(result, dict) else {"result": str(result)},
+        }
+    }
+
+
+def _execute_function_calls(fn_calls: list) -> list:
+    """
+    Run the ``functionCall`` parts of one model turn; return ``functionResponse``
+    parts in the same order.
+
+    A single call runs inline. Several calls are dispatched together: local
+    tools on a thread pool, MCP tools on the shared MCP event loop. Each call
+    gets its own ``AI_TOOL_CALL_TIMEOUT``, so a round costs the slowest call
+    rather than the sum of all of them.
+    """
+    if len(fn_calls) == 1:
+        fc = fn_calls[0]["functionCall"]
+        fn_name, fn_args = fc["name"], fc.get("args", {})
+        tool_fn = _TOOL_MAP.get(fn_name)
+        if tool_fn:
+            try:
+                result = tool_fn(**fn_args)
+            except Exception as e:
+                result = {"error": str(e)}
+        else:
+            result = sync_execute_mcp_tool(fn_name, fn_args)
+        return [_function_response_part(fn_name, result)]
+
+    timeout = getattr(settings, "AI_TOOL_CALL_TIMEOUT", 30)
+    started = time.monotonic()
+    pending = []
+    for fc_part in fn_calls:
+        fc = fc_part["functionCall"]
+        fn_name, fn_args = fc["name"], fc.get("args", {})
+        tool_fn = _TOOL_MAP.get(fn_name)
+        try:
+            if tool_fn:
+                future = _get_tool_executor().submit(_run_local_tool, tool_fn, fn_args)
+            else:
+                future = submit_mcp_tool(fn_name, fn_args)
+        except Exception as e:
+            pending.append((fn_name, None, {"error": str(e)}))
+            continue
+        pending.append((fn_name, future, None))
+
+    fn_response_parts = []
+    for fn_name, future, result in pending:
+        if future is not None:
+            remaining = max(0.0, timeout - (time.monotonic() - started))
+            try:
+                result = future.result(timeout=remaining)
+            except FutureTimeoutError:
+                future.cancel()
+                logger.warning("Tool %s timed out after %ss", fn_name, timeout)
+                result = {"error": f"Tool {fn_name} timed out after {timeout} seconds."}
+            except Exception as e:
+                result = {"error": str(e)}
+        fn_response_parts.append(_function_response_part(fn_name, result))
+
+    logger.info("[Tools] %d parallel calls finished in %.0f ms",
+                len(fn_calls), (time.monotonic() - started) * 1000)
+    return fn_response_parts
+
+
+def _chat_payload(messages: list, system: str = "", max_tokens: int = 8192,
+                  temperature: float = 0.7, images: list | None = None) -> dict:
+    """Request body shared by the sync and async plain-chat calls."""
+    return {
+        "contents": _build_gemini_contents(messages, system, images),
         "generationConfig": {
             "temperature": temperature,
             "maxOutputTokens": max_tokens,
         },
     }
 
-    logger.info("[Gemini Chat] Calling %s", model_name)
-    try:
-        resp = http_requests.post(url, json=payload, timeout=timeout)
-    except http_requests.exceptions.Timeout:
-        logger.error("Gemini Chat API timed out after %s seconds", timeout)
-        raise RuntimeError("The AI request timed out. Please try a simpler request or try again later.")
-    except http_requests.exceptions.RequestException as e:
-        logger.error("Gemini Chat API connection error: %s", e)
-        raise RuntimeError(f"Could not connect to AI service: {e}")
 
+def _gemini_response_text(resp, label: str = "Chat") -> str:
+    """Return the text of a generateContent response (requests or httpx)."""
     if resp.status_code != 200:
         body = resp.text[:600]
-        logger.error("Gemini Chat HTTP %s: %s", resp.status_code, body)
+        logger.error("Gemini %s HTTP %s: %s", label, resp.status_code, body)
         raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {body}")
 
     data = resp.json()
@@ -647,18 +787,31 @@ def _call_gemini(messages: list, system: str = "", max_tokens: int = 8192,
     return "\n".join(text_parts)
 
 
-def _repair_truncated_json(text: str) -> dict:
-    """Attempt to salvage truncated JSON by progressively closing brackets/braces.
-    """
-    for trim in range(min(200, len(text))):
-        candidate = text[:len(text) - trim] if trim else text
-        # Try closing with various bracket combos
-        for suffix in ["", "]}", "]}]}", '"]}'  , '"]}]}', '"}]}', "]", "}", '"}'  ]:
-            try:
-                return json.loads(candidate + suffix)
-            except json.JSONDecodeError:
-                continue
-    raise ValueError("Could not repair truncated JSON from Gemini response.")
+def _require_gemini_key():
+    api_key = settings.GEMINI_API_KEY
+    if not api_key or len(api_key) < 10:
+        raise RuntimeError("GEMINI_API_KEY is not configured.")
+
+
+def _call_gemini(messages: list, system: str = "", max_tokens: int = 8192,
+                 temperature: float = 0.7, images: list | None = None,
+                 timeout: float = 120.0) -> str:
+    """Call Gemini for chat/text completion. Returns assistant text."""
+    _require_gemini_key()
+    model_name = _get_gemini_chat_model()
+    payload = _chat_payload(messages, system, max_tokens, temperature, images)
+
+    logger.info("[Gemini Chat] Calling %s", model_name)
+    try:
+        resp = gemini_client.post(model_name, payload, timeout=timeout, label="chat")
+    except http_requests.exceptions.Timeout:
+        logger.error("Gemini Chat API timed out after %s seconds", timeout)
+        raise RuntimeError("The AI request timed out. Please try a simpler request or try again later.")
+    except http_requests.exceptions.RequestException as e:
+        logger.error("Gemini Chat API connection error: %s", e)
+        raise RuntimeError(f"Could not connect to AI service: {e}")
+
+    return _gemini_response_text(resp, "Chat")
 
 
 _GEMINI_UNSUPPORTED_SCHEMA_KEYS = {
@@ -687,72 +840,48 @@ def _sanitize_schema_for_gemini(schema: dict) -> dict:
     return cleaned
 
 
-def _call_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
-                            temperature: float = 0.7, images: list | None = None,
-                            timeout: float = 120.0) -> str:
-    """Call Gemini with function-calling. Loops until a final text response."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or len(api_key) < 10:
-        raise RuntimeError("GEMINI_API_KEY is not configured.")
-
-    model_name = _get_gemini_chat_model()
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}"
-        f":generateContent?key={api_key}"
-    )
-
-    mcp_tools = sync_get_mcp_tools()
-    all_tool_defs = _TOOL_DEFINITIONS + mcp_tools
-
-    gemini_tools = []
-    for td in all_tool_defs:
-        fn_decl = {
-            "name": td["name"],
-            "description": td.get("description", ""),
-        }
-        schema = td.get("input_schema")
-        if schema:
-            fn_decl["parameters"] = _sanitize_schema_for_gemini(schema)
-        gemini_tools.append(fn_decl)
+def _tools_payload(contents: list, tool_config: dict | None, max_tokens: int,
+                   temperature: float) -> dict:
+    payload: dict = {
+        "contents": contents,
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_tokens,
+        },
+    }
+    if tool_config:
+        payload["tools"] = [tool_config]
+    return payload
 
-    tool_config = {"functionDeclarations": gemini_tools} if gemini_tools else None
 
-    contents = []
-    full_system = system.strip()
+def _tool_round_parts(resp) -> list:
+    """Parts of the first candidate of one tool round (requests or httpx response)."""
+    if resp.status_code != 200:
+        body = resp.text[:600]
+        raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {body}")
 
-    for i, m in enumerate(messages):
-        role = "user" if m.get("role", "user") == "user" else "model"
-        parts: list[dict] = []
-        if i == 0 and full_system:
-            parts.append({"text": f"{full_system}\n\n{m.get('content', '')}"})
-        else:
-            parts.append({"text": m.get("content", "")})
+    data = resp.json()
+    candidates = data.get("candidates", [])
+    if not candidates:
+        raise RuntimeError("Gemini returned no candidates.")
+    return candidates[0].get("content", {}).get("parts", [])
 
-        if i == len(messages) - 1 and role == "user" and images:
-            for img_data in images:
-                if img_data.startswith("data:"):
-                    media_type = img_data.split(";")[0].split(":")[1]
-                    b64 = img_data.split(",", 1)[1]
-                else:
-                    media_type = "image/png"
-                    b64 = img_data
-                parts.append({"inlineData": {"mimeType": media_type, "data": b64}})
 
-        contents.append({"role": role, "parts": parts})
+def _call_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
+                            temperature: float = 0.7, images: list | None = None,
+                            timeout: float = 120.0) -> str:
+    """Call Gemini with function-calling. Loops until a final text response."""
+    _require_gemini_key()
+    model_name = _get_gemini_chat_model()
+    tool_config = _build_gemini_tool_config()
+    contents = _build_gemini_contents(messages, system, images)
 
+    parts: list = []
     for _round in range(5):
-        payload: dict = {
-            "contents": contents,
-            "generationConfig": {
-                "temperature": temperature,
-                "maxOutputTokens": max_tokens,
-            },
-        }
-        if tool_config:
-            payload["tools"] = [tool_config]
+        payload = _tools_payload(contents, tool_config, max_tokens, temperature)
 
         try:
-            resp = http_requests.post(url, json=payload, timeout=timeout)
+            resp = gemini_client.post(model_name, payload, timeout=timeout, label="chat_tools")
         except http_requests.exceptions.Timeout:
             logger.error("Gemini Chat tools API timed out after %s seconds", timeout)
             raise RuntimeError("The AI request timed out. Please try a simpler request or try again later.")
@@ -760,16 +889,7 @@ def _call_gemini_with_tools(messages: list, system: str = "", max_tokens: int =
             logger.error("Gemini Chat tools API connection error: %s", e)
             raise RuntimeError(f"Could not connect to AI service: {e}")
 
-        if resp.status_code != 200:
-            body = resp.text[:600]
-            raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {body}")
-
-        data = resp.json()
-        candidates = data.get("candidates", [])
-        if not candidates:
-            raise RuntimeError("Gemini returned no candidates.")
-
-        parts = candidates[0].get("content", {}).get("parts", [])
+        parts = _tool_round_parts(resp)
 
         fn_calls = [p for p in parts if "functionCall" in p]
         if not fn_calls:
@@ -777,28 +897,7 @@ def _call_gemini_with_tools(messages: list, system: str = "", max_tokens: int =
             return "\n".join(text_parts)
 
         contents.append({"role": "model", "parts": parts})
-        fn_response_parts = []
-        for fc_part in fn_calls:
-            fc = fc_part["functionCall"]
-            fn_name = fc["name"]
-            fn_args = fc.get("args", {})
-
-            tool_fn = _TOOL_MAP.get(fn_name)
-            if tool_fn:
-                try:
-                    result = tool_fn(**fn_args)
-                except Exception as e:
-                    result = {"error": str(e)}
-            else:
-                result = sync_execute_mcp_tool(fn_name, fn_args)
-
-            fn_response_parts.append({
-                "functionResponse": {
-                    "name": fn_name,
-                    "response": result if isinstance(result, dict) else {"result": str(result)},
-                }
-            })
-
+        fn_response_parts = _execute_function_calls(fn_calls)
         contents.append({"role": "user", "parts": fn_response_parts})
 
     text_parts = [p.get("text", "") for p in parts if "text" in p]
@@ -810,20 +909,8 @@ def _get_analyse_model_name() -> str:
     return (getattr(settings, "GEMINI_ANALYSE_MODEL", "") or "gemini-2.5-pro").strip()
 
 
-def _call_gemini_analyse(system: str, user_content: str, images: list | None = None,
-                         max_tokens: int = 16384, temperature: float = 0.3,
-                         timeout: float = 180.0) -> str:
-    """Call Gemini vision for /analyse. Returns raw text."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or len(api_key) < 10:
-        raise RuntimeError("GEMINI_API_KEY is not configured.")
-
-    model_name = _get_analyse_model_name()
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}"
-        f":generateContent?key={api_key}"
-    )
-
+def _analyse_payload(system: str, user_content: str, images: list | None,
+                     max_tokens: int, temperature: float, suffix: str = "") -> dict:
     parts: list[dict] = [{"text": f"{system}\n\n{user_content}"}]
 
     if images:
@@ -835,8 +922,11 @@ def _call_gemini_analyse(system: str, user_content: str, images: list | None = N
                 media_type = "image/png"
                 b64 = img_data
             parts.append({"inlineData": {"mimeType": media_type, "data": b64}})
+    if suffix:
+        # After the drawings, so requests differing only here share a prefix.
+        parts.append({"text": suffix})
 
-    payload = {
+    return {
         "contents": [{"parts": parts}],
         "generationConfig": {
             "temperature": temperature,
@@ -845,9 +935,21 @@ def _call_gemini_analyse(system: str, user_content: str, images: list | None = N
         },
     }
 
+
+def _call_gemini_analyse(system: str, user_content: str, images: list | None = None,
+                         max_tokens: int = 16384, temperature: float = 0.3,
+                         timeout: float = 180.0, suffix: str = "") -> str:
+    """Call Gemini vision for /analyse. Returns raw text."""
+    api_key = settings.GEMINI_API_KEY
+    if not api_key or len(api_key) < 10:
+        raise RuntimeError("GEMINI_API_KEY is not configured.")
+
+    model_name = _get_analyse_model_name()
+    payload = _analyse_payload(system, user_content, images, max_tokens, temperature, suffix)
+
     logger.info("[Analyse] Calling Gemini %s (max_tokens=%d)", model_name, max_tokens)
     try:
-        resp = http_requests.post(url, json=payload, timeout=timeout)
+        resp = gemini_client.post(model_name, payload, timeout=timeout, label="analyse")
     except http_requests.exceptions.Timeout:
         logger.error("Gemini Analyse API timed out after %s seconds", timeout)
         raise RuntimeError("The AI analysis timed out. The file might be too complex or large.")
@@ -870,6 +972,32 @@ def _call_gemini_analyse(system: str, user_content: str, images: list | None = N
     return "\n".join(text_parts)
 
 
+def _stream_gemini_analyse(system: str, user_content: str, images: list | None = None,
+                           max_tokens: int = 16384, temperature: float = 0.3,
+                           timeout: float = 180.0):
+    """Stream Gemini vision for /analyse, yielding the JSON text as it is generated."""
+    api_key = settings.GEMINI_API_KEY
+    if not api_key or len(api_key) < 10:
+        raise RuntimeError("GEMINI_API_KEY is not configured.")
+
+    model_name = _get_analyse_model_name()
+    payload = _analyse_payload(system, user_content, images, max_tokens, temperature)
+
+    logger.info("[Analyse] Streaming Gemini %s (max_tokens=%d)", model_name, max_tokens)
+    turn = _StreamRound()
+    try:
+        for chunk in gemini_client.stream_generate_content(
+            model_name, payload, timeout=timeout, label="analyse_stream",
+        ):
+            yield from turn.feed(chunk)
+    except http_requests.exceptions.Timeout:
+        logger.error("Gemini Analyse stream timed out after %s seconds", timeout)
+        raise RuntimeError("The AI analysis timed out. The file might be too complex or large.")
+    except http_requests.exceptions.RequestException as e:
+        logger.error("Gemini Analyse stream connection error: %s", e)
+        raise RuntimeError(f"Could not connect to AI service: {e}")
+
+
 def _coerce_float(value, default: float = 0.0) -> float:
     """Best-effort numeric coercion for AI payloads."""
     if value is None:
@@ -883,21 +1011,147 @@ def _coerce_float(value, default: float = 0.0) -> float:
         return default
 
 
+def _normalize_building_item(raw: dict, idx: int) -> dict:
+    category = str(raw.get("category") or raw.get("trade_element") or "").strip()
+    item_name = str(raw.get("item_name") or raw.get("name") or "").strip()
+    description = str(raw.get("description") or "").strip()
+    if not description:
+        description = item_name or f"BOQ Item {idx}"
+    if category and category.lower() not in description.lower():
+        description = f"{category} - {description}"
+    quantity = _coerce_float(raw.get("quantity"))
+    rate = _coerce_float(raw.get("rate"))
+    total_amount = _coerce_float(raw.get("total_amount"))
+    if rate <= 0 and quantity > 0 and total_amount > 0:
+        rate = total_amount / quantity
+    return {
+        "bill_no": str(raw.get("bill_no") or idx),
+        "description": description,
+        "specification": raw.get("specification") or raw.get("measurement_formula") or (f"Trade/Element: {category}" if category else None),
+        "unit": str(raw.get("unit") or "item"),
+        "quantity": quantity,
+        "rate": rate,
+    }
+
+
+def _normalize_professional_fee(raw: dict, idx: int) -> dict:
+    return {
+        "discipline": str(raw.get("discipline") or "").strip(),
+        "role_scope": str(raw.get("role_scope") or "").strip(),
+        "basis": str(raw.get("basis") or "").strip(),
+        "rate": str(raw.get("rate") or ""),
+        "estimated_fee": _coerce_float(raw.get("estimated_fee")),
+    }
+
+
+def _normalize_admin_expense(raw: dict, idx: int) -> dict:
+    return {
+        "item_role": str(raw.get("item_role") or "").strip(),
+        "description": str(raw.get("description") or "").strip(),
+        "trips_per_week": _coerce_float(raw.get("trips_per_week")) or None,
+        "total_trips": _coerce_float(raw.get("total_trips")) or None,
+        "distance": _coerce_float(raw.get("distance")) or None,
+        "rate": _coerce_float(raw.get("rate")),
+        "total_cost": _coerce_float(raw.get("total_cost")),
+    }
+
+
+def _normalize_labour_row(raw: dict, idx: int) -> dict:
+    # Shared by labour_costs and labour_breakdowns.
+    return {
+        "phase": str(raw.get("phase") or "").strip(),
+        "trade_role": str(raw.get("trade_role") or "").strip(),
+        "skill_level": str(raw.get("skill_level") or "").strip(),
+        "gang_size": _coerce_float(raw.get("gang_size")),
+        "duration_weeks": _coerce_float(raw.get("duration_weeks")),
+        "total_man_days": _coerce_float(raw.get("total_man_days")),
+        "daily_rate": _coerce_float(raw.get("daily_rate")),
+        "total_cost": _coerce_float(raw.get("total_cost")),
+    }
+
+
+def _normalize_machine_plant(raw: dict, idx: int) -> dict:
+    return {
+        "category": str(raw.get("category") or "").strip(),
+        "machine_item": str(raw.get("machine_item") or "").strip(),
+        "qty": _coerce_float(raw.get("qty"), default=1),
+        "dry_hire_rate": _coerce_float(raw.get("dry_hire_rate")) or None,
+        "fuel_l_hr": _coerce_float(raw.get("fuel_l_hr")) or None,
+        "hrs_day": _coerce_float(raw.get("hrs_day")) or None,
+        "fuel_cost": _coerce_float(raw.get("fuel_cost")) or None,
+        "operator_rate": str(raw.get("operator_rate") or "") or None,
+        "daily_wet_rate": _coerce_float(raw.get("daily_wet_rate")),
+        "days_rqd": _coerce_float(raw.get("days_rqd")),
+        "total_cost": _coerce_float(raw.get("total_cost")),
+    }
+
+
+def _normalize_schedule_task(raw: dict, idx: int) -> dict:
+    return {
+        "wbs": str(raw.get("wbs") or "").strip(),
+        "task_description": str(raw.get("task_description") or "").strip(),
+        "start_date": str(raw.get("start_date") or "").strip(),
+        "end_date": str(raw.get("end_date") or "").strip(),
+        "days": str(raw.get("days") or "").strip(),
+        "predecessor": raw.get("predecessor") or None,
+        "est_cost": _coerce_float(raw.get("est_cost")),
+    }
+
+
+_MATERIAL_SECTIONS = {"SUBSTRUCTURE", "SUPERSTRUCTURE", "ROOFING_CEILINGS", "FINISHES", "DOORS_WINDOWS", "PLUMBING", "ELECTRICAL_SOLAR"}
+
+
+def _normalize_schedule_material(raw: dict, idx: int) -> dict:
+    section = str(raw.get("section") or "").strip().upper().replace(" ", "_").replace("&", "").replace("__", "_")
+    if section not in _MATERIAL_SECTIONS:
+        section = "SUBSTRUCTURE"
+    est_qty = (
+        raw.get("estimated_qty")
+        or raw.get("estimated_quantity")
+        or raw.get("quantity")
+        or raw.get("qty")
+        or ""
+    )
+    return {
+        "section": section,
+        "material_description": str(raw.get("material_description") or raw.get("description") or raw.get("material") or "").strip(),
+        "specification": str(raw.get("specification") or raw.get("spec") or "") or None,
+        "estimated_qty": str(est_qty).strip() or None,
+    }
+
+
+# The 8 budget sheets in output order, each with its row normalizer
+# ``(raw_row, position_from_1) -> row``; rows that are not objects are dropped.
+_ANALYSE_SECTIONS = {
+    "building_items": _normalize_building_item,
+    "professional_fees": _normalize_professional_fee,
+    "admin_expenses": _normalize_admin_expense,
+    "labour_costs": _normalize_labour_row,
+    "machine_plants": _normalize_machine_plant,
+    "labour_breakdowns": _normalize_labour_row,
+    "schedule_tasks": _normalize_schedule_task,
+    "schedule_materials": _normalize_schedule_material,
+}
+# Lists passed through as-is.
+_ANALYSE_NOTE_SECTIONS = ("compliance_notes", "recommendations")
+
+
+def _empty_analyse_payload(summary: str = "") -> dict:
+    return {
+        "summary": summary,
+        **{key: [] for key in _ANALYSE_SECTIONS},
+        **{key: [] for key in _ANALYSE_NOTE_SECTIONS},
+    }
+
+
 def _normalize_analyse_payload(payload: dict) -> dict:
     """
     Normalize /analyse payload so frontend budget upload always works.
 
     Normalizes ALL 8 sections so field names/types match the Django models.
     """
-    _empty = {
-        "summary": "", "building_items": [], "professional_fees": [],
-        "admin_expenses": [], "labour_costs": [], "machine_plants": [],
-        "labour_breakdowns": [], "schedule_tasks": [], "schedule_materials": [],
-        "compliance_notes": [], "recommendations": [],
-    }
     if not isinstance(payload, dict):
-        _empty["summary"] = "Analysis returned an invalid payload."
-        return _empty
+        return _empty_analyse_payload("Analysis returned an invalid payload.")
 
     def _safe_list(key, alt_key=None):
         v = payload.get(key)
@@ -908,270 +1162,278 @@ def _normalize_analyse_payload(payload: dict) -> dict:
             return v2 if isinstance(v2, list) else []
         return []
 
-    # ── 1. Building Items ──
-    raw_building = _safe_list("building_items", "items")
-    building_items = []
-    for idx, raw in enumerate(raw_building, start=1):
-        if not isinstance(raw, dict):
-            continue
-        category = str(raw.get("category") or raw.get("trade_element") or "").strip()
-        item_name = str(raw.get("item_name") or raw.get("name") or "").strip()
-        description = str(raw.get("description") or "").strip()
-        if not description:
-            description = item_name or f"BOQ Item {idx}"
-        if category and category.lower() not in description.lower():
-            description = f"{category} - {description}"
-        quantity = _coerce_float(raw.get("quantity"))
-        rate = _coerce_float(raw.get("rate"))
-        total_amount = _coerce_float(raw.get("total_amount"))
-        if rate <= 0 and quantity > 0 and total_amount > 0:
-            rate = total_amount / quantity
-        building_items.append({
-            "bill_no": str(raw.get("bill_no") or idx),
-            "description": description,
-            "specification": raw.get("specification") or raw.get("measurement_formula") or (f"Trade/Element: {category}" if category else None),
-            "unit": str(raw.get("unit") or "item"),
-            "quantity": quantity,
-            "rate": rate,
-        })
+    norm = {"summary": str(payload.get("summary") or "").strip()}
+    for key, normalize_row in _ANALYSE_SECTIONS.items():
+        raw_rows = _safe_list(key, "items" if key == "building_items" else None)
+        norm[key] = [
+            normalize_row(raw, idx)
+            for idx, raw in enumerate(raw_rows, start=1)
+            if isinstance(raw, dict)
+        ]
+    for key in _ANALYSE_NOTE_SECTIONS:
+        norm[key] = _safe_list(key)
+    return norm
+
+
+# ── Sectioned /analyse ──
+# With fan-out, each group of sheets is generated by its own concurrent
+# Gemini call sharing the prompt and drawings, with a smaller output budget.
+_ANALYSE_SHEET_GROUPS = (
+    ("building_items",),
+    ("schedule_materials",),
+    ("labour_costs", "labour_breakdowns"),
+    ("professional_fees", "admin_expenses"),
+    ("machine_plants", "schedule_tasks"),
+    ("summary", "compliance_notes", "recommendations"),
+)
 
-    # ── 2. Professional Fees ──
-    prof_fees = []
-    for raw in _safe_list("professional_fees"):
-        if not isinstance(raw, dict):
-            continue
-        prof_fees.append({
-            "discipline": str(raw.get("discipline") or "").strip(),
-            "role_scope": str(raw.get("role_scope") or "").strip(),
-            "basis": str(raw.get("basis") or "").strip(),
-            "rate": str(raw.get("rate") or ""),
-            "estimated_fee": _coerce_float(raw.get("estimated_fee")),
-        })
+_analyse_executor: ThreadPoolExecutor | None = None
+_analyse_executor_lock = threading.Lock()
 
-    # ── 3. Admin Expenses ──
-    admin_exp = []
-    for raw in _safe_list("admin_expenses"):
-        if not isinstance(raw, dict):
-            continue
-        admin_exp.append({
-            "item_role": str(raw.get("item_role") or "").strip(),
-            "description": str(raw.get("description") or "").strip(),
-            "trips_per_week": _coerce_float(raw.get("trips_per_week")) or None,
-            "total_trips": _coerce_float(raw.get("total_trips")) or None,
-            "distance": _coerce_float(raw.get("distance")) or None,
-            "rate": _coerce_float(raw.get("rate")),
-            "total_cost": _coerce_float(raw.get("total_cost")),
-        })
 
-    # ── 4. Labour Costs ──
-    labour_costs = []
-    for raw in _safe_list("labour_costs"):
-        if not isinstance(raw, dict):
-            continue
-        labour_costs.append({
-            "phase": str(raw.get("phase") or "").strip(),
-            "trade_role": str(raw.get("trade_role") or "").strip(),
-            "skill_level": str(raw.get("skill_level") or "").strip(),
-            "gang_size": _coerce_float(raw.get("gang_size")),
-            "duration_weeks": _coerce_float(raw.get("duration_weeks")),
-            "total_man_days": _coerce_float(raw.get("total_man_days")),
-            "daily_rate": _coerce_float(raw.get("daily_rate")),
-            "total_cost": _coerce_float(raw.get("total_cost")),
-        })
+def _analyse_fan_out_default() -> bool:
+    return getattr(settings, "AI_ANALYSE_FAN_OUT", False)
 
-    # ── 5. Machine & Plant ──
-    machine_plants = []
-    for raw in _safe_list("machine_plants"):
-        if not isinstance(raw, dict):
-            continue
-        machine_plants.append({
-            "category": str(raw.get("category") or "").strip(),
-            "machine_item": str(raw.get("machine_item") or "").strip(),
-            "qty": _coerce_float(raw.get("qty"), default=1),
-            "dry_hire_rate": _coerce_float(raw.get("dry_hire_rate")) or None,
-            "fuel_l_hr": _coerce_float(raw.get("fuel_l_hr")) or None,
-            "hrs_day": _coerce_float(raw.get("hrs_day")) or None,
-            "fuel_cost": _coerce_float(raw.get("fuel_cost")) or None,
-            "operator_rate": str(raw.get("operator_rate") or "") or None,
-            "daily_wet_rate": _coerce_float(raw.get("daily_wet_rate")),
-            "days_rqd": _coerce_float(raw.get("days_rqd")),
-            "total_cost": _coerce_float(raw.get("total_cost")),
-        })
 
-    # ── 6. Labour Breakdowns ──
-    labour_breakdowns = []
-    for raw in _safe_list("labour_breakdowns"):
-        if not isinstance(raw, dict):
-            continue
-        labour_breakdowns.append({
-            "phase": str(raw.get("phase") or "").strip(),
-            "trade_role": str(raw.get("trade_role") or "").strip(),
-            "skill_level": str(raw.get("skill_level") or "").strip(),
-            "gang_size": _coerce_float(raw.get("gang_size")),
-            "duration_weeks": _coerce_float(raw.get("duration_weeks")),
-            "total_man_days": _coerce_float(raw.get("total_man_days")),
-            "daily_rate": _coerce_float(raw.get("daily_rate")),
-            "total_cost": _coerce_float(raw.get("total_cost")),
-        })
+def _get_analyse_executor() -> ThreadPoolExecutor:
+    global _analyse_executor
+    if _analyse_executor is None:
+        with _analyse_executor_lock:
+            if _analyse_executor is None:
+                _analyse_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "AI_ANALYSE_FAN_OUT_WORKERS", 6),
+                    thread_name_prefix="ai-analyse",
+                )
+    return _analyse_executor
 
-    # ── 7. Schedule Tasks ──
-    schedule_tasks = []
-    for raw in _safe_list("schedule_tasks"):
-        if not isinstance(raw, dict):
-            continue
-        schedule_tasks.append({
-            "wbs": str(raw.get("wbs") or "").strip(),
-            "task_description": str(raw.get("task_description") or "").strip(),
-            "start_date": str(raw.get("start_date") or "").strip(),
-            "end_date": str(raw.get("end_date") or "").strip(),
-            "days": str(raw.get("days") or "").strip(),
-            "predecessor": raw.get("predecessor") or None,
-            "est_cost": _coerce_float(raw.get("est_cost")),
-        })
 
-    # ── 8. Schedule of Materials ──
-    VALID_SECTIONS = {"SUBSTRUCTURE", "SUPERSTRUCTURE", "ROOFING_CEILINGS", "FINISHES", "DOORS_WINDOWS", "PLUMBING", "ELECTRICAL_SOLAR"}
-    schedule_materials = []
-    for raw in _safe_list("schedule_materials"):
-        if not isinstance(raw, dict):
-            continue
-        section = str(raw.get("section") or "").strip().upper().replace(" ", "_").replace("&", "").replace("__", "_")
-        if section not in VALID_SECTIONS:
-            section = "SUBSTRUCTURE"
-        est_qty = (
-            raw.get("estimated_qty")
-            or raw.get("estimated_quantity")
-            or raw.get("quantity")
-            or raw.get("qty")
-            or ""
+def _analyse_group_instruction(keys: tuple) -> str:
+    return (
+        "FOR THIS RESPONSE ONLY: return a JSON object containing exactly these top-level keys: "
+        + ", ".join(keys)
+        + ". Omit every other key — the remaining sheets are generated by separate requests. "
+        "Apply all the rules above to the keys you do return."
+    )
+
+
+def _run_analyse_group(keys: tuple, system: str, user_content: str, images: list | None) -> dict:
+    """One sheet group of a fan-out /analyse: ``{"parsed", "complete"}``."""
+    try:
+        raw = _call_gemini_analyse(
+            system=system,
+            user_content=user_content,
+            images=images,
+            max_tokens=getattr(settings, "AI_ANALYSE_FAN_OUT_MAX_TOKENS", 16384),
+            temperature=0.3,
+            suffix=_analyse_group_instruction(keys),
         )
-        schedule_materials.append({
-            "section": section,
-            "material_description": str(raw.get("material_description") or raw.get("description") or raw.get("material") or "").strip(),
-            "specification": str(raw.get("specification") or raw.get("spec") or "") or None,
-            "estimated_qty": str(est_qty).strip() or None,
-        })
+        parsed, complete = _parse_analyse_text(raw)
+        return {"parsed": parsed if isinstance(parsed, dict) else {}, "complete": complete}
+    finally:
+        connections.close_all()
+
+
+def _parse_analyse_text(raw: str) -> tuple:
+    """``(payload, complete)`` from Gemini's /analyse output (fences stripped, truncation recovered)."""
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
+    if cleaned.endswith("```"):
+        cleaned = cleaned[:-3]
+    cleaned = cleaned.strip()
+    try:
+        return json.loads(cleaned), True
+    except json.JSONDecodeError:
+        return json_stream.parse_partial(cleaned)
 
-    return {
-        "summary": str(payload.get("summary") or "").strip(),
-        "building_items": building_items,
-        "professional_fees": prof_fees,
-        "admin_expenses": admin_exp,
-        "labour_costs": labour_costs,
-        "machine_plants": machine_plants,
-        "labour_breakdowns": labour_breakdowns,
-        "schedule_tasks": schedule_tasks,
-        "schedule_materials": schedule_materials,
-        "compliance_notes": _safe_list("compliance_notes"),
-        "recommendations": _safe_list("recommendations"),
+
+def _fan_out_analyse(system: str, user_content: str, images: list | None) -> tuple[dict, dict]:
+    """
+    Generate the /analyse sheets concurrently, one Gemini call per group of
+    ``_ANALYSE_SHEET_GROUPS``. Returns the merged raw payload and a status per
+    sheet: ``ok``, ``partial`` (that response was truncated), ``missing``
+    (not returned) or ``failed`` (with the error). Raises ``RuntimeError``
+    only when every group failed.
+    """
+    executor = _get_analyse_executor()
+    futures = {
+        # Each call runs in a copy of this context so usage stays attributed.
+        executor.submit(contextvars.copy_context().run, _run_analyse_group, keys, system, user_content, images): keys
+        for keys in _ANALYSE_SHEET_GROUPS
     }
+    merged: dict = {}
+    sheets: dict = {}
+    errors = []
+    for done, future in enumerate(as_completed(futures), start=1):
+        keys = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error("/analyse sheet group %s failed: %s", ",".join(keys), e)
+            errors.append(str(e))
+            for key in keys:
+                sheets[key] = {"status": "failed", "error": str(e)}
+            continue
+        for key in keys:
+            if key in result["parsed"]:
+                merged[key] = result["parsed"][key]
+                sheets[key] = {"status": "ok" if result["complete"] else "partial"}
+            else:
+                sheets[key] = {"status": "missing" if result["complete"] else "partial"}
+        jobs.report_progress(20 + 55 * done // len(futures), f"Analysed {done} of {len(futures)} sheet groups")
 
+    if len(errors) == len(futures):
+        raise RuntimeError(errors[0])
+    return merged, sheets
 
-def _stream_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
-                              temperature: float = 0.7, images: list | None = None):
+
+class _AnalyseRowStream:
     """
-    Gemini equivalent of streaming with tool-use.
-    Gemini REST API does not support true SSE streaming in the same way,
-    so we perform a full call and then yield the response in chunks
-    to preserve the SSE contract with the frontend.
+    Maps members of a streamed /analyse response (``json_stream.ObjectStream``
+    events) to client events: ``analyse_row`` with the normalized row, its
+    sheet and its position in that sheet, and ``analyse_summary``.
     """
-    try:
-        full_text = _call_gemini_with_tools(
-            messages=messages, system=system,
-            max_tokens=max_tokens, temperature=temperature,
-            images=images,
-        )
-    except Exception as exc:
-        yield f"data: {json.dumps({'type': 'error', 'content': str(exc)})}\n\n"
-        yield "data: [DONE]\n\n"
-        return
 
-    CHUNK_SIZE = 80
-    for i in range(0, len(full_text), CHUNK_SIZE):
-        yield f"data: {json.dumps({'type': 'token', 'content': full_text[i:i+CHUNK_SIZE]})}\n\n"
+    def __init__(self):
+        self.counts: dict[str, int] = {}
+
+    def event(self, key: str, index: int | None, value) -> dict | None:
+        if index is None:
+            if key == "summary":
+                return {'type': 'analyse_summary', 'content': str(value or "").strip()}
+            return None
+        section = "building_items" if key == "items" else key
+        if section in _ANALYSE_SECTIONS:
+            if not isinstance(value, dict):
+                return None
+            row = _ANALYSE_SECTIONS[section](value, index + 1)
+        elif section in _ANALYSE_NOTE_SECTIONS:
+            row = value
+        else:
+            return None
+        position = self.counts.get(section, 0)
+        self.counts[section] = position + 1
+        return {'type': 'analyse_row', 'section': section, 'index': position, 'row': row}
 
-    yield "data: [DONE]\n\n"
 
+def _analyse_row_events(norm: dict):
+    """The SSE row events of an already normalized /analyse result (e.g. a cache hit)."""
+    yield _sse({'type': 'analyse_summary', 'content': norm.get("summary", "")})
+    for section in (*_ANALYSE_SECTIONS, *_ANALYSE_NOTE_SECTIONS):
+        for position, row in enumerate(norm.get(section) or []):
+            yield _sse({'type': 'analyse_row', 'section': section, 'index': position, 'row': row})
 
-# ── Project Context Helper ──────────────────────────────────────────
 
-def _get_project_context(project) -> str:
+def _sse(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+_STREAM_FALLBACK_TEXT = "I was unable to complete the request."
+
+
+class _StreamRound:
     """
-    Format all available project survey/brief data into a structured string
-    for the AI to understand the building's requirements and site conditions.
+    Accumulates one streamed model turn: text deltas and function calls.
+
+    ``feed`` returns the visible text deltas of a chunk so the caller can
+    forward them immediately; ``parts`` is the model turn to append to the
+    history before the tools run (thought signatures are kept verbatim).
     """
-    if not project:
-        return ""
 
-    lines = [
-        f"Project Title: {project.title}",
-        f"Location: {project.location}",
-        f"Engagement Tier: {project.get_engagement_tier_display()}",
-        f"SI-56 Verified: {'Yes' if project.si56_verified else 'No'}",
-        f"Budget Signed: {'Yes' if project.is_budget_signed else 'No'}",
-        f"Assigned Architect: {project.architect.username if project.architect else 'None'}",
-        f"Building Type: {project.building_type or 'Not specified'}",
-        f"Use Case: {project.use_case or 'Not specified'}",
-        f"Bedrooms: {project.bedrooms or 'Not specified'}",
-        f"Bathrooms: {project.bathrooms or 'Not specified'}",
-        f"Occupants: {project.occupants or 'Not specified'}",
-        f"Floors: {project.floors or 'Not specified'}",
-        f"Preferred Architectural Style: {project.preferred_style or 'Not specified'}",
-        f"Roof Type: {project.roof_type or 'Not specified'}",
-        f"Has Garage: {'Yes' if project.has_garage else 'No' if project.has_garage is False else 'Not specified'}",
-        f"Parking Spaces: {project.parking_spaces or 'Not specified'}",
-        f"Lot Size: {project.lot_size or 'Not specified'}",
-        f"Building Footprint: {project.footprint or 'Not specified'}",
-        f"Sustainability Requirements: {project.sustainability or 'None'}",
-        f"Accessibility Requirements: {project.accessibility or 'None'}",
-        f"Special Spaces Needed: {project.special_spaces or 'None'}",
-        f"Timeline: {project.timeline or 'Not specified'}",
-        f"Budget Flexibility: {project.budget_flex or 'Not specified'}",
-    ]
+    def __init__(self):
+        self.parts: list[dict] = []
+        self.fn_calls: list[dict] = []
+
+    def feed(self, chunk: dict) -> list[str]:
+        deltas = []
+        candidates = chunk.get("candidates") or []
+        if not candidates:
+            return deltas
+        for part in candidates[0].get("content", {}).get("parts", []):
+            if "functionCall" in part:
+                self.fn_calls.append(part)
+                self.parts.append(part)
+            elif part.get("text") and not part.get("thought"):
+                # Merge plain consecutive text deltas so the history stays
+                # compact; parts carrying a thoughtSignature are kept as-is.
+                if len(part) == 1 and self.parts and set(self.parts[-1]) == {"text"}:
+                    self.parts[-1]["text"] += part["text"]
+                else:
+                    self.parts.append(dict(part))
+                deltas.append(part["text"])
+        return deltas
 
-    # Added Financial Context
-    milestones = project.escrow_milestones.all()
-    if milestones.exists():
-        lines.append("\nEscrow Milestones:")
-        for m in milestones:
-            lines.append(f"- {m.name}: ${m.amount} ({m.status})")
 
-    schedule = project.capital_schedules.all()
-    if schedule.exists():
-        lines.append("\nCapital Schedule:")
-        for s in schedule:
-            lines.append(f"- {s.description}: ${s.amount} (Due: {s.due_date}, Status: {s.status})")
+def _stream_error_message(exc: Exception, timeout: float) -> str:
+    if isinstance(exc, http_requests.exceptions.Timeout):
+        logger.error("Gemini stream timed out after %s seconds", timeout)
+        return "The AI request timed out. Please try a simpler request or try again later."
+    if isinstance(exc, http_requests.exceptions.RequestException):
+        logger.error("Gemini stream connection error: %s", exc)
+        return f"Could not connect to AI service: {exc}"
+    return str(exc)
 
-    # Fully explore the database for related BOQ information 
+
+def _stream_gemini_with_tools(messages: list, system: str = "", max_tokens: int = 8192,
+                              temperature: float = 0.7, images: list | None = None,
+                              timeout: float = 120.0):
+    """
+    Stream a tool-enabled Gemini answer as SSE ``data:`` frames.
+
+    Each round is sent to ``streamGenerateContent`` and text deltas are
+    forwarded as ``token`` events the moment they arrive. When the model emits
+    function calls, the round's model turn is appended to the history, the
+    tools are run, a ``tool`` event is emitted per call, and generation resumes
+    with the function responses. Errors are reported as an ``error`` event;
+    the caller is responsible for the closing ``[DONE]``.
+    """
     try:
-        from apps.builder_dashboard.models import BOQBuildingItem, BOQCorrection, ProjectBudgetVersion
+        _require_gemini_key()
+    except RuntimeError as exc:
+        yield _sse({'type': 'error', 'content': str(exc)})
+        return
 
-        existing_items = BOQBuildingItem.objects.filter(
-            budget_version__project=project,
-            budget_version__kind=ProjectBudgetVersion.Kind.PRELIMINARY,
-        )
-        if existing_items.exists():
-            lines.append("\n--- EXISTING BOQ ITEMS ALREADY ON PROJECT ---")
-            for item in existing_items:
-                ai_flag = "[AI-Generated]" if getattr(item, 'is_ai_generated', False) else "[Manual]"
-                lines.append(f"- {getattr(item, 'bill_no', '')} | {item.description}: {item.quantity} {getattr(item, 'unit', '')} @ ${item.rate} {ai_flag}")
-                
-        corrections = BOQCorrection.objects.filter(project=project).order_by('-created_at')[:30]
-        if corrections.exists():
-            lines.append("\n--- PAST USER CORRECTIONS TO BOQ (Learn from these adjustments!) ---")
-            lines.append("Review how the user manually corrected previous AI outputs, and adjust your current calculations/rates to match their preferences.")
-            for c in corrections:
-                ai_src = "AI-Generated Item" if c.was_ai_generated else "Manual Item"
-                msg = f"- [{c.action}] on {ai_src}."
-                if c.action == "UPDATE":
-                    msg += f"\n  Before: {c.previous_data}\n  After:  {c.new_data}"
-                elif c.action == "DELETE":
-                    msg += f"\n  Deleted: {c.previous_data}"
-                lines.append(msg)
-    except Exception:
-        pass
+    model_name = _get_gemini_chat_model()
+    tool_config = _build_gemini_tool_config()
+    contents = _build_gemini_contents(messages, system, images)
 
-    return "\n".join(lines)
+    emitted_text = False
+    for _round in range(5):
+        payload = _tools_payload(contents, tool_config, max_tokens, temperature)
+        turn = _StreamRound()
+        try:
+            for chunk in gemini_client.stream_generate_content(
+                model_name, payload, timeout=timeout, label="chat_stream",
+            ):
+                for delta in turn.feed(chunk):
+                    emitted_text = True
+                    yield _sse({'type': 'token', 'content': delta})
+        except Exception as exc:
+            yield _sse({'type': 'error', 'content': _stream_error_message(exc, timeout)})
+            return
+
+        if not turn.fn_calls:
+            break
+
+        for fc_part in turn.fn_calls:
+            yield _sse({'type': 'tool', 'name': fc_part["functionCall"].get("name", "")})
+        contents.append({"role": "model", "parts": turn.parts})
+        contents.append({"role": "user", "parts": _execute_function_calls(turn.fn_calls)})
+
+    if not emitted_text:
+        yield _sse({'type': 'token', 'content': _STREAM_FALLBACK_TEXT})
+
+
+# ── Project Context Helper ──────────────────────────────────────────
+
+def _get_project_context(project) -> str:
+    """
+    Project survey/brief/BOQ context for prompts, served from the versioned
+    snapshot in ``project_context`` (rebuilt only after the project changes).
+    """
+    if not project:
+        return ""
+    return get_project_context_snapshot(project)["text"]
 
 
 def _build_active_boq_template_prompt() -> str:
@@ -1181,86 +1443,58 @@ def _build_active_boq_template_prompt() -> str:
     Returns an empty string if there is no active template or if retrieval fails.
     """
     try:
-        template = BOQTemplate.objects.filter(is_active=True).order_by('-updated_at', '-id').first()
-        if not template:
-            return ""
+        return config.active_boq_template()['prompt']
+    except Exception as e:
+        logger.warning("Failed to load active BOQ template for /analyse: %s", e)
+        return ""
 
-        lines = [
-            "\n\n--- ACTIVE BOQ TEMPLATE (STRICTLY FOLLOW) ---",
-            f"Template Name: {template.name}",
-        ]
 
-        if template.category_order:
-            lines.extend([
-                "Category Order (preserve this sequence):",
-                template.category_order.strip(),
-            ])
-
-        if template.extraction_rules:
-            lines.extend([
-                "Template Extraction Rules:",
-                template.extraction_rules.strip(),
-            ])
-
-        example_items = template.get_example_items()
-        if example_items:
-            lines.extend([
-                "Few-shot Example Items (mirror this naming/detail style):",
-                json.dumps(example_items, ensure_ascii=True, indent=2),
-            ])
-
-        # Keep these explicit so the model includes expected optional fields.
-        if template.include_labour_rate:
-            lines.append(
-                "For each building item, include `labour_rate` where reasonably derivable."
-            )
-        if template.include_measurement_formula:
-            lines.append(
-                "For each measurable item, include `measurement_formula` showing how quantity was computed."
-            )
+def _record_analysis_history(project, user, file_name, norm: dict):
+    """Persist a BudgetAnalysisHistory row for an /analyse result (fresh or cached)."""
+    if not (project and user and norm):
+        return
+    try:
+        # Calculate totals
+        sections = [
+            norm.get('building_items', []), norm.get('professional_fees', []),
+            norm.get('admin_expenses', []), norm.get('labour_costs', []),
+            norm.get('machine_plants', []), norm.get('labour_breakdowns', []),
+            norm.get('schedule_tasks', []), norm.get('schedule_materials', []),
+        ]
+        total_items = sum(len(s) if s else 0 for s in sections)
 
-        if template.header_text:
-            lines.append(
-                f"Use this BOQ export header intent/context when writing summary: {template.header_text.strip()}"
-            )
-        if template.footer_text:
-            lines.append(
-                f"Consider this BOQ footer intent/context for notes or recommendations: {template.footer_text.strip()}"
-            )
+        # Calculate cost from building items
+        total_cost = 0.0
+        for item in norm.get('building_items', []):
+            qty = float(item.get('quantity') or 0)
+            rate = float(item.get('rate') or 0)
+            total_cost += (qty * rate)
 
-        return "\n".join(lines)
-    except Exception as e:
-        logger.warning("Failed to load active BOQ template for /analyse: %s", e)
-        return ""
+        BudgetAnalysisHistory.objects.create(
+            project=project,
+            user=user,
+            file_name=file_name or "drawing_analysis",
+            summary=norm.get('summary', 'Analysis complete.'),
+            data=norm,
+            total_items=total_items,
+            total_cost=total_cost
+        )
+        logger.info("Saved BudgetAnalysisHistory for project %s", project.id)
+    except Exception as ex:
+        logger.error("Failed to auto-save history: %s", ex)
 
 
 def _get_project_vision_images(project: Project) -> list:
     """
-    Fetch all drawings associated with a project and convert them to base64
-    for Gemini vision analysis.
+    Fetch the project's drawings (most recent first) as downscaled, cached
+    data URLs for Gemini vision analysis, within the vision byte budget.
     """
-    from apps.builder_dashboard.models import DrawingFile
-    images = []
-    # Fetch all files for this project's requests
-    files = DrawingFile.objects.filter(request__project=project).order_by('-created_at')
-    for df in files:
-        try:
-            if not df.file:
-                continue
-            with df.file.open('rb') as f:
-                b64 = base64.b64encode(f.read()).decode('utf-8')
-                # Assume PNG/JPG based on extension or just use image/png as fallback
-                ext = df.file.name.split('.')[-1].lower()
-                mime = f"image/{ext}" if ext in ['png', 'jpg', 'jpeg', 'webp'] else 'image/png'
-                images.append(f"data:{mime};base64,{b64}")
-        except Exception as e:
-            logger.error(f"Failed to read drawing file {df.id}: {e}")
-    return images
+    return vision.project_drawing_images(project)
 
 
 # ── Chat Completion ──────────────────────────────────────────────────
 
-class ChatCompletionView(APIView):
+class ChatCompletionView(UsageBindingMixin, APIView):
     """
     Main AI chat endpoint — all powered by Gemini.
     • Chat / reasoning → Gemini Flash
@@ -1270,18 +1504,48 @@ class ChatCompletionView(APIView):
     • /analyse command → Gemini Pro for BOQ extraction
     """
     permission_classes = [IsAuthenticated]
+    usage_endpoint = 'chat'
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = 'ai_chat'
 
     def post(self, request):
+        prepared = self.prepare(request)
+        if isinstance(prepared, Response):
+            return prepared
+
+        try:
+            response_content = _call_gemini_with_tools(
+                messages=prepared['llm_messages'],
+                system=prepared['system'],
+                images=prepared['images'],
+            )
+            return self.completion_response(prepared, response_content)
+        except Exception as e:
+            return self.error_response(e)
+
+    def prepare(self, request):
+        """
+        Everything before the final chat call: validation, session bookkeeping,
+        command handlers (/analyse, /plans, /draw, /scan) and the system prompt.
+
+        Returns a ``Response`` when the request is already answered (or was
+        queued as a background job), otherwise a dict consumed by the chat
+        call and :meth:`completion_response`.
+        """
+        ctx = self.begin(request)
+        if isinstance(ctx, Response):
+            return ctx
+        if self.wants_background_job(request, ctx['user_query']):
+            return self.enqueue_job(ctx)
+        return self.run_commands(ctx)
+
+    def begin(self, request):
+        """Validate the request, resolve the project/session and save the user's message."""
         messages = request.data.get('messages', [])
         session_id = request.data.get('session_id')
-        user_image_data = request.data.get('image')  # Optional base64 image
-        user_pdf_data = request.data.get('pdf')  # Optional base64 PDF
         project_id = request.data.get('project_id')
         project = None
         user = request.user
-        vision_images = []
 
         if not messages:
             return Response({'error': 'No messages provided.'}, status=400)
@@ -1303,6 +1567,7 @@ class ChatCompletionView(APIView):
             first_msg = messages[0]['content'] if len(messages) > 0 else "New Chat"
             title = first_msg[:50] + "..." if len(first_msg) > 50 else first_msg
             session = ChatSession.objects.create(user=user, title=title)
+        usage.bind_session(session)
 
         if messages:
             latest_user_msg = messages[-1]
@@ -1313,31 +1578,153 @@ class ChatCompletionView(APIView):
                     content=latest_user_msg.get('content', '')
                 )
 
-        user_query = messages[-1]['content'] if messages else ""
+        return {
+            'user': user,
+            'session': session,
+            'project': project,
+            'messages': messages,
+            'user_query': messages[-1]['content'] if messages else "",
+            'image_data': request.data.get('image'),  # Optional base64 image
+            'pdf_data': request.data.get('pdf'),  # Optional base64 PDF
+            'file_name': request.data.get('file_name', 'drawing_analysis'),
+            'use_cache': not _to_bool(request.data.get('no_cache')),
+            'fan_out': _to_bool(request.data.get('fan_out'), default=_analyse_fan_out_default()),
+        }
+
+    # ── Background jobs ──────────────────────────────────────────────
+    @staticmethod
+    def job_kind(user_query: str) -> str | None:
+        """The :class:`AIJob` kind for slow commands (same precedence as run_commands)."""
+        if _is_analyse_request(user_query):
+            return 'analyse'
+        if _is_floor_plan_search(user_query):
+            return None
+        if _is_drawing_request(user_query):
+            return 'draw'
+        if _is_scan_request(user_query):
+            return 'scan'
+        return None
+
+    def wants_background_job(self, request, user_query: str) -> bool:
+        if not self.job_kind(user_query):
+            return False
+        return _to_bool(request.data.get('background'), default=jobs.backgrounding_enabled())
+
+    def enqueue_job(self, ctx: dict) -> Response:
+        kind = self.job_kind(ctx['user_query'])
+        job = jobs.enqueue(
+            kind,
+            ctx['user'],
+            {
+                'messages': ctx['messages'],
+                'image_data': ctx['image_data'],
+                'pdf_data': ctx['pdf_data'],
+                'file_name': ctx['file_name'],
+                'use_cache': ctx['use_cache'],
+                'fan_out': ctx['fan_out'],
+            },
+            session=ctx['session'],
+            project=ctx['project'],
+        )
+        body = {
+            'job_id': str(job.id),
+            'kind': kind,
+            'status': job.status,
+            'message': f"Your /{kind} request is running in the background.",
+            'role': 'assistant',
+            'session_id': ctx['session'].id,
+            'status_url': reverse('ai-job-detail', args=[job.id]),
+            'events_url': reverse('ai-job-events', args=[job.id]),
+        }
+        if kind == 'scan' and ctx['image_data']:
+            # Instant local answer while the sketch conversion is queued.
+            body['similar_plans'] = _find_similar_floor_plans(ctx['image_data'])
+        return Response(body, status=202)
+
+    def run_job(self, job) -> Response:
+        """Worker side of :meth:`enqueue_job`: run the command and the reply."""
+        if job.session is None:
+            return Response({'error': 'Chat session not found.'}, status=404)
+        payload = job.payload or {}
+        messages = payload.get('messages') or []
+        ctx = {
+            'user': job.user,
+            'session': job.session,
+            'project': job.project,
+            'messages': messages,
+            'user_query': messages[-1]['content'] if messages else "",
+            'image_data': payload.get('image_data'),
+            'pdf_data': payload.get('pdf_data'),
+            'file_name': payload.get('file_name', 'drawing_analysis'),
+            'use_cache': payload.get('use_cache', True),
+            'fan_out': payload.get('fan_out', _analyse_fan_out_default()),
+        }
+        usage_token = usage.bind(job.user, job.kind, session=job.session)
+        try:
+            prepared = self.run_commands(ctx)
+            if isinstance(prepared, Response):
+                return prepared
+            jobs.report_progress(85, 'Writing reply')
+            response_content = _call_gemini_with_tools(
+                messages=prepared['llm_messages'],
+                system=prepared['system'],
+                images=prepared['images'],
+            )
+            return self.completion_response(prepared, response_content)
+        except Exception as e:
+            return self.error_response(e)
+        finally:
+            usage.unbind(usage_token)
+
+    @staticmethod
+    def vision_inputs(ctx: dict) -> tuple[list, str]:
+        """
+        ``(vision_images, pdf_text)`` for the request: the attached image and
+        PDF pages, else the project's drawings for /scan and /analyse.
+        """
+        user_image_data = ctx['image_data']
+        vision_images = []
 
         if user_image_data:
             if not user_image_data.startswith('data:image/'):
                 user_image_data = f"data:image/png;base64,{user_image_data}"
-            vision_images.append(user_image_data)
+            vision_images.append(vision.preprocess_data_url(user_image_data))
 
-        if user_pdf_data:
-            pdf_images = _extract_pdf_pages_as_images(user_pdf_data, max_pages=5)
+        pdf_text = ""
+        if ctx['pdf_data']:
+            pdf_images, pdf_text = _extract_pdf_content(ctx['pdf_data'], max_pages=5)
             vision_images.extend(pdf_images)
 
+        user_query = ctx['user_query']
+        if not vision_images and ctx['project'] and (_is_scan_request(user_query) or _is_analyse_request(user_query)):
+            vision_images = _get_project_vision_images(ctx['project'])
+        return vision.fit_budget(vision_images), pdf_text
+
+    def run_commands(self, ctx: dict):
+        """Run the slash-command handlers and build the system prompt."""
+        user = ctx['user']
+        session = ctx['session']
+        project = ctx['project']
+        messages = ctx['messages']
+        user_query = ctx['user_query']
+        user_image_data = ctx['image_data']
+        vision_images, pdf_text = self.vision_inputs(ctx)
+
         image_url = None
         matched_preset = None
         final_image_prompt = None
         floor_plan_results = None
+        similar_plans = None
         analyse_results = None
         draw_error = None
 
-        if not vision_images and project and (_is_scan_request(user_query) or _is_analyse_request(user_query)):
-            vision_images = _get_project_vision_images(project)
-
         if _is_analyse_request(user_query):
-            # Extract optional file name for labeling history
-            file_name = request.data.get('file_name', 'drawing_analysis')
-            analyse_results = self._handle_analyse(user_query, vision_images, project, file_name=file_name, user=user)
+            jobs.report_progress(10, 'Preparing drawings')
+            analyse_results = self._handle_analyse(
+                f"{user_query}\n\n{pdf_text}" if pdf_text else user_query,
+                vision_images, project, file_name=ctx['file_name'], user=user,
+                use_cache=ctx['use_cache'], fan_out=ctx['fan_out'],
+            )
             summary = analyse_results.get("summary", "Analysis complete.")
             ChatMessage.objects.create(
                 session=session,
@@ -1360,6 +1747,7 @@ class ChatCompletionView(APIView):
             floor_plan_results = _search_floor_plans(search_terms, limit=6)
 
         elif _is_drawing_request(user_query):
+            jobs.report_progress(10, 'Engineering the image prompt')
             image_url, final_image_prompt, matched_preset, draw_error = self._handle_draw(user_query, project)
 
         elif _is_scan_request(user_query):
@@ -1371,18 +1759,14 @@ class ChatCompletionView(APIView):
                     "Please attach an image using the 📎 button and try again."
                 )
             else:
+                similar_plans = _find_similar_floor_plans(vision_images[0])
+                jobs.report_progress(10, 'Reading the sketch')
                 scan_desc = _extract_scan_description(user_query)
                 image_url, final_image_prompt, draw_error = self._handle_scan(
                     vision_images, scan_desc
                 )
 
-        instruction_obj = AIInstruction.objects.filter(is_active=True).first()
-        base_instruction = instruction_obj.instruction_text if instruction_obj else (
-            "You are the DzeNhare Architecture AI, a helpful, professional AI assistant "
-            "built into the builder dashboard. You specialize in construction, compliance "
-            "regulations (like SI-56), and architectural guidance. Keep answers concise, "
-            "helpful, and professional."
-        )
+        base_instruction = config.base_instruction()
 
         system_content = base_instruction + (
             "\n\nDo not refuse to answer. If data is limited, make reasonable, clearly labeled assumptions "
@@ -1454,79 +1838,103 @@ class ChatCompletionView(APIView):
                 f"Inform the user about the error and suggest they try again with a clearer image. "
                 f"Do NOT attempt any visual representation as a substitute."
             )
-
-        try:
-            llm_messages = [{"role": msg['role'], "content": msg['content']} for msg in messages]
-            final_images = None if _is_scan_request(user_query) else (
-                vision_images if vision_images else None
-            )
-
-            response_content = _call_gemini_with_tools(
-                messages=llm_messages,
-                system=system_content,
-                images=final_images,
+        if similar_plans:
+            system_content += (
+                "\n\nExisting floor plans in the library look similar to the user's sketch and are "
+                "shown as cards alongside your message: "
+                + "; ".join(f"{p['title']} ({p['category_name']})" for p in similar_plans)
+                + ". Mention that these may suit the user as ready-made alternatives."
             )
 
-            result = {
-                'message': response_content,
-                'role': 'assistant',
-            }
-            if image_url:
-                result['image_url'] = image_url
-            if final_image_prompt:
-                result['image_prompt'] = final_image_prompt
-            if matched_preset:
-                result['preset_id'] = matched_preset.id
-                result['preset_name'] = matched_preset.name
-            if floor_plan_results is not None:
-                result['floor_plans'] = floor_plan_results
-            if analyse_results is not None:
-                result['analyse'] = analyse_results
+        llm_messages, history_summary = history.build_history(session, messages)
+        llm_messages = _append_to_last_user_turn(llm_messages, pdf_text)
+        system_content += history.summary_prompt_block(history_summary)
+        system_content += knowledge.prompt_block(user_query)
+        final_images = None if _is_scan_request(user_query) else (
+            vision_images if vision_images else None
+        )
 
-            ChatMessage.objects.create(
-                session=session,
-                role='assistant',
-                content=result['message'],
-                image_url=image_url,
-            )
-            result['session_id'] = session.id
+        return {
+            'session': session,
+            'llm_messages': llm_messages,
+            'system': system_content,
+            'images': final_images,
+            'image_url': image_url,
+            'image_prompt': final_image_prompt,
+            'preset': matched_preset,
+            'floor_plans': floor_plan_results,
+            'similar_plans': similar_plans,
+            'analyse': analyse_results,
+        }
 
-            return Response(result)
+    @staticmethod
+    def completion_response(prepared: dict, response_content: str) -> Response:
+        session = prepared['session']
+        image_url = prepared['image_url']
+        result = {
+            'message': response_content,
+            'role': 'assistant',
+        }
+        if image_url:
+            result['image_url'] = image_url
+        if prepared['image_prompt']:
+            result['image_prompt'] = prepared['image_prompt']
+        if prepared['preset']:
+            result['preset_id'] = prepared['preset'].id
+            result['preset_name'] = prepared['preset'].name
+        if prepared['floor_plans'] is not None:
+            result['floor_plans'] = prepared['floor_plans']
+        if prepared.get('similar_plans'):
+            result['similar_plans'] = prepared['similar_plans']
+        if prepared['analyse'] is not None:
+            result['analyse'] = prepared['analyse']
+
+        ChatMessage.objects.create(
+            session=session,
+            role='assistant',
+            content=result['message'],
+            image_url=image_url,
+        )
+        history.schedule_summary(session)
+        result['session_id'] = session.id
 
-        except Exception as e:
-            logger.exception("ChatCompletionView error")
-            error_str = str(e)
-
-            is_transient = any(kw in error_str.lower() for kw in [
-                '502', '503', 'bad gateway', 'service unavailable',
-                'overloaded', 'internal server error',
-            ])
-            is_auth = '401' in error_str or 'unauthorized' in error_str.lower()
-
-            if is_transient:
-                user_msg = (
-                    "⚠️ The AI service (Gemini) is temporarily unavailable. "
-                    "This is usually resolved within a few minutes — please try again shortly."
-                )
-                http_status = 503
-            elif is_auth:
-                user_msg = (
-                    "⚠️ The AI service returned an authentication error. "
-                    "Please ask the admin to check the Gemini API key."
-                )
-                http_status = 502
-            else:
-                user_msg = (
-                    "I apologize, but my AI circuits are currently undergoing maintenance "
-                    "or are not fully configured. Please contact support."
-                )
-                http_status = 500
+        return Response(result)
 
-            return Response({
-                'error': error_str,
-                'message': user_msg,
-                'role': 'assistant',
-            }, status=http_status)
+    @staticmethod
+    def error_response(e: Exception) -> Response:
+        logger.error("ChatCompletionView error", exc_info=e)
+        error_str = str(e)
+
+        is_transient = any(kw in error_str.lower() for kw in [
+            '502', '503', 'bad gateway', 'service unavailable',
+            'overloaded', 'internal server error',
+        ])
+        is_auth = '401' in error_str or 'unauthorized' in error_str.lower()
+
+        if is_transient:
+            user_msg = (
+                "⚠️ The AI service (Gemini) is temporarily unavailable. "
+                "This is usually resolved within a few minutes — please try again shortly."
+            )
+            http_status = 503
+        elif is_auth:
+            user_msg = (
+                "⚠️ The AI service returned an authentication error. "
+                "Please ask the admin to check the Gemini API key."
+            )
+            http_status = 502
+        else:
+            user_msg = (
+                "I apologize, but my AI circuits are currently undergoing maintenance "
+                "or are not fully configured. Please contact support."
+            )
+            http_status = 500
+
+        return Response({
+            'error': error_str,
+            'message': user_msg,
+            'role': 'assistant',
+        }, status=http_status)
 
     # ── /draw handler ────────────────────────────────────────────────
     def _handle_draw(self, user_query: str, project=None):
@@ -1534,9 +1942,7 @@ class ChatCompletionView(APIView):
         Prompt engineering via Gemini → image generation via Gemini.
         Returns (image_url, final_prompt, matched_preset).
         """
-        matched_preset = _match_style_preset(user_query)
-        if not matched_preset and project:
-            matched_preset = _match_style_preset(project.preferred_style or "")
+        matched_preset = _match_style_preset(user_query, (project.preferred_style or "") if project else "")
         
         top_prompts = _get_top_rated_prompts(matched_preset, limit=3)
 
@@ -1740,6 +2146,7 @@ class ChatCompletionView(APIView):
         if matched_preset and matched_preset.negative_prompt:
             negative = matched_preset.negative_prompt + ", " + negative
 
+        jobs.report_progress(40, 'Rendering image')
         image_url, gen_error = _generate_image_from_gemini(
             prompt=image_prompt,
             negative_prompt=negative,
@@ -1764,10 +2171,6 @@ class ChatCompletionView(APIView):
             )
 
         scan_model = settings.GEMINI_IMAGE_MODEL  # gemini-3-pro-image-preview
-        scan_url = (
-            f"https://generativelanguage.googleapis.com/v1beta/models/{scan_model}"
-            f":generateContent?key={api_key}"
-        )
 
         # Decode the uploaded image
         img_data = vision_images[0]
@@ -1821,7 +2224,7 @@ class ChatCompletionView(APIView):
 
         try:
             logger.info("[Scan] Generating 2D floor plan with %s...", scan_model)
-            response = http_requests.post(scan_url, json=payload, timeout=120.0)
+            response = gemini_client.post(scan_model, payload, timeout=120.0, label="scan")
 
             if response.status_code != 200:
                 body = response.text[:500]
@@ -1889,7 +2292,8 @@ class ChatCompletionView(APIView):
             return None, final_prompt, f"⚠️ Floor plan generation failed: {e}"
 
     # ── /analyse handler ─────────────────────────────────────────────
-    def _handle_analyse(self, user_query: str, vision_images: list, project=None, file_name: str = None, user=None) -> dict:
+    def _handle_analyse(self, user_query: str, vision_images: list, project=None, file_name: str = None,
+                        user=None, use_cache: bool = True, fan_out: bool = False) -> dict:
         """
         Use Gemini Pro vision to analyse an uploaded image (floor plan, BOQ,
         site photo) and return structured BOQ / measurement data as JSON.
@@ -1897,7 +2301,80 @@ class ChatCompletionView(APIView):
         If an active BOQTemplate exists, its category ordering, extraction
         rules, example items, and optional columns are injected into the
         system prompt so the AI mirrors the admin's preferred format.
+
+        Results for identical drawings/template/project state are served from
+        ``analyse_cache`` unless ``use_cache`` is False.
+
+        With ``fan_out`` the sheets are generated by concurrent per-group calls
+        (see ``_fan_out_analyse``) and the result gains a ``sheets`` status map.
         """
+        analysis = self._analyse_request(user_query, vision_images, project, fan_out=fan_out)
+        cached = self._cached_analyse(analysis, project, user, file_name, use_cache)
+        if cached is not None:
+            return cached
+
+        try:
+            jobs.report_progress(20, 'Analysing drawings')
+            images = vision_images if vision_images else None
+            complete = True  # fan-out reports truncation per sheet
+            if fan_out:
+                parsed, sheets = _fan_out_analyse(analysis['system'], analysis['user_content'], images)
+            else:
+                raw = _call_gemini_analyse(
+                    system=analysis['system'],
+                    user_content=analysis['user_content'],
+                    images=images,
+                    max_tokens=65536,
+                    temperature=0.3,
+                )
+                (parsed, complete), sheets = _parse_analyse_text(raw), None
+            return self._finish_analyse(parsed, analysis, project, user, file_name, sheets=sheets, complete=complete)
+
+        except Exception as e:
+            logger.error("Gemini analyse error: %s", e, exc_info=True)
+            return _empty_analyse_payload(f"Analysis failed: {str(e)}")
+
+    def _stream_analyse(self, user_query: str, vision_images: list, project=None, file_name: str = None,
+                        user=None, use_cache: bool = True):
+        """
+        :meth:`_handle_analyse` as SSE frames. Each row is normalized and sent
+        as an ``analyse_row`` event as soon as Gemini has finished writing it
+        (``analyse_summary`` for the summary); the final ``analyse`` event
+        carries the complete normalized result, after it has been cached and
+        saved to the analysis history.
+        """
+        analysis = self._analyse_request(user_query, vision_images, project)
+        cached = self._cached_analyse(analysis, project, user, file_name, use_cache)
+        if cached is not None:
+            yield from _analyse_row_events(cached)
+            yield _sse({'type': 'analyse', 'analyse': cached})
+            return cached
+
+        stream = json_stream.ObjectStream()
+        rows = _AnalyseRowStream()
+        try:
+            for delta in _stream_gemini_analyse(
+                system=analysis['system'],
+                user_content=analysis['user_content'],
+                images=vision_images if vision_images else None,
+                max_tokens=65536,
+                temperature=0.3,
+            ):
+                for key, index, value in stream.feed(delta):
+                    event = rows.event(key, index, value)
+                    if event:
+                        yield _sse(event)
+            parsed, complete = _parse_analyse_text(stream.text)
+            norm = self._finish_analyse(parsed, analysis, project, user, file_name, complete=complete)
+        except Exception as e:
+            logger.error("Gemini analyse stream error: %s", e, exc_info=True)
+            yield _sse({'type': 'error', 'content': str(e)})
+            norm = _empty_analyse_payload(f"Analysis failed: {str(e)}")
+        yield _sse({'type': 'analyse', 'analyse': norm})
+        return norm
+
+    def _analyse_request(self, user_query: str, vision_images: list, project=None, fan_out: bool = False) -> dict:
+        """The /analyse prompt: ``{'system', 'user_content', 'cache_key'}`` (key ``None`` when uncached)."""
         analyse_text = user_query.strip()
         for kw in _ANALYSE_KEYWORDS:
             if analyse_text.lower().startswith(kw):
@@ -1954,95 +2431,78 @@ class ChatCompletionView(APIView):
         if template_prompt:
             analyse_system += template_prompt
 
+        context_version = None
         if project:
+            context = get_project_context_snapshot(project)
+            context_version = context["version"]
             analyse_system += (
                 f"\n\n--- PROJECT DB CONTEXT (YOU MUST FULLY EXPLORE THIS BEFORE ANALYSING) ---\n"
                 f"You are instructed to fully explore the data related to this project (Project ID: {project.id}). "
                 f"Thoroughly review the existing BOQ items and learn from the 'PAST USER CORRECTIONS' shown below. "
                 f"You MUST adjust your assumptions, measurements, branding, or pricing to perfectly mirror how the user corrected past entries.\n"
-                f"{_get_project_context(project)}"
+                f"{context['text']}"
             )
 
         user_content = analyse_text if analyse_text else "Please analyse this image and generate a full project budget."
         analyse_model = _get_analyse_model_name()
         logger.info("/analyse using Gemini model: %s", analyse_model)
 
-        try:
-            raw = _call_gemini_analyse(
-                system=analyse_system,
-                user_content=user_content,
-                images=vision_images if vision_images else None,
-                max_tokens=65536,
-                temperature=0.3,
+        cache_key = None
+        if vision_images and analyse_cache.is_enabled():
+            cache_key = analyse_cache.analyse_cache_key(
+                images=vision_images,
+                template_marker=config.active_boq_template()['marker'],
+                context_version=context_version,
+                system_prompt=analyse_system,
+                user_prompt=user_content,
+                model=analyse_model,
+                fan_out=fan_out,
             )
-            cleaned = raw.strip()
-            if cleaned.startswith("```"):
-                cleaned = cleaned.split("\n", 1)[1] if "\n" in cleaned else cleaned[3:]
-            if cleaned.endswith("```"):
-                cleaned = cleaned[:-3]
-            cleaned = cleaned.strip()
-
-            try:
-                parsed = json.loads(cleaned)
-            except json.JSONDecodeError:
-                parsed = _repair_truncated_json(cleaned)
-
-            norm = _normalize_analyse_payload(parsed)
-
-            # --- PERSIST TO HISTORY ---
-            if project and user and norm:
-                try:
-                    # Calculate totals
-                    sections = [
-                        norm.get('building_items', []), norm.get('professional_fees', []),
-                        norm.get('admin_expenses', []), norm.get('labour_costs', []),
-                        norm.get('machine_plants', []), norm.get('labour_breakdowns', []),
-                        norm.get('schedule_tasks', []), norm.get('schedule_materials', []),
-                    ]
-                    total_items = sum(len(s) if s else 0 for s in sections)
-                    
-                    # Calculate cost from building items
-                    total_cost = 0.0
-                    for item in norm.get('building_items', []):
-                        qty = float(item.get('quantity') or 0)
-                        rate = float(item.get('rate') or 0)
-                        total_cost += (qty * rate)
-                    
-                    BudgetAnalysisHistory.objects.create(
-                        project=project,
-                        user=user,
-                        file_name=file_name or "drawing_analysis",
-                        summary=norm.get('summary', 'Analysis complete.'),
-                        data=norm,
-                        total_items=total_items,
-                        total_cost=total_cost
-                    )
-                    logger.info("Saved BudgetAnalysisHistory for project %s", project.id)
-                except Exception as ex:
-                    logger.error("Failed to auto-save history: %s", ex)
-
-            return norm
 
-        except Exception as e:
-            logger.error("Gemini analyse error: %s", e, exc_info=True)
-            return {
-                "summary": f"Analysis failed: {str(e)}",
-                "building_items": [],
-                "professional_fees": [],
-                "admin_expenses": [],
-                "labour_costs": [],
-                "machine_plants": [],
-                "labour_breakdowns": [],
-                "schedule_tasks": [],
-                "schedule_materials": [],
-                "compliance_notes": [],
-                "recommendations": [],
-            }
+        return {'system': analyse_system, 'user_content': user_content, 'cache_key': cache_key}
 
+    @staticmethod
+    def _cached_analyse(analysis: dict, project, user, file_name, use_cache: bool):
+        cache_key = analysis['cache_key']
+        cached = analyse_cache.get_cached(cache_key) if cache_key and use_cache else None
+        if cached is None:
+            return None
+        logger.info("/analyse cache hit (%s)", cache_key[-12:])
+        _record_analysis_history(project, user, file_name, cached)
+        return {**cached, "cached": True}
 
-class ImageGenerationView(APIView):
+    @staticmethod
+    def _finish_analyse(parsed, analysis: dict, project, user, file_name, sheets: dict | None = None,
+                        complete: bool = True) -> dict:
+        """
+        Normalize Gemini's parsed /analyse output, then cache it and record it
+        in the history. Truncated (``complete`` false) or empty results are
+        not cached.
+        """
+        norm = _normalize_analyse_payload(parsed)
+        failed = incomplete = []
+        if sheets is not None:
+            norm["sheets"] = sheets
+            failed = [key for key, state in sheets.items() if state["status"] == "failed"]
+            incomplete = [key for key, state in sheets.items() if state["status"] in ("failed", "partial")]
+            if failed:
+                note = f"Some sheets could not be generated ({', '.join(failed)}); run /analyse again to retry them."
+                norm["summary"] = f"{norm['summary']}\n\n{note}" if norm["summary"] else note
+        jobs.report_progress(80, 'Saving analysis')
+
+        # Failed, truncated or empty results are retried by the next /analyse, not served from the cache.
+        has_rows = any(norm.get(key) for key in _ANALYSE_SECTIONS)
+        if analysis['cache_key'] and complete and has_rows and not incomplete:
+            analyse_cache.store(analysis['cache_key'], norm)
+        _record_analysis_history(project, user, file_name, norm)
+
+        return norm
+
+
+class ImageGenerationView(UsageBindingMixin, APIView):
     """Standalone endpoint for direct image generation requests via Gemini."""
     permission_classes = [IsAuthenticated]
+    usage_endpoint = 'draw'
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = 'ai_generate'
 
@@ -2067,49 +2527,172 @@ class ImageGenerationView(APIView):
 
 # ── PDF vision helper ────────────────────────────────────────────────
 
-def _extract_pdf_pages_as_images(pdf_base64: str, max_pages: int = 5) -> list[str]:
+def _extract_pdf_content(pdf_base64: str, max_pages: int = 5) -> tuple[list[str], str]:
     """
-    Convert a base64-encoded PDF into a list of base64 PNG data-URLs
-    (one per page, capped at *max_pages*).  Uses pdf2image if available,
-    falls back to PyPDF text extraction.
+    Split a base64-encoded PDF into vision images (rasterized pages, capped
+    at *max_pages*) and a text block for pages that are plain text.
+    Rasterization is cached and parallel; see ``pdf_pages``.
     """
     try:
-        import pdf2image
-        pdf_bytes = base64.b64decode(pdf_base64)
-        images = pdf2image.convert_from_bytes(pdf_bytes, first_page=1, last_page=max_pages, dpi=200)
-        data_urls = []
-        for img in images:
-            buf = io.BytesIO()
-            img.save(buf, format="PNG")
-            b64 = base64.b64encode(buf.getvalue()).decode()
-            data_urls.append(f"data:image/png;base64,{b64}")
-        return data_urls
-    except ImportError:
-        logger.warning("pdf2image not installed — falling back to text extraction for PDFs")
-        return []
+        pdf_bytes = base64.b64decode(pdf_base64.split(",", 1)[1] if pdf_base64.startswith("data:") else pdf_base64)
     except Exception as e:
-        logger.error("PDF-to-image conversion error: %s", e)
-        return []
+        logger.error("PDF decode error: %s", e)
+        return [], ""
+    content = pdf_pages.extract_pdf(pdf_bytes, max_pages=max_pages)
+    return content["images"], pdf_pages.text_pages_block(content["text_pages"])
+
+
+def _append_to_last_user_turn(llm_messages: list, text: str) -> list:
+    """Attach extracted attachment text to the latest user message."""
+    if text:
+        for msg in reversed(llm_messages):
+            if msg.get("role") == "user":
+                msg["content"] = f"{msg.get('content', '')}\n\n{text}"
+                break
+    return llm_messages
 
 
 # ── Streaming SSE endpoint ───────────────────────────────────────────
 
 from apps.authentication.permissions import IsApproved
 
-class ChatStreamView(APIView):
+class ChatStreamView(UsageBindingMixin, APIView):
     """
     SSE streaming chat endpoint.
-    Streams Gemini's response token-by-token, with tool-use support.
+    Streams Gemini's response token-by-token as it is generated, with tool-use
+    support (a ``tool`` event is sent while a function call is executed).
     Falls back to non-streaming endpoints for /draw, /plans, /analyse.
+    With ``"stream_analyse": true``, /analyse is streamed instead: BOQ rows
+    arrive as ``analyse_row`` events while Gemini writes them, then the full
+    result as one ``analyse`` event.
     
     POST /ai/chat/stream/
     Same payload as /ai/chat/ — returns text/event-stream.
     """
     permission_classes = [IsAuthenticated, IsApproved]
+    usage_endpoint = 'stream'
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = 'ai_chat'
 
     def post(self, request):
+        if self.wants_analyse_stream(request):
+            return self.stream_analyse(request)
+
+        prepared = self.prepare(request)
+        if isinstance(prepared, Response):
+            return prepared
+
+        session_id_value = prepared['session_id']
+        usage_binding = usage.current_binding()
+
+        def event_stream():
+            # The body is iterated after post() returns, possibly elsewhere.
+            usage_token = usage.restore_binding(usage_binding)
+            collected = []
+            try:
+                for chunk in _stream_gemini_with_tools(
+                    messages=prepared['llm_messages'],
+                    system=prepared['system'],
+                    images=prepared['images'],
+                ):
+                    yield chunk
+                    self.collect_token(chunk, collected)
+
+                yield _sse({'type': 'meta', 'session_id': session_id_value})
+                yield "data: [DONE]\n\n"
+
+            except Exception as e:
+                logger.exception("ChatStreamView SSE error")
+                yield _sse({'type': 'error', 'content': str(e)})
+                yield "data: [DONE]\n\n"
+            finally:
+                self.save_reply(session_id_value, collected)
+                usage.unbind(usage_token)
+
+        return self.sse_response(event_stream())
+
+    @staticmethod
+    def wants_analyse_stream(request) -> bool:
+        messages = request.data.get('messages', [])
+        user_query = messages[-1]['content'] if messages else ""
+        return _is_analyse_request(user_query) and _to_bool(request.data.get('stream_analyse'))
+
+    def stream_analyse(self, request):
+        """Run /analyse (see :meth:`ChatCompletionView._stream_analyse`) as an event stream."""
+        inputs = self.begin_analyse(request)
+        if isinstance(inputs, Response):
+            return inputs
+        view = inputs['view']
+        usage_binding = usage.current_binding()
+
+        def event_stream():
+            usage_token = usage.restore_binding(usage_binding)
+            try:
+                analyse_results = yield from view._stream_analyse(
+                    inputs['user_query'], inputs['vision_images'], inputs['project'],
+                    file_name=inputs['file_name'], user=inputs['user'], use_cache=inputs['use_cache'],
+                )
+                self.save_analyse_reply(inputs['session'], analyse_results)
+                yield _sse({'type': 'meta', 'session_id': inputs['session'].id})
+                yield "data: [DONE]\n\n"
+            except Exception as e:
+                logger.exception("ChatStreamView /analyse SSE error")
+                yield _sse({'type': 'error', 'content': str(e)})
+                yield "data: [DONE]\n\n"
+            finally:
+                usage.unbind(usage_token)
+
+        return self.sse_response(event_stream())
+
+    @staticmethod
+    def begin_analyse(request):
+        """
+        Validate a streamed /analyse request and record the user turn. Returns
+        a ``Response`` for early exits, otherwise the inputs of the stream.
+        """
+        view = ChatCompletionView()
+        view.request = request
+        ctx = view.begin(request)
+        if isinstance(ctx, Response):
+            return ctx
+        vision_images, pdf_text = view.vision_inputs(ctx)
+        user_query = ctx['user_query']
+        return {
+            'view': view,
+            'session': ctx['session'],
+            'user_query': f"{user_query}\n\n{pdf_text}" if pdf_text else user_query,
+            'vision_images': vision_images,
+            'project': ctx['project'],
+            'file_name': ctx['file_name'],
+            'user': ctx['user'],
+            'use_cache': ctx['use_cache'],
+        }
+
+    @staticmethod
+    def save_analyse_reply(session, analyse_results: dict):
+        ChatMessage.objects.create(
+            session=session,
+            role='assistant',
+            content=analyse_results.get("summary", "Analysis complete."),
+            image_url=None,
+        )
+
+    @staticmethod
+    def is_command(request) -> bool:
+        """Slash commands are answered by ChatCompletionView (not streamed)."""
+        messages = request.data.get('messages', [])
+        user_query = messages[-1]['content'] if messages else ""
+        return bool(
+            _is_drawing_request(user_query) or _is_floor_plan_search(user_query)
+            or _is_analyse_request(user_query) or _is_scan_request(user_query)
+        )
+
+    def prepare(self, request):
+        """
+        Validate the request, record the user turn and build the prompt.
+        Returns a ``Response`` for early exits (including delegated commands),
+        otherwise the inputs of the stream.
+        """
         messages = request.data.get('messages', [])
         session_id = request.data.get('session_id')
         user_image_data = request.data.get('image')
@@ -2128,10 +2711,7 @@ class ChatStreamView(APIView):
             except Exception:
                 pass
 
-        user_query = messages[-1]['content'] if messages else ""
-
-        if (_is_drawing_request(user_query) or _is_floor_plan_search(user_query)
-                or _is_analyse_request(user_query) or _is_scan_request(user_query)):
+        if self.is_command(request):
             view = ChatCompletionView()
             view.request = request
             return view.post(request)
@@ -2145,6 +2725,7 @@ class ChatStreamView(APIView):
             first_msg = messages[0]['content'] if len(messages) > 0 else "New Chat"
             title = first_msg[:50] + "..." if len(first_msg) > 50 else first_msg
             session = ChatSession.objects.create(user=user, title=title)
+        usage.bind_session(session)
 
         if messages:
             latest_user_msg = messages[-1]
@@ -2159,20 +2740,16 @@ class ChatStreamView(APIView):
         if user_image_data:
             if not user_image_data.startswith('data:image/'):
                 user_image_data = f"data:image/png;base64,{user_image_data}"
-            vision_images.append(user_image_data)
+            vision_images.append(vision.preprocess_data_url(user_image_data))
 
+        pdf_text = ""
         if user_pdf_data:
-            pdf_images = _extract_pdf_pages_as_images(user_pdf_data, max_pages=5)
+            pdf_images, pdf_text = _extract_pdf_content(user_pdf_data, max_pages=5)
             vision_images.extend(pdf_images)
+        vision_images = vision.fit_budget(vision_images)
 
         # ── System prompt ──
-        instruction_obj = AIInstruction.objects.filter(is_active=True).first()
-        base_instruction = instruction_obj.instruction_text if instruction_obj else (
-            "You are the DzeNhare Architecture AI, a helpful, professional AI assistant "
-            "built into the builder dashboard. You specialize in construction, compliance "
-            "regulations (like SI-56), and architectural guidance. Keep answers concise, "
-            "helpful, and professional."
-        )
+        base_instruction = config.base_instruction()
         system_content = base_instruction
         
         if project:
@@ -2181,46 +2758,42 @@ class ChatStreamView(APIView):
                 f"\n\nProject Brief/Notes: Brief={project.ai_brief or ''}; Site notes={project.site_notes or ''}; Constraints={project.constraints or ''}."
             )
 
-        llm_messages = [{"role": msg['role'], "content": msg['content']} for msg in messages]
+        llm_messages, history_summary = history.build_history(session, messages)
+        system_content += history.summary_prompt_block(history_summary)
+        system_content += knowledge.prompt_block(messages[-1].get('content', ''))
 
-        # Generator that also saves the final message to DB
-        session_id_value = session.id
+        return {
+            'session_id': session.id,
+            'llm_messages': _append_to_last_user_turn(llm_messages, pdf_text),
+            'system': system_content,
+            'images': vision_images if vision_images else None,
+        }
 
-        def event_stream():
-            collected = []
-            try:
-                for chunk in _stream_gemini_with_tools(
-                    messages=llm_messages,
-                    system=system_content,
-                    images=vision_images if vision_images else None,
-                ):
-                    yield chunk
-                    # Collect text tokens for DB save
-                    try:
-                        if chunk.startswith('data: ') and '[DONE]' not in chunk:
-                            payload = json.loads(chunk[6:].strip())
-                            if payload.get('type') == 'token':
-                                collected.append(payload.get('content', ''))
-                    except Exception:
-                        pass
-
-                yield f"data: {json.dumps({'type': 'meta', 'session_id': session_id_value})}\n\n"
-                yield "data: [DONE]\n\n"
+    @staticmethod
+    def collect_token(chunk: str, collected: list):
+        """Collect text tokens of an SSE frame for the DB save."""
+        try:
+            if chunk.startswith('data: '):
+                payload = json.loads(chunk[6:].strip())
+                if payload.get('type') == 'token':
+                    collected.append(payload.get('content', ''))
+        except Exception:
+            pass
 
-            except Exception as e:
-                logger.exception("ChatStreamView SSE error")
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-                yield "data: [DONE]\n\n"
-            finally:
-                full_text = "".join(collected)
-                if full_text:
-                    ChatMessage.objects.create(
-                        session_id=session_id_value,
-                        role='assistant',
-                        content=full_text,
-                    )
-
-        response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    @staticmethod
+    def save_reply(session_id, collected: list):
+        full_text = "".join(collected)
+        if full_text:
+            ChatMessage.objects.create(
+                session_id=session_id,
+                role='assistant',
+                content=full_text,
+            )
+            history.schedule_summary(session_id)
+
+    @staticmethod
+    def sse_response(stream) -> StreamingHttpResponse:
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
         response['Cache-Control'] = 'no-cache'
         response['X-Accel-Buffering'] = 'no'
         return response
@@ -2230,39 +2803,116 @@ class ChatStreamView(APIView):
 # ── TOOL MAP ─────────────────────────────────────────────────────────
 
 class ChatSessionListView(APIView):
+    """
+    The user's chat sessions, most recently active first, each with its
+    message count and a short preview of the last message.
+
+    Without ``limit`` / ``cursor`` the full list is returned as before; with
+    either, one page ``{"results", "next_cursor"}`` keyed on
+    ``(updated_at, id)`` (see ``pagination``).
+    """
     permission_classes = [IsAuthenticated]
+    preview_chars = 120
+    default_limit = 20
+    max_limit = 100
+
+    def get_queryset(self, request):
+        last_message = ChatMessage.objects.filter(session=OuterRef('pk')).order_by('-created_at', '-id')
+        message_count = (
+            ChatMessage.objects.filter(session=OuterRef('pk'))
+            .order_by().values('session').annotate(n=Count('id')).values('n')
+        )
+        return (
+            ChatSession.objects.filter(user=request.user)
+            .only('id', 'title', 'updated_at')
+            .annotate(
+                message_count=Coalesce(Subquery(message_count), 0),
+                last_message_role=Subquery(last_message.values('role')[:1]),
+                last_message_preview=Subquery(
+                    last_message.annotate(preview=Substr('content', 1, self.preview_chars)).values('preview')[:1]
+                ),
+            )
+        )
 
-    def get(self, request):
-        sessions = ChatSession.objects.filter(user=request.user)
-        data = [{
+    @staticmethod
+    def serialize(s):
+        return {
             'id': s.id,
             'title': s.title,
-            'updated_at': s.updated_at
-        } for s in sessions]
-        return Response(data)
+            'updated_at': s.updated_at,
+            'message_count': s.message_count,
+            'last_message': {
+                'role': s.last_message_role,
+                'preview': s.last_message_preview,
+            } if s.last_message_role else None,
+        }
 
-class ChatSessionDetailView(APIView):
-    permission_classes = [IsAuthenticated]
+    def get(self, request):
+        sessions = self.get_queryset(request)
+        cursor = request.query_params.get('cursor')
+        if cursor is None and 'limit' not in request.query_params:
+            return Response([self.serialize(s) for s in sessions.order_by('-updated_at', '-id')])
 
-    def get(self, request, pk):
+        limit = pagination.parse_limit(request.query_params.get('limit'), self.default_limit, self.max_limit)
         try:
-            session = ChatSession.objects.get(pk=pk, user=request.user)
-        except ChatSession.DoesNotExist:
-            return Response({'error': 'Session not found'}, status=404)
+            rows, next_cursor = pagination.keyset_page(sessions, 'updated_at', cursor, limit)
+        except pagination.InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=400)
+        return Response({
+            'results': [self.serialize(s) for s in rows],
+            'next_cursor': next_cursor,
+        })
+
+class ChatSessionDetailView(APIView):
+    """
+    A session and its messages in chronological order.
 
-        messages = session.messages.all()
-        msg_data = [{
+    With ``limit`` / ``cursor`` only the newest ``limit`` messages older than
+    the cursor are returned, plus ``next_cursor`` for the page before them,
+    so clients can load history incrementally while scrolling up.
+    """
+    permission_classes = [IsAuthenticated]
+    default_limit = 50
+    max_limit = 200
+
+    @staticmethod
+    def serialize_message(m):
+        return {
             'id': m.id,
             'role': m.role,
             'content': m.content,
             'image_url': m.image_url,
             'created_at': m.created_at
-        } for m in messages]
+        }
+
+    def get(self, request, pk):
+        try:
+            session = ChatSession.objects.only('id', 'title').get(pk=pk, user=request.user)
+        except ChatSession.DoesNotExist:
+            return Response({'error': 'Session not found'}, status=404)
+
+        messages = ChatMessage.objects.filter(session=session).only(
+            'id', 'role', 'content', 'image_url', 'created_at',
+        )
+        cursor = request.query_params.get('cursor')
+        if cursor is None and 'limit' not in request.query_params:
+            return Response({
+                'id': session.id,
+                'title': session.title,
+                'messages': [self.serialize_message(m) for m in messages.order_by('created_at', 'id')],
+            })
 
+        limit = pagination.parse_limit(request.query_params.get('limit'), self.default_limit, self.max_limit)
+        try:
+            rows, next_cursor = pagination.keyset_page(messages, 'created_at', cursor, limit)
+        except pagination.InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=400)
+        rows.reverse()
         return Response({
             'id': session.id,
             'title': session.title,
-            'messages': msg_data
+            'messages': [self.serialize_message(m) for m in rows],
+            'next_cursor': next_cursor,
         })
 
     def delete(self, request, pk):
@@ -2274,6 +2924,74 @@ class ChatSessionDetailView(APIView):
             return Response({'error': 'Session not found'}, status=404)
 
 
+class AIJobDetailView(APIView):
+    """Status (and, once finished, the result) of a background AI job."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = AIJob.objects.get(pk=job_id, user=request.user)
+        except AIJob.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=404)
+        return Response(job.as_status_dict())
+
+
+class AIJobEventsView(APIView):
+    """
+    SSE progress feed for a background AI job.
+
+    Emits ``progress`` events whenever the job's status/progress changes and a
+    final ``result`` event (the body the synchronous endpoint would have
+    returned) followed by ``[DONE]``. The stream polls the job row and is a
+    short long-poll: it closes after ``AI_JOB_EVENTS_TIMEOUT`` seconds (a few,
+    so an open feed never pins a sync worker for long) and tells the client to
+    reconnect via the SSE ``retry`` field, as ``EventSource`` does by itself.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        if not AIJob.objects.filter(pk=job_id, user=request.user).exists():
+            return Response({'error': 'Job not found'}, status=404)
+        return ChatStreamView.sse_response(self.event_stream(job_id))
+
+    @staticmethod
+    def event_stream(job_id):
+        poll = getattr(settings, 'AI_JOB_POLL_INTERVAL', 1.0)
+        deadline = time.monotonic() + getattr(settings, 'AI_JOB_EVENTS_TIMEOUT', 10)
+        last_state = None
+        yield f"retry: {int(poll * 1000)}\n\n"
+        while True:
+            job = AIJob.objects.filter(pk=job_id).first()
+            if job is None:
+                yield _sse({'type': 'error', 'content': 'Job not found'})
+                yield "data: [DONE]\n\n"
+                return
+            state = (job.status, job.progress, job.progress_message)
+            if state != last_state:
+                last_state = state
+                yield _sse({
+                    'type': 'progress',
+                    'job_id': str(job.id),
+                    'status': job.status,
+                    'progress': job.progress,
+                    'message': job.progress_message,
+                })
+            if job.is_finished:
+                yield _sse({
+                    'type': 'result',
+                    'job_id': str(job.id),
+                    'status': job.status,
+                    'http_status': job.http_status,
+                    'result': job.result,
+                })
+                yield "data: [DONE]\n\n"
+                return
+            if time.monotonic() >= deadline:
+                # Not finished: close without [DONE] so the client reconnects.
+                return
+            time.sleep(poll)
+
+
 # ── Image Feedback ───────────────────────────────────────────────────
 
 class ImageFeedbackView(APIView):
@@ -2491,9 +3209,10 @@ class MaterialPriceView(APIView):
 
 # ── Site Intelligence (Project) ─────────────────────────────────────
 
-class SiteIntelView(APIView):
+class SiteIntelView(UsageBindingMixin, APIView):
     """Generate and fetch site intelligence for a project."""
     permission_classes = [IsAuthenticated]
+    usage_endpoint = 'site_intel'
 
     def get(self, request, project_id):
         try:
@@ -2532,13 +3251,7 @@ class SiteIntelView(APIView):
         if not (request.user.is_staff or project.owner_id == request.user.id):
             return Response({'error': 'Not authorized for this project'}, status=403)
 
-        instruction_obj = AIInstruction.objects.filter(is_active=True).first()
-        base_instruction = instruction_obj.instruction_text if instruction_obj else (
-            "You are the DzeNhare Architecture AI, a helpful, professional AI assistant "
-            "built into the builder dashboard. You specialize in construction, compliance "
-            "regulations (like SI-56), and architectural guidance. Keep answers concise, "
-            "helpful, and professional."
-        )
+        base_instruction = config.base_instruction()
 
         system_content = base_instruction + (
             "\n\nCRITICAL INSTRUCTION: You are generating SITE INTELLIGENCE. "
@@ -2615,18 +3328,39 @@ class SiteIntelView(APIView):
 from .prompts import DRAW_AGENT_SYSTEM as _DRAW_AGENT_SYSTEM
 
 
-class DrawAgentView(APIView):
+class DrawAgentView(UsageBindingMixin, APIView):
     """AI drawing agent: converts natural language to parametric floor-plan JSON."""
     permission_classes = [IsAuthenticated]
+    usage_endpoint = 'draw_agent'
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = 'ai_chat'
 
+    # Shared with the async variant in async_views.py.
+    gemini_options = {"max_tokens": 16384, "temperature": 0.4, "timeout": 180.0}
+
     def post(self, request):
+        prompt, user_message = self.build_user_message(request)
+        if prompt is None:
+            return Response({'error': 'prompt is required'}, status=400)
+
+        try:
+            raw = _call_gemini(
+                messages=[{"role": "user", "content": user_message}],
+                system=_DRAW_AGENT_SYSTEM,
+                **self.gemini_options,
+            )
+            return self.plan_response(raw, prompt)
+        except Exception as e:
+            return self.error_response(e)
+
+    @staticmethod
+    def build_user_message(request):
+        """Return ``(prompt, user_message)``; ``prompt`` is None when missing."""
         prompt = (request.data.get('prompt') or '').strip()
         current_elements = request.data.get('current_elements', [])
 
         if not prompt:
-            return Response({'error': 'prompt is required'}, status=400)
+            return None, None
 
         # Build context about what's already on canvas
         context = ""
@@ -2641,43 +3375,27 @@ class DrawAgentView(APIView):
                 f"Return ONLY the NEW elements to add, not the existing ones."
             )
 
-        user_message = f"{prompt}{context}"
-
-        try:
-            raw = _call_gemini(
-                messages=[{"role": "user", "content": user_message}],
-                system=_DRAW_AGENT_SYSTEM,
-                max_tokens=16384,
-                temperature=0.4,
-                timeout=180.0,
-            )
+        return prompt, f"{prompt}{context}"
 
-            # Strip markdown fences if present
-            cleaned = raw.strip()
-            if cleaned.startswith("```"):
-                first_nl = cleaned.index("\n")
-                cleaned = cleaned[first_nl + 1:]
-            if cleaned.endswith("```"):
-                cleaned = cleaned[:-3]
-            cleaned = cleaned.strip()
+    @staticmethod
+    def plan_response(raw: str, prompt: str) -> Response:
+        cleaned = _strip_json_fences(raw)
 
-            try:
-                plan = json.loads(cleaned)
-            except json.JSONDecodeError:
-                plan = _repair_truncated_json(cleaned)
+        plan = json_stream.loads(cleaned)
 
-            # Ensure summary exists
-            if 'summary' not in plan:
-                plan['summary'] = f"Generated from: {prompt[:100]}"
+        # Ensure summary exists
+        if 'summary' not in plan:
+            plan['summary'] = f"Generated from: {prompt[:100]}"
 
-            return Response(plan)
+        return Response(plan)
 
-        except Exception as e:
-            logger.error("DrawAgent error: %s", e, exc_info=True)
-            return Response(
-                {'error': f'AI generation failed: {str(e)}'},
-                status=502,
-            )
+    @staticmethod
+    def error_response(e: Exception) -> Response:
+        logger.error("DrawAgent error: %s", e, exc_info=True)
+        return Response(
+            {'error': f'AI generation failed: {str(e)}'},
+            status=502,
+        )
 
 
 # ── Draft Copilot (Pascal Architectural Drafter) ─────────────────────
@@ -2938,20 +3656,12 @@ def _normalize_draft_openings(draft: Dict[str, Any]) -> Dict[str, Any]:
     return draft
 
 
-def _call_gemini_json(system: str, user_content: str, max_tokens: int = 8192,
-                      temperature: float = 0.4, timeout: float = 90.0) -> str:
-    """Call Gemini with responseMimeType=application/json for structured output."""
-    api_key = settings.GEMINI_API_KEY
-    if not api_key or len(api_key) < 10:
-        raise RuntimeError("GEMINI_API_KEY is not configured.")
+def _get_draft_model_name() -> str:
+    return getattr(settings, 'AI_DRAFT_MODEL', '') or 'gemini-3.1-pro-preview'
 
-    model_name = getattr(settings, 'AI_DRAFT_MODEL', '') or 'gemini-3.1-pro-preview'
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}"
-        f":generateContent?key={api_key}"
-    )
 
-    payload = {
+def _json_payload(system: str, user_content: str, max_tokens: int, temperature: float) -> dict:
+    return {
         "contents": [
             {"role": "user", "parts": [{"text": f"{system}\n\n{user_content}"}]}
         ],
@@ -2962,40 +3672,51 @@ def _call_gemini_json(system: str, user_content: str, max_tokens: int = 8192,
         },
     }
 
+
+def _call_gemini_json(system: str, user_content: str, max_tokens: int = 8192,
+                      temperature: float = 0.4, timeout: float = 90.0) -> str:
+    """Call Gemini with responseMimeType=application/json for structured output."""
+    _require_gemini_key()
+    model_name = _get_draft_model_name()
+    payload = _json_payload(system, user_content, max_tokens, temperature)
+
     logger.info("[Gemini JSON] Calling %s for draft-copilot", model_name)
     try:
-        resp = http_requests.post(url, json=payload, timeout=timeout)
+        resp = gemini_client.post(model_name, payload, timeout=timeout, label="draft_json")
     except http_requests.exceptions.Timeout:
         raise RuntimeError("Gemini timed out. Try a simpler prompt.")
     except http_requests.exceptions.RequestException as e:
         raise RuntimeError(f"Could not connect to Gemini: {e}")
 
-    if resp.status_code != 200:
-        body = resp.text[:600]
-        raise RuntimeError(f"Gemini API error (HTTP {resp.status_code}): {body}")
+    return _gemini_response_text(resp, "JSON")
 
-    data = resp.json()
-    candidates = data.get("candidates", [])
-    if not candidates:
-        raise RuntimeError("Gemini returned no candidates.")
 
-    parts = candidates[0].get("content", {}).get("parts", [])
-    text_parts = [p["text"] for p in parts if "text" in p]
-    return "\n".join(text_parts)
+def _strip_json_fences(raw: str) -> str:
+    cleaned = raw.strip()
+    if cleaned.startswith("```"):
+        first_nl = cleaned.index("\n")
+        cleaned = cleaned[first_nl + 1:]
+    if cleaned.endswith("```"):
+        cleaned = cleaned[:-3]
+    return cleaned.strip()
 
 
-class DraftCopilotView(APIView):
+class DraftCopilotView(UsageBindingMixin, APIView):
     """
     POST /api/v1/ai/draft-copilot/
     Accepts { "prompt": "Build a 3-bedroom house" }
     Returns the Parametric OOP JSON draft from Gemini.
     """
     permission_classes = [IsAuthenticated]
+    usage_endpoint = 'draft'
     throttle_classes = [ScopedRateThrottle]
     throttle_scope = 'ai_generate'
 
+    # Shared with the async variant in async_views.py.
+    gemini_options = {"max_tokens": 8192, "temperature": 0.4, "timeout": 90.0}
+
     def post(self, request):
-        prompt = (request.data.get('prompt') or request.data.get('input') or '').strip()
+        prompt = self.get_prompt(request)
         if not prompt:
             return Response({'error': 'prompt is required'}, status=400)
 
@@ -3003,40 +3724,37 @@ class DraftCopilotView(APIView):
             raw = _call_gemini_json(
                 system=_DRAFT_COPILOT_SYSTEM_PROMPT,
                 user_content=prompt,
-                max_tokens=8192,
-                temperature=0.4,
-                timeout=90.0,
+                **self.gemini_options,
             )
+            return self.draft_response(raw, prompt)
+        except Exception as e:
+            return self.error_response(e)
 
-            cleaned = raw.strip()
-            if cleaned.startswith("```"):
-                first_nl = cleaned.index("\n")
-                cleaned = cleaned[first_nl + 1:]
-            if cleaned.endswith("```"):
-                cleaned = cleaned[:-3]
-            cleaned = cleaned.strip()
-
-            try:
-                draft = json.loads(cleaned)
-            except json.JSONDecodeError:
-                draft = _repair_truncated_json(cleaned)
-
-            if 'rooms' not in draft or not isinstance(draft.get('rooms'), list):
-                return Response(
-                    {'error': 'Gemini returned invalid draft structure (missing rooms array).'},
-                    status=502,
-                )
-
-            if 'draft_name' not in draft:
-                draft['draft_name'] = f"Draft: {prompt[:60]}"
+    @staticmethod
+    def get_prompt(request) -> str:
+        return (request.data.get('prompt') or request.data.get('input') or '').strip()
 
-            draft = _normalize_draft_openings(draft)
+    @staticmethod
+    def draft_response(raw: str, prompt: str) -> Response:
+        cleaned = _strip_json_fences(raw)
 
-            return Response(draft)
+        draft = json_stream.loads(cleaned)
 
-        except Exception as e:
-            logger.error("DraftCopilot error: %s", e, exc_info=True)
+        if 'rooms' not in draft or not isinstance(draft.get('rooms'), list):
             return Response(
-                {'error': f'AI drafting failed: {str(e)}'},
+                {'error': 'Gemini returned invalid draft structure (missing rooms array).'},
                 status=502,
             )
+
+        if 'draft_name' not in draft:
+            draft['draft_name'] = f"Draft: {prompt[:60]}"
+
+        return Response(_normalize_draft_openings(draft))
+
+    @staticmethod
+    def error_response(e: Exception) -> Response:
+        logger.error("DraftCopilot error: %s", e, exc_info=True)
+        return Response(
+            {'error': f'AI drafting failed: {str(e)}'},
+            status=502,
+        )
@@ -0,0 +1,269 @@
+"""
+Image preprocessing for Gemini vision calls.
+
+Drawings and attachments are sent to Gemini as base64 ``inlineData``. At full
+resolution a handful of scanned sheets makes a multi-megabyte request body,
+which dominates /analyse upload time and memory. Every image therefore goes
+through :func:`preprocess_image` first:
+
+* downscaled so the longest edge is at most ``AI_VISION_MAX_EDGE`` pixels
+* re-encoded as WebP or JPEG (``AI_VISION_FORMAT`` / ``AI_VISION_QUALITY``)
+* cached on disk under ``AI_VISION_CACHE_DIR``, keyed by the SHA-256 of the
+  source bytes and the encoding parameters, so repeat calls skip Pillow
+
+:func:`fit_budget` then caps a request at ``AI_VISION_MAX_IMAGES`` images and
+``AI_VISION_MAX_BYTES`` of encoded data, keeping images in priority order
+(user attachments first, then the most recent project drawings).
+"""
+import base64
+import binascii
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+
+from apps.core.cache_utils import shared_cache
+
+logger = logging.getLogger(__name__)
+
+_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def _params():
+    fmt = str(getattr(settings, 'AI_VISION_FORMAT', 'webp')).lower()
+    if fmt not in _FORMATS:
+        fmt = 'webp'
+    return (
+        int(getattr(settings, 'AI_VISION_MAX_EDGE', 2048)),
+        fmt,
+        int(getattr(settings, 'AI_VISION_QUALITY', 85)),
+    )
+
+
+def _cache_dir() -> Path:
+    return Path(getattr(settings, 'AI_VISION_CACHE_DIR', Path(tempfile.gettempdir()) / 'ai_vision_cache'))
+
+
+def _cache_path(digest: str, max_edge: int, fmt: str, quality: int) -> Path:
+    return _cache_dir() / digest[:2] / f"{digest}-{max_edge}-{quality}.{fmt}"
+
+
+def _read_cached(path: Path):
+    try:
+        return path.read_bytes()
+    except OSError:
+        return None
+
+
+def _write_cached(path: Path, data: bytes):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Vision cache write failed for %s: %s", path.name, e)
+
+
+def _encode(raw: bytes, max_edge: int, fmt: str, quality: int) -> bytes:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(raw)) as img:
+        # JPEG can decode straight to a reduced size, which is much cheaper
+        # than decoding a 40-megapixel scan and resizing afterwards.
+        img.draft('RGB', (max_edge, max_edge))
+        img.load()
+        return _encode_pil(img, max_edge, fmt, quality)
+
+
+def _encode_pil(img, max_edge: int, fmt: str, quality: int) -> bytes:
+    from PIL import Image
+
+    if max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Drawings with transparency are flattened onto white paper.
+        rgba = img.convert('RGBA')
+        img = Image.new('RGB', rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.split()[-1])
+    elif img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    buf = io.BytesIO()
+    pil_format = _FORMATS[fmt][0]
+    if pil_format == 'WEBP':
+        img.save(buf, format=pil_format, quality=quality, method=4)
+    else:
+        img.save(buf, format=pil_format, quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def encode_pil_image(img):
+    """Encode an already-decoded PIL image with the configured parameters; returns ``(mime, bytes)``."""
+    max_edge, fmt, quality = _params()
+    return _FORMATS[fmt][1], _encode_pil(img, max_edge, fmt, quality)
+
+
+def encoding_signature() -> str:
+    """Identifies the current encoding parameters (for derived cache keys)."""
+    max_edge, fmt, quality = _params()
+    return f"{max_edge}-{quality}-{fmt}"
+
+
+def preprocess_image(raw: bytes):
+    """
+    Return ``(mime_type, encoded_bytes)`` for ``raw`` image bytes, or ``None``
+    if Pillow cannot decode them.
+    """
+    max_edge, fmt, quality = _params()
+    mime = _FORMATS[fmt][1]
+    digest = hashlib.sha256(raw).hexdigest()
+    path = _cache_path(digest, max_edge, fmt, quality)
+
+    cached = _read_cached(path)
+    if cached is not None:
+        return mime, cached
+
+    try:
+        encoded = _encode(raw, max_edge, fmt, quality)
+    except Exception as e:
+        logger.warning("Could not preprocess image (%d bytes): %s", len(raw), e)
+        return None
+    _write_cached(path, encoded)
+    logger.debug("[Vision] %s: %d → %d bytes", digest[:12], len(raw), len(encoded))
+    return mime, encoded
+
+
+def to_data_url(mime: str, data: bytes) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def preprocess_data_url(img_data: str) -> str:
+    """Preprocess a data URL / bare base64 image; returns the input unchanged on failure."""
+    b64 = img_data.split(',', 1)[1] if img_data.startswith('data:') else img_data
+    try:
+        raw = base64.b64decode(b64, validate=False)
+    except (binascii.Error, ValueError):
+        return img_data
+    result = preprocess_image(raw)
+    if result is None:
+        return img_data
+    return to_data_url(*result)
+
+
+def encoded_size(img_data: str) -> int:
+    """Decoded byte size of a data URL / base64 image (without decoding it)."""
+    b64 = img_data.split(',', 1)[1] if img_data.startswith('data:') else img_data
+    padding = b64[-2:].count('=')
+    return len(b64) * 3 // 4 - padding
+
+
+def fit_budget(images: list, max_bytes: int | None = None, max_images: int | None = None) -> list:
+    """
+    Keep images in priority order while they fit in the byte/count budget.
+    Images that would overflow the byte budget are skipped, so a smaller,
+    lower-ranked drawing can still make it in.
+    """
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'AI_VISION_MAX_BYTES', 8 * 1024 * 1024)
+    if max_images is None:
+        max_images = getattr(settings, 'AI_VISION_MAX_IMAGES', 10)
+
+    kept, used = [], 0
+    for img in images:
+        if len(kept) >= max_images:
+            break
+        size = encoded_size(img)
+        if used + size > max_bytes:
+            logger.info("[Vision] skipping %d-byte image: over the %d-byte budget", size, max_bytes)
+            continue
+        kept.append(img)
+        used += size
+    if len(kept) < len(images):
+        logger.info("[Vision] sending %d of %d images (%d bytes)", len(kept), len(images), used)
+    return kept
+
+
+# ── Project drawings ─────────────────────────────────────────────────
+
+_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif', 'bmp', 'tif', 'tiff'}
+
+
+def _file_digest_key(name: str) -> str:
+    max_edge, fmt, quality = _params()
+    return f"ai:vision:file:{hashlib.sha1(name.encode('utf-8')).hexdigest()}:{max_edge}:{fmt}:{quality}"
+
+
+def drawing_file_image(df):
+    """Preprocessed data URL for a ``DrawingFile``, or ``None`` if it is not an image."""
+    if not df.file:
+        return None
+    name = df.file.name
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    if ext not in _IMAGE_EXTENSIONS:
+        return None
+
+    # Uploaded files are immutable, so the storage name maps to one source
+    # digest; on a hit the original is not read from storage at all.
+    max_edge, fmt, quality = _params()
+    digest_key = _file_digest_key(name)
+    try:
+        digest = shared_cache().get(digest_key)
+    except Exception:
+        digest = None
+    if digest:
+        cached = _read_cached(_cache_path(digest, max_edge, fmt, quality))
+        if cached is not None:
+            return to_data_url(_FORMATS[fmt][1], cached)
+
+    with df.file.open('rb') as f:
+        raw = f.read()
+    result = preprocess_image(raw)
+    if result is None:
+        return None
+    try:
+        shared_cache().set(digest_key, hashlib.sha256(raw).hexdigest(), None)
+    except Exception as e:
+        logger.warning("Vision digest cache write failed: %s", e)
+    return to_data_url(*result)
+
+
+def project_drawing_images(project, max_bytes: int | None = None, max_images: int | None = None) -> list:
+    """
+    The project's drawings as preprocessed data URLs, most recent first,
+    trimmed to the vision budget. Files past the budget are never read.
+    """
+    from apps.builder_dashboard.models import DrawingFile
+
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'AI_VISION_MAX_BYTES', 8 * 1024 * 1024)
+    if max_images is None:
+        max_images = getattr(settings, 'AI_VISION_MAX_IMAGES', 10)
+
+    images, used = [], 0
+    files = DrawingFile.objects.filter(request__project=project).order_by('-created_at', '-id')
+    for df in files.iterator():
+        if len(images) >= max_images:
+            break
+        try:
+            img = drawing_file_image(df)
+        except Exception as e:
+            logger.error("Failed to read drawing file %s: %s", df.id, e)
+            continue
+        if img is None:
+            continue
+        size = encoded_size(img)
+        if used + size > max_bytes:
+            continue
+        images.append(img)
+        used += size
+    return images
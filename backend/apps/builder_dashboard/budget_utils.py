@@ -1,9 +1,17 @@
 """Helpers for preliminary vs final project budgets."""
 from __future__ import annotations
 
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
-from django.db import transaction
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.db.models.lookups import GreaterThan
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from apps.ai_architecture.project_context import invalidate_project_context
 
 from .models import (
     Project,
@@ -16,6 +24,18 @@ from .models import (
     BOQLabourBreakdown,
     BOQScheduleTask,
     ScheduleOfMaterial,
+    BOQCorrection,
+    BudgetTotals,
+)
+from .serializers import (
+    BOQBuildingItemSerializer,
+    BOQProfessionalFeeSerializer,
+    BOQAdminExpenseSerializer,
+    BOQLabourCostSerializer,
+    BOQMachinePlantSerializer,
+    BOQLabourBreakdownSerializer,
+    BOQScheduleTaskSerializer,
+    ScheduleOfMaterialSerializer,
 )
 
 
@@ -83,76 +103,357 @@ def promote_preliminary_to_final(project: Project) -> ProjectBudgetVersion:
         ]
     )
     _copy_boq_rows(pre, final)
+    # The final rows are now an exact copy, and so are their totals.
+    pre_totals = get_budget_totals(pre)
+    _store_totals(final, {name: getattr(pre_totals, name) for name in _TOTALS_FIELDS})
     # Unsigned final budget — block procurement until re-signed
     project.is_budget_signed = False
     project.save(update_fields=["is_budget_signed"])
     return final
 
 
+# Budget sheet -> (model, serializer, fields identifying a row already in the
+# budget). The identifying fields match the duplicate check the budget
+# engineer applied when it saved analysis rows one by one.
+BUDGET_SHEETS = {
+    "building_items": (BOQBuildingItem, BOQBuildingItemSerializer, ("description", "bill_no")),
+    "professional_fees": (BOQProfessionalFee, BOQProfessionalFeeSerializer, ("discipline", "role_scope")),
+    "admin_expenses": (BOQAdminExpense, BOQAdminExpenseSerializer, ("item_role", "description")),
+    "labour_costs": (BOQLabourCost, BOQLabourCostSerializer, ("phase", "trade_role")),
+    "machine_plants": (BOQMachinePlant, BOQMachinePlantSerializer, ("machine_item", "category")),
+    "labour_breakdowns": (BOQLabourBreakdown, BOQLabourBreakdownSerializer, ("phase", "trade_role")),
+    "schedule_tasks": (BOQScheduleTask, BOQScheduleTaskSerializer, ("wbs", "task_description")),
+    "schedule_materials": (ScheduleOfMaterial, ScheduleOfMaterialSerializer, ("section", "material_description")),
+}
+
+APPLY_MODES = ("append", "replace")
+
+
+def _fit_row(model, row: dict) -> dict:
+    """Round decimals and clip text of an AI row to what ``model`` can store."""
+    fitted = dict(row)
+    for field in model._meta.concrete_fields:
+        value = fitted.get(field.name)
+        if value is None:
+            continue
+        if isinstance(field, models.DecimalField):
+            try:
+                step = Decimal(1).scaleb(-field.decimal_places)
+                fitted[field.name] = str(Decimal(str(value)).quantize(step))
+            except (InvalidOperation, ValueError):
+                pass
+        elif isinstance(field, models.CharField) and field.max_length and isinstance(value, str):
+            fitted[field.name] = value[:field.max_length]
+    return fitted
+
+
+def _building_item_rows(rows: list) -> list:
+    """Drop items without a description; number unnumbered ones by position."""
+    prepared = []
+    for idx, row in enumerate(rows):
+        description = str(row.get("description") or "").strip()
+        if description:
+            prepared.append({
+                **row,
+                "description": description,
+                "bill_no": row.get("bill_no") or str(idx + 1),
+                "unit": row.get("unit") or "item",
+            })
+    return prepared
+
+
+@transaction.atomic
+def apply_analysis_to_budget(project: Project, user, analysis: dict, mode: str = "append") -> dict:
+    """
+    Write the sheets of an ``/analyse`` result into the preliminary budget.
+
+    Every sheet is validated with its serializer and inserted with one
+    ``bulk_create``; one ``BOQCorrection`` per written row is recorded in a
+    single batch. ``append`` skips rows already in the budget (same
+    identifying fields); ``replace`` first removes the existing rows of each
+    sheet the analysis has rows for, leaving other sheets untouched.
+
+    Returns ``{"mode", "created": {sheet: n}, "skipped": {...}, "deleted": {...}}``.
+    """
+    if mode not in APPLY_MODES:
+        raise ValidationError({"mode": f"Must be one of: {', '.join(APPLY_MODES)}."})
+    if not isinstance(analysis, dict):
+        raise ValidationError({"analysis": "Expected an object with the budget sheets."})
+
+    bv = get_or_create_preliminary_version(project)
+    result = {"mode": mode, "created": {}, "skipped": {}, "deleted": {}}
+    corrections = []
+    changes = {}
+
+    # Validate everything before touching the budget.
+    pending = {}
+    errors = {}
+    for sheet, (model, serializer_class, key_fields) in BUDGET_SHEETS.items():
+        rows = [row for row in analysis.get(sheet) or [] if isinstance(row, dict)]
+        if model is BOQBuildingItem:
+            rows = _building_item_rows(rows)
+        if not rows:
+            continue
+        serializer = serializer_class(data=[_fit_row(model, row) for row in rows], many=True)
+        if serializer.is_valid():
+            pending[sheet] = serializer.validated_data
+        else:
+            errors[sheet] = serializer.errors
+    if errors:
+        raise ValidationError(errors)
+
+    for sheet, rows in pending.items():
+        model, serializer_class, key_fields = BUDGET_SHEETS[sheet]
+        content_type = ContentType.objects.get_for_model(model)
+        existing = set()
+        # Deltas cover only the rows written here; rows another request
+        # commits meanwhile have already been counted by that request.
+        removed = (Decimal("0"), 0)
+        if mode == "replace":
+            old_rows = list(model.objects.filter(budget_version=bv).select_related("budget_version"))
+            corrections.extend(
+                BOQCorrection(
+                    project=project, user=user, content_type=None, object_id=None, action="DELETE",
+                    was_ai_generated=row.is_ai_generated, previous_data=data, new_data=None,
+                )
+                for row, data in zip(old_rows, serializer_class(old_rows, many=True).data)
+            )
+            stale = model.objects.filter(pk__in=[row.pk for row in old_rows])
+            removed = boq_rows_total(stale)
+            stale.delete()
+            result["deleted"][sheet] = len(old_rows)
+        else:
+            existing = set(model.objects.filter(budget_version=bv).values_list(*key_fields))
+
+        new_rows = []
+        for data in rows:
+            obj = model(**{**data, "budget_version": bv, "is_ai_generated": True})
+            if tuple(getattr(obj, name) for name in key_fields) in existing:
+                continue
+            if model is BOQBuildingItem:
+                obj.amount = obj.quantity * obj.rate  # save() is bypassed by bulk_create
+            new_rows.append(obj)
+        model.objects.bulk_create(new_rows)
+        added = (Decimal("0"), 0)
+        if new_rows:
+            added = boq_rows_total(model.objects.filter(pk__in=[obj.pk for obj in new_rows]))
+        changes[model] = (added[0] - removed[0], added[1] - removed[1])
+        result["created"][sheet] = len(new_rows)
+        result["skipped"][sheet] = len(rows) - len(new_rows)
+
+        corrections.extend(
+            BOQCorrection(
+                project=project, user=user, content_type=content_type, object_id=obj.pk, action="CREATE",
+                was_ai_generated=True, previous_data=None, new_data=data,
+            )
+            for obj, data in zip(new_rows, serializer_class(new_rows, many=True).data)
+        )
+
+    BOQCorrection.objects.bulk_create(corrections)
+    update_budget_totals(bv, changes)
+    # bulk_create sends no signals.
+    transaction.on_commit(lambda: invalidate_project_context(project.pk))
+    return result
+
+
 def final_version_is_locked(version: ProjectBudgetVersion) -> bool:
     return version.kind == ProjectBudgetVersion.Kind.FINAL and version.signed_at is not None
 
 
-def _money(v) -> Decimal:
-    if v is None:
-        return Decimal("0")
-    return Decimal(str(v))
+_MONEY = models.DecimalField(max_digits=20, decimal_places=2)
+_ZERO = Value(Decimal("0"), output_field=_MONEY)
+
+
+def _times(a: str, b: str):
+    return ExpressionWrapper(Coalesce(a, _ZERO) * Coalesce(b, _ZERO), output_field=_MONEY)
 
 
-def _building_item_total(row: BOQBuildingItem) -> Decimal:
-    a = _money(row.amount)
-    if a > 0:
-        return a
-    return (_money(row.quantity) * _money(row.rate)).quantize(Decimal("0.01"))
+def _cents(expression):
+    return Round(expression, 2, output_field=_MONEY)
 
 
-def _labour_cost_total(row: BOQLabourCost) -> Decimal:
-    tc = _money(row.total_cost)
-    if tc > 0:
-        return tc
-    wb = _money(row.weekly_wage_bill)
-    if wb > 0:
-        return wb
-    return (_money(row.daily_rate) * _money(row.total_man_days)).quantize(Decimal("0.01"))
+# Priced sheet -> amount of one row. A stored total wins when positive;
+# otherwise the amount falls back to its components. The schedule of
+# materials has no amount field.
+_ROW_AMOUNTS = {
+    "building_items": Case(
+        When(amount__gt=0, then=F("amount")),
+        default=_cents(_times("quantity", "rate")),
+        output_field=_MONEY,
+    ),
+    "professional_fees": F("estimated_fee"),
+    "admin_expenses": F("total_cost"),
+    "labour_costs": Case(
+        When(total_cost__gt=0, then=F("total_cost")),
+        When(weekly_wage_bill__gt=0, then=F("weekly_wage_bill")),
+        default=_cents(_times("daily_rate", "total_man_days")),
+        output_field=_MONEY,
+    ),
+    "machine_plants": Case(
+        When(total_cost__gt=0, then=F("total_cost")),
+        When(
+            GreaterThan(_times("daily_wet_rate", "days_rqd"), 0),
+            then=_cents(_times("daily_wet_rate", "days_rqd") + Coalesce("fuel_cost", _ZERO)),
+        ),
+        When(GreaterThan(_times("dry_hire_rate", "qty"), 0), then=_cents(_times("dry_hire_rate", "qty"))),
+        default=_ZERO,
+        output_field=_MONEY,
+    ),
+    "labour_breakdowns": Case(
+        When(total_cost__gt=0, then=F("total_cost")),
+        default=_cents(_times("daily_rate", "total_man_days")),
+        output_field=_MONEY,
+    ),
+    "schedule_tasks": F("est_cost"),
+}
 
 
-def _machine_plant_total(row: BOQMachinePlant) -> Decimal:
-    tc = _money(row.total_cost)
-    if tc > 0:
-        return tc
-    wet = _money(row.daily_wet_rate) * _money(row.days_rqd)
-    if wet > 0:
-        return (wet + _money(row.fuel_cost)).quantize(Decimal("0.01"))
-    dry = _money(row.dry_hire_rate) * _money(row.qty)
-    if dry > 0:
-        return dry.quantize(Decimal("0.01"))
-    return Decimal("0")
+def _sheet_totals(bv: ProjectBudgetVersion) -> dict[str, tuple[Decimal, int]]:
+    """
+    ``{sheet: (subtotal, rows)}`` for every sheet of ``bv``, summed by the
+    database in one ``UNION ALL`` of per-sheet aggregates.
+    """
+    parts = [
+        model.objects.filter(budget_version=bv)
+        .order_by()
+        .values("budget_version")
+        .annotate(
+            sheet=Value(sheet, output_field=models.CharField()),
+            subtotal=Coalesce(Sum(_ROW_AMOUNTS.get(sheet, _ZERO), output_field=_MONEY), _ZERO),
+            rows=Count("pk"),
+        )
+        .values_list("sheet", "subtotal", "rows")
+        for sheet, (model, _, _) in BUDGET_SHEETS.items()
+    ]
+    totals = dict.fromkeys(BUDGET_SHEETS, (Decimal("0.00"), 0))
+    for sheet, subtotal, rows in parts[0].union(*parts[1:], all=True):
+        totals[sheet] = (Decimal(subtotal or 0).quantize(Decimal("0.01")), rows)
+    return totals
+
+
+def compute_budget_subtotals(bv: ProjectBudgetVersion) -> dict[str, Decimal]:
+    """``{sheet: subtotal}`` for every priced sheet of ``bv``, computed from its rows."""
+    totals = _sheet_totals(bv)
+    return {sheet: totals[sheet][0] for sheet in _ROW_AMOUNTS}
 
 
 def compute_budget_gross_total(bv: ProjectBudgetVersion) -> Decimal:
     """Sum of every price-like amount on all BOQ rows (schedule of materials has no amount field)."""
-    t = Decimal("0")
-    for row in bv.building_items.all():
-        t += _building_item_total(row)
-    for row in bv.professional_fees.all():
-        t += _money(row.estimated_fee)
-    for row in bv.admin_expenses.all():
-        t += _money(row.total_cost)
-    for row in bv.labour_costs.all():
-        t += _labour_cost_total(row)
-    for row in bv.machine_plants.all():
-        t += _machine_plant_total(row)
-    for row in bv.labour_breakdowns.all():
-        lbt = _money(row.total_cost)
-        if lbt <= 0:
-            lbt = (_money(row.daily_rate) * _money(row.total_man_days)).quantize(Decimal("0.01"))
-        t += lbt
-    for row in bv.schedule_tasks.all():
-        t += _money(row.est_cost)
-    return t.quantize(Decimal("0.01"))
+    return sum(compute_budget_subtotals(bv).values(), Decimal("0")).quantize(Decimal("0.01"))
+
+
+# ── BudgetTotals read model ──────────────────────────────────────────
+
+_SHEET_OF_MODEL = {model: sheet for sheet, (model, _, _) in BUDGET_SHEETS.items()}
+
+
+def boq_rows_total(queryset) -> tuple[Decimal, int]:
+    """``(amount, rows)`` the rows of ``queryset`` (one BOQ model) contribute to their sheet."""
+    amount = _ROW_AMOUNTS.get(_SHEET_OF_MODEL[queryset.model], _ZERO)
+    result = queryset.order_by().aggregate(
+        amount=Coalesce(Sum(amount, output_field=_MONEY), _ZERO),
+        rows=Count("pk"),
+    )
+    return Decimal(result["amount"]).quantize(Decimal("0.01")), result["rows"]
+
+
+def boq_row_amount(row) -> Decimal:
+    """The amount saved ``row`` currently contributes to its sheet subtotal."""
+    return boq_rows_total(type(row).objects.filter(pk=row.pk))[0]
+
+
+def _totals_fields(totals: dict[str, tuple[Decimal, int]]) -> dict:
+    fields = {}
+    for sheet, (amount, rows) in totals.items():
+        if sheet in _ROW_AMOUNTS:
+            fields[f"{sheet}_total"] = amount
+        fields[f"{sheet}_count"] = rows
+    fields["gross_total"] = sum((amount for amount, _ in totals.values()), Decimal("0.00"))
+    fields["row_count"] = sum(rows for _, rows in totals.values())
+    return fields
+
+
+_TOTALS_FIELDS = [
+    *(f"{sheet}_total" for sheet in _ROW_AMOUNTS),
+    *(f"{sheet}_count" for sheet in BUDGET_SHEETS),
+    "gross_total",
+    "row_count",
+]
+
+
+def _store_totals(bv: ProjectBudgetVersion, fields: dict) -> BudgetTotals:
+    """Overwrite the totals of ``bv`` with ``fields``, bumping the revision."""
+    updates = {**fields, "revision": F("revision") + 1, "updated_at": timezone.now()}
+    if not BudgetTotals.objects.filter(budget_version=bv).update(**updates):
+        try:
+            with transaction.atomic():
+                BudgetTotals.objects.create(budget_version=bv, revision=1, **fields)
+        except IntegrityError:
+            BudgetTotals.objects.filter(budget_version=bv).update(**updates)
+    totals = BudgetTotals.objects.get(budget_version=bv)
+    bv.totals = totals
+    return totals
+
+
+def rebuild_budget_totals(bv: ProjectBudgetVersion) -> BudgetTotals:
+    """Recompute the totals of ``bv`` from its rows."""
+    return _store_totals(bv, _totals_fields(_sheet_totals(bv)))
+
+
+def get_budget_totals(bv: ProjectBudgetVersion) -> BudgetTotals:
+    """The totals of ``bv``, built on first use."""
+    try:
+        return bv.totals
+    except BudgetTotals.DoesNotExist:
+        return rebuild_budget_totals(bv)
+
+
+def update_budget_totals(bv: ProjectBudgetVersion, changes: dict) -> None:
+    """
+    Apply ``{model: (amount_delta, rows_delta)}`` to the totals of ``bv``
+    after the rows have been written, as one atomic ``UPDATE``. A version
+    without totals yet is rebuilt from its rows instead.
+    """
+    if not changes:
+        return
+    updates = {"revision": F("revision") + 1, "updated_at": timezone.now()}
+    gross = Decimal("0")
+    rows = 0
+    for model, (amount_delta, rows_delta) in changes.items():
+        sheet = _SHEET_OF_MODEL[model]
+        if sheet in _ROW_AMOUNTS:
+            updates[f"{sheet}_total"] = F(f"{sheet}_total") + amount_delta
+            gross += amount_delta
+        updates[f"{sheet}_count"] = F(f"{sheet}_count") + rows_delta
+        rows += rows_delta
+    updates["gross_total"] = F("gross_total") + gross
+    updates["row_count"] = F("row_count") + rows
+    if BudgetTotals.objects.filter(budget_version=bv).update(**updates):
+        # Drop a stale cached instance; the next read loads the new row.
+        bv._state.fields_cache.pop("totals", None)
+    else:
+        rebuild_budget_totals(bv)
 
 
 def format_gross_total(bv: ProjectBudgetVersion | None) -> str:
     if bv is None:
         return "0.00"
-    return str(compute_budget_gross_total(bv))
+    return str(get_budget_totals(bv).gross_total)
+
+
+def format_budget_totals(bv: ProjectBudgetVersion | None) -> dict:
+    """``gross_total``, per-sheet ``subtotals``/``row_counts`` and ``totals_revision`` for ``budget_meta``."""
+    if bv is None:
+        return {
+            "gross_total": "0.00",
+            "subtotals": dict.fromkeys(_ROW_AMOUNTS, "0.00"),
+            "row_counts": dict.fromkeys(BUDGET_SHEETS, 0),
+            "totals_revision": 0,
+        }
+    totals = get_budget_totals(bv)
+    return {
+        "gross_total": str(totals.gross_total),
+        "subtotals": {sheet: str(getattr(totals, f"{sheet}_total")) for sheet in _ROW_AMOUNTS},
+        "row_counts": {sheet: getattr(totals, f"{sheet}_count") for sheet in BUDGET_SHEETS},
+        "totals_revision": totals.revision,
+    }
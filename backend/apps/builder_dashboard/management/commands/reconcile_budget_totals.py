@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from apps.builder_dashboard.models import ProjectBudgetVersion
+from apps.builder_dashboard.budget_utils import rebuild_budget_totals
+
+class Command(BaseCommand):
+    help = 'Rebuild the BudgetTotals of every budget version from its BOQ rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', type=int, help='Only rebuild the budget versions of this project')
+
+    def handle(self, *args, **options):
+        versions = ProjectBudgetVersion.objects.select_related('totals').order_by('id')
+        if options['project']:
+            versions = versions.filter(project_id=options['project'])
+
+        rebuilt = drifted = 0
+        for bv in versions.iterator():
+            previous = getattr(bv, 'totals', None)
+            before = (previous.gross_total, previous.row_count) if previous else None
+            totals = rebuild_budget_totals(bv)
+            rebuilt += 1
+            if before != (totals.gross_total, totals.row_count):
+                drifted += 1
+                self.stdout.write(
+                    f'  ✓ {bv}: {before[0] if before else "-"} → {totals.gross_total} '
+                    f'({totals.row_count} rows)'
+                )
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} budget version(s); {drifted} had drifted.'))
@@ -4,6 +4,7 @@ from apps.builder_dashboard.models import (
     Project, EscrowMilestone, CapitalSchedule, MaterialAudit,
     WeatherEvent, ESignatureRequest, SiteCamera
 )
+from apps.ai_architecture.project_context import invalidate_project_context
 
 class Command(BaseCommand):
     help = 'Seed dashboard widget test data for all projects'
@@ -35,6 +36,9 @@ class Command(BaseCommand):
                 ])
                 self.stdout.write(f'  ✓ Capital schedule for "{project.title}"')
 
+            # bulk_create skips post_save, so drop the cached AI context explicitly
+            invalidate_project_context(project.pk)
+
             # Material Audits
             if not project.material_audits.exists():
                 MaterialAudit.objects.bulk_create([
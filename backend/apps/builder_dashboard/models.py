@@ -388,6 +388,42 @@ class ScheduleOfMaterial(TimeStampedModel):
     def __str__(self):
         return f"{self.material_description} ({self.section})"
 
+class BudgetTotals(TimeStampedModel):
+    """
+    Running subtotals and row counts of one budget version. Writers apply
+    deltas through ``budget_utils.update_budget_totals``; ``revision`` grows
+    with every change. ``manage.py reconcile_budget_totals`` rebuilds it.
+    """
+    budget_version = models.OneToOneField(
+        ProjectBudgetVersion,
+        on_delete=models.CASCADE,
+        related_name="totals",
+    )
+    building_items_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    professional_fees_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    admin_expenses_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    labour_costs_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    machine_plants_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    labour_breakdowns_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    schedule_tasks_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    gross_total = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    building_items_count = models.IntegerField(default=0)
+    professional_fees_count = models.IntegerField(default=0)
+    admin_expenses_count = models.IntegerField(default=0)
+    labour_costs_count = models.IntegerField(default=0)
+    machine_plants_count = models.IntegerField(default=0)
+    labour_breakdowns_count = models.IntegerField(default=0)
+    schedule_tasks_count = models.IntegerField(default=0)
+    schedule_materials_count = models.IntegerField(default=0)
+    row_count = models.IntegerField(default=0)
+    revision = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Budget totals"
+
+    def __str__(self):
+        return f"{self.budget_version} r{self.revision}: {self.gross_total}"
+
 class BOQCorrection(TimeStampedModel):
     ACTION_CHOICES = [
         ('CREATE', 'Created Manually'),
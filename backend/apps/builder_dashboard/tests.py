@@ -1,3 +1,268 @@
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.authentication.models import Profile
+
+from .budget_utils import (
+    boq_row_amount,
+    compute_budget_gross_total,
+    compute_budget_subtotals,
+    format_budget_totals,
+    get_or_create_preliminary_version,
+    rebuild_budget_totals,
+    update_budget_totals,
+)
+from .models import (
+    BOQAdminExpense,
+    BOQBuildingItem,
+    BOQCorrection,
+    BOQLabourBreakdown,
+    BOQLabourCost,
+    BOQMachinePlant,
+    BOQProfessionalFee,
+    BOQScheduleTask,
+    BudgetAnalysisHistory,
+    BudgetTotals,
+    Project,
+    ProjectBudgetVersion,
+    ScheduleOfMaterial,
+)
+
+User = get_user_model()
+
+
+class ApplyAnalysisTest(TestCase):
+    """An /analyse result is written into the preliminary budget in one request."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("applier", password="pw")
+        Profile.objects.update_or_create(user=self.user, defaults={"is_approved": True, "role": "BUILDER"})
+        self.user.refresh_from_db()
+        self.project = Project.objects.create(owner=self.user, title="Apply House", location="Harare", budget=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("budget-apply-analysis", args=[self.project.id])
+        self.analysis = {
+            "summary": "Two rooms",
+            "building_items": [
+                {"bill_no": "1", "description": "Slab", "unit": "m3", "quantity": 2, "rate": 45.555},
+                {"description": "Walls", "quantity": 40, "rate": 12},
+                {"description": "  ", "quantity": 1, "rate": 1},
+            ],
+            "professional_fees": [{"discipline": "QS", "role_scope": "Costing", "estimated_fee": 1200}],
+            "schedule_materials": [{"section": "SUPERSTRUCTURE", "material_description": "Cement 32.5N"}],
+        }
+
+    def _apply(self, **body):
+        return self.client.post(self.url, body, format="json")
+
+    def test_append_writes_rows_and_one_batch_of_corrections(self):
+        response = self._apply(analysis=self.analysis)
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.data["created"], {"building_items": 2, "professional_fees": 1, "schedule_materials": 1})
+
+        bv = get_or_create_preliminary_version(self.project)
+        slab = BOQBuildingItem.objects.get(budget_version=bv, description="Slab")
+        self.assertEqual(slab.rate, Decimal("45.56"))
+        self.assertEqual(slab.amount, Decimal("91.12"))
+        self.assertTrue(slab.is_ai_generated)
+        walls = BOQBuildingItem.objects.get(budget_version=bv, description="Walls")
+        self.assertEqual((walls.bill_no, walls.unit), ("2", "item"))
+        self.assertEqual(ScheduleOfMaterial.objects.get(budget_version=bv).section, "SUPERSTRUCTURE")
+
+        corrections = BOQCorrection.objects.filter(project=self.project, action="CREATE")
+        self.assertEqual(corrections.count(), 4)
+        correction = corrections.get(object_id=slab.id, content_type__model="boqbuildingitem")
+        self.assertEqual(correction.new_data["description"], "Slab")
+        self.assertEqual(correction.new_data["project"], self.project.id)
+
+        meta = self.client.get(reverse("budget-aggregate", args=[self.project.id])).data["budget_meta"]
+        self.assertEqual(meta["gross_total"], "1771.12")
+        self.assertEqual(meta["subtotals"]["building_items"], "571.12")
+
+    def test_append_skips_rows_already_in_the_budget(self):
+        self._apply(analysis=self.analysis)
+        response = self._apply(analysis=self.analysis)
+        self.assertEqual(sum(response.data["created"].values()), 0)
+        self.assertEqual(response.data["skipped"]["building_items"], 2)
+        self.assertEqual(BOQBuildingItem.objects.count(), 2)
+
+    def test_replace_clears_only_the_sheets_it_writes(self):
+        self._apply(analysis=self.analysis)
+        analysis = {"building_items": [{"bill_no": "9", "description": "Roof", "quantity": 1, "rate": 500}]}
+        response = self._apply(analysis=analysis, mode="replace")
+        self.assertEqual(response.data["deleted"], {"building_items": 2})
+        self.assertEqual(list(BOQBuildingItem.objects.values_list("description", flat=True)), ["Roof"])
+        self.assertEqual(BOQProfessionalFee.objects.count(), 1)
+        deleted = BOQCorrection.objects.filter(action="DELETE")
+        self.assertEqual(sorted(c.previous_data["description"] for c in deleted), ["Slab", "Walls"])
+
+    def test_applies_a_saved_history_entry(self):
+        history = BudgetAnalysisHistory.objects.create(project=self.project, user=self.user, data=self.analysis)
+        response = self._apply(history=history.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(BOQBuildingItem.objects.count(), 2)
+
+    def test_invalid_row_writes_nothing(self):
+        self.analysis["schedule_materials"] = [{"section": "NOT_A_SECTION", "material_description": "Sand"}]
+        response = self._apply(analysis=self.analysis)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("schedule_materials", response.data["errors"])
+        self.assertFalse(BOQBuildingItem.objects.exists())
+        self.assertFalse(BOQCorrection.objects.exists())
+
+    def test_rows_another_request_adds_meanwhile_are_counted_once(self):
+        self._apply(analysis=self.analysis)
+        bv = get_or_create_preliminary_version(self.project)
+        bulk_create = BOQBuildingItem.objects.bulk_create
+
+        def bulk_create_alongside_a_viewset_write(objs, *args, **kwargs):
+            door = BOQBuildingItem.objects.create(budget_version=bv, description="Door", quantity=1, rate=30)
+            update_budget_totals(bv, {BOQBuildingItem: (boq_row_amount(door), 1)})
+            return bulk_create(objs, *args, **kwargs)
+
+        analysis = {"building_items": [{"bill_no": "9", "description": "Roof", "quantity": 1, "rate": 500}]}
+        with patch.object(BOQBuildingItem.objects, "bulk_create", side_effect=bulk_create_alongside_a_viewset_write):
+            self._apply(analysis=analysis, mode="replace")
+        totals = BudgetTotals.objects.get(budget_version=bv)
+        self.assertEqual((totals.building_items_total, totals.building_items_count), (Decimal("530.00"), 2))
+        self.assertEqual(totals.gross_total, rebuild_budget_totals(bv).gross_total)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def queries_for(n):
+            self.analysis["building_items"] = [
+                {"bill_no": str(i), "description": f"Item {i}", "quantity": 1, "rate": i} for i in range(n)
+            ]
+            self._apply(analysis=self.analysis, mode="replace")
+            with CaptureQueriesContext(connection) as queries:  # replaces n rows with n rows
+                response = self._apply(analysis=self.analysis, mode="replace")
+            self.assertEqual(response.status_code, 201)
+            return len(queries)
+
+        # SQLite splits large inserts and deletes into a few batches; rows never cost a query each.
+        self.assertLess(queries_for(200), queries_for(10) + 10)
+        self.assertEqual(BOQBuildingItem.objects.count(), 10)
+
+
+class BudgetTotalsTest(TestCase):
+    """Gross total and per-sheet subtotals are summed by the database with the row fallbacks."""
+
+    def setUp(self):
+        user = User.objects.create_user("totals", password="pw")
+        project = Project.objects.create(owner=user, title="Totals House", location="Bulawayo", budget=1)
+        self.bv = get_or_create_preliminary_version(project)
+
+    def test_row_fallbacks(self):
+        bv = self.bv
+        BOQBuildingItem.objects.create(budget_version=bv, description="Slab", quantity=2, rate=Decimal("10.50"))
+        # amount left at zero (bulk insert): quantity * rate is used instead
+        BOQBuildingItem.objects.bulk_create([BOQBuildingItem(budget_version=bv, description="Walls", quantity=3, rate=4)])
+        BOQProfessionalFee.objects.create(budget_version=bv, estimated_fee=100)
+        BOQAdminExpense.objects.create(budget_version=bv, total_cost=7)
+        BOQLabourCost.objects.create(budget_version=bv, total_cost=50, weekly_wage_bill=999)
+        BOQLabourCost.objects.create(budget_version=bv, weekly_wage_bill=30, daily_rate=1, total_man_days=1)
+        BOQLabourCost.objects.create(budget_version=bv, daily_rate=5, total_man_days=3)
+        BOQMachinePlant.objects.create(budget_version=bv, total_cost=200)
+        BOQMachinePlant.objects.create(budget_version=bv, daily_wet_rate=10, days_rqd=2, fuel_cost=5, dry_hire_rate=99)
+        BOQMachinePlant.objects.create(budget_version=bv, qty=2, dry_hire_rate=15)
+        BOQMachinePlant.objects.create(budget_version=bv, qty=2)
+        BOQLabourBreakdown.objects.create(budget_version=bv, daily_rate=4, total_man_days=Decimal("2.5"))
+        BOQScheduleTask.objects.create(budget_version=bv, est_cost=11)
+        BOQScheduleTask.objects.create(budget_version=bv)
+
+        with self.assertNumQueries(1):
+            subtotals = compute_budget_subtotals(bv)
+        self.assertEqual(subtotals, {
+            "building_items": Decimal("33.00"),
+            "professional_fees": Decimal("100.00"),
+            "admin_expenses": Decimal("7.00"),
+            "labour_costs": Decimal("95.00"),
+            "machine_plants": Decimal("255.00"),
+            "labour_breakdowns": Decimal("10.00"),
+            "schedule_tasks": Decimal("11.00"),
+        })
+        self.assertEqual(compute_budget_gross_total(bv), Decimal("511.00"))
+
+    def test_empty_budget(self):
+        totals = format_budget_totals(self.bv)
+        self.assertEqual(totals["gross_total"], "0.00")
+        empty = format_budget_totals(None)
+        self.assertEqual(totals.pop("totals_revision"), 1)
+        self.assertEqual(empty.pop("totals_revision"), 0)
+        self.assertEqual(totals, empty)
+
+
+class BudgetTotalsReadModelTest(TestCase):
+    """BudgetTotals follows every BOQ row change and can be rebuilt from scratch."""
+
+    def setUp(self):
+        self.user = User.objects.create_user("ledger", password="pw")
+        Profile.objects.update_or_create(
+            user=self.user, defaults={"is_approved": True, "role": "BUILDER", "signature": "data:image/png;base64,AA=="},
+        )
+        self.user.refresh_from_db()
+        self.project = Project.objects.create(owner=self.user, title="Ledger House", location="Gweru", budget=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _totals(self, kind=ProjectBudgetVersion.Kind.PRELIMINARY):
+        return BudgetTotals.objects.get(budget_version__project=self.project, budget_version__kind=kind)
+
+    def test_viewset_changes_apply_deltas(self):
+        created = self.client.post(reverse("boqbuildingitem-list"), {
+            "project": self.project.id, "description": "Slab", "quantity": "2", "rate": "10",
+        }, format="json")
+        self.assertEqual(created.status_code, 201, created.content)
+        self.client.post(reverse("boqprofessionalfee-list"), {
+            "project": self.project.id, "discipline": "QS", "estimated_fee": "100",
+        }, format="json")
+        totals = self._totals()
+        self.assertEqual((totals.gross_total, totals.row_count), (Decimal("120.00"), 2))
+
+        item = reverse("boqbuildingitem-detail", args=[created.data["id"]])
+        self.client.patch(item, {"rate": "15"}, format="json")
+        totals = self._totals()
+        self.assertEqual((totals.building_items_total, totals.gross_total), (Decimal("30.00"), Decimal("130.00")))
+
+        revision = totals.revision
+        self.client.delete(item)
+        totals = self._totals()
+        self.assertEqual((totals.gross_total, totals.building_items_count, totals.row_count), (Decimal("100.00"), 0, 1))
+        self.assertGreater(totals.revision, revision)
+
+    def test_promote_copies_totals_and_sign_checks_them(self):
+        bv = get_or_create_preliminary_version(self.project)
+        final_url = reverse("budget-sign-final", args=[self.project.id])
+        self.client.post(reverse("budget-promote-final", args=[self.project.id]))
+        self.assertEqual(self.client.post(final_url).status_code, 400)
+
+        BOQScheduleTask.objects.create(budget_version=bv, est_cost=40)
+        rebuild_budget_totals(bv)
+        response = self.client.post(reverse("budget-promote-final", args=[self.project.id]))
+        self.assertEqual(response.data["budget_meta"]["gross_total"], "40.00")
+        self.assertEqual(self._totals(ProjectBudgetVersion.Kind.FINAL).row_count, 1)
+        self.assertEqual(self.client.post(final_url).status_code, 200)
+
+        dashboard = self.client.get(reverse("project-dashboard", args=[self.project.id])).data
+        self.assertEqual(dashboard["budget_totals"]["final"]["gross_total"], "40.00")
+
+    def test_reconcile_command_repairs_drift(self):
+        bv = get_or_create_preliminary_version(self.project)
+        BOQAdminExpense.objects.create(budget_version=bv, total_cost=25)
+        rebuild_budget_totals(bv)
+        BOQAdminExpense.objects.filter(budget_version=bv).update(total_cost=35)  # sends no signal
+        self.assertEqual(self._totals().gross_total, Decimal("25.00"))
 
-# Create your tests here.
+        out = StringIO()
+        call_command("reconcile_budget_totals", stdout=out)
+        self.assertEqual(self._totals().gross_total, Decimal("35.00"))
+        self.assertIn("1 had drifted", out.getvalue())
@@ -9,7 +9,7 @@ from .views import (
     BOQBuildingItemViewSet, BOQProfessionalFeeViewSet, BOQAdminExpenseViewSet,
     BOQLabourCostViewSet, BOQMachinePlantViewSet, BOQLabourBreakdownViewSet,
     BOQScheduleTaskViewSet, BudgetAggregateView, ScheduleOfMaterialViewSet,
-    PromoteFinalBudgetView, SignFinalBudgetView,
+    PromoteFinalBudgetView, SignFinalBudgetView, ApplyAnalysisView,
     ProjectMilestoneViewSet, ProjectActivityViewSet, UserNotificationViewSet,
     ProjectDocumentViewSet, ArchitecturalDrawingView,
     BudgetAnalysisHistoryViewSet, MaterialPoolViewSet,
@@ -48,6 +48,7 @@ urlpatterns = [
     path('', include(router.urls)),
     path('projects/<int:project_id>/budget-sheets/', BudgetAggregateView.as_view(), name='budget-aggregate'),
     path('projects/<int:project_id>/budget/promote-to-final/', PromoteFinalBudgetView.as_view(), name='budget-promote-final'),
+    path('projects/<int:project_id>/budget/apply-analysis/', ApplyAnalysisView.as_view(), name='budget-apply-analysis'),
     path('projects/<int:project_id>/budget/sign-final/', SignFinalBudgetView.as_view(), name='budget-sign-final'),
     path('projects/<int:pk>/dashboard/', ProjectDashboardView.as_view(), name='project-dashboard'),
     path('builder-connections/', BuilderConnectionsView.as_view(), name='builder-connections'),
@@ -23,7 +23,11 @@ from .budget_utils import (
     get_or_create_preliminary_version,
     promote_preliminary_to_final,
     final_version_is_locked,
-    format_gross_total,
+    format_budget_totals,
+    apply_analysis_to_budget,
+    boq_row_amount,
+    get_budget_totals,
+    update_budget_totals,
 )
 from .serializers import (
     ProjectSerializer, SiteUpdateSerializer, EscrowMilestoneSerializer,
@@ -95,6 +99,10 @@ class ProjectDashboardView(views.APIView):
             'unverified_updates': SiteUpdateSerializer(
                 project.site_updates.filter(verified=False), many=True
             ).data,
+            'budget_totals': {
+                bv.kind.lower(): format_budget_totals(bv)
+                for bv in project.budget_versions.select_related('totals')
+            },
         })
 
 class EscrowMilestoneViewSet(viewsets.ModelViewSet):
@@ -193,6 +201,7 @@ class BOQCorrectionMixin:
 
         is_ai = str(self.request.data.get('is_ai_generated', False)).lower() == 'true'
         instance = serializer.save(budget_version=bv, is_ai_generated=is_ai)
+        update_budget_totals(bv, {type(instance): (boq_row_amount(instance), 1)})
 
         ct = ContentType.objects.get_for_model(instance)
         BOQCorrection.objects.create(
@@ -213,9 +222,13 @@ class BOQCorrectionMixin:
             raise PermissionDenied('The signed final budget cannot be edited.')
         old_data = self.get_serializer(old_instance).data
         was_ai = getattr(old_instance, 'is_ai_generated', False)
+        old_amount = boq_row_amount(old_instance)
 
         instance = serializer.save()
         new_data = self.get_serializer(instance).data
+        update_budget_totals(
+            instance.budget_version, {type(instance): (boq_row_amount(instance) - old_amount, 0)}
+        )
 
         ct = ContentType.objects.get_for_model(instance)
         BOQCorrection.objects.create(
@@ -235,6 +248,7 @@ class BOQCorrectionMixin:
         old_data = self.get_serializer(instance).data
         project = instance.budget_version.project
         was_ai = getattr(instance, 'is_ai_generated', False)
+        amount = boq_row_amount(instance)
 
         BOQCorrection.objects.create(
             project=project,
@@ -246,7 +260,9 @@ class BOQCorrectionMixin:
             previous_data=old_data,
             new_data=None
         )
+        bv = instance.budget_version
         instance.delete()
+        update_budget_totals(bv, {type(instance): (-amount, -1)})
 
 class BOQBuildingItemViewSet(BOQCorrectionMixin, viewsets.ModelViewSet):
     serializer_class = BOQBuildingItemSerializer
@@ -328,7 +344,7 @@ def _budget_sheets_payload(project: Project, kind: str):
         if kind == 'final'
         else ProjectBudgetVersion.Kind.PRELIMINARY
     )
-    bv = ProjectBudgetVersion.objects.filter(project=project, kind=vkind).first()
+    bv = ProjectBudgetVersion.objects.filter(project=project, kind=vkind).select_related('totals').first()
     if not bv:
         return {
             'building_items': [],
@@ -347,7 +363,7 @@ def _budget_sheets_payload(project: Project, kind: str):
                 'author_signature': '',
                 'is_locked': False,
                 'version_id': None,
-                'gross_total': '0.00',
+                **format_budget_totals(None),
                 'signature_image': None,
             },
         }
@@ -374,7 +390,7 @@ def _budget_sheets_payload(project: Project, kind: str):
             'author_signature': bv.author_signature or '',
             'is_locked': final_version_is_locked(bv),
             'version_id': bv.id,
-            'gross_total': format_gross_total(bv),
+            **format_budget_totals(bv),
             'signature_image': bv.signature_image or None,
         },
     }
@@ -401,6 +417,28 @@ class PromoteFinalBudgetView(views.APIView):
         return Response(_budget_sheets_payload(project, 'final'))
 
 
+class ApplyAnalysisView(views.APIView):
+    """
+    Write a Budget Engineer analysis into the preliminary budget in one transaction.
+
+    Body: ``{"history": <BudgetAnalysisHistory id>}`` or ``{"analysis": {...sheets}}``,
+    plus ``"mode": "append" | "replace"`` (default ``append``).
+    """
+    permission_classes = [permissions.IsAuthenticated, IsBuilder]
+
+    def post(self, request, project_id):
+        project = get_object_or_404(Project, id=project_id, owner=request.user)
+        history_id = request.data.get('history')
+        if history_id:
+            analysis = get_object_or_404(BudgetAnalysisHistory, id=history_id, project=project).data
+        else:
+            analysis = request.data.get('analysis')
+        if not analysis:
+            raise ValidationError('Provide "history" or "analysis".')
+        result = apply_analysis_to_budget(project, request.user, analysis, request.data.get('mode') or 'append')
+        return Response(result, status=status.HTTP_201_CREATED)
+
+
 class SignFinalBudgetView(views.APIView):
     """Sign final budget using the builder's saved profile signature (locks editing)."""
     permission_classes = [permissions.IsAuthenticated, IsBuilder]
@@ -415,20 +453,10 @@ class SignFinalBudgetView(views.APIView):
             )
         final = ProjectBudgetVersion.objects.filter(
             project=project, kind=ProjectBudgetVersion.Kind.FINAL
-        ).first()
+        ).select_related('totals').first()
         if not final:
             raise ValidationError('Final budget does not exist yet. Promote from preliminary first.')
-        n_rows = (
-            final.building_items.count()
-            + final.professional_fees.count()
-            + final.admin_expenses.count()
-            + final.labour_costs.count()
-            + final.machine_plants.count()
-            + final.labour_breakdowns.count()
-            + final.schedule_tasks.count()
-            + final.schedule_materials.count()
-        )
-        if n_rows == 0:
+        if get_budget_totals(final).row_count == 0:
             raise ValidationError('Final budget is empty. Promote from preliminary first.')
 
         display_name = " ".join(
@@ -1,7 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_cache_tables(sender, using='default', **kwargs):
+    """Create the database cache tables (``shared`` without Redis) after ``migrate``."""
+    from django.core.management import call_command
+
+    call_command('createcachetable', database=using, verbosity=0)
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.core'
     verbose_name = '2. Core Platform Controls'
+
+    def ready(self):
+        post_migrate.connect(create_cache_tables, sender=self, dispatch_uid='core:create_cache_tables')
@@ -0,0 +1,75 @@
+"""
+Helpers around the cross-process "shared" cache.
+
+Cached values are invalidated with *generation counters* rather than by
+deleting keys: readers fold the current generation into their cache key, and
+writers simply bump the counter. Stale entries are never read again and age
+out through their TTL, which makes invalidation a single atomic operation
+that is safe to call from signals and bulk code paths alike.
+
+A generation is never handed out twice. A counter that does not exist yet
+(never bumped, expired or evicted) is seeded from ``time.time_ns()``, so it
+restarts above every value it could have reached before; and a failed read
+returns a fresh value that matches no stamp, so callers simply reload.
+"""
+import logging
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.base import InvalidCacheBackendError
+
+logger = logging.getLogger(__name__)
+
+SHARED_CACHE_ALIAS = 'shared'
+
+
+def shared_cache():
+    """The cache shared by all workers (falls back to ``default`` if not configured)."""
+    try:
+        return caches[SHARED_CACHE_ALIAS]
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def _generation_key(namespace: str, ident) -> str:
+    return f"gen:{namespace}:{ident}"
+
+
+def _seed(cache, key: str) -> int:
+    """Create the counter at ``key`` from the clock, or return the one another process created first."""
+    seed = time.time_ns()
+    if cache.add(key, seed, timeout=None):
+        return seed
+    value = cache.get(key)
+    return int(value) if value is not None else seed
+
+
+def get_generation(namespace: str, ident='') -> int:
+    """Current generation of ``namespace``/``ident``."""
+    cache = shared_cache()
+    key = _generation_key(namespace, ident)
+    try:
+        value = cache.get(key)
+        return int(value) if value is not None else _seed(cache, key)
+    except Exception as e:
+        logger.warning("Generation read failed for %s:%s: %s", namespace, ident, e)
+        return time.time_ns()
+
+
+def bump_generation(namespace: str, ident='') -> int:
+    """Invalidate everything cached under ``namespace``/``ident``; returns the new generation."""
+    cache = shared_cache()
+    key = _generation_key(namespace, ident)
+    try:
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Never bumped, expired or evicted: a freshly seeded counter is
+            # already newer than anything handed out before.
+            seed = time.time_ns()
+            if cache.add(key, seed, timeout=None):
+                return seed
+            return cache.incr(key)
+    except Exception as e:
+        logger.warning("Generation bump failed for %s:%s: %s", namespace, ident, e)
+        return time.time_ns()
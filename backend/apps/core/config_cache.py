@@ -0,0 +1,80 @@
+"""
+Read-through, in-process cache for admin-edited configuration.
+
+Singleton and "active row" models (the AI instruction, the active BOQ
+template, platform settings, drawing presets) are read on nearly every
+request but change a few times a month. A :class:`ConfigCache` keeps the
+*derived* value — a rendered prompt, a parsed JSON block, a compiled matcher
+— in process memory, stamped with a generation counter from
+``cache_utils``:
+
+* saving or deleting any of the watched models (``post_save`` /
+  ``post_delete``, again on commit) drops the local value and bumps the
+  generation, so the writing process reloads immediately
+* other processes compare their stamp with the shared generation at most
+  every ``CONFIG_CACHE_CHECK_INTERVAL`` seconds; in between, :meth:`get`
+  touches neither the database nor the shared cache
+
+Code that changes watched rows with ``QuerySet.update()`` (which sends no
+signal) must call :meth:`ConfigCache.invalidate` itself.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from .cache_utils import bump_generation, get_generation
+
+logger = logging.getLogger(__name__)
+
+GENERATION_NAMESPACE = 'config'
+
+_MISSING = object()
+
+
+class ConfigCache:
+    def __init__(self, name: str, loader, *models):
+        self.name = name
+        self.loader = loader
+        self._value = _MISSING
+        self._generation = None
+        self._checked_at = 0.0
+        # Re-entrant: a loader that saves a watched row (get_or_create) invalidates.
+        self._lock = threading.RLock()
+        for model in models:
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    self._on_change, sender=model, weak=False,
+                    dispatch_uid=f"config_cache:{name}:{model._meta.label}:{signal is post_save}",
+                )
+
+    def __repr__(self):
+        return f"<ConfigCache {self.name}>"
+
+    def _on_change(self, sender, **kwargs):
+        self.invalidate()
+        # A worker reloading before the writer commits would cache the old
+        # row under the new generation; bump again once the write is visible.
+        transaction.on_commit(self.invalidate)
+
+    def invalidate(self):
+        with self._lock:
+            self._value = _MISSING
+        bump_generation(GENERATION_NAMESPACE, self.name)
+
+    def get(self):
+        value = self._value
+        interval = getattr(settings, 'CONFIG_CACHE_CHECK_INTERVAL', 5.0)
+        if value is not _MISSING and time.monotonic() - self._checked_at < interval:
+            return value
+        with self._lock:
+            generation = get_generation(GENERATION_NAMESPACE, self.name)
+            if self._value is _MISSING or self._generation != generation:
+                self._value = self.loader()
+                self._generation = generation
+                logger.debug("[ConfigCache] %s loaded (generation %s)", self.name, generation)
+            self._checked_at = time.monotonic()
+            return self._value
@@ -1,3 +1,59 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from apps.admin_dashboard.models import PlatformSettings
+
+from .cache_utils import _generation_key, bump_generation, get_generation, shared_cache
+from .config_cache import GENERATION_NAMESPACE, ConfigCache
+
+
+class ConfigCacheTest(TestCase):
+    """Read-through configuration cache with generation-based invalidation."""
+
+    def setUp(self):
+        self.loads = 0
+
+        def loader():
+            self.loads += 1
+            return PlatformSettings.load().site_name.upper()
+
+        # Unique per test: handlers are connected once per cache name.
+        self.cache = ConfigCache(f'test_site_name:{self._testMethodName}', loader, PlatformSettings)
+
+    def test_hot_path_runs_no_queries(self):
+        self.assertEqual(self.cache.get(), 'AFRICONTECH HUB')
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                self.cache.get()
+        self.assertEqual(self.loads, 1)
+
+    def test_save_reloads_derived_value(self):
+        self.cache.get()
+        settings_row = PlatformSettings.load()
+        settings_row.site_name = 'Build Hub'
+        settings_row.save()
+        self.assertEqual(self.cache.get(), 'BUILD HUB')
+        self.assertEqual(PlatformSettings.cached().site_name, 'Build Hub')
+
+    @override_settings(CONFIG_CACHE_CHECK_INTERVAL=0)
+    def test_other_process_bump_is_noticed(self):
+        self.cache.get()
+        bump_generation(GENERATION_NAMESPACE, self.cache.name)
+        self.cache.get()
+        self.assertEqual(self.loads, 2)
+
+
+class GenerationCounterTest(TestCase):
+    """Generations are never reused, even after the counter is evicted."""
+
+    def test_evicted_counter_restarts_above_old_values(self):
+        seen = {get_generation('test_gen', 1)}
+        seen.add(bump_generation('test_gen', 1))
+        seen.add(bump_generation('test_gen', 1))
+        shared_cache().delete(_generation_key('test_gen', 1))
+        after_read = get_generation('test_gen', 1)
+        self.assertGreater(after_read, max(seen))
+        self.assertEqual(get_generation('test_gen', 1), after_read)
+
+        shared_cache().delete(_generation_key('test_gen', 1))
+        self.assertGreater(bump_generation('test_gen', 1), after_read)
 
-# Create your tests here.
@@ -99,6 +99,34 @@ else:
         }
     }
 
+# Caches
+# "default" stays per-process. "shared" is visible to every worker/container
+# (MCP tool registry, cross-worker invalidation counters): Redis when
+# REDIS_URL is set, otherwise a database table, created by `createcachetable`
+# (run automatically after `migrate`). The table must not be culled at
+# Django's default 300 entries: generation counters, context snapshots and
+# analyse results live there and are expected to stay until replaced.
+REDIS_URL = os.getenv('REDIS_URL', '')
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '1000000'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': SHARED_CACHE_MAX_ENTRIES,
+            # When the cap is reached, cull 1/10 of the entries instead of 1/3.
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
 # Supabase Configuration
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
@@ -117,6 +145,120 @@ APIFY_API_TOKEN = os.getenv('APIFY_API_TOKEN', '')
 GEMINI_CHAT_MODEL = AI_CHAT_MODEL
 GEMINI_IMAGE_MODEL = os.getenv('GEMINI_IMAGE_MODEL', 'gemini-1.5-flash')
 
+# Pooled keep-alive HTTP client shared by every Gemini call (apps/ai_architecture/gemini_client.py)
+GEMINI_HTTP_POOL_CONNECTIONS = int(os.getenv('GEMINI_HTTP_POOL_CONNECTIONS', '4'))
+GEMINI_HTTP_POOL_MAXSIZE = int(os.getenv('GEMINI_HTTP_POOL_MAXSIZE', '32'))
+GEMINI_HTTP_MAX_RETRIES = int(os.getenv('GEMINI_HTTP_MAX_RETRIES', '2'))
+GEMINI_HTTP_BACKOFF_BASE = float(os.getenv('GEMINI_HTTP_BACKOFF_BASE', '0.5'))
+GEMINI_HTTP_BACKOFF_MAX = float(os.getenv('GEMINI_HTTP_BACKOFF_MAX', '8'))
+
+# Serve chat/stream, draw-agent and draft-copilot from the async views in
+# apps/ai_architecture/async_views.py. Only useful when running under ASGI
+# (gunicorn -k uvicorn_worker.UvicornWorker config.asgi:application).
+AI_ASGI_VIEWS = os.getenv('AI_ASGI_VIEWS', 'False') == 'True'
+
+# Function calls returned in one Gemini tool round run concurrently; each call
+# gets its own timeout (seconds). Local tools share a small thread pool.
+AI_TOOL_CALL_TIMEOUT = float(os.getenv('AI_TOOL_CALL_TIMEOUT', '30'))
+AI_TOOL_MAX_WORKERS = int(os.getenv('AI_TOOL_MAX_WORKERS', '8'))
+
+# Lifetime (seconds) of a cached per-project AI context snapshot. Snapshots are
+# also invalidated by signals whenever the underlying project rows change.
+AI_PROJECT_CONTEXT_TTL = int(os.getenv('AI_PROJECT_CONTEXT_TTL', '86400'))
+
+# /analyse result cache (keyed on drawing hashes, template, project context
+# version, prompt and model). Send "no_cache": true to force a fresh analysis.
+AI_ANALYSE_CACHE_ENABLED = os.getenv('AI_ANALYSE_CACHE_ENABLED', 'True') == 'True'
+AI_ANALYSE_CACHE_TTL = int(os.getenv('AI_ANALYSE_CACHE_TTL', str(7 * 86400)))
+
+# Sectioned /analyse: the budget sheets are generated by concurrent Gemini
+# calls (one per sheet group, sharing the prompt and drawings) instead of one
+# 65k-token response. Clients can opt in or out per request ("fan_out").
+AI_ANALYSE_FAN_OUT = os.getenv('AI_ANALYSE_FAN_OUT', 'False') == 'True'
+AI_ANALYSE_FAN_OUT_MAX_TOKENS = int(os.getenv('AI_ANALYSE_FAN_OUT_MAX_TOKENS', '16384'))
+AI_ANALYSE_FAN_OUT_WORKERS = int(os.getenv('AI_ANALYSE_FAN_OUT_WORKERS', '6'))
+
+# Background jobs for /analyse, /draw and /scan (apps/ai_architecture/jobs.py).
+# When enabled those commands answer 202 with a job id and are run by
+# `manage.py run_ai_jobs`; clients can also opt in per request ("background": true).
+AI_BACKGROUND_JOBS = os.getenv('AI_BACKGROUND_JOBS', 'False') == 'True'
+AI_JOB_WORKER_POLL_INTERVAL = float(os.getenv('AI_JOB_WORKER_POLL_INTERVAL', '2'))
+AI_JOB_STALE_AFTER = int(os.getenv('AI_JOB_STALE_AFTER', '600'))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv('AI_JOB_MAX_ATTEMPTS', '2'))
+AI_JOB_POLL_INTERVAL = float(os.getenv('AI_JOB_POLL_INTERVAL', '1'))
+# The events SSE holds a worker while open: keep it a short long-poll, the
+# browser's EventSource reconnects on its own.
+AI_JOB_EVENTS_TIMEOUT = int(os.getenv('AI_JOB_EVENTS_TIMEOUT', '10'))
+AI_JOB_HEARTBEAT_INTERVAL = int(os.getenv('AI_JOB_HEARTBEAT_INTERVAL', '30'))
+
+# Gemini usageMetadata is buffered and written to TokenUsage with bulk_create
+# every AI_USAGE_FLUSH_INTERVAL seconds or once AI_USAGE_FLUSH_SIZE rows are pending.
+AI_USAGE_FLUSH_INTERVAL = float(os.getenv('AI_USAGE_FLUSH_INTERVAL', '10'))
+AI_USAGE_FLUSH_SIZE = int(os.getenv('AI_USAGE_FLUSH_SIZE', '50'))
+AI_USAGE_BACKGROUND_FLUSH = os.getenv('AI_USAGE_BACKGROUND_FLUSH', 'True') == 'True'
+
+# Vision inputs are downscaled / re-encoded before being inlined into Gemini
+# requests (apps/ai_architecture/vision.py). Derivatives are cached on disk by
+# content hash; a request carries at most AI_VISION_MAX_IMAGES images and
+# AI_VISION_MAX_BYTES of encoded image data.
+AI_VISION_MAX_EDGE = int(os.getenv('AI_VISION_MAX_EDGE', '2048'))
+AI_VISION_FORMAT = os.getenv('AI_VISION_FORMAT', 'webp')  # webp | jpeg
+AI_VISION_QUALITY = int(os.getenv('AI_VISION_QUALITY', '85'))
+AI_VISION_MAX_BYTES = int(os.getenv('AI_VISION_MAX_BYTES', str(8 * 1024 * 1024)))
+AI_VISION_MAX_IMAGES = int(os.getenv('AI_VISION_MAX_IMAGES', '10'))
+AI_VISION_CACHE_DIR = os.getenv('AI_VISION_CACHE_DIR', str(BASE_DIR / 'var' / 'vision_cache'))
+
+# Chat PDF uploads (apps/ai_architecture/pdf_pages.py): per-page DPI is derived
+# from the page size within [AI_PDF_MIN_DPI, AI_PDF_MAX_DPI]; pages rendered
+# concurrently; plain-text pages are sent as text instead of images.
+AI_PDF_MIN_DPI = int(os.getenv('AI_PDF_MIN_DPI', '72'))
+AI_PDF_MAX_DPI = int(os.getenv('AI_PDF_MAX_DPI', '200'))
+AI_PDF_RENDER_WORKERS = int(os.getenv('AI_PDF_RENDER_WORKERS', '4'))
+AI_PDF_TEXT_MIN_CHARS = int(os.getenv('AI_PDF_TEXT_MIN_CHARS', '200'))
+AI_PDF_TEXT_MAX_PATH_OPS = int(os.getenv('AI_PDF_TEXT_MAX_PATH_OPS', '60'))
+AI_PDF_TEXT_MAX_CHARS = int(os.getenv('AI_PDF_TEXT_MAX_CHARS', '20000'))
+
+# Chat history (apps/ai_architecture/history.py): prompts carry the session's
+# rolling summary plus recent stored messages within AI_HISTORY_PROMPT_BUDGET
+# estimated tokens. Once unsummarised history exceeds
+# AI_HISTORY_SUMMARIZE_AFTER_TOKENS it is folded into the summary in the
+# background, keeping the last AI_HISTORY_KEEP_RECENT messages verbatim.
+AI_HISTORY_PROMPT_BUDGET = int(os.getenv('AI_HISTORY_PROMPT_BUDGET', '12000'))
+AI_HISTORY_MAX_MESSAGES = int(os.getenv('AI_HISTORY_MAX_MESSAGES', '40'))
+AI_HISTORY_SUMMARY_ENABLED = os.getenv('AI_HISTORY_SUMMARY_ENABLED', 'True') == 'True'
+AI_HISTORY_SUMMARIZE_AFTER_TOKENS = int(os.getenv('AI_HISTORY_SUMMARIZE_AFTER_TOKENS', '8000'))
+AI_HISTORY_KEEP_RECENT = int(os.getenv('AI_HISTORY_KEEP_RECENT', '6'))
+AI_HISTORY_SUMMARY_MAX_WORDS = int(os.getenv('AI_HISTORY_SUMMARY_MAX_WORDS', '400'))
+
+# Knowledge base (apps/ai_architecture/knowledge.py): KnowledgeDocument uploads
+# are chunked into a local NumPy vector index; the top AI_KNOWLEDGE_TOP_K
+# passages scoring at least AI_KNOWLEDGE_MIN_SCORE are added to chat prompts.
+# AI_KNOWLEDGE_EMBEDDER is the dotted path of the embedding backend.
+# AI_KNOWLEDGE_INDEX_DIR must be shared by the web and worker containers
+# (the knowledge_index volume in docker-compose.prod.yml); a process that finds
+# no index there rebuilds it from the stored chunks.
+AI_KNOWLEDGE_ENABLED = os.getenv('AI_KNOWLEDGE_ENABLED', 'True') == 'True'
+AI_KNOWLEDGE_AUTO_INDEX = os.getenv('AI_KNOWLEDGE_AUTO_INDEX', 'True') == 'True'
+AI_KNOWLEDGE_INDEX_DIR = os.getenv('AI_KNOWLEDGE_INDEX_DIR', str(BASE_DIR / 'var' / 'knowledge_index'))
+AI_KNOWLEDGE_EMBEDDER = os.getenv('AI_KNOWLEDGE_EMBEDDER', 'apps.ai_architecture.knowledge.HashingEmbedder')
+AI_KNOWLEDGE_EMBED_DIM = int(os.getenv('AI_KNOWLEDGE_EMBED_DIM', '1024'))
+AI_KNOWLEDGE_CHUNK_CHARS = int(os.getenv('AI_KNOWLEDGE_CHUNK_CHARS', '1200'))
+AI_KNOWLEDGE_CHUNK_OVERLAP = int(os.getenv('AI_KNOWLEDGE_CHUNK_OVERLAP', '200'))
+AI_KNOWLEDGE_TOP_K = int(os.getenv('AI_KNOWLEDGE_TOP_K', '4'))
+AI_KNOWLEDGE_MIN_SCORE = float(os.getenv('AI_KNOWLEDGE_MIN_SCORE', '0.15'))
+AI_KNOWLEDGE_MAX_CHARS = int(os.getenv('AI_KNOWLEDGE_MAX_CHARS', '6000'))
+
+# /scan shows up to AI_SCAN_SIMILAR_LIMIT library floor plans whose visual
+# descriptor scores at least AI_SCAN_SIMILAR_MIN_SCORE against the sketch
+# (apps/admin_dashboard/visual_index.py).
+AI_SCAN_SIMILAR_LIMIT = int(os.getenv('AI_SCAN_SIMILAR_LIMIT', '4'))
+AI_SCAN_SIMILAR_MIN_SCORE = float(os.getenv('AI_SCAN_SIMILAR_MIN_SCORE', '0.5'))
+
+# Seconds a process serves admin configuration (AI instruction, BOQ template,
+# platform settings, drawing presets) from memory before checking the shared
+# generation counters for edits made by other workers (apps/core/config_cache.py).
+CONFIG_CACHE_CHECK_INTERVAL = float(os.getenv('CONFIG_CACHE_CHECK_INTERVAL', '5'))
+
 # ── Model Context Protocol (MCP) Configuration ───────────────────────
 # List of URLs for remote MCP servers (SSE transport)
 # Set via environment variable 'MCP_SERVERS=url1,url2'
@@ -138,6 +280,15 @@ MCP_STDIO_SERVERS = [
     }
 ]
 
+# Warm MCP session pool (one per worker process, apps/ai_architecture/mcp_manager.py)
+MCP_CONNECT_TIMEOUT = float(os.getenv('MCP_CONNECT_TIMEOUT', '30'))
+MCP_POOL_MAX_CONCURRENCY = int(os.getenv('MCP_POOL_MAX_CONCURRENCY', '4'))
+MCP_POOL_IDLE_TIMEOUT = float(os.getenv('MCP_POOL_IDLE_TIMEOUT', '600'))
+MCP_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('MCP_POOL_HEALTHCHECK_INTERVAL', '60'))
+# Discovered MCP tools are kept in the shared cache and refreshed in the background
+# once older than MCP_TOOLS_TTL; `manage.py warm_mcp_tools` fills it at deploy.
+MCP_TOOLS_TTL = int(os.getenv('MCP_TOOLS_TTL', '3600'))
+
 _db_url = os.getenv('DATABASE_URL', '')
 if _db_url.startswith('postgres'):
     MCP_STDIO_SERVERS.append({
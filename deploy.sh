@@ -87,6 +87,11 @@ case "${1:-deploy}" in
     # Run migrations
     log "Running database migrations..."
     docker compose -f $COMPOSE_FILE run --rm backend python manage.py migrate --noinput
+    docker compose -f $COMPOSE_FILE run --rm backend python manage.py createcachetable
+
+    # Discover MCP tools once so the first chat request doesn't have to
+    log "Warming MCP tool registry..."
+    docker compose -f $COMPOSE_FILE run --rm backend python manage.py warm_mcp_tools || warn "MCP tool warm-up failed (will refresh in background)"
 
     # Collect static files
     log "Collecting static files..."
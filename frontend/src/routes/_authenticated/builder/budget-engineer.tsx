@@ -449,85 +449,10 @@ function RouteComponent() {
   const handleSaveToBOQ = async (analyse: AnalyseResult) => {
     if (!selectedProject) return;
     setIsSavingBOQ(true);
-    let createdCount = 0;
     try {
-      const existingRes = await builderApi.getProjectBudgetSheets(selectedProject);
-      const ext = existingRes.data;
-
-      if (analyse.building_items) {
-        for (let idx = 0; idx < analyse.building_items.length; idx++) {
-          const item = analyse.building_items[idx];
-          const description = (item.description || '').trim();
-          const billNo = item.bill_no || String(idx + 1);
-          const specification = (item.specification || '').trim() || undefined;
-          if (!description) continue;
-          if (!ext.building_items?.some((e: any) => e.description === description && e.bill_no === billNo)) {
-            await builderApi.createBOQBuildingItem({
-              project: selectedProject,
-              bill_no: billNo, description, specification,
-              unit: item.unit || 'item', quantity: item.quantity, rate: item.rate,
-              is_ai_generated: true,
-            });
-          }
-        }
-      }
-      if (analyse.professional_fees) {
-        for (const item of analyse.professional_fees) {
-          if (!ext.professional_fees?.some((e: any) => e.discipline === item.discipline && e.role_scope === item.role_scope)) {
-            await builderApi.createBOQProfessionalFee({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.admin_expenses) {
-        for (const item of analyse.admin_expenses) {
-          if (!ext.admin_expenses?.some((e: any) => e.item_role === item.item_role && e.description === item.description)) {
-            await builderApi.createBOQAdminExpense({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.labour_costs) {
-        for (const item of analyse.labour_costs) {
-          if (!ext.labour_costs?.some((e: any) => e.phase === item.phase && e.trade_role === item.trade_role)) {
-            await builderApi.createBOQLabourCost({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.machine_plants) {
-        for (const item of analyse.machine_plants) {
-          if (!ext.machine_plants?.some((e: any) => e.machine_item === item.machine_item && e.category === item.category)) {
-            await builderApi.createBOQMachinePlant({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.labour_breakdowns) {
-        for (const item of analyse.labour_breakdowns) {
-          if (!ext.labour_breakdowns?.some((e: any) => e.phase === item.phase && e.trade_role === item.trade_role)) {
-            await builderApi.createBOQLabourBreakdown({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.schedule_tasks) {
-        for (const item of analyse.schedule_tasks) {
-          if (!ext.schedule_tasks?.some((e: any) => e.wbs === item.wbs && e.task_description === item.task_description)) {
-            await builderApi.createBOQScheduleTask({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      if (analyse.schedule_materials) {
-        for (const item of analyse.schedule_materials) {
-          if (!ext.schedule_materials?.some((e: any) => e.section === item.section && e.material_description === item.material_description)) {
-            await builderApi.createScheduleMaterial({ ...item, project: selectedProject, is_ai_generated: true });
-            createdCount++;
-          }
-        }
-      }
-      
+      const res = await builderApi.applyAnalysisToBudget(selectedProject, { analysis: analyse, mode: 'append' });
+      const createdCount = Object.values(res.data.created).reduce((sum, n) => sum + n, 0);
+
       if (createdCount > 0) {
         toast.success(`Budget sheets updated! Added ${createdCount} new items.`);
       } else {
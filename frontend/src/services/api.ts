@@ -351,6 +351,18 @@ export const builderApi = {
     signFinalBudget: (projectId: number) =>
         api.post<BudgetSheets>(`/projects/${projectId}/budget/sign-final/`, {}),
 
+    /** Write an analysis (or a saved history entry) into the preliminary budget in one request. */
+    applyAnalysisToBudget: (
+        projectId: number,
+        data: { analysis?: Record<string, any>; history?: number; mode?: 'append' | 'replace' },
+    ) =>
+        api.post<{
+            mode: 'append' | 'replace';
+            created: Record<string, number>;
+            skipped: Record<string, number>;
+            deleted: Record<string, number>;
+        }>(`/projects/${projectId}/budget/apply-analysis/`, data),
+
     /** Use `final` for procurement (signed budget lines). Default `preliminary` for editing working budget. */
     getProjectBOQBuildingItems: (projectId: number, budgetKind: 'preliminary' | 'final' = 'preliminary') =>
         api.get<BOQBuildingItem[]>(`/boq-building-items/`, { params: { project: projectId, budget_kind: budgetKind } }),
@@ -585,6 +597,9 @@ export const aiApi = {
      * Stream chat via SSE — returns a ReadableStream.
      * For /plans, /analyse the backend falls back to a JSON response
      * (non-streaming), so the caller should check content-type.
+     * With streamAnalyse, /analyse is streamed too: `analyse_row` events
+     * ({ section, index, row }) as rows are generated, then one `analyse`
+     * event with the full result.
      */
     sendMessageStream: async (
         messages: { role: string; content: string }[],
@@ -593,6 +608,7 @@ export const aiApi = {
         pdf?: string,
         projectId?: number,
         fileName?: string,
+        streamAnalyse?: boolean,
     ): Promise<Response> => {
         const token = cachedSession;
         return fetch(`${api.defaults.baseURL}/ai/chat/stream/`, {
@@ -601,7 +617,7 @@ export const aiApi = {
                 'Content-Type': 'application/json',
                 ...(token ? { Authorization: `Bearer ${token}` } : {}),
             },
-            body: JSON.stringify({ messages, session_id: sessionId, image, pdf, project_id: projectId, file_name: fileName }),
+            body: JSON.stringify({ messages, session_id: sessionId, image, pdf, project_id: projectId, file_name: fileName, stream_analyse: streamAnalyse }),
         });
     },
     generateSiteIntel: (projectId: number, prompt?: string) =>
@@ -619,6 +635,14 @@ export const aiApi = {
         api.post<{ commands: { type: string; params: Record<string, any> }[]; summary: string }>('/ai/draw-agent/', { prompt, current_elements: currentElements ?? [] }),
     getSessions: () => api.get<{ id: number, title: string, updated_at: string }[]>('/ai/chat/sessions/'),
     getSessionDetails: (id: number) => api.get<{ id: number, title: string, messages: { id: number, role: string, content: string, image_url: string | null, created_at: string }[] }>(`/ai/chat/sessions/${id}/`),
+    getSessionsPage: (cursor?: string | null, limit = 20) =>
+        api.get<{ results: { id: number, title: string, updated_at: string, message_count: number, last_message: { role: string, preview: string } | null }[], next_cursor: string | null }>(
+            '/ai/chat/sessions/', { params: { limit, ...(cursor ? { cursor } : {}) } }
+        ),
+    getSessionMessagesPage: (id: number, cursor?: string | null, limit = 50) =>
+        api.get<{ id: number, title: string, messages: { id: number, role: string, content: string, image_url: string | null, created_at: string }[], next_cursor: string | null }>(
+            `/ai/chat/sessions/${id}/`, { params: { limit, ...(cursor ? { cursor } : {}) } }
+        ),
     deleteSession: (id: number) => api.delete(`/ai/chat/sessions/${id}/`),
     draftCopilot: (prompt: string) =>
         api.post<{ draft_name: string; rooms: Array<{ id: string; type: string; dimensions: { width: number; depth: number }; origin: [number, number]; doors: Array<{ wall: string; offset: number }> }> }>('/ai/draft-copilot/', { prompt }),
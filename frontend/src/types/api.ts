@@ -198,8 +198,15 @@ export interface BudgetMeta {
     version_id: number | null;
     /** Sum of all line amounts (USD). */
     gross_total?: string;
+    /** Per-sheet share of gross_total (schedule of materials carries no amounts). */
+    subtotals?: Partial<Record<keyof Omit<BudgetSheets, 'budget_meta' | 'schedule_materials'>, string>>;
+    row_counts?: Partial<Record<keyof Omit<BudgetSheets, 'budget_meta'>, number>>;
+    /** Bumped on every change to the budget's rows. */
+    totals_revision?: number;
 }
 
+export type BudgetTotals = Pick<BudgetMeta, 'gross_total' | 'subtotals' | 'row_counts' | 'totals_revision'>;
+
 export interface BudgetSheets {
     building_items: BOQBuildingItem[];
     professional_fees: BOQProfessionalFee[];
@@ -220,6 +227,7 @@ export interface ProjectDashboard {
     esignature_requests: ESignatureRequest[];
     site_cameras: SiteCamera[];
     unverified_updates: SiteUpdate[];
+    budget_totals?: { preliminary?: BudgetTotals; final?: BudgetTotals };
     contractors?: any[];
     suppliers?: any[];
 }